@@ -197,3 +197,23 @@ if (data["type_"] == "ActorIdentity") {
 return parts.join(" ");
 $$
 LANGUAGE plv8 IMMUTABLE STRICT;
+
+-- Weighted text search vector of a resource: name (A), description (B), keywords (C), other attributes (D)
+CREATE OR REPLACE FUNCTION json_tsvector(data json) RETURNS tsvector AS
+$$
+SELECT setweight(to_tsvector('english', coalesce(json_string(data, 'name'), '')), 'A') ||
+       setweight(to_tsvector('english', coalesce(json_string(data, 'description'), '')), 'B') ||
+       setweight(to_tsvector('english', coalesce(array_to_string(json_keywords(data), ' '), '')), 'C') ||
+       setweight(to_tsvector('english', coalesce(json_allattr(data), '')), 'D');
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Trigger function to maintain the text search vector column when a resource document is written
+CREATE OR REPLACE FUNCTION ion_tsv_update() RETURNS trigger AS
+$$
+BEGIN
+    NEW.tsv := json_tsvector(NEW.doc);
+    RETURN NEW;
+END;
+$$
+LANGUAGE plpgsql;
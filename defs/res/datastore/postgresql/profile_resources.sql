@@ -4,7 +4,7 @@ CREATE TABLE "%(ds)s" (id varchar(300) PRIMARY KEY, rev int, doc json,
     name varchar(300),
     ts_created varchar(14), ts_updated varchar(14),
     vertical_range numrange, temporal_range numrange,
-    deleted boolean);
+    deleted boolean, tsv tsvector);
 
 SELECT AddGeometryColumn('public', '%(ds)s', 'geom', 4326, 'POINT', 2);
 
@@ -14,6 +14,9 @@ SELECT AddGeometryColumn('public', '%(ds)s', 'geom_mpoly', 4326, 'MULTIPOLYGON',
 
 GRANT SELECT, INSERT, UPDATE, DELETE on "%(ds)s" TO ion;
 
+CREATE TRIGGER "%(ds)s_tsv_trigger" BEFORE INSERT OR UPDATE OF doc ON "%(ds)s"
+    FOR EACH ROW EXECUTE PROCEDURE ion_tsv_update();
+
 CREATE TABLE "%(ds)s_assoc" (id varchar(300) PRIMARY KEY, rev int, doc json,
     s varchar(300) REFERENCES %(ds)s (id) ON DELETE CASCADE, st varchar(80), p varchar(40),
     o varchar(300) REFERENCES %(ds)s (id) ON DELETE CASCADE, ot varchar(80), retired boolean,
@@ -27,6 +30,10 @@ CREATE TABLE "%(ds)s_dir" (id varchar(300) PRIMARY KEY, rev int, doc json,
 
 GRANT SELECT, INSERT, UPDATE, DELETE on "%(ds)s_dir" TO ion;
 
+CREATE SEQUENCE "%(ds)s_dir_fence_seq" OWNED BY "%(ds)s_dir".id;
+
+GRANT USAGE, SELECT, UPDATE on "%(ds)s_dir_fence_seq" TO ion;
+
 CREATE TABLE "%(ds)s_att" (id serial PRIMARY KEY,
     docid varchar(300) REFERENCES %(ds)s (id) ON DELETE CASCADE, rev int, doc bytea,
     name varchar(200), content_type varchar(200));
@@ -47,6 +54,11 @@ CREATE INDEX "%(ds)s_visibility_idx" ON "%(ds)s" (visibility);
 
 CREATE INDEX "%(ds)s_name_idx" ON "%(ds)s" (name);
 
+-- Indexes for paged listing of resources of a type in name or creation order
+CREATE INDEX "%(ds)s_type_name_idx" ON "%(ds)s" (type_, name, id);
+
+CREATE INDEX "%(ds)s_type_ts_idx" ON "%(ds)s" (type_, ts_created, id);
+
 CREATE INDEX "%(ds)s_name_full_idx" ON "%(ds)s" USING GIST (name gist_trgm_ops);
 
 CREATE INDEX "%(ds)s_keywords_idx" ON "%(ds)s" USING GIN (json_keywords(doc));
@@ -59,18 +71,27 @@ CREATE INDEX "%(ds)s_altids_ns_idx" ON "%(ds)s" USING GIN (json_altids_ns(doc));
 
 CREATE INDEX "%(ds)s_altids_id_idx" ON "%(ds)s" USING GIN (json_altids_id(doc));
 
-CREATE INDEX "%(ds)s_geom_idx" ON "%(ds)s" USING GIST (geom);
+-- Space-time indexes: partial (most resources have no geospatial or temporal bounds), with the temporal
+-- range as second key column such that combined bbox and time range filters are answered from one index
+CREATE INDEX "%(ds)s_geom_idx" ON "%(ds)s" USING GIST (geom, temporal_range) WHERE geom IS NOT NULL;
 
-CREATE INDEX "%(ds)s_geom_loc_idx" ON "%(ds)s" USING GIST (geom_loc);
+CREATE INDEX "%(ds)s_geom_loc_idx" ON "%(ds)s" USING GIST (geom_loc, temporal_range) WHERE geom_loc IS NOT NULL;
 
-CREATE INDEX "%(ds)s_geom_mpoly_idx" ON "%(ds)s" USING GIST (geom_mpoly);
+CREATE INDEX "%(ds)s_geom_mpoly_idx" ON "%(ds)s" USING GIST (geom_mpoly) WHERE geom_mpoly IS NOT NULL;
 
-CREATE INDEX "%(ds)s_geom_vert_idx" ON "%(ds)s" USING GIST (vertical_range);
+CREATE INDEX "%(ds)s_geom_vert_idx" ON "%(ds)s" USING SPGIST (vertical_range) WHERE vertical_range IS NOT NULL;
 
-CREATE INDEX "%(ds)s_geom_temp_idx" ON "%(ds)s" USING GIST (temporal_range);
+CREATE INDEX "%(ds)s_geom_temp_idx" ON "%(ds)s" USING SPGIST (temporal_range) WHERE temporal_range IS NOT NULL;
 
 CREATE INDEX "%(ds)s_all_full_idx" ON "%(ds)s" USING GIST (json_allattr(doc) gist_trgm_ops);
 
+CREATE INDEX "%(ds)s_tsv_idx" ON "%(ds)s" USING GIN (tsv);
+
+-- Partial indexes for governance checks (roles of actor in Org, commitments of consumer)
+CREATE INDEX "%(ds)s_role_gov_idx" ON "%(ds)s" (json_string(doc,'org_governance_name'), json_string(doc,'governance_name')) WHERE type_='UserRole';
+
+CREATE INDEX "%(ds)s_commitment_idx" ON "%(ds)s" (json_string(doc,'consumer'), json_string(doc,'expiration')) WHERE type_='Commitment';
+
 
 -- Resource association table indexes
 --CREATE INDEX "%(ds)s_assoc_s_idx" ON "%(ds)s_assoc" (s, p, o);  -- Already in unique constraint
@@ -83,6 +104,8 @@ CREATE INDEX "%(ds)s_assoc_o_idx" ON "%(ds)s_assoc" (o, p, s);
 
 CREATE INDEX "%(ds)s_assoc_ot_idx" ON "%(ds)s_assoc" (ot, p);
 
+CREATE INDEX "%(ds)s_assoc_p_id_idx" ON "%(ds)s_assoc" (p, id);
+
 
 -- Resource directory table indexes
 CREATE INDEX "%(ds)s_dir_org_idx" ON "%(ds)s_dir" (org);
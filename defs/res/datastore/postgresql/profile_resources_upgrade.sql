@@ -0,0 +1,41 @@
+-- Upgrade of resource tables created by earlier versions of profile_resources.sql.
+-- Executed for existing datastores on start (see PostgresDataStore.upgrade_datastore), so all
+-- statements must be idempotent.
+
+-- Text search (tsv column, trigger and index). Existing resources are indexed when the column is added
+CREATE OR REPLACE FUNCTION json_tsvector(data json) RETURNS tsvector AS
+$$
+SELECT setweight(to_tsvector('english', coalesce(json_string(data, 'name'), '')), 'A') ||
+       setweight(to_tsvector('english', coalesce(json_string(data, 'description'), '')), 'B') ||
+       setweight(to_tsvector('english', coalesce(array_to_string(json_keywords(data), ' '), '')), 'C') ||
+       setweight(to_tsvector('english', coalesce(json_allattr(data), '')), 'D');
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION ion_tsv_update() RETURNS trigger AS
+$$
+BEGIN
+    NEW.tsv := json_tsvector(NEW.doc);
+    RETURN NEW;
+END;
+$$
+LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT * FROM information_schema.columns WHERE table_name='%(ds)s' AND column_name='tsv') THEN
+        ALTER TABLE "%(ds)s" ADD COLUMN tsv tsvector;
+        DROP TRIGGER IF EXISTS "%(ds)s_tsv_trigger" ON "%(ds)s";
+        CREATE TRIGGER "%(ds)s_tsv_trigger" BEFORE INSERT OR UPDATE OF doc ON "%(ds)s"
+            FOR EACH ROW EXECUTE PROCEDURE ion_tsv_update();
+        UPDATE "%(ds)s" SET doc=doc;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS "%(ds)s_tsv_idx" ON "%(ds)s" USING GIN (tsv);
+
+-- Fencing tokens of directory locks
+CREATE SEQUENCE IF NOT EXISTS "%(ds)s_dir_fence_seq" OWNED BY "%(ds)s_dir".id;
+
+GRANT USAGE, SELECT, UPDATE on "%(ds)s_dir_fence_seq" TO ion;
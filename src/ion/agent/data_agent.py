@@ -2,22 +2,29 @@
 
 __author__ = 'Michael Meisinger'
 
+import time
 from gevent.event import Event
 
 from pyon.public import BadRequest, EventPublisher, log, NotFound, OT, RT, get_safe
 from pyon.util.async import spawn
 
 from ion.agent.streaming_agent import StreamingAgent, AgentPlugin
-from ion.data.packet.packet_builder import DataPacketBuilder
+from ion.data.packet.packet_builder import DataPacketBuilder, SampleRingBuffer
 
 from interface.objects import DataPacket
 
 class DataAgent(StreamingAgent):
+    ACQMODE_POLL = "poll"           # Acquire samples from plugin every sampling interval
+    ACQMODE_STREAM = "stream"       # Plugin yields sample batches continuously, published on size/latency
+
     agent_type = "data_agent"
     agent_plugin = None
     sampling_gl = None
     sampling_gl_quit = None
     sampling_interval = 5
+    publish_gl = None
+    sample_buffer = None
+    acquisition_stats = None
 
     def on_connect(self, connect_args=None):
         if self.agent_plugin and hasattr(self.agent_plugin, 'on_connect'):
@@ -26,7 +33,25 @@ class DataAgent(StreamingAgent):
     def on_start_streaming(self, streaming_args=None):
         self.sampling_gl_quit = Event()
         self.sampling_interval = self.agent_config.get("sampling_interval", 5)
-        self.sampling_gl = spawn(self._sample_data_loop, self.sampling_interval)
+        self.acquisition_mode = self.agent_config.get("acquisition_mode", self.ACQMODE_POLL)
+        self.acquisition_stats = dict(samples_acquired=0, samples_published=0, samples_dropped=0,
+                                      batches_acquired=0, packets_published=0, max_buffer_fill=0, publish_time=0.0)
+        if self.acquisition_mode == self.ACQMODE_STREAM:
+            self.buffer_size = int(self.agent_config.get("buffer_size", 100000))
+            self.packet_size = int(self.agent_config.get("packet_size", 1000))
+            self.packet_latency = float(self.agent_config.get("packet_latency", 0.5))
+            self.overflow_timeout = float(self.agent_config.get("overflow_timeout", 1.0))
+            self.sample_buffer = None
+            self.buffered_since = None
+            self.stream_error = None
+            self.buffer_data_event = Event()
+            self.buffer_space_event = Event()
+            self.sampling_gl = spawn(self._stream_data_loop)
+            self.publish_gl = spawn(self._publish_data_loop)
+        elif self.acquisition_mode == self.ACQMODE_POLL:
+            self.sampling_gl = spawn(self._sample_data_loop, self.sampling_interval)
+        else:
+            raise BadRequest("Unknown acquisition mode: %s" % self.acquisition_mode)
         if self.agent_plugin and hasattr(self.agent_plugin, 'on_start_streaming'):
             self.agent_plugin.on_start_streaming(streaming_args)
 
@@ -37,6 +62,12 @@ class DataAgent(StreamingAgent):
         self.sampling_gl.join(timeout=3)
         self.sampling_gl.kill()
         self.sampling_gl = None
+        if self.publish_gl:
+            # Publishes remaining buffered samples before exiting
+            self.buffer_data_event.set()
+            self.publish_gl.join(timeout=3)
+            self.publish_gl.kill()
+            self.publish_gl = None
         self.sampling_gl_quit = None
 
     def on_acquire_data(self, streaming_args=None):
@@ -48,6 +79,10 @@ class DataAgent(StreamingAgent):
             self.agent_plugin.on_disconnect()
 
     def on_get_status(self, agent_status):
+        if self.acquisition_stats is not None:
+            acq_status = dict(self.acquisition_stats)
+            acq_status["buffer_fill"] = len(self.sample_buffer) if self.sample_buffer is not None else 0
+            agent_status["acquisition"] = acq_status
         if self.agent_plugin and hasattr(self.agent_plugin, 'on_get_status'):
             return self.agent_plugin.on_get_status(agent_status)
         return agent_status
@@ -62,11 +97,108 @@ class DataAgent(StreamingAgent):
                         packet = DataPacketBuilder.build_packet_from_samples(sample,
                                     resource_id=self.resource_id, stream_name=self.stream_name)
                         self.stream_pub.publish(packet)
+                        num_samples = len(sample["data"])
+                        self.acquisition_stats["samples_acquired"] += num_samples
+                        self.acquisition_stats["samples_published"] += num_samples
+                        self.acquisition_stats["packets_published"] += 1
             except Exception as ex:
                 log.exception("Error in sampling greenlet")
 
+    # -------------------------------------------------------------------------
+    # Streaming acquisition mode
+
+    def _stream_data_loop(self):
+        """ Pulls sample batches from the plugin into the sample buffer. While the buffer is full
+        because publishing falls behind, the plugin stream is not consumed (backpressure);
+        samples that do not fit within the overflow timeout are dropped. An acquisition error ends
+        the stream; consumers are sent an error packet after the remaining buffered samples. """
+        stats = self.acquisition_stats
+        try:
+            for batch in self.agent_plugin.stream_samples():
+                if self.sampling_gl_quit.is_set():
+                    break
+                if isinstance(batch, dict):
+                    batch = DataPacketBuilder.get_sample_array(batch)
+                if batch is None or not len(batch):
+                    continue
+                if self.sample_buffer is None:
+                    self.sample_buffer = SampleRingBuffer(batch.dtype, self.buffer_size)
+                elif batch.dtype.names != self.sample_buffer.dtype.names:
+                    raise BadRequest("Sample batch columns %s differ from stream columns %s" % (
+                        batch.dtype.names, self.sample_buffer.dtype.names))
+                stats["batches_acquired"] += 1
+                stats["samples_acquired"] += len(batch)
+
+                num_appended = 0
+                while True:
+                    if not self.sample_buffer:
+                        self.buffered_since = time.time()
+                    num_appended += self.sample_buffer.append(batch[num_appended:])
+                    stats["max_buffer_fill"] = max(stats["max_buffer_fill"], len(self.sample_buffer))
+                    self.buffer_data_event.set()
+                    if num_appended == len(batch):
+                        break
+                    self.buffer_space_event.clear()
+                    if not self.buffer_space_event.wait(timeout=self.overflow_timeout) or \
+                            self.sampling_gl_quit.is_set():
+                        stats["samples_dropped"] += len(batch) - num_appended
+                        break
+        except Exception as ex:
+            log.exception("Error in streaming acquisition greenlet - ending stream")
+            stats["stream_error"] = self.stream_error = str(ex) or ex.__class__.__name__
+            self.buffer_data_event.set()
+
+    def _publish_data_loop(self):
+        """ Publishes packets of buffered samples once packet size or packet latency is reached """
+        while True:
+            try:
+                quit = self.sampling_gl_quit.is_set()
+                num_buffered = len(self.sample_buffer) if self.sample_buffer is not None else 0
+                wait_time = self.packet_latency
+                if num_buffered:
+                    wait_time -= time.time() - self.buffered_since
+                    if num_buffered >= self.packet_size or wait_time <= 0 or quit:
+                        self._publish_buffered()
+                        continue
+                elif self.stream_error:
+                    self._publish_stream_error()
+                    continue
+                if quit:
+                    break
+                self.buffer_data_event.clear()
+                self.buffer_data_event.wait(timeout=wait_time)
+            except Exception:
+                log.exception("Error in streaming publish greenlet")
+                self.sampling_gl_quit.wait(timeout=self.packet_latency)
+
+    def _publish_buffered(self):
+        # Samples remaining in the buffer keep buffered_since, so they are not held back longer
+        records = self.sample_buffer.take(self.packet_size)
+        self.buffer_space_event.set()
+
+        start_time = time.time()
+        packet = DataPacketBuilder.build_packet_from_array(records,
+                    resource_id=self.resource_id, stream_name=self.stream_name)
+        self.stream_pub.publish(packet)
+        stats = self.acquisition_stats
+        stats["publish_time"] = time.time() - start_time
+        stats["samples_published"] += len(records)
+        stats["packets_published"] += 1
+
+    def _publish_stream_error(self):
+        error_msg, self.stream_error = self.stream_error, None
+        packet = DataPacketBuilder.build_error_packet(error_msg,
+                    resource_id=self.resource_id, stream_name=self.stream_name)
+        self.stream_pub.publish(packet)
+
 
 class DataAgentPlugin(AgentPlugin):
 
     def acquire_samples(self, max_samples=0):
         return None
+
+    def stream_samples(self):
+        """ For the streaming acquisition mode: generator yielding batches of samples as numpy
+        record arrays (or samples dicts) for as long as the agent is streaming. Must not block
+        the gevent loop. """
+        return iter(())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import gevent
+from gevent.event import Event
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import UnitTestCase
+
+from ion.agent.data_agent import DataAgent
+from ion.data.packet.packet_builder import SampleRingBuffer, np
+
+
+@attr('UNIT')
+class TestDataAgent(UnitTestCase):
+
+    def setUp(self):
+        if np is None:
+            raise self.SkipTest("numpy not available")
+
+    def _get_records(self, cols, num):
+        records = np.zeros(num, dtype=[(col, "f8") for col in cols])
+        records[cols[0]] = np.arange(num)
+        return records
+
+    def test_stream_error(self):
+        agent = DataAgent()
+        agent.resource_id, agent.stream_name = "res1", "stream1"
+        agent.agent_config = dict(acquisition_mode="stream", packet_size=10, packet_latency=0.01)
+        agent.stream_pub = Mock()
+        agent.agent_plugin = Mock()
+        # The second batch has different columns, which ends the stream
+        agent.agent_plugin.stream_samples.return_value = iter([self._get_records(["time", "var1"], 5),
+                                                               self._get_records(["time", "var2"], 5)])
+
+        agent.on_start_streaming()
+        with gevent.Timeout(2):
+            while agent.stream_pub.publish.call_count < 2:
+                gevent.sleep(0.01)
+        agent.on_stop_streaming()
+
+        packets = [call_args[0][0] for call_args in agent.stream_pub.publish.call_args_list]
+        self.assertEquals(len(packets), 2)
+        self.assertEquals(packets[0].packet_class, "data")
+        self.assertEquals(len(packets[0].data["data"]), 5)
+        self.assertEquals(packets[1].packet_class, "error")
+        self.assertIn("var2", packets[1].data["error"])
+        self.assertEquals(packets[1].stream_name, "stream1")
+
+        acq_status = agent.acquisition_stats
+        self.assertEquals(acq_status["samples_published"], 5)
+        self.assertIn("var2", acq_status["stream_error"])
+
+    def test_publish_buffered(self):
+        agent = DataAgent()
+        agent.resource_id, agent.stream_name = "res1", "stream1"
+        agent.stream_pub = Mock()
+        agent.packet_size = 3
+        agent.acquisition_stats = dict(samples_published=0, packets_published=0, publish_time=0.0)
+        agent.buffer_space_event = Event()
+        records = self._get_records(["time", "var1"], 5)
+        agent.sample_buffer = SampleRingBuffer(records.dtype, 10)
+        agent.sample_buffer.append(records)
+        agent.buffered_since = 100.0
+
+        # Remaining samples keep the time of the oldest buffered samples
+        agent._publish_buffered()
+        self.assertEquals(len(agent.sample_buffer), 2)
+        self.assertEquals(agent.buffered_since, 100.0)
+        self.assertTrue(agent.buffer_space_event.is_set())
@@ -5,7 +5,7 @@ __author__ = 'Michael Meisinger'
 import gevent
 from gevent.event import Event
 
-from pyon.public import BadRequest, log, get_ion_ts_millis
+from pyon.public import BadRequest, log
 from pyon.util.async import spawn
 
 
@@ -13,10 +13,11 @@ class LeaderManager(object):
     """ This class spawns a background thread that acquires a leader lock for a given
     scope, so that concurrent peer processes can determine a leader among them.
     The mechanism guarantees that there is never more than 1 leader.
-    It is based on an atomic, central directory (database) lock with timeout.
-    It does not guarantee that there is always an active leader, e.g. when a leader
-    suddenly fails. It does, however, have the leader lock expire after a while,
-    so that a surviving peer can claim the leader role.
+    It is based on an atomic, central directory (database) lock lease with timeout.
+    The leader renews its lease in the background. Peers block on the lock and are woken
+    up when the leader releases it or when its lease expires, e.g. when a leader suddenly
+    fails, so that a surviving peer can claim the leader role quickly.
+    The fencing token of the current leader lease is available as leader_fence.
     """
 
     def __init__(self, scope, process=None, container=None):
@@ -25,14 +26,13 @@ class LeaderManager(object):
         self.container = container or process.container
         self.instance_id = self.process.id if self.process else self.container.id
 
-        self.leader_interval = 60
+        self.leader_interval = 10       # Secs between lease renewals
         self._has_leader = Event()
-        self._lock_timeout = self.leader_interval * 1.5
+        self._lock_timeout = self.leader_interval * 3
 
         self._leader_thread = None
         self._leader_quit = None        # Signal to terminate background thread
-        self._has_lock = False
-        self._lock_expires = 0          # Timestamp in millis when lock expires
+        self._lease = None              # DirectoryLease while leader
         self._leader_callbacks = []     # Callables cb(atts_dict) to be notified when leader status changes
 
     def start(self):
@@ -43,30 +43,34 @@ class LeaderManager(object):
             self._leader_thread = spawn(self._leader_loop)
 
     def stop(self):
-        self.release_leader()
         self._leader_quit.set()
+        self.release_leader()
         self._leader_thread.join(timeout=2)
 
     def is_leader(self):
-        """ Returns true if current instance is leader and lock did not expire """
-        if self._has_lock and get_ion_ts_millis() >= self._lock_expires:
+        """ Returns true if current instance is leader and lease did not expire """
+        if self._lease and not self._lease.is_valid():
             log.warn("Master lock '%s' held and expired by %s", self.scope, self.instance_id)
             self._inform_error("lock_expired")
             try:
-                # Cannot call release_leader due to infinite recursion
-                self.container.directory.release_lock(self.scope, lock_holder=self.instance_id)
+                self._lease.release()
                 self._inform_release()
             except Exception:
                 pass
-            self._has_lock = False
-            self._lock_expires = 0
+            self._lease = None
             return False
 
-        return self._has_lock
+        return self._lease is not None
+
+    @property
+    def leader_fence(self):
+        """ Fencing token of the leader lease or None if not leader """
+        return self._lease.fence if self.is_leader() else None
 
     def release_leader(self):
         if self.is_leader():
-            self.container.directory.release_lock(self.scope, lock_holder=self.instance_id)
+            lease, self._lease = self._lease, None
+            lease.release()
             self._inform_release()
 
     def add_leader_callback(self, cb):
@@ -83,27 +87,42 @@ class LeaderManager(object):
 
         self._check_lock()
         self._has_leader.set()
-        while not self._leader_quit.wait(timeout=self.leader_interval):
+        while not self._leader_quit.is_set():
             try:
-                self._check_lock()
+                if self.is_leader():
+                    # Lease is renewed in the background
+                    self._leader_quit.wait(timeout=self.leader_interval)
+                else:
+                    # Block until the current leader releases the lock or its lease expires
+                    self._check_lock(wait_timeout=self.leader_interval)
             except Exception:
                 log.exception("Exception in _leader_loop '%s' for pid=%s", self.scope, self.instance_id)
-
-    def _check_lock(self):
-        cur_time = get_ion_ts_millis()
-        was_leader = self.is_leader()
-        self._has_lock = self.container.directory.acquire_lock(self.scope, self._lock_timeout, self.instance_id)
-        if self._has_lock:
+                self._leader_quit.wait(timeout=self.leader_interval)
+
+    def _check_lock(self, wait_timeout=0):
+        lease = self.container.directory.acquire_lease(self.scope, self._lock_timeout, self.instance_id,
+                                                       wait_timeout=wait_timeout)
+        if lease and self._leader_quit.is_set():
+            # Stopped while waiting for the lock
+            lease.release()
+        elif lease:
             # We are the leader
-            if not was_leader:
-                log.info("Process %s is now the leader for '%s'", self.instance_id, self.scope)
-                self._inform_acquire()
-            self._lock_expires = cur_time + int(1000*self._lock_timeout)
+            lease.lost_callback = self._lease_lost
+            self._lease = lease
+            log.info("Process %s is now the leader for '%s' (fence=%s)", self.instance_id, self.scope, lease.fence)
+            self._inform_acquire()
+
+    def _lease_lost(self, lease):
+        if lease is self._lease:
+            log.warn("Master lock '%s' lost by %s", self.scope, self.instance_id)
+            self._lease = None
+            self._inform_error("lock_lost")
+            self._inform_release()
 
     def _inform_acquire(self):
         for cb in self._leader_callbacks:
             attrs = dict(scope=self.scope, action="acquire_leader", instance_id=self.instance_id,
-                         expires=self._lock_expires)
+                         expires=self._lease.expires, fence=self._lease.fence)
             cb(attrs)
 
     def _inform_release(self):
@@ -6,7 +6,7 @@ from copy import deepcopy
 import random
 import re
 import gevent
-from gevent.event import AsyncResult
+from gevent.event import AsyncResult, Event
 from gevent.queue import Queue
 
 from pyon.public import BadRequest, log, NotFound, OT, RT, Subscriber, Publisher, get_safe, CFG
@@ -29,6 +29,10 @@ class ProcessDispatcherDecisionEngine(object):
         self.sub_cont_gl = None
         self.sub_active = False
 
+        self._scaled_apps = {}      # Rel apps with load based scaling: app name -> scaling info dict
+        self.scaling_quit = Event()
+        self.scaling_gl = None
+
         self._pd_core.leader_manager.add_leader_callback(self._leader_callback)
 
         self._load_rules()
@@ -41,7 +45,15 @@ class ProcessDispatcherDecisionEngine(object):
 
         self.pub_result = Publisher()
 
+        if self.scaling_cfg.get("enabled", False) is True:
+            self.scaling_gl = spawn(self._scaling_loop)
+
     def stop(self):
+        if self.scaling_gl:
+            self.scaling_quit.set()
+            self.scaling_gl.join(timeout=2)
+            self.scaling_gl.kill()
+            self.scaling_gl = None
         if self.sub_cont:
             self.sub_cont.close()
             self.sub_cont_gl.join(timeout=2)
@@ -131,25 +143,30 @@ class ProcessDispatcherDecisionEngine(object):
                     if proc_replicas < 1 or proc_replicas > 100:
                         log.warn("Invalid number of process replicas: %s", proc_replicas)
                         proc_replicas = 1
+                    proc_ids = []
                     for i in xrange(proc_replicas):
-                        cont_info = self._determine_target_container(rel_app_cfg, target_engine)
-                        container_name = self._get_cc_agent_name(cont_info)
                         proc_name = "%s.%s" % (name, i) if i else name
-                        action_res = self._add_spawn_process_action(cc_agent=container_name, proc_name=proc_name,
-                                                                    module=module, cls=cls, config=rel_cfg)
-                        proc_id = action_res.wait()
-                        self._slot_process(cont_info, proc_id, dict(proc_name=proc_name, state=ProcessStateEnum.RUNNING))
+                        proc_ids.append(self._spawn_app_process(rel_app_cfg, target_engine, proc_name, rel_cfg))
                 else:
-                    cont_info = self._determine_target_container(rel_app_cfg, target_engine)
-                    container_name = self._get_cc_agent_name(cont_info)
-                    action_res = self._add_spawn_process_action(cc_agent=container_name, proc_name=name,
-                                                                module=module, cls=cls, config=rel_cfg)
-                    proc_id = action_res.wait()
-                    self._slot_process(cont_info, proc_id, dict(proc_name=name, state=ProcessStateEnum.RUNNING))
+                    proc_ids = [self._spawn_app_process(rel_app_cfg, target_engine, name, rel_cfg)]
+
+                if "scaling" in rel_app_cfg:
+                    self._scaled_apps[app_name] = dict(app_cfg=rel_app_cfg, engine=target_engine, config=rel_cfg,
+                                                       proc_ids=proc_ids, num_spawned=len(proc_ids))
 
             else:
                 log.warn("App file not supported")
 
+    def _spawn_app_process(self, app_cfg, target_engine, proc_name, config):
+        name, module, cls = app_cfg["processapp"]
+        cont_info = self._determine_target_container(app_cfg, target_engine)
+        container_name = self._get_cc_agent_name(cont_info)
+        action_res = self._add_spawn_process_action(cc_agent=container_name, proc_name=proc_name,
+                                                    module=module, cls=cls, config=config)
+        proc_id = action_res.wait()
+        self._slot_process(cont_info, proc_id, dict(proc_name=proc_name, state=ProcessStateEnum.RUNNING))
+        return proc_id
+
     def _add_spawn_process_action(self, cc_agent, proc_name, module, cls, config):
         action_res = AsyncResult()
         action_kwargs = dict(cc_agent=cc_agent, proc_name=proc_name, module=module, cls=cls, config=config)
@@ -157,11 +174,84 @@ class ProcessDispatcherDecisionEngine(object):
         self.executor.add_action(action)
         return action_res
 
+    def _add_terminate_process_action(self, cc_agent, process_id):
+        action_res = AsyncResult()
+        action_kwargs = dict(cc_agent=cc_agent, process_id=process_id)
+        action = ("terminate_process", action_res, action_kwargs)
+        self.executor.add_action(action)
+        return action_res
+
+    # -------------------------------------------------------------------------
+    # Load based scaling
+
+    def _scaling_loop(self):
+        scaling_interval = float(self.scaling_cfg.get("interval", 60))
+        while not self.scaling_quit.wait(timeout=scaling_interval):
+            if not self._pd_core.is_leader():
+                continue
+            for app_name in self._scaled_apps.keys():
+                try:
+                    self._check_app_scaling(app_name)
+                except Exception:
+                    log.exception("Error checking scaling for app %s", app_name)
+
+    def _get_app_load(self, app_name):
+        """ Returns a tuple (list of running replica process ids, average saturation,
+        queued messages per replica) based on the last heartbeats """
+        scale_info = self._scaled_apps[app_name]
+        proc_ids = [pid for pid in scale_info["proc_ids"] if self.registry.find_process_container(pid)]
+        proc_loads = [self.registry.get_process_load(pid) for pid in proc_ids]
+        proc_loads = [pl for pl in proc_loads if pl is not None]
+        if not proc_loads:
+            return proc_ids, None, None
+        avg_saturation = sum(pl.get("saturation", 0) for pl in proc_loads) / float(len(proc_loads))
+        # Replicas of a service share one queue, so each reports the same backlog
+        backlog = max(pl.get("msg_backlog", 0) for pl in proc_loads) / float(len(proc_loads))
+        return proc_ids, avg_saturation, backlog
+
+    def _check_app_scaling(self, app_name):
+        """ Adds or removes one replica of a rel app if the measured load of its replicas is above
+        or below the configured thresholds """
+        scale_info = self._scaled_apps[app_name]
+        app_scaling = scale_info["app_cfg"]["scaling"] or {}
+        min_replicas = int(app_scaling.get("min_replicas", 1))
+        max_replicas = int(app_scaling.get("max_replicas", min_replicas))
+        scale_up_sat = float(app_scaling.get("scale_up_saturation", self.scaling_cfg.get("scale_up_saturation", 80)))
+        scale_down_sat = float(app_scaling.get("scale_down_saturation", self.scaling_cfg.get("scale_down_saturation", 20)))
+        scale_up_backlog = float(app_scaling.get("scale_up_backlog", self.scaling_cfg.get("scale_up_backlog", 0)))
+
+        proc_ids, avg_saturation, backlog = self._get_app_load(app_name)
+        scale_info["proc_ids"] = proc_ids
+        if avg_saturation is None:
+            return
+
+        num_replicas = len(proc_ids)
+        overloaded = avg_saturation > scale_up_sat or bool(scale_up_backlog and backlog > scale_up_backlog)
+        if (num_replicas < min_replicas or overloaded) and num_replicas < max_replicas:
+            name = scale_info["app_cfg"]["processapp"][0]
+            proc_name = "%s.%s" % (name, scale_info["num_spawned"])
+            log.info("Scaling up app %s to %s replicas (saturation %.0f%%, backlog %s)", app_name,
+                     num_replicas + 1, avg_saturation, backlog)
+            proc_id = self._spawn_app_process(scale_info["app_cfg"], scale_info["engine"], proc_name, scale_info["config"])
+            scale_info["proc_ids"].append(proc_id)
+            scale_info["num_spawned"] += 1
+
+        elif avg_saturation < scale_down_sat and not overloaded and num_replicas > min_replicas:
+            # Remove the most recently added replica
+            proc_id = proc_ids[-1]
+            cont_info = self.registry.find_process_container(proc_id)
+            log.info("Scaling down app %s to %s replicas (saturation %.0f%%)", app_name, num_replicas - 1, avg_saturation)
+            action_res = self._add_terminate_process_action(cc_agent=self._get_cc_agent_name(cont_info), process_id=proc_id)
+            action_res.wait()
+            self.registry.register_process(cont_info["container_id"], proc_id, dict(state=ProcessStateEnum.TERMINATED))
+            scale_info["proc_ids"].remove(proc_id)
+
     # -------------------------------------------------------------------------
 
     def _load_rules(self):
         self.rules_cfg = get_safe(self._pd_core.pd_cfg, "engine.dispatch_rules") or []
         self.default_engine = get_safe(self._pd_core.pd_cfg, "engine.default_engine") or "default"
+        self.scaling_cfg = get_safe(self._pd_core.pd_cfg, "engine.scaling") or {}
 
     def _determine_target_engine(self, app_cfg):
 
@@ -212,6 +302,20 @@ class ProcessDispatcherDecisionEngine(object):
                     break
             if not cont_info:
                 raise BadRequest("Could not find open slot")
+        elif dispatch_spread == "load":
+            # Least loaded container with open slot, as reported in heartbeats. Containers without
+            # reported load count as idle; ties are broken by allocation count
+            cont_info, current_min_load = None, None
+            for cont in ee_conts_sorted:
+                max_capacity = int(get_safe(cont["ee_info"], "capacity.max", 0))
+                if max_capacity and len(cont["allocation"]) >= max_capacity:
+                    continue
+                cont_load = (self.registry.get_container_load(cont) or 0.0, len(cont["allocation"]))
+                if current_min_load is None or cont_load < current_min_load:
+                    cont_info = cont
+                    current_min_load = cont_load
+            if not cont_info:
+                raise BadRequest("Could not find open slot")
         elif dispatch_spread == "random":
             cont_num = random.randint(0, len(ee_conts_sorted)-1)
             cont_info = ee_conts_sorted[cont_num]
@@ -86,8 +86,13 @@ class ProcessDispatcherAgentExecutor(ProcessDispatcherExecutorBase):
         proc_id = target_cc_agent.spawn_process(proc_name, module, cls, config)
         return proc_id
 
-    def _action_terminate_process(self):
-        pass
+    def _action_terminate_process(self, action_kwargs):
+        cc_agent_name = action_kwargs["cc_agent"]
+        process_id = action_kwargs["process_id"]
+
+        target_cc_agent = ContainerAgentClient(to_name=cc_agent_name)
+        target_cc_agent.terminate_process(process_id)
+        return process_id
 
 
 
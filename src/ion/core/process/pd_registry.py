@@ -63,11 +63,17 @@ class ProcessDispatcherRegistry(object):
                 # This is filled for every new container_entry
                 container_entry["ts_update"] = get_ion_ts_millis()
                 container_entry["ts_event"] = ts_event
+                if container_entry.get("state", None) != state:
+                    # Keep the process allocation while heartbeats confirm the same state
+                    container_entry["allocation"] = {}
+                    container_entry["dead_procs"] = {}
+                    container_entry["proc_load"] = {}
                 container_entry["state"] = state
                 container_entry["ee_info"] = container_entry["cc_obj"].execution_engine_config
                 container_entry["ts_created"] = int(container_entry["cc_obj"].ts_created)
-                container_entry["allocation"] = {}
-                container_entry["dead_procs"] = {}
+                if container_info and "proc_load" in container_info:
+                    container_entry["proc_load"] = container_info["proc_load"] or {}
+                    container_entry["ts_load"] = ts_event
 
         if not self.preconditions_true.is_set():
             self.check_preconditions()
@@ -87,6 +93,29 @@ class ProcessDispatcherRegistry(object):
             eng_cont_list.sort(key=lambda ci: ci["ts_created"])
         return ee_infos
 
+    def get_container_load(self, container_info):
+        """ Returns a load score for a container: the sum of its process saturations (in units of
+        fully busy processes), or None if no load was reported yet """
+        proc_load = container_info.get("proc_load", None)
+        if not proc_load:
+            return None
+        return sum(pl.get("saturation", 0) for pl in proc_load.values()) / 100.0
+
+    def get_process_load(self, process_id):
+        """ Returns the last reported load stats dict for a process, or None """
+        for container_entry in self._containers.values():
+            proc_load = container_entry.get("proc_load", None)
+            if proc_load and process_id in proc_load:
+                return proc_load[process_id]
+        return None
+
+    def find_process_container(self, process_id):
+        """ Returns the info dict of the running container that has the given process allocated, or None """
+        for container_entry in self.get_running_containers():
+            if process_id in container_entry["allocation"]:
+                return container_entry
+        return None
+
     def register_process(self, container_id, process_id, proc_info, update=True):
         container_entry = self._containers.get(container_id, None)
         if not container_entry:
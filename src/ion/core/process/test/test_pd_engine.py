@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.public import BadRequest
+from ion.core.process import EE_STATE_RUNNING
+from ion.core.process.pd_engine import ProcessDispatcherDecisionEngine
+from ion.core.process.pd_registry import ProcessDispatcherRegistry
+
+from interface.objects import ProcessStateEnum
+
+
+@attr('UNIT', group='cei')
+class TestProcessDispatcherEngine(PyonTestCase):
+
+    def setUp(self):
+        self.pd_core = Mock()
+        self.pd_core.pd_cfg = dict(engine=dict(dispatch_spread="load",
+                                               scaling=dict(enabled=True, scale_up_saturation=80, scale_down_saturation=20)))
+        self.pd_core.container.resource_registry = Mock()
+        self.registry = ProcessDispatcherRegistry(pd_core=self.pd_core)
+        self.pd_core.registry = self.registry
+        self.engine = ProcessDispatcherDecisionEngine(pd_core=self.pd_core)
+
+    def _add_container(self, container_id, ts_created, proc_load=None):
+        cc_obj = Mock()
+        cc_obj.cc_agent = "cc_agent_" + container_id
+        cc_obj.execution_engine_config = dict(name="default", capacity=dict(max=5))
+        cc_obj.ts_created = str(ts_created)
+        self.registry._containers[container_id] = dict(cc_obj=cc_obj, container_id=container_id, ts_event=0)
+        self.registry.register_container(container_id, 1, EE_STATE_RUNNING, dict(proc_load=proc_load or {}))
+        return self.registry._containers[container_id]
+
+    def test_load_dispatch(self):
+        cont1 = self._add_container("c1", 100, dict(p1=dict(saturation=90), p2=dict(saturation=50)))
+        cont2 = self._add_container("c2", 200, dict(p3=dict(saturation=30)))
+        app_cfg = dict(name="app1")
+
+        self.assertIs(self.engine._determine_target_container(app_cfg, "default"), cont2)
+
+        # Heartbeat with new load keeps the allocation
+        self.registry.register_process("c2", "p3", dict(state=ProcessStateEnum.RUNNING))
+        self.registry.register_container("c2", 2, EE_STATE_RUNNING, dict(proc_load=dict(p3=dict(saturation=100),
+                                                                                        p4=dict(saturation=80))))
+        self.assertIn("p3", cont2["allocation"])
+        self.assertIs(self.engine._determine_target_container(app_cfg, "default"), cont1)
+
+        # Full containers are skipped
+        for i in xrange(5):
+            self.registry.register_process("c1", "px%s" % i, dict(state=ProcessStateEnum.RUNNING))
+        self.assertIs(self.engine._determine_target_container(app_cfg, "default"), cont2)
+        for i in xrange(5):
+            self.registry.register_process("c2", "py%s" % i, dict(state=ProcessStateEnum.RUNNING))
+        with self.assertRaises(BadRequest):
+            self.engine._determine_target_container(app_cfg, "default")
+
+    def test_app_scaling(self):
+        self._add_container("c1", 100)
+        self.registry.register_process("c1", "p1", dict(state=ProcessStateEnum.RUNNING))
+        app_cfg = dict(name="app1", processapp=["svc1", "mod1", "Cls1"], scaling=dict(min_replicas=1, max_replicas=2))
+        self.engine._scaled_apps["app1"] = dict(app_cfg=app_cfg, engine="default", config=None,
+                                                proc_ids=["p1"], num_spawned=1)
+        self.engine._spawn_app_process = Mock(return_value="p2")
+        self.engine._add_terminate_process_action = Mock()
+
+        # No load reported - no decision
+        self.engine._check_app_scaling("app1")
+        self.assertFalse(self.engine._spawn_app_process.called)
+
+        # Overloaded - scale up, but not beyond max_replicas
+        self.registry.register_container("c1", 2, EE_STATE_RUNNING, dict(proc_load=dict(p1=dict(saturation=95))))
+        self.engine._check_app_scaling("app1")
+        self.engine._spawn_app_process.assert_called_once_with(app_cfg, "default", "svc1.1", None)
+        self.registry.register_process("c1", "p2", dict(state=ProcessStateEnum.RUNNING))
+        self.assertEquals(self.engine._scaled_apps["app1"]["proc_ids"], ["p1", "p2"])
+
+        self.registry.register_container("c1", 3, EE_STATE_RUNNING, dict(proc_load=dict(p1=dict(saturation=95),
+                                                                                        p2=dict(saturation=85))))
+        self.engine._check_app_scaling("app1")
+        self.assertEquals(self.engine._spawn_app_process.call_count, 1)
+
+        # Idle - scale down to min_replicas, most recent replica first
+        self.registry.register_container("c1", 4, EE_STATE_RUNNING, dict(proc_load=dict(p1=dict(saturation=5),
+                                                                                        p2=dict(saturation=5))))
+        self.engine._check_app_scaling("app1")
+        self.engine._add_terminate_process_action.assert_called_once_with(cc_agent="cc_agent_c1", process_id="p2")
+        self.assertEquals(self.engine._scaled_apps["app1"]["proc_ids"], ["p1"])
+        self.assertNotIn("p2", self.registry._containers["c1"]["allocation"])
+
+        self.engine._check_app_scaling("app1")
+        self.assertEquals(self.engine._add_terminate_process_action.call_count, 1)
@@ -12,6 +12,9 @@ from ion.util.ntp_time import NTP4Time
 
 from interface.objects import DataPacket
 
+PACKET_CLASS_DATA = "data"
+PACKET_CLASS_ERROR = "error"    # Marks the end of a stream due to an acquisition error
+
 
 class DataPacketBuilder(object):
     def __init__(self):
@@ -19,6 +22,26 @@ class DataPacketBuilder(object):
 
     @classmethod
     def build_packet_from_samples(cls, samples, **kwargs):
+        data = samples.copy()
+        data["data"] = cls.get_sample_array(samples)
+        return cls._build_packet(data, **kwargs)
+
+    @classmethod
+    def build_packet_from_array(cls, data_array, **kwargs):
+        """ Builds a packet from a numpy record array of samples (e.g. as acquired in batches),
+        without per-sample conversion. Columns are the record field names. """
+        data = dict(cols=list(data_array.dtype.names), data=data_array)
+        return cls._build_packet(data, **kwargs)
+
+    @classmethod
+    def build_error_packet(cls, error_msg, **kwargs):
+        """ Builds a packet without samples that tells consumers that the stream ended with an error """
+        kwargs["packet_class"] = PACKET_CLASS_ERROR
+        return cls._build_packet(dict(error=error_msg), **kwargs)
+
+    @classmethod
+    def get_sample_array(cls, samples):
+        """ Returns the rows of a samples dict (with cols, data and optional coltypes) as numpy record array """
         num_samples = len(samples["data"])
         dtype_parts = []
         for coldef in samples["cols"]:
@@ -33,8 +56,10 @@ class DataPacketBuilder(object):
         for row_num, data_row in enumerate(samples["data"]):
             row_tuple = tuple(NTP4Time.np_from_string(dv) if isinstance(dv, basestring) else dv for dv in data_row)
             data_array[row_num] = np.array(row_tuple, dtype=dt)
-        data = samples.copy()
-        data["data"] = data_array
+        return data_array
+
+    @classmethod
+    def _build_packet(cls, data, **kwargs):
         new_packet = DataPacket(ts_created=get_ion_ts(), data=data)
         for attr in new_packet.__dict__.keys():
             if attr in ('data', 'ts_created'):
@@ -42,3 +67,51 @@ class DataPacketBuilder(object):
             if attr in kwargs:
                 setattr(new_packet, attr, kwargs[attr])
         return new_packet
+
+
+class SampleRingBuffer(object):
+    """
+    Preallocated FIFO ring buffer of numpy sample records with fixed capacity. Records are
+    appended and taken in at most two contiguous slice copies, without per-sample work.
+    """
+    def __init__(self, dtype, capacity):
+        self.dtype = np.dtype(dtype)
+        self.capacity = int(capacity)
+        self.buffer = np.zeros(self.capacity, dtype=self.dtype)
+        self.start = 0      # Index of the oldest record
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def free(self):
+        return self.capacity - self.count
+
+    def append(self, records):
+        """ Appends as many records as there is free capacity for.
+        @retval number of records appended """
+        if records.dtype != self.dtype:
+            records = records.astype(self.dtype)
+        num = min(len(records), self.free)
+        if num <= 0:
+            return 0
+        end = (self.start + self.count) % self.capacity
+        first = min(num, self.capacity - end)
+        self.buffer[end:end + first] = records[:first]
+        if num > first:
+            self.buffer[:num - first] = records[first:num]
+        self.count += num
+        return num
+
+    def take(self, max_count=0):
+        """ Removes and returns up to max_count (all if 0) of the oldest records as a new array """
+        num = min(max_count, self.count) if max_count else self.count
+        first = min(num, self.capacity - self.start)
+        if num > first:
+            records = np.concatenate((self.buffer[self.start:], self.buffer[:num - first]))
+        else:
+            records = self.buffer[self.start:self.start + num].copy()
+        self.start = (self.start + num) % self.capacity
+        self.count -= num
+        return records
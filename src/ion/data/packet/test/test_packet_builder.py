@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import UnitTestCase
+
+from ion.data.packet.packet_builder import DataPacketBuilder, SampleRingBuffer, np
+
+
+@attr('UNIT', group='data')
+class TestPacketBuilder(UnitTestCase):
+
+    def setUp(self):
+        if np is None:
+            raise self.SkipTest("numpy not available")
+        self.dtype = np.dtype([("time", "i8"), ("var1", "f8")])
+
+    def _get_records(self, start, num):
+        records = np.zeros(num, dtype=self.dtype)
+        records["time"] = np.arange(start, start + num)
+        records["var1"] = records["time"] * 0.5
+        return records
+
+    def test_ring_buffer(self):
+        buf = SampleRingBuffer(self.dtype, 10)
+        self.assertEquals(buf.append(self._get_records(0, 6)), 6)
+        self.assertEquals(list(buf.take(4)["time"]), [0, 1, 2, 3])
+
+        # Append wraps around the buffer end and is limited to free capacity
+        self.assertEquals(buf.append(self._get_records(6, 10)), 8)
+        self.assertEquals((len(buf), buf.free), (10, 0))
+        self.assertEquals(buf.append(self._get_records(14, 1)), 0)
+
+        records = buf.take(7)
+        self.assertEquals(list(records["time"]), range(4, 11))
+        self.assertEquals(list(buf.take()["time"]), [11, 12, 13])
+        self.assertEquals(len(buf), 0)
+        self.assertEquals(len(buf.take()), 0)
+
+    def test_build_packet(self):
+        samples = dict(cols=["time", "var1"], data=[[1, 0.5], [2, 1.0]])
+        packet = DataPacketBuilder.build_packet_from_samples(samples, stream_name="s1")
+        self.assertEquals(packet.data["data"].dtype, self.dtype)
+        self.assertEquals(packet.stream_name, "s1")
+
+        packet = DataPacketBuilder.build_packet_from_array(self._get_records(1, 2), stream_name="s1")
+        self.assertEquals(packet.data["cols"], ["time", "var1"])
+        self.assertEquals(list(packet.data["data"]["var1"]), [0.5, 1.0])
+        self.assertTrue(packet.ts_created)
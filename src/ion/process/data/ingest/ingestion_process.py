@@ -4,6 +4,8 @@ __author__ = 'Michael Meisinger'
 
 from pyon.public import log, StandaloneProcess, BadRequest, CFG, StreamSubscriber, named_any, get_safe
 
+from ion.data.packet.packet_builder import PACKET_CLASS_DATA
+
 from interface.objects import StreamRoute, DataPacket
 
 CONFIG_KEY = "process.ingestion_process"
@@ -61,6 +63,10 @@ class IngestionProcess(StandaloneProcess):
     def process_package(self, packet, route, stream):
         if not isinstance(packet, DataPacket):
             log.warn("Ingestion received a non DataPacket message")
+        elif packet.packet_class != PACKET_CLASS_DATA:
+            # E.g. error packets ending a stream - nothing to persist
+            log.info("Ingestion skipped %s packet from %s: %s", packet.packet_class, packet.resource_id, packet.data)
+            return
 
         #print "INGEST", packet, route, stream
         try:
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import UnitTestCase
+
+from ion.data.packet.packet_builder import DataPacketBuilder, np
+from ion.process.data.ingest.ingestion_process import IngestionProcess
+
+
+@attr('UNIT', group='data')
+class TestIngestionProcess(UnitTestCase):
+
+    def test_process_package(self):
+        if np is None:
+            raise self.SkipTest("numpy not available")
+        ingestion = IngestionProcess()
+        ingestion.plugin = Mock()
+        ingestion._persist_packet = Mock()
+
+        # Error packets ending a stream are not persisted
+        packet = DataPacketBuilder.build_error_packet("Stream failed", resource_id="res1", stream_name="s1")
+        ingestion.process_package(packet, None, None)
+        self.assertFalse(ingestion.plugin.get_dataset_info.called)
+        self.assertFalse(ingestion._persist_packet.called)
+
+        records = np.zeros(2, dtype=[("time", "i8"), ("var1", "f8")])
+        packet = DataPacketBuilder.build_packet_from_array(records, resource_id="res1", stream_name="s1")
+        ingestion.process_package(packet, None, None)
+        ingestion.plugin.get_dataset_info.assert_called_once_with(packet)
+        ingestion._persist_packet.assert_called_once_with(packet, ingestion.plugin.get_dataset_info.return_value)
@@ -6,10 +6,11 @@ __author__ = 'Michael Meisinger'
 
 import collections, traceback, datetime, time, yaml
 import flask, ast, pprint
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, stream_with_context
 from gevent.wsgi import WSGIServer
 import json
 import os
+import urllib
 try:
     yaml_dumper = yaml.CDumper
 except:
@@ -18,7 +19,10 @@ except:
 
 from pyon.core.object import IonObjectBase
 from pyon.core.registry import getextends, model_classes
-from pyon.public import Container, SimpleProcess, log, PRED, RT, IonObject, CFG, NotFound, Inconsistent, BadRequest, Unauthorized, named_any
+from pyon.public import Container, SimpleProcess, log, PRED, RT, IonObject, CFG, NotFound, Inconsistent, BadRequest, Unauthorized, named_any, \
+    DotDict, DQ, ResourceQuery, AssociationQuery, EventQuery
+
+from ion.util.ui_utils import CONT_TYPE_HTML, CONT_TYPE_JSON, json_dumps, encode_ion_object
 
 from interface import objects
 
@@ -41,6 +45,13 @@ date_fieldnames = ['ts_created', 'ts_updated']
 
 CFG_PREFIX = "process.admin_ui"
 
+# Paged lists: rows per page and columns to sort by (with id), each backed by an index
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+RES_SORT_COLS = ["name", "ts_created"]
+ASSOC_SORT_COLS = ["id"]
+EVENT_SORT_COLS = ["ts_created"]
+
 
 class AdminUI(SimpleProcess):
     """
@@ -225,35 +236,57 @@ def process_list_resources(resource_type):
     try:
         restype = str(resource_type)
         with_details = get_arg("details", "off") == "on"
-
-        res_list,_ = Container.instance.resource_registry.find_resources(restype=restype,
-                                                                         access_args=get_rr_access_args())
+        page = get_page_args(RES_SORT_COLS)
+        columns = [col for col in get_arg("cols").split(",") if col]
+        filter_args = dict(details=get_arg("details", "off"), cols=get_arg("cols"), q=get_arg("q"),
+                           name=get_arg("name"), lcstate=get_arg("lcstate"), attr=get_arg("attr"), value=get_arg("value"))
+
+        rq = ResourceQuery()
+        filters = [rq.filter_type(restype)]
+        if filter_args["q"]:
+            filters.append(rq.filter_fulltext(filter_args["q"]))
+        if filter_args["name"]:
+            filters.append(rq.filter_name(filter_args["name"], DQ.TXT_ICONTAINS))
+        if filter_args["lcstate"]:
+            filters.append(rq.filter_lcstate(filter_args["lcstate"]))
+        if filter_args["attr"]:
+            filters.append(rq.filter_attribute(filter_args["attr"], filter_args["value"]))
+        add_page_filter(rq, page, filters)
+        if columns:
+            # Projection: only id, sort value and requested columns are read
+            rq.set_returns(["id", page.sort] + columns)
+        res_list = Container.instance.resource_registry.find_resources_ext(query=rq.get_query(), id_only=False,
+                                                                          access_args=get_rr_access_args())
 
         fragments = [
             build_standard_menu(),
             "<h1>List of '%s' Resources</h1>" % restype,
-            build_command("Hide details" if with_details else "Show details", "/list/%s?details=%s" % (
-                restype, "off" if with_details else "on")),
+            build_command("Hide details" if with_details else "Show details", "/list/%s?%s" % (
+                restype, urllib.urlencode(dict(filter_args, details="off" if with_details else "on")))),
             build_command("New %s" % restype, "/new/%s" % restype),
             build_res_extends(restype),
+            build_command("Filter", "/list/%s?details=%s" % (restype, filter_args["details"]),
+                          [("input", "q", 30), ("input", "cols", 30)]),
             "<p>",
             "<table>",
             "<tr>"
         ]
-
-        fragments.extend(build_table_header(restype))
+        if columns:
+            fragments.append("".join("<th>%s</th>" % col for col in ["ID"] + columns))
+            build_row = lambda row: "".join(["<td><a href='%s'>%s</a></td>" % (_link("/view/%s" % row[0]), row[0])] +
+                                            ["<td>%s</td>" % get_formatted_value(value, fieldname=col) if value is not None else "<td>&nbsp;</td>"
+                                             for col, value in zip(columns, row[2:])])
+            get_position = lambda row: (row[1], row[0])
+            build_json_row = lambda row: dict(zip(["_id"] + columns, [row[0]] + row[2:]))
+        else:
+            fragments.extend(build_table_header(restype))
+            build_row = lambda res: "".join(build_table_row(res, details=with_details))
+            get_position = lambda res: (getattr(res, page.sort), res._id)
+            build_json_row = lambda res: res
         fragments.append("</tr>")
 
-        for res in res_list:
-            fragments.append("<tr>")
-            fragments.extend(build_table_row(res, details=with_details))
-            fragments.append("</tr>")
-
-        fragments.append("</table></p>")
-        fragments.append("<p>Number of resources: %s</p>" % len(res_list))
-
-        content = "\n".join(fragments)
-        return build_page(content)
+        return build_paged_response(page, res_list, "/list/%s" % restype, filter_args, fragments,
+                                    build_row, get_position, build_json_row)
 
     #except NotFound:
     #    return flask.redirect("/")
@@ -338,7 +371,10 @@ def process_view_resource(resource_id):
         events_list = Container.instance.event_repository.find_events(origin=resid,
                         descending=True, limit=50)
 
-        fragments.extend(build_events_table(events_list))
+        fragments.extend(build_events_table_header())
+        for event_id, event_key, event in events_list:
+            fragments.append("<tr>%s</tr>" % build_event_row(event))
+        fragments.append("</table></p>")
         content = "\n".join(fragments)
         return build_page(content)
 
@@ -689,28 +725,40 @@ def build_editable_resource(res, is_new=False):
 @app.route('/assoc', methods=['GET','POST'])
 def process_assoc_list():
     try:
-        predicate = get_arg('predicate')
-
-        assoc_list = Container.instance.resource_registry.find_associations(predicate=predicate, id_only=False,
-                                                                            access_args=get_rr_access_args())
+        page = get_page_args(ASSOC_SORT_COLS)
+        filter_args = dict(predicate=get_arg('predicate'), s=get_arg('s'), o=get_arg('o'),
+                           st=get_arg('st'), ot=get_arg('ot'))
+
+        aq = AssociationQuery()
+        filters = []
+        if filter_args["predicate"]:
+            filters.append(aq.filter_predicate(filter_args["predicate"]))
+        if filter_args["s"]:
+            filters.append(aq.filter_subject(filter_args["s"]))
+        if filter_args["o"]:
+            filters.append(aq.filter_object(filter_args["o"]))
+        if filter_args["st"]:
+            filters.append(aq.filter_subject_type(filter_args["st"]))
+        if filter_args["ot"]:
+            filters.append(aq.filter_object_type(filter_args["ot"]))
+        add_page_filter(aq, page, filters)
+        assoc_list = Container.instance.resource_registry.find_associations(query=aq.get_query(), id_only=False)
 
         fragments = [
             build_standard_menu(),
             "<h1>List of Associations</h1>",
-            "<p>Restrictions: predicate=%s</p>" % (predicate),
+            "<p>Restrictions: %s</p>" % ", ".join("%s=%s" % (k, v) for k, v in sorted(filter_args.iteritems()) if v),
             "<p>",
             "<table>",
             "<tr><th>Subject</th><th>Subject type</th><th>Predicate</th><th>Object ID</th><th>Object type</th></tr>"
         ]
 
-        for assoc in assoc_list:
-            fragments.append("<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>" % (
-                build_link(assoc.s, "/view/%s" % assoc.s), build_type_link(assoc.st), assoc.p, build_link(assoc.o, "/view/%s" % assoc.o), build_type_link(assoc.ot)))
-
-        fragments.append("</table></p>")
+        def build_row(assoc):
+            return "<td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td>" % (
+                build_link(assoc.s, "/view/%s" % assoc.s), build_type_link(assoc.st), assoc.p, build_link(assoc.o, "/view/%s" % assoc.o), build_type_link(assoc.ot))
 
-        content = "\n".join(fragments)
-        return build_page(content)
+        return build_paged_response(page, assoc_list, "/assoc", filter_args, fragments,
+                                    build_row, lambda assoc: (assoc._id, assoc._id), lambda assoc: assoc)
 
     except NotFound:
         return flask.redirect("/")
@@ -787,54 +835,55 @@ def build_dir_link(parent, key):
 @app.route('/events', methods=['GET','POST'])
 def process_events():
     try:
-        event_type = request.args.get('event_type', None)
-        origin = request.args.get('origin', None)
-        limit = int(request.args.get('limit', 100))
-        descending = request.args.get('descending', True)
-        skip = int(request.args.get('skip', 0))
-
-        events_list = Container.instance.event_repository.find_events(event_type=event_type, origin=origin,
-                                     descending=descending, limit=limit, skip=skip)
+        page = get_page_args(EVENT_SORT_COLS, default_order="desc")
+        filter_args = dict(event_type=get_arg('event_type'), origin=get_arg('origin'),
+                           origin_type=get_arg('origin_type'), sub_type=get_arg('sub_type'))
+
+        eq = EventQuery()
+        filters = []
+        if filter_args["event_type"]:
+            filters.append(eq.filter_type(filter_args["event_type"]))
+        if filter_args["origin"]:
+            filters.append(eq.filter_origin(filter_args["origin"]))
+        if filter_args["origin_type"]:
+            filters.append(eq.filter_origin_type(filter_args["origin_type"]))
+        if filter_args["sub_type"]:
+            filters.append(eq.filter_sub_type(filter_args["sub_type"]))
+        add_page_filter(eq, page, filters)
+        events_list = Container.instance.event_repository.find_events_query(eq.get_query(), id_only=False)
 
         fragments = [
             build_standard_menu(),
             "<h1>List of Events</h1>",
-            "Restrictions: event_type=%s, origin=%s, limit=%s, descending=%s, skip=%s" % (event_type, origin, limit, descending, skip),
+            "Restrictions: %s" % ", ".join("%s=%s" % (k, v) for k, v in sorted(filter_args.iteritems()) if v),
         ]
+        fragments.extend(build_events_table_header())
 
-        fragments.extend(build_events_table(events_list))
-
-        if len(events_list) >= limit:
-            fragments.append("<p>%s</p>" % build_link("Next page", "/events?skip=%s" % (skip + limit)))
-
-        content = "\n".join(fragments)
-        return build_page(content)
+        return build_paged_response(page, events_list, "/events", filter_args, fragments,
+                                    build_event_row, lambda event: (event.ts_created, event._id), lambda event: event)
 
     except NotFound:
         return flask.redirect("/")
     except Exception as e:
         return build_error_page(traceback.format_exc())
 
-def build_events_table(events_list):
-    fragments = [
+EVENT_IGNORE_FIELDS = ["base_types", "origin", "description", "ts_created", "sub_type", "origin_type", "_rev", "_id"]
+
+def build_events_table_header():
+    return [
         "<p><table>",
         "<tr><th>Timestamp</th><th>Event type</th><th>Sub-type</th><th>Origin</th><th>Origin type</th><th>Other Attributes</th><th>Description</th></tr>"
     ]
 
-    ignore_fields=["base_types", "origin", "description", "ts_created", "sub_type", "origin_type", "_rev", "_id"]
-    for event_id, event_key, event in events_list:
-        fragments.append("<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>" % (
-            get_formatted_value(event.ts_created, fieldname="ts_created", time_millis=True),
-            build_link(event._get_type(), "/events?event_type=%s" % event._get_type()),
-            event.sub_type or "&nbsp;",
-            build_link(event.origin, "/view/%s" % event.origin),
-            event.origin_type or "&nbsp;",
-            get_formatted_value(get_value_dict(event, ignore_fields=ignore_fields), fieldtype="dict"),
-            event.description  or "&nbsp;"))
-
-    fragments.append("</table></p>")
-
-    return fragments
+def build_event_row(event):
+    return "<td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td>" % (
+        get_formatted_value(event.ts_created, fieldname="ts_created", time_millis=True),
+        build_link(event._get_type(), "/events?event_type=%s" % event._get_type()),
+        event.sub_type or "&nbsp;",
+        build_link(event.origin, "/view/%s" % event.origin),
+        event.origin_type or "&nbsp;",
+        get_formatted_value(get_value_dict(event, ignore_fields=EVENT_IGNORE_FIELDS), fieldtype="dict"),
+        event.description  or "&nbsp;")
 
 # ----------------------------------------------------------------------------------------
 
@@ -854,19 +903,16 @@ def process_view_objects():
             build_command("Object ID", "/viewobj?dummy=1", args_view),
         ]
         if obj_filter:
+            page = get_page_args(["id"])
             fragments.append("<h2>Object List</h2>")
-            fragments.append("<p>")
-
-            obj_ids = Container.instance.object_store.obj_store.list_objects()
             fragments.append("<p><table>")
             fragments.append("<tr><th>Object ID</th></tr>")
-            for oid in obj_ids:
-                if obj_filter == "*" or obj_filter in oid:
-                    fragments.append("<tr>")
-                    fragments.append("<td>%s</td></tr>" % (build_link(oid, "/viewobj?object_id=%s" % oid)))
 
-            fragments.append("</table></p>")
-            fragments.append("</p>")
+            obj_ids = Container.instance.object_store.obj_store.list_objects(
+                id_filter=obj_filter if obj_filter != "*" else None, start_after=page.after_id, limit=page.limit + 1)
+            return build_paged_response(page, obj_ids, "/viewobj", dict(filter=obj_filter), fragments,
+                                        lambda oid: "<td>%s</td>" % build_link(oid, "/viewobj?object_id=%s" % oid),
+                                        lambda oid: (oid, oid), lambda oid: oid)
 
         if obj_id:
             fragments.append("<h2>Object Details</h2>")
@@ -1036,6 +1082,9 @@ def build_simple_page(content):
     return build_page("<p><pre>" + content + "</pre></p>")
 
 def build_page(content, title=""):
+    return "\n".join([build_page_head(title), content, build_page_end()])
+
+def build_page_head(title=""):
     fragments = [
         "<!doctype html>",
         "<html><head>",
@@ -1057,11 +1106,94 @@ def build_page(content, title=""):
         "}",
         "</script></head>"
         "<body>",
-        content,
-        "</body></html>"
     ]
     return "\n".join(fragments)
 
+def build_page_end():
+    return "</body></html>"
+
+# ----------------------------------------------------------------------------------------
+# Paged lists
+
+def get_page_args(sort_cols, default_order="asc"):
+    """Returns the paging request arguments: page size, format, sort column and order, and the position
+    of the page as sort value and id of the last row of the previous page"""
+    limit = int(get_arg("limit", DEFAULT_PAGE_SIZE))
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise BadRequest("Page size must be between 1 and %s" % MAX_PAGE_SIZE)
+    sort = get_arg("sort", sort_cols[0])
+    if sort not in sort_cols:
+        raise BadRequest("Cannot sort by %s" % sort)
+    order = get_arg("order", default_order)
+    return DotDict(limit=limit, format=get_arg("format", "html"), sort=sort, order=order,
+                   descending=order == DQ.ORDER_DESC, after=request.values.get("after", ""), after_id=get_arg("after_id"))
+
+def add_page_filter(qb, page, filters):
+    """Sets the filters, order and limit of a query for the requested page. Rows are ordered by sort column
+    and id and the page starts after the last row of the previous page (keyset) instead of skipping rows,
+    so that any page is read from an index range at the same cost. One more row than the page size is
+    read to determine whether there is a next page."""
+    filters = list(filters)
+    order = DQ.ORDER_DESC if page.descending else DQ.ORDER_ASC
+    if page.after_id:
+        cmp_op, cmp_eq_op = (qb.lt, qb.lte) if page.descending else (qb.gt, qb.gte)
+        if page.sort == "id":
+            filters.append(cmp_op("id", page.after_id))
+        else:
+            # Leading range condition on the sort column for the index, tie break by id
+            filters.append(qb.and_(cmp_eq_op(page.sort, page.after),
+                                   qb.or_(cmp_op(page.sort, page.after), cmp_op("id", page.after_id))))
+    if filters:
+        qb.set_filter(*filters)
+    order_cols = [(page.sort, order)] if page.sort == "id" else [(page.sort, order), ("id", order)]
+    qb.set_order_by(qb.order_by(order_cols))
+    qb.set_limit(page.limit + 1)
+
+def get_page_link(link, filter_args, page, after=None, after_id=None):
+    link_args = {k: v for k, v in filter_args.iteritems() if v}
+    link_args.update(limit=page.limit, sort=page.sort, order=page.order)
+    if page.format != "html":
+        link_args["format"] = page.format
+    if after_id:
+        link_args.update(after=after or "", after_id=after_id)
+    link_args = {k: v.encode("utf8") if isinstance(v, unicode) else v for k, v in link_args.iteritems()}
+    return "%s?%s" % (link, urllib.urlencode(sorted(link_args.iteritems())))
+
+def build_paged_response(page, results, link, filter_args, fragments, build_row, get_position, build_json_row):
+    """
+    Returns a response for one page of query results that is rendered while it is sent, as HTML page
+    (given start fragments ending with the table header, then one table row per result) or as JSON.
+    Results contain up to one row more than the page size, indicating a next page.
+    """
+    next_link = None
+    if len(results) > page.limit:
+        results = results[:page.limit]
+        next_link = get_page_link(link, filter_args, page, *get_position(results[-1]))
+
+    if page.format == "json":
+        def gen_json():
+            yield '{"rows": ['
+            for i, res in enumerate(results):
+                yield (",\n" if i else "\n") + json_dumps(build_json_row(res), default=encode_ion_object)
+            yield '\n], "next": %s}' % json_dumps(_link(next_link) if next_link else None)
+        return Response(stream_with_context(gen_json()), mimetype=CONT_TYPE_JSON)
+
+    def gen_html():
+        yield build_page_head()
+        yield "\n".join(fragments)
+        try:
+            for res in results:
+                yield "\n<tr>%s</tr>" % build_row(res)
+            yield "\n</table></p>"
+            links = [build_link("First page", get_page_link(link, filter_args, page))]
+            if next_link:
+                links.append(build_link("Next page", next_link))
+            yield "\n<p>%s rows. %s</p>" % (len(results), " ".join(links))
+        except Exception:
+            yield "\n</table></p><p><pre>%s</pre></p>" % traceback.format_exc()
+        yield "\n" + build_page_end()
+    return Response(stream_with_context(gen_html()), mimetype=CONT_TYPE_HTML)
+
 def get_arg(arg_name, default="", is_mult=False):
     if is_mult:
         aval = request.form.getlist(arg_name)
@@ -15,7 +15,7 @@ from gevent.wsgi import WSGIServer
 from datetime import datetime, timedelta
 import random
 
-from pyon.public import SimpleProcess, log, BadRequest, Conflict, NotFound, OT, get_ion_ts_millis
+from pyon.public import SimpleProcess, log, BadRequest, Conflict, NotFound, OT, RT, EventPublisher, get_ion_ts_millis
 from pyon.util.containers import named_any, current_time_millis
 from ion.util.ui_utils import (build_json_response, build_json_error, get_arg, get_auth, get_req_bearer_token,
                                set_auth, clear_auth, OAuthClientObj, OAuthTokenObj)
@@ -27,6 +27,7 @@ DEFAULT_WEB_SERVER_HOSTNAME = ""
 DEFAULT_WEB_SERVER_PORT = 4000
 DEFAULT_SESSION_TIMEOUT = 600
 DEFAULT_GATEWAY_PREFIX = "/service"
+DEFAULT_METRICS_PATH = "/metrics"
 
 CFG_PREFIX = "process.ui_server"
 
@@ -76,6 +77,8 @@ class UIServer(SimpleProcess):
 
         self.has_service_gateway = self.CFG.get_safe(CFG_PREFIX + ".service_gateway.enabled") is True
         self.service_gateway_prefix = self.CFG.get_safe(CFG_PREFIX + ".service_gateway.url_prefix", DEFAULT_GATEWAY_PREFIX)
+        self.has_metrics = self.CFG.get_safe(CFG_PREFIX + ".metrics.enabled") is True
+        self.metrics_path = self.CFG.get_safe(CFG_PREFIX + ".metrics.url_path", DEFAULT_METRICS_PATH)
         self.extensions = self.CFG.get_safe(CFG_PREFIX + ".extensions") or []
         self.extension_objs = []
 
@@ -84,6 +87,7 @@ class UIServer(SimpleProcess):
         self.gateway_base_url = None
 
         self.idm_client = IdentityManagementServiceProcessClient(process=self)
+        self.event_pub = EventPublisher(process=self)
 
         # One time setup
         if self.server_enabled:
@@ -102,6 +106,13 @@ class UIServer(SimpleProcess):
 
                 app.register_blueprint(sg_blueprint, url_prefix=self.service_gateway_prefix)
 
+                stats_mgr = getattr(self.container, "stats_mgr", None)
+                if stats_mgr:
+                    stats_mgr.register_gateway(self.service_gateway)
+
+            if self.has_metrics:
+                app.add_url_rule(self.metrics_path, "metrics", metrics_route)
+
             for ext_cls in self.extensions:
                 try:
                     cls = named_any(ext_cls)
@@ -306,6 +317,9 @@ class UIServer(SimpleProcess):
                     token_obj.attributes["cancel_msg"] = "User logout"
                     ui_instance.container.object_store.update(token_obj)
                     log.info("Invalidated stored access token for user=%s", token_obj.actor_id)
+                    ui_instance.event_pub.publish_event(event_type=OT.AuthTokenInvalidatedEvent,
+                                                        origin=token_obj.actor_id, origin_type=RT.ActorIdentity,
+                                                        sub_type=token_obj.token_type, token_string=access_token)
                 except NotFound:
                     pass
                 except Exception:
@@ -351,6 +365,17 @@ def logout_route():
     return enable_cors(resp)
 
 
+# -------------------------------------------------------------------------
+# Metrics route
+
+def metrics_route():
+    """ Returns container metrics in Prometheus text exposition format (registered if enabled) """
+    stats_mgr = getattr(ui_instance.container, "stats_mgr", None)
+    if stats_mgr is None or not stats_mgr.metrics_enabled:
+        return Response("Container metrics not enabled\n", status=404, mimetype="text/plain")
+    return Response(stats_mgr.get_metrics_exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # -------------------------------------------------------------------------
 # OAuth2 routes and callbacks
 
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import json
+import sys
+import time
+from mock import Mock, patch
+from nose.plugins.attrib import attr
+
+from pyon.datastore.postgresql.pg_query import PostgresQueryBuilder
+from pyon.public import BadRequest, DotDict, IonObject, RT, OT, ResourceQuery, EventQuery
+from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
+
+from ion.process.ui import admin_ui
+from ion.process.ui.admin_ui import app, get_page_args, add_page_filter, get_page_link, build_paged_response
+
+
+def get_sql(qb):
+    pqb = PostgresQueryBuilder(qb.get_query(), "ion_resources")
+    return pqb.get_query() % {k: repr(v) for k, v in pqb.get_values().iteritems()}
+
+
+@attr('UNIT')
+@patch("ion.process.ui.admin_ui.adminui_instance", Mock(url_prefix=""))
+class TestAdminUIPaging(PyonTestCase):
+
+    def test_page_filter(self):
+        with app.test_request_context("/list/TestInstrument?sort=ts_created&after=1000&after_id=id1&limit=10"):
+            page = get_page_args(["name", "ts_created"])
+        self.assertEquals((page.limit, page.sort, page.descending, page.after, page.after_id),
+                          (10, "ts_created", False, "1000", "id1"))
+        rq = ResourceQuery()
+        add_page_filter(rq, page, [rq.filter_type(RT.TestInstrument)])
+        self.assertEquals(get_sql(rq), "SELECT id,doc FROM ion_resources WHERE (type_='TestInstrument' AND "
+                                       "(ts_created>='1000' AND (ts_created>'1000' OR id>'id1'))) "
+                                       "ORDER BY ts_created ASC,id ASC LIMIT 11")
+
+        with app.test_request_context("/events"):
+            page = get_page_args(["ts_created"], default_order="desc")
+        eq = EventQuery()
+        add_page_filter(eq, page, [])
+        self.assertEquals(get_sql(eq), "SELECT id,doc FROM ion_resources ORDER BY ts_created DESC,id DESC LIMIT 101")
+
+        with app.test_request_context("/list/TestInstrument?sort=firmware_version"):
+            self.assertRaises(BadRequest, get_page_args, ["name"])
+        with app.test_request_context("/list/TestInstrument?limit=100000"):
+            self.assertRaises(BadRequest, get_page_args, ["name"])
+
+    def test_paged_response(self):
+        rows = [DotDict(_id="id%s" % i, name="res%s" % i) for i in xrange(4)]
+        with app.test_request_context("/list/TestInstrument?limit=3&name=res"):
+            page = get_page_args(["name"])
+            filter_args = dict(name="res", lcstate="")
+            resp = build_paged_response(page, rows, "/list/TestInstrument", filter_args, ["<table>"],
+                                        lambda res: "<td>%s</td>" % res.name, lambda res: (res.name, res._id),
+                                        lambda res: res)
+            html = "".join(resp.response)
+        self.assertIn("<tr><td>res2</td></tr>", html)
+        self.assertNotIn("res3", html)
+        next_link = get_page_link("/list/TestInstrument", filter_args, page, "res2", "id2")
+        self.assertEquals(next_link, "/list/TestInstrument?after=res2&after_id=id2&limit=3&name=res&order=asc&sort=name")
+        self.assertIn("href='%s'>Next page" % next_link, html)
+
+        with app.test_request_context("/list/TestInstrument?limit=4&format=json"):
+            page = get_page_args(["name"])
+            resp = build_paged_response(page, rows, "/list/TestInstrument", {}, [],
+                                        None, lambda res: (res.name, res._id), lambda res: res)
+            resp_json = json.loads("".join(resp.response))
+        self.assertEquals([r["name"] for r in resp_json["rows"]], ["res0", "res1", "res2", "res3"])
+        self.assertIsNone(resp_json["next"])
+
+    @patch("ion.process.ui.admin_ui.Container")
+    def test_view_resource(self, container_mock):
+        res_obj = IonObject(RT.TestInstrument, name="res1")
+        res_obj._id, res_obj._rev = "res1_id", "1"
+        event = IonObject(OT.ResourceModifiedEvent, origin="res1_id", origin_type=RT.TestInstrument,
+                          sub_type="UPDATE", ts_created="1000")
+        event._id = "ev1"
+        rr = container_mock.instance.resource_registry
+        rr.read.return_value = res_obj
+        rr.find_subjects.return_value = ([], [])
+        rr.find_objects.return_value = ([], [])
+        container_mock.instance.event_repository.find_events.return_value = [("ev1", "key1", event)]
+
+        html = app.test_client().get("/view/res1_id").data
+        self.assertNotIn("<h1>Error</h1>", html)
+        self.assertIn("View <a", html)
+        self.assertIn("/events?event_type=ResourceModifiedEvent", html)
+        self.assertIn("<td>UPDATE</td>", html)
+        self.assertIn("</table></p>", html)
+
+
+@attr('PFM')
+class TestAdminUIPagingPerformance(IonIntegrationTestCase):
+
+    def setUp(self):
+        self._start_container()
+        self.rr = self.container.resource_registry
+        admin_ui.adminui_instance = Mock(url_prefix="")
+        self.client = app.test_client()
+
+    def test_page_latency(self):
+        """ Latency of listing resource pages with a growing number of resources and page depth """
+        num_pages, num_res = 20, 0
+        print >>sys.stderr, ""
+        for num_total in (1000, 10000, 100000):
+            for batch_start in xrange(num_res, num_total, 10000):
+                self.rr.create_mult([IonObject(RT.TestInstrument, name="res%08d" % i)
+                                     for i in xrange(batch_start, min(batch_start + 10000, num_total))])
+            num_res = num_total
+            for cols in ("", "name,firmware_version"):
+                link = "/list/TestInstrument?limit=100&format=json&cols=%s" % cols
+                start_time = time.time()
+                for i in xrange(num_pages):
+                    resp = self.client.get(link)
+                    resp_json = json.loads(resp.data)
+                    self.assertEquals(len(resp_json["rows"]), 100)
+                    link = resp_json["next"]
+                diff = time.time() - start_time
+                print >>sys.stderr, "Resource list pages (cols=%s) with %s resources: %.3f ms per page" % (
+                    cols or "all", num_total, diff / num_pages * 1000)
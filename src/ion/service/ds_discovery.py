@@ -5,13 +5,19 @@
 __author__ = 'Michael Meisinger'
 
 import calendar
+import copy
 import datetime
+import logging
 import pprint
+import simplejson as json
 
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.datastore_query import DatastoreQueryBuilder, DQ
 from pyon.ion.resource import create_access_args
-from pyon.public import PRED, CFG, RT, log, BadRequest, get_ion_actor_id, ResourceQuery, EventQuery
+from pyon.public import PRED, CFG, RT, OT, log, BadRequest, get_ion_actor_id, ResourceQuery, EventQuery
+from pyon.util.cache import BoundedCache
+
+from ion.util.geo_utils import GeoUtils
 
 from interface.objects import View
 
@@ -39,8 +45,24 @@ COL_MAP = {"_all": DQ.RA_NAME,
            "geospatial_bounds": DQ.RA_GEOM_LOC,
            }
 
+FTS_MODE_MAP = {"plain": DQ.FTS_PLAIN,
+                "phrase": DQ.FTS_PHRASE,
+                "query": DQ.FTS_QUERY,
+                }
+
+# Discovery query keys with values that are bound as query parameters of a compiled query.
+# All other keys (field, cmpop, order etc) determine the shape of the query.
+PARAM_KEYS = {"value", "match", "fuzzy", "search", "range", "time", "time_bounds",
+              "top_left", "bottom_right", "wkt", "vertical_bounds"}
+# Top level discovery query keys that are set in the query args of a compiled query (paging)
+QUERY_ARG_KEYS = {"limit", "skip"}
+
 ISO8601_DATE_SIMPLE = "%Y-%m-%dT%H:%M:%S"
 
+# Resource events that invalidate cached query results. Association changes publish no event,
+# so queries with association filters are not cached.
+RESULT_INVALIDATION_EVENTS = [OT.ResourceModifiedEvent, OT.ResourceLifecycleEvent]
+
 
 class DatastoreDiscovery(object):
     def __init__(self, process):
@@ -49,6 +71,7 @@ class DatastoreDiscovery(object):
 
         # Query matchers
         self._qmatchers = [self._qmatcher_andor,
+                           self._qmatcher_fulltext,
                            self._qmatcher_allmatch,
                            self._qmatcher_field_time,
                            self._qmatcher_fieldeq,
@@ -57,21 +80,72 @@ class DatastoreDiscovery(object):
                            self._qmatcher_geo_vert,
                           ]
 
+        # Datastore queries compiled from discovery queries, by query shape
+        self._query_cache = BoundedCache("rms_discovery_queries_%s" % self.process.id,
+                                         max_entries=CFG.get_safe("service.resource_management.discovery.query_cache_size", 1000))
+        # Optional short lived results of resource queries, by query, parameters and actor
+        self._result_cache = None
+        result_ttl = CFG.get_safe("service.resource_management.discovery.result_cache_ttl", 0)
+        if result_ttl:
+            self._result_cache = BoundedCache("rms_discovery_results_%s" % self.process.id, ttl=result_ttl,
+                                              max_entries=CFG.get_safe("service.resource_management.discovery.result_cache_size", 1000))
+            for event_type in RESULT_INVALIDATION_EVENTS:
+                self._result_cache.add_invalidation_event(event_type)
+
+    def close(self):
+        self._query_cache.close()
+        if self._result_cache is not None:
+            self._result_cache.close()
+
     def execute_query(self, discovery_query, id_only=True, query_args=None, query_params=None):
+        """
+        Executes a query in discovery query format or datastore query format.
+        Returns a list of objects or ids. If query_args has count, returns a list with the number
+        of matching objects. If query_args has has_more, a dict with _has_more is appended that
+        indicates whether there are more results beyond the query limit.
+        If query_args has geo_extent, returns a list with a dict of number of matching resources and
+        the bounding box of their locations, vertical and temporal ranges. If query_args has geo_tiles
+        (tile size in degrees), returns a list of dicts with number, center and bounding box of
+        located resources per tile, e.g. to show clusters of resources on a map.
+        """
         try:
+            query_args = query_args or {}
             if "QUERYEXP" in discovery_query:
                 ds_query, ds_name = discovery_query, discovery_query["query_args"].get("datastore", DataStore.DS_RESOURCES)
+                ds_query.setdefault("query_params", {})
+                if query_params:
+                    ds_query["query_params"].update(query_params)
             else:
-                log.info("DatastoreDiscovery.execute_query(): discovery_query=\n%s", pprint.pformat(discovery_query))
-                ds_query, ds_name = self._build_ds_query(discovery_query, id_only=id_only)
+                compiled_query = self._get_compiled_query(discovery_query, id_only=id_only)
+                ds_query, ds_name = self._bind_query(compiled_query, discovery_query, query_params)
 
             current_actor_id=get_ion_actor_id(self.process)
-            ds_query.setdefault("query_params", {})
-            if query_params:
-                ds_query["query_params"].update(query_params)
             ds_query["query_params"]["current_actor"] = current_actor_id
 
-            log.debug("DatastoreDiscovery.execute_query(): ds_query=\n%s", pprint.pformat(ds_query))
+            count, has_more = query_args.get("count", False), query_args.get("has_more", False)
+            geo_extent, geo_tiles = query_args.get("geo_extent", False), query_args.get("geo_tiles", 0)
+            limit = ds_query["query_args"].get("limit", 0)
+            if count:
+                ds_query = self._get_count_query(ds_query)
+            elif geo_extent:
+                ds_query = self._get_aggregate_query(ds_query, lambda qb: qb.set_geo_extent())
+            elif geo_tiles:
+                ds_query = self._get_aggregate_query(ds_query, lambda qb: qb.set_geo_tiles(geo_tiles))
+            elif has_more and limit > 0:
+                ds_query = dict(ds_query, query_args=dict(ds_query["query_args"], limit=limit + 1))
+
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("DatastoreDiscovery.execute_query(): ds_query=\n%s", pprint.pformat(ds_query))
+
+            result_key = None
+            if self._result_cache is not None and ds_name == DataStore.DS_RESOURCES and \
+                    not query_args.get("query_info", False) and self._is_cacheable_query(ds_query):
+                result_key = json.dumps({k: v for k, v in ds_query.iteritems() if k != "_result"},
+                                        sort_keys=True, default=str)
+                query_results = self._result_cache.get(result_key)
+                if query_results is not None:
+                    # Callers may modify returned objects
+                    return copy.deepcopy(query_results)
 
             ds = self._get_datastore(ds_name)
             access_args = create_access_args(current_actor_id=current_actor_id,
@@ -79,16 +153,106 @@ class DatastoreDiscovery(object):
             query_results = ds.find_by_query(ds_query, access_args=access_args)
             log.info("Datastore discovery query resulted in %s rows", len(query_results))
 
-            if query_args and query_args.get("query_info", False):
+            if count:
+                query_results = [query_results[0][0]] if ds_query["query_args"].get("returns", None) else [len(query_results)]
+            elif geo_extent:
+                query_results = [self._get_extent_result(*query_results[0])]
+            elif geo_tiles:
+                query_results = [self._get_tile_result(*row) for row in query_results if row[0]]
+            elif has_more:
+                query_results, more_results = query_results[:limit or None], limit > 0 and len(query_results) > limit
+                query_results.append(dict(_has_more=more_results))
+            if result_key:
+                self._result_cache.put(result_key, copy.deepcopy(query_results))
+
+            if query_args.get("query_info", False):
                 query_info = dict(_query_info=True, query=ds_query, access_args=access_args, ds_name=ds_name)
                 query_info.update(ds_query.get("_result", {}))
                 query_results.append(query_info)
 
             return query_results
+        except BadRequest as ex:
+            # Invalid query or query values, e.g. malformed text search query
+            log.info("DatastoreDiscovery.execute_query() invalid query: %s", ex.message)
+            raise
         except Exception as ex:
             log.exception("DatastoreDiscovery.execute_query() failed")
         return []
 
+    def _is_cacheable_query(self, ds_query):
+        """Returns True if the results of the datastore query are only affected by resource changes"""
+        query_args = ds_query["query_args"]
+        if query_args.get("format", "") in ("complex", "sql") or query_args.get("ds_sub", ""):
+            return False
+        return not self._has_association_filter(ds_query.get("where", None))
+
+    def _has_association_filter(self, where):
+        if not where or not isinstance(where, (list, tuple)):
+            return False
+        if isinstance(where[0], basestring) and where[0].startswith(DQ.ASSOP_PREFIX):
+            return True
+        return any(self._has_association_filter(ex) for ex in where)
+
+    def _get_count_query(self, ds_query):
+        """Returns a copy of the datastore query that counts matching objects, without order and paging"""
+        if ds_query["query_args"].get("format", "") in ("complex", "sql"):
+            # Count the returned rows
+            return dict(ds_query, query_args=dict(ds_query["query_args"], id_only=True, limit=0, skip=0))
+        return self._get_aggregate_query(ds_query, lambda qb: qb.set_returns([DQ.AGG_COUNT]))
+
+    def _get_aggregate_query(self, ds_query, set_returns):
+        """Returns a copy of the datastore query that returns values aggregated over matching objects,
+        without order and paging. set_returns(qb) sets the returned values"""
+        if ds_query["query_args"].get("format", "") in ("complex", "sql"):
+            raise BadRequest("Aggregates not supported for query format")
+        qb = DatastoreQueryBuilder()
+        qb.query = dict(ds_query, query_args=dict(ds_query["query_args"], id_only=True, limit=0, skip=0))
+        set_returns(qb)
+        qb.set_order_by(None)
+        return qb.query
+
+    def _get_extent_result(self, count, geo_extent, vert_extent, time_extent):
+        extent = dict(count=count, **GeoUtils.parse_extent(geo_extent))
+        extent["depth_min"], extent["depth_max"] = GeoUtils.parse_range(vert_extent)
+        extent["time_start"], extent["time_end"] = GeoUtils.parse_range(time_extent)
+        return extent
+
+    def _get_tile_result(self, geo_tile, geo_center, geo_extent, count):
+        lat, lon = GeoUtils.parse_point(geo_center)
+        return dict(count=count, lat=lat, lon=lon, **GeoUtils.parse_extent(geo_extent))
+
+    # -------------------------------------------------------------------------
+    # Query compilation
+
+    def _get_compiled_query(self, discovery_query, id_only=True):
+        """
+        Returns the compiled query for the shape of the discovery query: a tuple of datastore query
+        with named query parameters, datastore name and list of parameter bindings.
+        Discovery queries of the same shape only differ in values and are compiled once.
+        """
+        query_shape = get_query_shape({k: v for k, v in discovery_query.iteritems() if k not in QUERY_ARG_KEYS})
+        shape_key = (query_shape, bool(id_only))
+
+        def compile_query(key):
+            log.info("DatastoreDiscovery compiling query: discovery_query=\n%s", pprint.pformat(discovery_query))
+            qb, ds_name = self._build_ds_query(discovery_query, id_only=id_only)
+            return qb.get_query(), ds_name, qb.param_bindings
+
+        return self._query_cache.get_or_load(shape_key, compile_query)
+
+    def _bind_query(self, compiled_query, discovery_query, query_params=None):
+        """Returns a datastore query and datastore name for the compiled query with parameter values
+        from the discovery query. The compiled datastore query is shared and not modified."""
+        ds_query, ds_name, param_bindings = compiled_query
+        bound_params = dict(query_params) if query_params else {}
+        for param_name, exp_path, value_func in param_bindings:
+            query_exp = discovery_query
+            for path_key in exp_path:
+                query_exp = query_exp[path_key]
+            bound_params[param_name] = value_func(query_exp)
+        query_args = dict(ds_query["query_args"], limit=discovery_query.get("limit", 0),
+                          skip=discovery_query.get("skip", 0))
+        return dict(ds_query, query_args=query_args, query_params=bound_params), ds_name
 
     def _build_ds_query(self, discovery_query, id_only=True):
         query_exp = discovery_query["query"] or {}
@@ -102,7 +266,7 @@ class DatastoreDiscovery(object):
         skip = discovery_query.get("skip", 0)
         order = discovery_query.get("order", None)
 
-        qb = DatastoreQueryBuilder(limit=limit, skip=skip, id_only=id_only, profile=ds_profile)
+        qb = DiscoveryQueryBuilder(discovery_query, limit=limit, skip=skip, id_only=id_only, profile=ds_profile)
         where = None
         for qm in self._qmatchers:
             where = qm(discovery_query, qb)
@@ -125,9 +289,24 @@ class DatastoreDiscovery(object):
                         col, colsort = column, "asc"
                     order_list.append((col, colsort))
             order_by = qb.order_by(order_list)
+        elif self._has_fulltext(where):
+            # Text search results are returned most relevant first, paged by limit and skip
+            order_by = qb.order_by([(DQ.AGG_RANK, DQ.ORDER_DESC), ("id", DQ.ORDER_ASC)])
+
+        if discovery_query.get("highlight", False) and self._has_fulltext(where):
+            # Return rows of resource id, rank and highlighted snippet instead of resources
+            qb.set_returns([DQ.ATT_ID, DQ.AGG_RANK, DQ.AGG_SNIPPET])
 
         qb.build_query(where=where, order_by=order_by)
-        return qb.get_query(), ds_name
+        return qb, ds_name
+
+    def _has_fulltext(self, where):
+        op, args = where
+        if op == DQ.XOP_FULLTEXT:
+            return True
+        elif op in (DQ.EXP_AND, DQ.EXP_OR):
+            return any(self._has_fulltext(ex) for ex in args)
+        return False
 
     def _get_datastore(self, ds_name):
         ds = None
@@ -163,6 +342,18 @@ class DatastoreDiscovery(object):
             res_where = qb.or_(*exp_parts)
         return res_where
 
+    def _qmatcher_fulltext(self, query, qb):
+        query_exp = query.get("query", query)
+        field = query_exp.get("field", "_all")
+        search = query_exp.get("search", None)
+        if field != "_all" or search is None:
+            return
+
+        mode = query_exp.get("search_mode", "plain")
+        if mode not in FTS_MODE_MAP:
+            raise BadRequest("Unknown search mode: %s" % mode)
+        return qb.fulltext(qb.param(query_exp, lambda q: q["search"]), FTS_MODE_MAP[mode])
+
     def _qmatcher_allmatch(self, query, qb):
         query_exp = query.get("query", query)
         field = query_exp.get("field", None)
@@ -170,7 +361,7 @@ class DatastoreDiscovery(object):
         if field != "_all" or match is None:
             return
 
-        return qb.all_match(match)
+        return qb.all_match(qb.param(query_exp, lambda q: q["match"]))
 
     def _qmatcher_field_time(self, query, qb):
         query_exp = query.get("query", query)
@@ -182,20 +373,16 @@ class DatastoreDiscovery(object):
         to_time = time.get("to", None)
         if not (from_time and to_time):
             return
-        datetime.datetime.strptime(from_time, ISO8601_DATE_SIMPLE)
-        from_time_val = calendar.timegm(datetime.datetime.strptime(from_time, ISO8601_DATE_SIMPLE).timetuple())
-        to_time_val = calendar.timegm(datetime.datetime.strptime(to_time, ISO8601_DATE_SIMPLE).timetuple())
 
         range_op = query_exp.get("cmpop", None)
         basic_col = COL_MAP.get(field, None)
         if basic_col == DQ.RA_TS_CREATED or basic_col == DQ.RA_TS_UPDATED:
-            from_time_val *= 1000
-            to_time_val *= 1000
-            lower_val, upper_val = min(from_time_val, to_time_val), max(from_time_val, to_time_val)
-            return qb.between(basic_col, str(lower_val), str(upper_val))
+            return qb.between(basic_col, qb.param(query_exp, lambda q: str(get_time_bounds(q)[0] * 1000)),
+                              qb.param(query_exp, lambda q: str(get_time_bounds(q)[1] * 1000)))
         else:
             temp_col = DQ.RA_TEMP_RANGE
-            lower_val, upper_val = min(from_time_val, to_time_val), max(from_time_val, to_time_val)
+            lower_val = qb.param(query_exp, lambda q: get_time_bounds(q)[0])
+            upper_val = qb.param(query_exp, lambda q: get_time_bounds(q)[1])
 
             if range_op == "contains":
                 return qb.contains_range(temp_col, lower_val, upper_val)
@@ -219,29 +406,28 @@ class DatastoreDiscovery(object):
         basic_col = COL_MAP.get(field, None)
         if basic_col:
             if value is not None and "*" in value:
-                match = value.replace("*", "%")
-                where = qb.like(basic_col, match, case_sensitive=False)
+                where = qb.like(basic_col, qb.param(query_exp, lambda q: q["value"].replace("*", "%")),
+                                case_sensitive=False)
             elif match is not None:
-                where = qb.like(basic_col, "%" + str(match) + "%", case_sensitive=False)
+                where = qb.like(basic_col, qb.param(query_exp, lambda q: "%" + str(q["match"]) + "%"),
+                                case_sensitive=False)
             elif value is not None:
-                where = qb.eq(basic_col, value)
+                where = qb.eq(basic_col, qb.param(query_exp, lambda q: q["value"]))
             elif range is not None:
-                rng_from, rng_to = range["from"], range["to"]
                 if basic_col == DQ.RA_TS_CREATED:
-                    rng_from, rng_to = str(int(rng_from)), str(int(rng_to))
-                    where = qb.and_(qb.gte(basic_col, rng_from), qb.lte(basic_col, rng_to))
+                    where = qb.and_(qb.gte(basic_col, qb.param(query_exp, lambda q: str(int(q["range"]["from"])))),
+                                    qb.lte(basic_col, qb.param(query_exp, lambda q: str(int(q["range"]["to"])))))
                 else:
-                    rng_from, rng_to = int(rng_from), int(rng_to)
-                    where = qb.between(basic_col, rng_from, rng_to)
+                    where = qb.between(basic_col, qb.param(query_exp, lambda q: int(q["range"]["from"])),
+                                       qb.param(query_exp, lambda q: int(q["range"]["to"])))
             else:
-                where = qb.fuzzy(basic_col, fuzzy)
+                where = qb.fuzzy(basic_col, qb.param(query_exp, lambda q: q["fuzzy"]))
         elif range:
-            rng_from, rng_to = int(range["from"]), int(range["to"])
-            where = qb.between(field, rng_from, rng_to)
+            where = qb.between(field, qb.param(query_exp, lambda q: int(q["range"]["from"])),
+                               qb.param(query_exp, lambda q: int(q["range"]["to"])))
         else:
-            match = match or value
-            match = match.replace("*", "%")
-            where = qb.attr_like(field, match, case_sensitive=False)
+            where = qb.attr_like(field, qb.param(query_exp, lambda q: (q.get("match", None) or q["value"]).replace("*", "%")),
+                                 case_sensitive=False)
 
         return where
 
@@ -255,12 +441,14 @@ class DatastoreDiscovery(object):
 
         geom_col = COL_MAP.get(field, DQ.RA_GEOM)
         range_op = query_exp.get("cmpop", None)
+        bbox = (qb.param(query_exp, lambda q: q["top_left"][0]), qb.param(query_exp, lambda q: q["bottom_right"][1]),
+                qb.param(query_exp, lambda q: q["bottom_right"][0]), qb.param(query_exp, lambda q: q["top_left"][1]))
         if range_op == "contains":
-            return qb.contains_bbox(geom_col, top_left[0], bottom_right[1], bottom_right[0], top_left[1])
+            return qb.contains_bbox(geom_col, *bbox)
         elif range_op == "within":
-            return qb.within_bbox(geom_col, top_left[0], bottom_right[1], bottom_right[0], top_left[1])
+            return qb.within_bbox(geom_col, *bbox)
         else:
-            return qb.overlaps_bbox(geom_col, top_left[0], bottom_right[1], bottom_right[0], top_left[1])
+            return qb.overlaps_bbox(geom_col, *bbox)
 
     def _qmatcher_geo_wkt(self, query, qb):
         query_exp = query.get("query", query)
@@ -270,6 +458,7 @@ class DatastoreDiscovery(object):
             return
 
         geom_col = COL_MAP.get(field, DQ.RA_GEOM)
+        wkt = qb.param(query_exp, lambda q: q["wkt"])
         buf = query_exp.get("buffer", None)
         range_op = query_exp.get("cmpop", None)
         if range_op == "contains":
@@ -287,14 +476,16 @@ class DatastoreDiscovery(object):
             return
 
         geom_col = DQ.RA_VERT_RANGE
+        lower_val = qb.param(query_exp, lambda q: q["vertical_bounds"].get("from", 0))
+        upper_val = qb.param(query_exp, lambda q: q["vertical_bounds"].get("to", 0))
 
         range_op = query_exp.get("cmpop", None)
         if range_op == "contains":
-            return qb.contains_range(geom_col, vertical_bounds.get("from", 0), vertical_bounds.get("to", 0))
+            return qb.contains_range(geom_col, lower_val, upper_val)
         elif range_op == "within":
-            return qb.within_range(geom_col, vertical_bounds.get("from", 0), vertical_bounds.get("to", 0))
+            return qb.within_range(geom_col, lower_val, upper_val)
         else:
-            return qb.overlaps_range(geom_col, vertical_bounds.get("from", 0), vertical_bounds.get("to", 0))
+            return qb.overlaps_range(geom_col, lower_val, upper_val)
 
     def get_builtin_view(self, view_name):
         view_obj = View(name=view_name)
@@ -306,3 +497,66 @@ class DatastoreDiscovery(object):
             eq = EventQuery()
             view_obj.view_definition = eq.get_query()
             return view_obj
+
+
+class DiscoveryQueryBuilder(DatastoreQueryBuilder):
+    """
+    Builds a datastore query for a discovery query, with the discovery query values as named
+    query parameters. The parameter bindings compute the values from the discovery query
+    expressions, so that the datastore query can be reused for queries of the same shape.
+    """
+
+    def __init__(self, discovery_query, **kwargs):
+        DatastoreQueryBuilder.__init__(self, **kwargs)
+        self.param_bindings = []     # List of (param name, path of query expression, value function)
+        self._exp_paths = {}         # id of query expression dict -> path from discovery query
+        self._add_exp_paths(discovery_query, ())
+
+    def _add_exp_paths(self, query_exp, exp_path):
+        if isinstance(query_exp, dict):
+            self._exp_paths[id(query_exp)] = exp_path
+            for key, value in query_exp.iteritems():
+                if key not in PARAM_KEYS:
+                    self._add_exp_paths(value, exp_path + (key,))
+        elif isinstance(query_exp, (list, tuple)):
+            for i, value in enumerate(query_exp):
+                self._add_exp_paths(value, exp_path + (i,))
+
+    def param(self, query_exp, value_func):
+        """Returns a placeholder for the query parameter value_func(query_exp) of a discovery query expression"""
+        param_name = "_dq%s" % (len(self.param_bindings) + 1)
+        self.param_bindings.append((param_name, self._exp_paths[id(query_exp)], value_func))
+        return "$(%s)" % param_name
+
+
+def get_query_shape(query_exp):
+    """Returns a hashable representation of the structure of a discovery query without its values.
+    Queries with the same shape compile to the same datastore query."""
+    if isinstance(query_exp, dict):
+        return tuple(sorted((key, get_value_shape(value) if key in PARAM_KEYS else get_query_shape(value))
+                            for key, value in query_exp.iteritems()))
+    elif isinstance(query_exp, (list, tuple)):
+        return tuple(get_query_shape(value) for value in query_exp)
+    return query_exp
+
+
+def get_value_shape(value):
+    """Returns the parts of a discovery query value that the compiled query depends on:
+    type, presence of items, emptiness and wildcards"""
+    if value is None:
+        return None
+    elif isinstance(value, dict):
+        return tuple(sorted((key, get_value_shape(val)) for key, val in value.iteritems()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(get_value_shape(val) for val in value)
+    elif isinstance(value, basestring):
+        return "str", bool(value), "*" in value
+    return type(value).__name__, bool(value)
+
+
+def get_time_bounds(query_exp):
+    """Returns tuple of lower and upper seconds since epoch for the time bounds of a discovery query expression"""
+    time = query_exp.get("time", None) or query_exp.get("time_bounds", None)
+    from_time_val = calendar.timegm(datetime.datetime.strptime(time["from"], ISO8601_DATE_SIMPLE).timetuple())
+    to_time_val = calendar.timegm(datetime.datetime.strptime(time["to"], ISO8601_DATE_SIMPLE).timetuple())
+    return min(from_time_val, to_time_val), max(from_time_val, to_time_val)
@@ -369,6 +369,11 @@ class IdentityManagementService(BaseIdentityManagementService):
         token.status = "INVALID"
         self.container.object_store.update(token)
         log.info("Invalidated security auth token: %s", token.token_string)
+        if self.event_pub:
+            # Gateways evict the token from their authentication caches
+            self.event_pub.publish_event(event_type=OT.AuthTokenInvalidatedEvent, origin=token.actor_id,
+                                         origin_type=RT.ActorIdentity, sub_type=token.token_type,
+                                         token_string=token.token_string)
 
     def check_authentication_token(self, token_string=''):
         """Checks given token and returns a dict with actor id if valid.
@@ -2,12 +2,14 @@
 
 __author__ = "Stephen P. Henrie, Michael Meisinger"
 
-from pyon.public import CFG, IonObject, LCS, RT, PRED, OT, Inconsistent, NotFound, BadRequest, log, EventPublisher
-from pyon.core.governance import MODERATOR_ROLE, MEMBER_ROLE, OPERATOR_ROLE
+from pyon.public import CFG, IonObject, LCS, RT, PRED, OT, Inconsistent, NotFound, BadRequest, log, EventPublisher, \
+    ResourceQuery
+from pyon.core.governance import MODERATOR_ROLE, MEMBER_ROLE, OPERATOR_ROLE, get_commitment_filter, \
+    get_commitment_query
 from pyon.core.governance.negotiation import Negotiation
 from pyon.core.registry import issubtype
 from pyon.ion.directory import Directory
-from pyon.util.containers import is_basic_identifier, get_ion_ts, create_basic_identifier, get_ion_ts_millis
+from pyon.util.containers import is_basic_identifier, get_ion_ts, create_basic_identifier
 
 from interface.objects import ProposalStatusEnum, ProposalOriginatorEnum, NegotiationStatusEnum
 from interface.services.core.iorg_management_service import BaseOrgManagementService
@@ -566,12 +568,15 @@ class OrgManagementService(BaseOrgManagementService):
         if org_id == self._get_root_org_id() and role_name == MEMBER_ROLE:
             return True
 
-        role_list, _ = self.rr.find_objects(actor_id, PRED.hasRole, RT.UserRole, id_only=False)
-        for role in role_list:
-            if role.governance_name == role_name and role.org_governance_name == org_obj.org_governance_name:
-                return True
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_type(RT.UserRole),
+                      rq.filter_attribute("org_governance_name", org_obj.org_governance_name),
+                      rq.filter_attribute("governance_name", role_name),
+                      rq.filter_associated_from_subject(actor_id, predicate=PRED.hasRole))
+        rq.set_limit(1)
+        role_ids = self.rr.find_resources_ext(query=rq.get_query(), id_only=True)
 
-        return False
+        return bool(role_ids)
 
     def list_actor_roles(self, actor_id="", org_id=""):
         """Returns a list of User Roles for a specific actor in an Org.
@@ -579,10 +584,12 @@ class OrgManagementService(BaseOrgManagementService):
         actor_obj = self._validate_resource_id("actor_id", actor_id, RT.ActorIdentity)
         org_obj = self._validate_resource_id("org_id", org_id, RT.Org, optional=True)
 
-        role_list, _ = self.rr.find_objects(actor_id, PRED.hasRole, RT.UserRole, id_only=False)
-
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_type(RT.UserRole),
+                      rq.filter_associated_from_subject(actor_id, predicate=PRED.hasRole))
         if org_id:
-            role_list = [r for r in role_list if r.org_governance_name == org_obj.org_governance_name]
+            rq.add_filter(rq.filter_attribute("org_governance_name", org_obj.org_governance_name))
+        role_list = self.rr.find_resources_ext(query=rq.get_query(), id_only=False)
 
         if not org_id or org_id == self._get_root_org_id():
             # Because a user is automatically enrolled with the ION Org then the membership role
@@ -704,11 +711,13 @@ class OrgManagementService(BaseOrgManagementService):
         if org_id:
             self.rr.create_association(org_id, PRED.hasCommitment, commitment._id)
 
-            self.event_pub.publish_event(event_type=OT.ResourceCommitmentCreatedEvent,
-                                         origin=org_id, origin_type="Org", sub_type=resource_obj.type_,
-                                         description="The resource has been committed by the Org",
-                                         resource_id=resource_id, org_name=org_obj.name,
-                                         commitment_id=commitment._id, commitment_type=commitment.commitment.type_)
+        # Published also without Org, such that cached commitments get invalidated
+        self.event_pub.publish_event(event_type=OT.ResourceCommitmentCreatedEvent,
+                                     origin=org_id, origin_type="Org", sub_type=resource_obj.type_,
+                                     description="The resource has been committed by the Org",
+                                     resource_id=resource_id, org_name=org_obj.name if org_obj else "",
+                                     actor_id=actor_id,
+                                     commitment_id=commitment._id, commitment_type=commitment.commitment.type_)
 
         return commitment._id
 
@@ -724,6 +733,7 @@ class OrgManagementService(BaseOrgManagementService):
                                      origin=commitment_obj.provider, origin_type="Org", sub_type="",
                                      description="The resource has been uncommitted by the Org",
                                      resource_id=commitment_obj.commitment.resource_id,
+                                     actor_id=commitment_obj.consumer,
                                      commitment_id=commitment_id, commitment_type=commitment_obj.commitment.type_)
 
     def find_commitments(self, org_id='', resource_id='', actor_id='', exclusive=False, include_expired=False):
@@ -735,27 +745,9 @@ class OrgManagementService(BaseOrgManagementService):
         if not org_id and not resource_id and not actor_id:
             raise BadRequest("Must restrict search for commitments")
 
-        if resource_id:
-            com_objs, _ = self.rr.find_subjects(RT.Commitment, PRED.hasTarget, resource_id, id_only=False)
-            if actor_id:
-                com_objs = [c for c in com_objs if c.consumer == actor_id]
-            if org_id:
-                com_objs = [c for c in com_objs if c.provider == org_id]
-        elif actor_id:
-            com_objs, _ = self.rr.find_objects(actor_id, PRED.hasCommitment, RT.Commitment, id_only=False)
-            if org_id:
-                com_objs = [c for c in com_objs if c.provider == org_id]
-        else:
-            com_objs, _ = self.rr.find_objects(org_id, PRED.hasCommitment, RT.Commitment, id_only=False)
-
-        if exclusive:
-            com_objs = [c for c in com_objs if c.commitment.type_ == OT.ResourceCommitment and c.commitment.exclusive]
-        else:
-            com_objs = [c for c in com_objs if c.commitment.type_ != OT.ResourceCommitment or (
-                        c.commitment.type_ == OT.ResourceCommitment and not c.commitment.exclusive)]
-        if not include_expired:
-            cur_time = get_ion_ts_millis()
-            com_objs = [c for c in com_objs if int(c.expiration) == 0 or cur_time < int(c.expiration)]
+        rq = get_commitment_query(resource_id=resource_id, principal_id=org_id, consumer_id=actor_id,
+                                  exclusive=bool(exclusive), include_expired=include_expired)
+        com_objs = self.rr.find_resources_ext(query=rq.get_query(), id_only=False)
 
         return com_objs
 
@@ -779,8 +771,10 @@ class OrgManagementService(BaseOrgManagementService):
             raise BadRequest("The resource_id argument is missing")
 
         try:
-            com_objs = self.find_commitments(resource_id=resource_id, actor_id=actor_id, exclusive=exclusive)
-            return bool(com_objs)
+            rq = get_commitment_query(resource_id=resource_id, consumer_id=actor_id, exclusive=exclusive)
+            rq.set_limit(1)
+            com_ids = self.rr.find_resources_ext(query=rq.get_query(), id_only=True)
+            return bool(com_ids)
 
         except Exception as ex:
             log.exception("Error checking acquired status, actor_id=%s, resource_id=%s" % (actor_id, resource_id))
@@ -791,11 +785,13 @@ class OrgManagementService(BaseOrgManagementService):
         if not org_id and not actor_id:
             raise BadRequest("Must provide org_id or actor_id")
 
-        com_objs = self.find_commitments(org_id=org_id, actor_id=actor_id,
-                                         exclusive=exclusive, include_expired=include_expired)
-
-        res_ids = {c.commitment.resource_id for c in com_objs if c.commitment.type_ == OT.ResourceCommitment}
-        res_objs = self.rr.read_mult(list(res_ids))
+        # Resources targeted by a matching commitment, in one query
+        rq = ResourceQuery()
+        com_filter = get_commitment_filter(rq, principal_id=org_id, consumer_id=actor_id,
+                                           exclusive=bool(exclusive), include_expired=include_expired)
+        rq.set_filter(rq.filter_associated_from_subject(subject_type=RT.Commitment, predicate=PRED.hasTarget,
+                                                        target_filter=com_filter))
+        res_objs = self.rr.find_resources_ext(query=rq.get_query(), id_only=False)
 
         return res_objs
 
@@ -5,8 +5,10 @@ and templates for policy definitions, aka attribute authority."""
 
 __author__ = 'Stephen P. Henrie, Michael Meisinger'
 
+from pyon.core.governance.policy.policy_bundle import POLICY_SCOPE_COMMON, POLICY_SCOPE_SERVICE, POLICY_SCOPE_RESOURCE, \
+    create_policy_bundle, get_policy_scope
 from pyon.public import PRED, RT, OT, IonObject, NotFound, BadRequest, Inconsistent, log, EventPublisher, ResourceQuery
-from pyon.util.containers import is_basic_identifier, create_basic_identifier
+from pyon.util.containers import is_basic_identifier, create_basic_identifier, get_ion_ts
 
 from interface.objects import PolicyTypeEnum
 from interface.services.core.ipolicy_management_service import BasePolicyManagementService
@@ -18,6 +20,8 @@ class PolicyManagementService(BasePolicyManagementService):
 
     def on_start(self):
         self.event_pub = EventPublisher(process=self)
+        self.publish_bundles = self.CFG.get_safe("service.policy_management.publish_bundles", True)
+        self._bundle_versions = {}
 
     # -------------------------------------------------------------------------
     # Policy management
@@ -278,6 +282,7 @@ class PolicyManagementService(BasePolicyManagementService):
             event_data['resource_type'] = resource.type_
             event_data['resource_name'] = resource.name
             event_data['sub_type'] = 'DeletePolicy' if delete_policy else ''
+            event_data['policy_bundle'] = self._get_policy_bundle(POLICY_SCOPE_RESOURCE, resource._id)
 
             self.event_pub.publish_event(event_type='ResourcePolicyEvent', origin=policy._id, **event_data)
 
@@ -288,6 +293,7 @@ class PolicyManagementService(BasePolicyManagementService):
             event_data['description'] = 'Updated Related Resource Policy'
             event_data['resource_id'] = resource_id
             event_data['sub_type'] = 'DeletePolicy' if delete_policy else ''
+            event_data['policy_bundle'] = self._get_policy_bundle(POLICY_SCOPE_RESOURCE, resource_id)
 
             self.event_pub.publish_event(event_type='RelatedResourcePolicyEvent', origin=policy._id, **event_data)
 
@@ -301,9 +307,33 @@ class PolicyManagementService(BasePolicyManagementService):
 
             if policy.policy_type == PolicyTypeEnum.SERVICE_OP_PRECOND:
                 event_data['op'] = policy.details.op
+            event_data['policy_bundle'] = self._get_policy_bundle(POLICY_SCOPE_SERVICE, event_data['service_name'])
 
             self.event_pub.publish_event(event_type='ServicePolicyEvent', origin=policy._id, **event_data)
 
+    def _get_policy_bundle(self, scope_type, scope_key):
+        """Returns the versioned set of all active policies for the scope of a changed policy, so that
+        containers can apply the change without reading back. Returns an empty dict if not available.
+        """
+        if not self.publish_bundles:
+            return {}
+        scope = get_policy_scope(scope_type, scope_key)
+        try:
+            if scope == POLICY_SCOPE_COMMON:
+                policy_list = self.get_active_service_access_policy_rules()
+            elif scope_type == POLICY_SCOPE_SERVICE:
+                policy_list = self.get_active_service_access_policy_rules(service_name=scope_key)
+            else:
+                policy_list = self.get_active_resource_access_policy_rules(resource_id=scope_key)
+            # Versions are assigned here only and increase per scope, independent of container clocks
+            version = max(int(get_ion_ts()), self._bundle_versions.get(scope, 0) + 1)
+            self._bundle_versions[scope] = version
+            return create_policy_bundle(scope, policy_list, version=version)
+        except Exception:
+            # Containers will read the policy themselves
+            log.warn("Cannot create policy bundle for %s", scope, exc_info=True)
+            return {}
+
 
     def find_resource_policies(self, resource_id=''):
         """Finds all policies associated with a specific resource
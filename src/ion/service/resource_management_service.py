@@ -8,6 +8,7 @@ from ion.agent.agent import ResourceAgentClient
 from pyon.core.bootstrap import get_service_registry
 from pyon.datastore.datastore_query import QUERY_EXP_KEY, DQ
 from pyon.public import log, IonObject, Unauthorized, ResourceQuery, PRED, CFG, RT, log, BadRequest, NotFound
+from pyon.util.cache import BoundedCache
 from pyon.util.config import Config
 from pyon.util.containers import get_safe, named_any, get_ion_ts, is_basic_identifier
 
@@ -33,17 +34,24 @@ class ResourceManagementService(BaseResourceManagementService):
         self._augment_resource_interface_from_interfaces()
 
         # Keep a cache of known resource ids
-        self.restype_cache = {}
+        self.restype_cache = BoundedCache("rms_restype_%s" % self.id, max_entries=10000)
 
         self.ds_discovery = DatastoreDiscovery(self)
 
+    def on_quit(self):
+        self.restype_cache.close()
+        self.ds_discovery.close()
+
     # -------------------------------------------------------------------------
     # Search and query
 
     def query(self, query=None, id_only=True, search_args=None):
         """Issue a query provided in structured dict format or internal datastore query format.
         Returns a list of resource or event objects or their IDs only.
-        Search_args may contain parameterized values.
+        Search_args may contain parameterized values. With count in search_args, returns a list with
+        the number of matching objects; with has_more, appends a dict with _has_more (more results beyond limit).
+        With geo_extent, returns a list with a dict of the number and extent of matching resources; with
+        geo_tiles (tile size in degrees), returns a list of dicts with number, center and extent per map tile.
         See the query format definition: https://confluence.oceanobservatories.org/display/CIDev/Discovery+Service+Query+Format
         """
         if not query:
@@ -119,14 +127,14 @@ class ResourceManagementService(BaseResourceManagementService):
         elif 'query' not in query:
             raise BadRequest('Unsupported request. %s' % query)
 
-        # if count requested, run id_only query without limit/skip
+        # if count requested, count matching objects without limit/skip
         count = search_args.get("count", False)
         if count:
-            # Only return the count of ID only search
+            # Only return the count
             query.pop("limit", None)
             query.pop("skip", None)
             res = self.ds_discovery.execute_query(query, id_only=True, query_args=search_args, query_params=query_params)
-            return [len(res)]
+            return res or [0]
 
         # TODO: Not all queries are permissible by all users
 
@@ -146,7 +154,8 @@ class ResourceManagementService(BaseResourceManagementService):
             raise BadRequest("Illegal argument type: attribute_filter")
 
         if not id_only and attr_filter:
-            filtered_res = [dict(__noion__=True, **{k: v for k, v in obj.__dict__.iteritems() if k in attr_filter or k in {"_id", "type_"}}) for obj in query_results]
+            filtered_res = [obj if isinstance(obj, dict) else  # Query info and has more
+                            dict(__noion__=True, **{k: v for k, v in obj.__dict__.iteritems() if k in attr_filter or k in {"_id", "type_"}}) for obj in query_results]
             return filtered_res
         return query_results
 
@@ -250,32 +259,28 @@ class ResourceManagementService(BaseResourceManagementService):
         """
         if not org_id:
             raise BadRequest("Must provide org_id")
-        res_list = []
-        res_objs, _ = self.clients.resource_registry.find_objects(org_id, PRED.hasResource, id_only=False)
-        res_list.extend(res_objs)
-        # TODO: The following is not correct - this should be all attachments in the Org
-        res_objs, _ = self.clients.resource_registry.find_objects(org_id, PRED.hasAttachment, id_only=False)
-        res_list.extend(res_objs)
-        # TODO: The following should be shared in the Org
-        res_objs, _ = self.clients.resource_registry.find_objects(org_id, PRED.hasRole, id_only=False)
-        res_list.extend(res_objs)
-
-        def get_core_attrs(resource):
-            res_attr = {k:v for k, v in resource.__dict__.iteritems() if k in self.CORE_ATTRIBUTES}
-            # HACK: Cannot use type_ because that would treat the dict as IonObject and add back all attributes
-            res_attr["type__"] = resource.type_
-            return res_attr
-        if type_filter:
-            type_filter = set(type_filter)
-        attr_list = [get_core_attrs(res) for res in res_list if not type_filter or res.type_ in type_filter]
 
+        # TODO: Attachments and roles should be the ones shared in the Org
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_associated_from_subject(org_id, predicate=[PRED.hasResource, PRED.hasAttachment,
+                                                                           PRED.hasRole]))
+        if type_filter:
+            rq.add_filter(rq.filter_type(list(type_filter)))
+        res_cols = ["id", "type_"] + sorted(self.CORE_ATTRIBUTES - {"_id"})
+        rq.set_returns(res_cols)
         order_by = order_by or "name"
-        attr_list = sorted(attr_list, key=lambda o: o.get(order_by, ""))
-
-        if skip:
-            attr_list = attr_list[skip:]
-        if limit:
-            attr_list = attr_list[:limit]
+        rq.set_order_by(rq.order_by({"_id": "id", "type__": "type_"}.get(order_by, order_by)))
+        rq.set_limit(limit)
+        rq.set_skip(skip)
+        res_rows = self.clients.resource_registry.find_resources_ext(query=rq.get_query())
+
+        attr_list = []
+        for row in res_rows:
+            res_attr = {col: val for col, val in zip(res_cols[2:], row[2:]) if val is not None}
+            res_attr["_id"] = row[0]
+            # HACK: Cannot use type_ because that would treat the dict as IonObject and add back all attributes
+            res_attr["type__"] = row[1]
+            attr_list.append(res_attr)
 
         # Need to return a similar type than RR.find_objects
         # Major bug in service gateway
@@ -301,22 +306,32 @@ class ResourceManagementService(BaseResourceManagementService):
         if res_filter and type(res_filter) not in (list, tuple):
             raise BadRequest("Illegal value for argument res_filter")
 
-        # NOTE: This can alternatively be implemented as a SELECT DISTINCT query, but this is not
-        # supported by the underlying datastore interface.
         rq = ResourceQuery()
         if res_filter:
             rq.set_filter(rq.eq(rq.ATT_TYPE, restype), res_filter)
         else:
             rq.set_filter(rq.eq(rq.ATT_TYPE, restype))
-        res_list = self.clients.resource_registry.find_resources_ext(query=rq.get_query(), id_only=False)
+        rq.set_returns(attr_list, distinct=True)
+        res_rows = self.clients.resource_registry.find_resources_ext(query=rq.get_query())
 
-        log.debug("Found %s resources of type %s", len(res_list), restype)
-        att_values = sorted({tuple(getattr(res, an) for an in attr_list) for res in res_list})
+        # Attribute values are returned as str - convert back to schema type
+        att_schemas = [type_cls._schema[an] for an in attr_list]
+        att_values = sorted({tuple(self._convert_attr_value(val, att_schema) for val, att_schema in zip(row, att_schemas))
+                             for row in res_rows})
 
         log.debug("Found %s distinct vales for attribute(s): %s", len(att_values), attr_list)
 
         return att_values
 
+    def _convert_attr_value(self, value, att_schema):
+        if value is None:
+            return att_schema["default"]
+        if att_schema["type"] == "int":
+            return int(value)
+        elif att_schema["type"] == "float":
+            return float(value)
+        return value
+
     def execute_lifecycle_transition(self, resource_id='', transition_event=''):
         """Alter object lifecycle according to given transition event. Throws exception
         if resource object does not exist or given transition_event is unknown/illegal.
@@ -510,14 +525,8 @@ class ResourceManagementService(BaseResourceManagementService):
         pass
 
     def _get_resource_type(self, resource_id):
-        if resource_id in self.restype_cache:
-            return self.restype_cache[resource_id]
-        res = self.container.resource_registry.read(resource_id)
-        res_type = res._get_type()
-        self.restype_cache[resource_id] = res_type
-        if len(self.restype_cache) > 10000:
-            log.warn("Resource type cache exceeds size: %s", len(self.restype_cache))
-        return res_type
+        return self.restype_cache.get_or_load(resource_id,
+                                              lambda res_id: self.container.resource_registry.read(res_id)._get_type())
 
     def _has_agent(self, res_type):
         type_interface = self.resource_interface.get(res_type, None)
@@ -25,22 +25,26 @@ from pyon.core.governance import DEFAULT_ACTOR_ID, get_role_message_headers, fin
 from pyon.ion.resource import get_object_schema
 from pyon.public import IonObject, OT, NotFound, Inconsistent, BadRequest, EventSubscriber, log, CFG
 from pyon.public import MSG_HEADER_ACTOR, MSG_HEADER_VALID, MSG_HEADER_ROLES
-from pyon.util.lru_cache import LRUCache
+from pyon.util.cache import BoundedCache
 from pyon.util.containers import current_time_millis
 
 from ion.service.utility.swagger_gen import SwaggerSpecGenerator
 from ion.util.parse_utils import get_typed_value
-from ion.util.ui_utils import CONT_TYPE_JSON, json_dumps, json_loads, encode_ion_object, get_auth, clear_auth, OAuthTokenObj
+from ion.util.ui_utils import CONT_TYPE_JSON, json_dumps, json_loads, encode_ion_object, get_auth, clear_auth, OAuthTokenObj, \
+    json_iterencode, gzip_iterencode, get_json_item_count
 
 from interface.services.core.idirectory_service import DirectoryServiceProcessClient
 from interface.services.core.iresource_registry_service import ResourceRegistryServiceProcessClient
 from interface.services.core.iidentity_management_service import IdentityManagementServiceProcessClient
 from interface.services.core.iorg_management_service import OrgManagementServiceProcessClient
-from interface.objects import Attachment, ProcessDefinition, MediaResponse, UserRoleModifiedEvent, UserRoleCacheResetEvent
+from interface.objects import Attachment, ProcessDefinition, MediaResponse, UserRoleModifiedEvent, UserRoleCacheResetEvent, \
+    AuthTokenInvalidatedEvent
 from interface import objects
 
 CFG_PREFIX = "service.service_gateway"
 DEFAULT_USER_CACHE_SIZE = 2000
+DEFAULT_AUTH_CACHE_TTL = 300
+DEFAULT_INVALID_TOKEN_TTL = 30
 DEFAULT_EXPIRY = "0"
 
 SG_IDENTIFICATION = "service_gateway/ScionCC/1.0"
@@ -66,6 +70,73 @@ sg_instance = None
 req_seqnum = 0
 
 
+class AuthInfoCache(object):
+    """
+    Size and TTL bounded cache for request authentication in the gateway. Caches resolved
+    authentication tokens (token -> actor_id, expiry), including negative entries for invalid
+    tokens, and known actors with their role headers (actor_id -> roles). Entries for valid
+    tokens do not outlive the token expiry. If name is given, the caches are registered for
+    stats under this name prefix, which must be unique in the container.
+    """
+    def __init__(self, max_size=DEFAULT_USER_CACHE_SIZE, ttl=DEFAULT_AUTH_CACHE_TTL,
+                 invalid_token_ttl=DEFAULT_INVALID_TOKEN_TTL, name=None):
+        self.ttl = ttl
+        self.invalid_token_ttl = invalid_token_ttl
+        tokens_name, actors_name = ("%s_tokens" % name, "%s_actors" % name) if name else (None, None)
+        self.tokens = BoundedCache(tokens_name, max_entries=max_size, ttl=ttl)   # token -> (actor_id or None, expiry)
+        self.actors = BoundedCache(actors_name, max_entries=max_size, ttl=ttl)   # actor_id -> role header or None
+
+    def get_token(self, token):
+        """ Returns tuple (actor_id, expiry) for a cached token, with actor_id None if the token is
+        known to be invalid, or None if the token is not cached """
+        return self.tokens.get(token)
+
+    def put_token(self, token, actor_id, expiry):
+        ttl = self.ttl
+        try:
+            expiry_time = int(expiry) / 1000.0
+        except (TypeError, ValueError):
+            return
+        if expiry_time > 0:
+            ttl = min(ttl, expiry_time - time.time())
+            if ttl <= 0:
+                return
+        self.tokens.put(token, (actor_id, expiry), ttl=ttl)
+
+    def put_invalid_token(self, token):
+        self.tokens.put(token, (None, None), ttl=self.invalid_token_ttl)
+
+    def has_actor(self, actor_id):
+        """ Returns True if the actor is known to exist """
+        return actor_id in self.actors
+
+    def put_actor(self, actor_id, role_header=None):
+        self.actors.put(actor_id, role_header)
+
+    def get_roles(self, actor_id):
+        """ Returns the cached role header for given actor or None """
+        return self.actors.get(actor_id)
+
+    def put_roles(self, actor_id, role_header):
+        self.actors.put(actor_id, role_header)
+
+    def evict_actor(self, actor_id):
+        self.actors.evict(actor_id)
+
+    def evict_token(self, token):
+        # OAuth2 access tokens passed as request args are cached with prefix
+        self.tokens.evict(token)
+        self.tokens.evict("Bearer_" + token)
+
+    def clear(self):
+        self.tokens.clear()
+        self.actors.clear()
+
+    def close(self):
+        self.tokens.close()
+        self.actors.close()
+
+
 class ServiceGateway(object):
     """
     The Service Gateway exports service routes for a web server via a Flask blueprint.
@@ -110,10 +181,16 @@ class ServiceGateway(object):
         self.user_cache_size = self.config.get_safe(CFG_PREFIX + ".user_cache_size", DEFAULT_USER_CACHE_SIZE)
         self.max_content_length = self.config.get_safe(CFG_PREFIX + ".max_content_length")
 
-        # Initialize an LRU Cache to keep user roles cached for performance reasons
-        #maxSize = maximum number of elements to keep in cache
-        #maxAgeMs = oldest entry to keep
-        self.user_role_cache = LRUCache(self.user_cache_size, 0, 0)
+        # Cache for resolved authentication tokens, known actors and their roles
+        self.auth_cache = AuthInfoCache(max_size=self.user_cache_size,
+                                        ttl=self.config.get_safe(CFG_PREFIX + ".auth_cache_ttl", DEFAULT_AUTH_CACHE_TTL),
+                                        invalid_token_ttl=self.config.get_safe(CFG_PREFIX + ".invalid_token_ttl",
+                                                                               DEFAULT_INVALID_TOKEN_TTL),
+                                        name="sg_auth_%s" % self.process.id)
+
+        # Streaming of large JSON responses
+        self.stream_cfg = self.config.get_safe(CFG_PREFIX + ".response_streaming") or {}
+        self.stream_responses = self.stream_cfg.get("enabled", False) is True
 
         self.request_callback = None
         self.log_errors = self.config.get_safe(CFG_PREFIX + ".log_errors", True)
@@ -130,10 +207,11 @@ class ServiceGateway(object):
         self.event_subscriber = EventSubscriber(event_type=OT.UserRoleModifiedEvent, origin_type="Org",
                                                           callback=self._event_callback)
         self.event_subscriber.add_event_subscription(event_type=OT.UserRoleCacheResetEvent)
+        self.event_subscriber.add_event_subscription(event_type=OT.AuthTokenInvalidatedEvent)
         self.process.add_endpoint(self.event_subscriber)
 
     def stop(self):
-        pass
+        self.auth_cache.close()
         # Stop event subscribers - TODO: This hangs
         #self.process.remove_endpoint(self.event_subscriber)
 
@@ -151,12 +229,15 @@ class ServiceGateway(object):
             log.debug("User Role modified: %s %s %s" % (org_id, actor_id, role_name))
 
             # Evict the user and their roles from the cache so that it gets updated with the next call.
-            if self.user_role_cache and self.user_role_cache.has_key(actor_id):
-                log.debug("Evicting user from the user_role_cache: %s" % actor_id)
-                self.user_role_cache.evict(actor_id)
+            log.debug("Evicting user from the auth_cache: %s" % actor_id)
+            self.auth_cache.evict_actor(actor_id)
         elif isinstance(event, UserRoleCacheResetEvent):
             # An event is received to clear the user data cache
-            self.user_role_cache.clear()
+            self.auth_cache.clear()
+        elif isinstance(event, AuthTokenInvalidatedEvent):
+            # Logged out or revoked tokens must not authenticate from the cache
+            log.debug("Evicting invalidated token from the auth_cache: %s", event.token_string)
+            self.auth_cache.evict_token(event.token_string)
 
     # -------------------------------------------------------------------------
     # Routes
@@ -470,7 +551,17 @@ class ServiceGateway(object):
 
         # Enable temporary authentication tokens to resolve to actor ids
         if authtoken:
+            token_info = self.auth_cache.get_token(authtoken)
+            if token_info is not None:
+                if token_info[0]:
+                    actor_id, expiry = token_info
+                    log.debug("Resolved cached token into actor_id=%s expiry=%s", actor_id, expiry)
+                else:
+                    log.debug("Authentication token cached as invalid: %s", authtoken)
+                return actor_id, expiry
+
             try:
+                cache_key = authtoken
                 if authtoken.startswith(("Bearer_")):
                     # Backdoor way for OAuth2 access tokens as request args for GET URLs
                     authtoken = authtoken[7:]
@@ -481,15 +572,21 @@ class ServiceGateway(object):
                         actor_id = token.user["actor_id"]
                         expiry = str(token._token_obj.expires)
                         log.info("Resolved OAuth2 token %s into actor_id=%s expiry=%s", authtoken, actor_id, expiry)
+                        self.auth_cache.put_token(cache_key, actor_id, expiry)
+                    else:
+                        self.auth_cache.put_invalid_token(cache_key)
                 else:
                     token_info = self.idm_client.check_authentication_token(authtoken, headers=self._get_gateway_headers())
                     actor_id = token_info.get("actor_id", actor_id)
                     expiry = token_info.get("expiry", expiry)
                     log.info("Resolved token %s into actor_id=%s expiry=%s", authtoken, actor_id, expiry)
+                    self.auth_cache.put_token(cache_key, actor_id, expiry)
             except NotFound:
                 log.info("Provided authentication token not found: %s", authtoken)
+                self.auth_cache.put_invalid_token(cache_key)
             except Unauthorized:
                 log.info("Authentication token expired or invalid: %s", authtoken)
+                self.auth_cache.put_invalid_token(cache_key)
             except Exception as ex:
                 log.exception("Problem resolving authentication token")
 
@@ -510,7 +607,9 @@ class ServiceGateway(object):
                 return DEFAULT_ACTOR_ID, DEFAULT_EXPIRY
 
         try:
-            user = self.idm_client.read_actor_identity(actor_id=ion_actor_id, headers=self._get_gateway_headers())
+            if not self.auth_cache.has_actor(ion_actor_id):
+                self.idm_client.read_actor_identity(actor_id=ion_actor_id, headers=self._get_gateway_headers())
+                self.auth_cache.put_actor(ion_actor_id)
         except NotFound as e:
             if not in_whitelist and self.require_login:
                 # This could be a restart of the system with a new preload.
@@ -772,11 +871,10 @@ class ServiceGateway(object):
 
         try:
             # Check to see if the user's roles are cached already - keyed by user id
-            if self.user_role_cache.has_key(actor_id):
-                role_header = self.user_role_cache.get(actor_id)
-                if role_header is not None:
-                    headers[MSG_HEADER_ROLES] = role_header
-                    return headers
+            role_header = self.auth_cache.get_roles(actor_id)
+            if role_header is not None:
+                headers[MSG_HEADER_ROLES] = role_header
+                return headers
 
             # The user's roles were not cached so hit the datastore to find it.
             role_list = self.org_client.list_actor_roles(actor_id, headers=self._get_gateway_headers())
@@ -787,7 +885,7 @@ class ServiceGateway(object):
             role_header = get_role_message_headers(org_roles)
 
             # Cache the roles by user id
-            self.user_role_cache.put(actor_id, role_header)
+            self.auth_cache.put_roles(actor_id, role_header)
 
         except Exception:
             role_header = dict()  # Default to empty dict if there is a problem finding roles for the user
@@ -848,6 +946,8 @@ class ServiceGateway(object):
     def json_response(self, response_data):
         """Private implementation of standard flask jsonify to specify the use of an encoder to walk ION objects
         """
+        if self.stream_responses and get_json_item_count(response_data) >= self.stream_cfg.get("min_items", 1000):
+            return self.json_stream_response(response_data)
         resp_obj = json_dumps(response_data, default=encode_ion_object, indent=None if request.is_xhr else 2)
         resp = self.response_class(resp_obj, mimetype=CONT_TYPE_JSON)
         if self.develop_mode and (self.set_cors_headers or ("api_key" in request.args and request.args["api_key"])):
@@ -855,6 +955,22 @@ class ServiceGateway(object):
         self._log_request_response(CONT_TYPE_JSON, resp_obj, len(resp_obj))
         return resp
 
+    def json_stream_response(self, response_data):
+        """Returns a chunked JSON response that is encoded incrementally while it is sent,
+        gzip compressed if the client accepts it
+        """
+        resp_chunks = json_iterencode(response_data, chunk_size=self.stream_cfg.get("chunk_size", 65536))
+        resp_headers = {}
+        if self.stream_cfg.get("gzip", True) and "gzip" in request.headers.get("Accept-Encoding", ""):
+            resp_chunks = gzip_iterencode(resp_chunks, level=self.stream_cfg.get("gzip_level", 6))
+            resp_headers["Content-Encoding"] = "gzip"
+            resp_headers["Vary"] = "Accept-Encoding"
+        resp = self.response_class(resp_chunks, mimetype=CONT_TYPE_JSON, headers=resp_headers)
+        if self.develop_mode and (self.set_cors_headers or ("api_key" in request.args and request.args["api_key"])):
+            self._add_cors_headers(resp)
+        self._log_request_response(CONT_TYPE_JSON, "stream", -1)
+        return resp
+
     def gateway_json_response(self, response_data):
         """Returns the normal service gateway response as JSON or as media in case the response
         is a media response
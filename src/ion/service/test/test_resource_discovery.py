@@ -4,13 +4,20 @@
 
 __author__ = 'Luke Campbell <LCampbell@ASAScience.com>, Michael Meisinger'
 
+import sys
+import time
 from unittest import SkipTest
 from nose.plugins.attrib import attr
 from mock import Mock, patch, sentinel
 
+from pyon.util.cache import BoundedCache
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from pyon.public import PRED, CFG, RT, OT, LCS, BadRequest, NotFound, IonObject, DotDict, ResourceQuery, EventQuery, log
+from pyon.datastore.datastore_query import DQ
+from pyon.datastore.postgresql.pg_query import PostgresQueryBuilder
 
+from ion.service.ds_discovery import DatastoreDiscovery
 from ion.service.resource_management_service import ResourceManagementService
 from ion.util.geo_utils import GeoUtils
 from ion.util.testing_utils import create_dummy_resources, create_dummy_events
@@ -588,3 +595,337 @@ class ResourceQueryTest(IonIntegrationTestCase):
         self.assertEquals(len(result), 2)
         #self.assertEquals(result[0].name, "ID2")
 
+    def test_fulltext_search(self):
+        res_objs = [
+            dict(res=IonObject(RT.TestInstrument, name="Seawater sensor", description="Measures salinity")),
+            dict(res=IonObject(RT.TestInstrument, name="CTD1", description="Conductivity of sea water")),
+            dict(res=IonObject(RT.TestInstrument, name="CTD2", keywords=["water", "sea"])),
+            dict(res=IonObject(RT.TestInstrument, name="CTD3", firmware_version="water sea")),
+            dict(res=IonObject(RT.TestInstrument, name="Lake water sensor", description="Lake water")),
+            dict(res=IonObject(RT.TestPlatform, name="Buoy", description="Platform in the sea")),
+        ]
+        res_by_name = create_dummy_resources(res_objs)
+
+        log.info("TEST: Ranked text search, weighted by attribute")
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_fulltext("sea water"))
+        rq.order_by_rank()
+        result = self.discovery.query(rq.get_query(), id_only=True)
+        self.assertEquals(result, [res_by_name[n] for n in ("CTD1", "CTD2", "CTD3")])
+
+        # Paging by rank
+        rq.set_limit(2)
+        rq.set_skip(1)
+        result = self.discovery.query(rq.get_query(), id_only=True)
+        self.assertEquals(result, [res_by_name[n] for n in ("CTD2", "CTD3")])
+
+        log.info("TEST: Text search modes")
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_fulltext("water sensor", DQ.FTS_PHRASE))
+        result = self.discovery.query(rq.get_query(), id_only=False)
+        self.assertEquals({r.name for r in result}, {"Lake water sensor"})
+
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_fulltext("water & !lake", DQ.FTS_QUERY), rq.filter_type(RT.TestInstrument))
+        result = self.discovery.query(rq.get_query(), id_only=False)
+        self.assertEquals({r.name for r in result}, {"CTD1", "CTD2", "CTD3"})
+
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_fulltext("water & & lake", DQ.FTS_QUERY))
+        with self.assertRaises(BadRequest):
+            self.discovery.query(rq.get_query(), id_only=True)
+
+        # Stemming
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_fulltext("measuring"))
+        result = self.discovery.query(rq.get_query(), id_only=False)
+        self.assertEquals({r.name for r in result}, {"Seawater sensor"})
+
+        log.info("TEST: Rank and snippet, updated text index")
+        ctd1_obj = self.rr.read(res_by_name["CTD1"])
+        ctd1_obj.description = "Conductivity of lake water"
+        self.rr.update(ctd1_obj)
+
+        query_str = "{'and': [], 'or': [], 'highlight': True, 'query': {'field': '_all', 'index': 'resources_index', 'search': 'lake'}}"
+        result = self.discovery.query(eval(query_str), id_only=True)
+        self.assertEquals([row[0] for row in result], [res_by_name["Lake water sensor"], res_by_name["CTD1"]])
+        self.assertGreater(result[0][1], result[1][1])
+        self.assertIn("<b>lake</b>", result[1][2])
+
+        query_str = "{'and': [], 'or': [], 'query': {'field': '_all', 'index': 'resources_index', 'search': 'sea platform', 'search_mode': 'plain'}}"
+        result = self.discovery.query(eval(query_str), id_only=True)
+        self.assertEquals(result, [res_by_name["Buoy"]])
+
+    def test_geo_aggregates(self):
+        res_objs = [
+            dict(res=IonObject(RT.TestSite, name="Site1", location=self._geopt(10, 20),
+                               temporal_bounds=self._temprng(1000, 2000))),
+            dict(res=IonObject(RT.TestSite, name="Site2", location=self._geopt(12, 23),
+                               temporal_bounds=self._temprng(1500, 3000))),
+            dict(res=IonObject(RT.TestSite, name="Site3", location=self._geopt(-4, 31))),
+            dict(res=IonObject(RT.TestSite, name="Site4")),
+        ]
+        create_dummy_resources(res_objs)
+
+        # Note that in Discovery intermediate format top_left=x1,y2 and bottom_right=x2,y1
+        query_obj = {"query": {"field": "geospatial_point_center", "index": "resources_index",
+                               "top_left": [0.0, 20.0], "bottom_right": [40.0, -10.0]}}
+        result = self.discovery.query(query_obj, id_only=True, search_args=dict(geo_extent=True))
+        self.assertEquals(len(result), 1)
+        extent = result[0]
+        self.assertEquals(extent["count"], 3)
+        self.assertEquals((extent["lat_north"], extent["lat_south"], extent["lon_east"], extent["lon_west"]),
+                          (12.0, -4.0, 31.0, 20.0))
+        self.assertEquals((extent["time_start"], extent["time_end"]), (1000.0, 3000.0))
+
+        result = self.discovery.query(query_obj, id_only=True, search_args=dict(geo_tiles=10.0))
+        tiles = sorted(result, key=lambda tile: tile["count"])
+        self.assertEquals([tile["count"] for tile in tiles], [1, 2])
+        self.assertEquals((tiles[0]["lat"], tiles[0]["lon"]), (-4.0, 31.0))
+        self.assertAlmostEqual(tiles[1]["lat"], 11.0)
+        self.assertAlmostEqual(tiles[1]["lon"], 21.5)
+        self.assertEquals((tiles[1]["lat_north"], tiles[1]["lat_south"], tiles[1]["lon_east"], tiles[1]["lon_west"]),
+                          (12.0, 10.0, 23.0, 20.0))
+
+
+@attr('UNIT', group='core')
+class DiscoveryQueryCompileTest(PyonTestCase):
+
+    def setUp(self):
+        self.process = Mock()
+        self.process.get_context.return_value = {}
+        self.process.container.resource_registry.get_superuser_actors.return_value = []
+        self.ds = self.process.container.resource_registry.rr_store
+        self.discovery = DatastoreDiscovery(self.process)
+        self.addCleanup(self.discovery.close)
+
+    def _get_sql(self, discovery_query):
+        ds_query, _ = self.discovery._bind_query(self.discovery._get_compiled_query(discovery_query),
+                                                 discovery_query)
+        pqb = PostgresQueryBuilder(ds_query, "ion_resources")
+        return pqb.get_query() % {k: repr(v) for k, v in pqb.get_values().iteritems()}
+
+    def test_compiled_query(self):
+        query1 = {"and": [{"field": "lcstate", "value": "DEPLOYED"}],
+                  "query": {"field": "name", "match": "CTD", "index": "resources_index"}}
+        query2 = {"and": [{"field": "lcstate", "value": "RETIRED"}],
+                  "query": {"field": "name", "match": "Buoy", "index": "resources_index"}}
+        self.assertEquals(self._get_sql(query1), "SELECT id FROM ion_resources WHERE "
+                                                 "(name ILIKE '%CTD%' AND lcstate='DEPLOYED')")
+        self.assertEquals(self._get_sql(query2), "SELECT id FROM ion_resources WHERE "
+                                                 "(name ILIKE '%Buoy%' AND lcstate='RETIRED')")
+        self.assertEquals(self.discovery._query_cache.get_stats()["loads"], 1)
+
+        # Pages of a query share the compiled query
+        for skip in (0, 10, 20):
+            page_query, _ = self.discovery._bind_query(self.discovery._get_compiled_query(
+                dict(query1, limit=10, skip=skip)), dict(query1, limit=10, skip=skip))
+            self.assertEquals((page_query["query_args"]["limit"], page_query["query_args"]["skip"]), (10, skip))
+        self.assertEquals(self.discovery._query_cache.get_stats()["loads"], 1)
+
+        # Wildcards, time and geospatial values are bound to the same shape
+        query3 = dict(query1, **{"and": [{"field": "lcstate", "value": "DEPL*"}]})
+        self.assertIn("lcstate ILIKE 'DEPL%'", self._get_sql(query3))
+        time_query = {"query": {"field": "ts_created", "index": "resources_index",
+                                "time": {"from": "2016-01-02T00:00:00", "to": "2016-01-01T00:00:00"}}}
+        self.assertIn("ts_created BETWEEN '1451606400000' AND '1451692800000'", self._get_sql(time_query))
+        time_query["query"]["time"] = {"from": "2016-01-01T00:00:00", "to": "2016-01-03T00:00:00"}
+        self.assertIn("ts_created BETWEEN '1451606400000' AND '1451779200000'", self._get_sql(time_query))
+        geo_query = {"query": {"field": "geospatial_point_center", "index": "resources_index",
+                               "top_left": [0.0, 10.0], "bottom_right": [10.0, 0.0]}}
+        self.assertIn("geom && ST_MakeEnvelope(0.0,0.0,10.0,10.0,4326)", self._get_sql(geo_query))
+        self.assertEquals(self.discovery._query_cache.get_stats()["loads"], 4)
+
+    def test_query_modes(self):
+        query = {"query": {"field": "name", "value": "CTD", "index": "resources_index"}, "limit": 2}
+        self.ds.find_by_query.return_value = ["id1", "id2", "id3"]
+        self.assertEquals(self.discovery.execute_query(query, query_args=dict(has_more=True)),
+                          ["id1", "id2", dict(_has_more=True)])
+        self.assertEquals(self.ds.find_by_query.call_args[0][0]["query_args"]["limit"], 3)
+
+        self.ds.find_by_query.return_value = [[5]]
+        self.assertEquals(self.discovery.execute_query(query, query_args=dict(count=True)), [5])
+        count_query = self.ds.find_by_query.call_args[0][0]
+        self.assertEquals(count_query["query_args"]["returns"], [DQ.AGG_COUNT])
+        self.assertEquals((count_query["query_args"]["limit"], count_query["order_by"]), (0, {}))
+
+        # Results are cached per query values and actor until a resource is modified
+        self.discovery._result_cache = BoundedCache(ttl=10)
+        self.ds.find_by_query.return_value = ["id1"]
+        self.assertEquals(self.discovery.execute_query(query), ["id1"])
+        self.assertEquals(self.discovery.execute_query(query), ["id1"])
+        self.assertEquals(self.ds.find_by_query.call_count, 3)
+        self.discovery.execute_query(dict(query, query=dict(query["query"], value="Buoy")))
+        self.process.get_context.return_value = {"ion-actor-id": "actor1"}
+        self.discovery.execute_query(query)
+        self.assertEquals(self.ds.find_by_query.call_count, 5)
+        self.discovery._result_cache.clear()
+        self.discovery.execute_query(query)
+        self.assertEquals(self.ds.find_by_query.call_count, 6)
+
+        # Returned objects are copies of the cached results
+        self.ds.find_by_query.return_value = [dict(_id="id1", name="CTD")]
+        self.discovery.execute_query(query, id_only=False)[0]["name"] = "Modified"
+        self.assertEquals(self.discovery.execute_query(query, id_only=False), [dict(_id="id1", name="CTD")])
+        self.assertEquals(self.ds.find_by_query.call_count, 7)
+
+        # Results of queries with association filters are not cached
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_associated_from_object(object="res1", predicate=PRED.hasTestSite))
+        self.ds.find_by_query.return_value = ["id2"]
+        self.assertEquals(self.discovery.execute_query(rq.get_query()), ["id2"])
+        self.assertEquals(self.discovery.execute_query(rq.get_query()), ["id2"])
+        self.assertEquals(self.ds.find_by_query.call_count, 9)
+
+    def test_geo_modes(self):
+        query = {"query": {"field": "geospatial_point_center", "index": "resources_index",
+                           "top_left": [-20.0, 10.0], "bottom_right": [20.0, -10.0]}, "limit": 10}
+        self.ds.find_by_query.return_value = [[3, "BOX(-10 -5,10 5)", "[0,100]", "[1000,2000]"]]
+        self.assertEquals(self.discovery.execute_query(query, query_args=dict(geo_extent=True)),
+                          [dict(count=3, lat_north=5.0, lat_south=-5.0, lon_east=10.0, lon_west=-10.0,
+                                depth_min=0.0, depth_max=100.0, time_start=1000.0, time_end=2000.0)])
+        extent_query = self.ds.find_by_query.call_args[0][0]
+        self.assertEquals(extent_query["query_args"]["returns"][0], DQ.AGG_COUNT)
+        self.assertEquals(extent_query["query_args"]["limit"], 0)
+
+        self.ds.find_by_query.return_value = [[3, None, None, None]]
+        self.assertEquals(self.discovery.execute_query(query, query_args=dict(geo_extent=True)),
+                          [dict(count=3, depth_min=None, depth_max=None, time_start=None, time_end=None)])
+
+        # Resources without location are not in any tile
+        self.ds.find_by_query.return_value = [["POINT(0 0)", "POINT(2 1)", "BOX(1 0,3 2)", 2],
+                                              [None, None, None, 5]]
+        self.assertEquals(self.discovery.execute_query(query, query_args=dict(geo_tiles=5)),
+                          [dict(count=2, lat=1.0, lon=2.0, lat_north=2.0, lat_south=0.0, lon_east=3.0, lon_west=1.0)])
+        tile_query = self.ds.find_by_query.call_args[0][0]
+        self.assertEquals(tile_query["query_args"]["tile_size"], 5.0)
+        self.assertTrue(tile_query["query_args"]["group_count"])
+        with self.assertRaises(BadRequest):
+            self.discovery.execute_query(query, query_args=dict(geo_tiles=-1))
+
+        # Errors of the datastore are empty results, invalid query values are reported
+        self.ds.find_by_query.side_effect = Exception("relation does not exist")
+        self.assertEquals(self.discovery.execute_query(query), [])
+        self.ds.find_by_query.side_effect = BadRequest("Invalid text search query")
+        with self.assertRaises(BadRequest):
+            self.discovery.execute_query({"query": {"field": "_all", "search": "sea & & water",
+                                                    "search_mode": "query", "index": "resources_index"}})
+
+
+@attr('PFM', group='core')
+class ResourceSearchPerformanceTest(IonIntegrationTestCase):
+
+    def setUp(self):
+        self._start_container()
+        self.rr = self.container.resource_registry
+
+    def _create_resources(self, start, num_res, batch_size=10000):
+        words = ["sea", "water", "salinity", "temperature", "pressure", "oxygen", "current", "wave", "buoy",
+                 "glider", "mooring", "profiler", "sensor", "array", "coastal", "deep", "surface", "station"]
+        for batch_start in xrange(start, start + num_res, batch_size):
+            res_objs = []
+            for i in xrange(batch_start, min(batch_start + batch_size, start + num_res)):
+                res_objs.append(IonObject(RT.TestInstrument, name="%s %s %s" % (words[i % 18], words[i / 18 % 18], i),
+                                          description=" ".join(words[(i * 7 + j) % 18] for j in xrange(5)),
+                                          keywords=[words[i / 324 % 18]], firmware_version="FW%s" % (i % 100)))
+            self.rr.create_mult(res_objs)
+
+    def test_search_latency(self):
+        """ Latency of ranked text search compared to substring match with a growing number of resources """
+        num_queries, num_res = 20, 0
+        print >>sys.stderr, ""
+        for num_total in (10000, 100000, 1000000):
+            self._create_resources(num_res, num_total - num_res)
+            num_res = num_total
+            for label, search in (("fulltext", "salinity buoy"), ("allmatch", "salinity")):
+                start_time = time.time()
+                for i in xrange(num_queries):
+                    rq = ResourceQuery(limit=20, skip=20 * (i % 5))
+                    if label == "fulltext":
+                        rq.set_filter(rq.filter_fulltext(search))
+                        rq.order_by_rank()
+                    else:
+                        rq.set_filter(rq.filter_matchany(search))
+                    result = self.rr.find_resources_ext(query=rq.get_query(), id_only=True)
+                    self.assertEquals(len(result), 20)
+                diff = time.time() - start_time
+                print >>sys.stderr, "Search (%s) with %s resources: %.3f ms per query" % (
+                    label, num_total, diff / num_queries * 1000)
+
+    def test_discovery_query_latency(self):
+        """ Latency of repeated discovery queries of the same shape, compiled once and with cached results """
+        self._create_resources(0, 10000)
+        process = Mock()
+        process.container = self.container
+        process.get_context.return_value = {}
+        discovery = DatastoreDiscovery(process)
+        self.addCleanup(discovery.close)
+
+        num_queries = 200
+        print >>sys.stderr, ""
+        for label in ("uncompiled", "compiled", "cached results"):
+            if label == "cached results":
+                discovery._result_cache = BoundedCache(ttl=60)
+            start_time = time.time()
+            for i in xrange(num_queries):
+                if label == "uncompiled":
+                    discovery._query_cache.clear()
+                query = {"and": [{"field": "type_", "value": RT.TestInstrument}],
+                         "query": {"field": "name", "match": "salinity %s" % (i % 10), "index": "resources_index"},
+                         "limit": 20}
+                discovery.execute_query(query, id_only=True, query_args=dict(has_more=True))
+            diff = time.time() - start_time
+            print >>sys.stderr, "Discovery query (%s) with 10000 resources: %.3f ms per query" % (
+                label, diff / num_queries * 1000)
+
+    def _create_sites(self, start, num_res, batch_size=10000):
+        """Creates sites spread over a 0.1 degree grid with one year long temporal bounds starting in 2010-2014"""
+        for batch_start in xrange(start, start + num_res, batch_size):
+            res_objs = []
+            for i in xrange(batch_start, min(batch_start + batch_size, start + num_res)):
+                lat, lon = -60.0 + (i * 7919 % 1200) * 0.1, -150.0 + (i * 104729 % 3000) * 0.1
+                t_start = 1262304000 + (i % 1825) * 86400
+                res_objs.append(IonObject(RT.TestSite, name="site%s" % i,
+                                          location=GeospatialLocation(latitude=lat, longitude=lon),
+                                          temporal_bounds=TemporalBounds(start_datetime=str(t_start),
+                                                                         end_datetime=str(t_start + 31536000))))
+            self.rr.create_mult(res_objs)
+
+    def test_geo_search_latency(self):
+        """ Latency of geospatial and temporal search, of the extent of results computed in the datastore
+        compared to the client, and of map tile clusters with a growing number of located resources """
+        process = Mock()
+        process.container = self.container
+        process.get_context.return_value = {}
+        discovery = DatastoreDiscovery(process)
+        self.addCleanup(discovery.close)
+
+        bbox_query = {"query": {"field": "geospatial_point_center", "index": "resources_index",
+                                "top_left": [-10.0, 5.0], "bottom_right": [10.0, -5.0]},
+                      "and": [{"field": "type_", "value": RT.TestSite}], "limit": 100}
+        time_query = dict(bbox_query, **{"and": bbox_query["and"] + [
+            {"field": "temporal_range", "time": {"from": "2011-01-01T00:00:00", "to": "2011-02-01T00:00:00"}}]})
+        num_queries, num_res = 10, 0
+        print >>sys.stderr, ""
+        for num_total in (10000, 100000, 1000000):
+            self._create_sites(num_res, num_total - num_res)
+            num_res = num_total
+            for label, query, query_args in (("bbox", bbox_query, {}), ("bbox+time", time_query, {}),
+                                             ("extent", bbox_query, dict(geo_extent=True)),
+                                             ("tiles", bbox_query, dict(geo_tiles=1.0))):
+                start_time = time.time()
+                for i in xrange(num_queries):
+                    result = discovery.execute_query(query, id_only=True, query_args=query_args)
+                    self.assertTrue(result)
+                diff = time.time() - start_time
+                print >>sys.stderr, "Geo search (%s) with %s resources: %.3f ms per query" % (
+                    label, num_total, diff / num_queries * 1000)
+
+            # Extent computed in the client from all matching resources
+            start_time = time.time()
+            for i in xrange(num_queries):
+                res_objs = discovery.execute_query(dict(bbox_query, limit=0), id_only=False)
+                GeoUtils.calc_bounding_box_for_points([res_obj.location.__dict__ for res_obj in res_objs])
+            diff = time.time() - start_time
+            print >>sys.stderr, "Geo search (client extent) with %s resources: %.3f ms per query" % (
+                num_total, diff / num_queries * 1000)
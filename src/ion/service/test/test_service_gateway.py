@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import time
+from nose.plugins.attrib import attr
+
+from pyon.util.cache import cache_registry
+from pyon.util.unit_test import UnitTestCase
+
+from ion.service.service_gateway import AuthInfoCache
+
+
+@attr('UNIT')
+class TestAuthInfoCache(UnitTestCase):
+
+    def test_token_cache(self):
+        cache = AuthInfoCache(max_size=2, ttl=10, invalid_token_ttl=10)
+        self.assertIsNone(cache.get_token("tok1"))
+
+        expiry = str(int((time.time() + 100) * 1000))
+        cache.put_token("tok1", "actor1", expiry)
+        cache.put_invalid_token("tok2")
+        self.assertEquals(cache.get_token("tok1"), ("actor1", expiry))
+        self.assertEquals(cache.get_token("tok2"), (None, None))
+
+        # Least recently used entries are evicted
+        cache.put_token("tok3", "actor2", "0")
+        self.assertEquals(cache.get_token("tok3"), ("actor2", "0"))
+        self.assertIsNone(cache.get_token("tok1"))
+
+        # Entries do not outlive the token expiry
+        cache.put_token("tok4", "actor1", str(int((time.time() - 1) * 1000)))
+        self.assertIsNone(cache.get_token("tok4"))
+        self.assertEquals(cache.tokens.get_stats()["evictions"], 1)
+
+        # Invalidated tokens are evicted, including OAuth2 tokens passed as request args
+        cache.put_token("Bearer_tok3", "actor2", "0")
+        cache.evict_token("tok3")
+        self.assertIsNone(cache.get_token("tok3"))
+        self.assertIsNone(cache.get_token("Bearer_tok3"))
+
+    def test_actor_cache(self):
+        cache = AuthInfoCache(max_size=10, ttl=10)
+        self.assertFalse(cache.has_actor("actor1"))
+        cache.put_actor("actor1")
+        self.assertTrue(cache.has_actor("actor1"))
+        self.assertIsNone(cache.get_roles("actor1"))
+
+        cache.put_roles("actor1", {})
+        self.assertEquals(cache.get_roles("actor1"), {})
+        cache.put_roles("actor2", {"ION": ["MEMBER"]})
+        self.assertEquals(cache.get_roles("actor2"), {"ION": ["MEMBER"]})
+
+        cache.evict_actor("actor1")
+        self.assertFalse(cache.has_actor("actor1"))
+        cache.clear()
+        self.assertIsNone(cache.get_roles("actor2"))
+
+        cache.actors.put("actor3", None, ttl=-1)
+        self.assertFalse(cache.has_actor("actor3"))
+
+    def test_cache_names(self):
+        cache1 = AuthInfoCache(name="sg_auth_proc1")
+        cache2 = AuthInfoCache(name="sg_auth_proc2")
+        self.assertIs(cache_registry["sg_auth_proc1_tokens"], cache1.tokens)
+        self.assertIs(cache_registry["sg_auth_proc2_actors"], cache2.actors)
+        self.assertIsNone(AuthInfoCache().tokens.name)
+
+        cache1.close()
+        self.assertNotIn("sg_auth_proc1_tokens", cache_registry)
+        self.assertNotIn("sg_auth_proc1_actors", cache_registry)
+        self.assertIn("sg_auth_proc2_tokens", cache_registry)
+        cache2.close()
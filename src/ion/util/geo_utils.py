@@ -143,6 +143,32 @@ class GeoUtils(object):
         temp_bounds = TemporalBounds(start_datetime=start_min, end_datetime=end_max)
         return temp_bounds
 
+    @staticmethod
+    def parse_extent(box_str):
+        """Returns the bounding box dict (as calc_bounding_box_for_points) for a PostGIS box string,
+        such as computed by the datastore for a query result (AGG_GEO_EXTENT). Empty if no locations."""
+        if not box_str:
+            return {}
+        (lon_west, lat_south), (lon_east, lat_north) = [[float(v) for v in corner.split()]
+                                                        for corner in box_str[4:-1].split(",")]
+        return dict(lat_north=lat_north, lat_south=lat_south, lon_east=lon_east, lon_west=lon_west)
+
+    @staticmethod
+    def parse_range(range_str):
+        """Returns tuple (lower, upper) for a numrange string such as "[0,10]", None for unbounded"""
+        if not range_str or range_str == "empty":
+            return None, None
+        lower, upper = range_str[1:-1].split(",")
+        return float(lower) if lower else None, float(upper) if upper else None
+
+    @staticmethod
+    def parse_point(point_wkt):
+        """Returns tuple (lat, lon) for a WKT point, such as "POINT(lon lat)" """
+        if not point_wkt:
+            return None, None
+        lon, lat = point_wkt[point_wkt.index("(") + 1:-1].split()
+        return float(lat), float(lon)
+
     # -------------------------------------------------------------------------
 
     @staticmethod
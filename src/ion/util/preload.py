@@ -8,6 +8,9 @@ import json
 import yaml
 import re
 import os
+import time
+import gevent
+from gevent.queue import Queue
 
 from pyon.core import MSG_HEADER_ACTOR, MSG_HEADER_ROLES, MSG_HEADER_VALID
 from pyon.core.bootstrap import get_service_registry
@@ -30,6 +33,9 @@ ID_SYSTEM_ACTOR = "USER_SYSTEM"
 
 UUID_RE = '^[0-9a-fA-F]{32}$'
 
+DEFAULT_BULK_BATCH_SIZE = 5000   # Max number of objects per bulk create/update statement
+RESOLVE_BATCH_SIZE = 1000        # Max number of ids per bulk read/association lookup
+
 
 class Preloader(object):
 
@@ -42,6 +48,8 @@ class Preloader(object):
         self.rr = self.process.container.resource_registry
 
         self.bulk = self.preload_cfg.get("bulk", False) is True
+        self.bulk_batch_size = int(self.preload_cfg.get("bulk_batch_size", DEFAULT_BULK_BATCH_SIZE))
+        self.parallel_steps = int(self.preload_cfg.get("parallel_steps", 1))
 
         # Loads internal bootstrapped resource ids that will be referenced during preload
         self._load_system_ids()
@@ -54,6 +62,10 @@ class Preloader(object):
         self.resource_ids = {}          # Holds a mapping of preload IDs to internal resource ids
         self.resource_objs = {}         # Holds a mapping of preload IDs to the actual resource objects
         self.resource_assocs = {}       # Holds a mapping of existing associations list by predicate
+        self.resource_aliases = {}      # Holds a mapping of internal resource ids to preload IDs
+        self.assoc_index = set()        # Holds (subject, predicate, object) of existing associations
+        self.assoc_indexed_ids = set()  # Holds internal resource ids whose existing associations are indexed
+        self.preload_stats = dict(steps=0, actions=0, failed=0, resources=0, associations=0)
 
         self.bulk_resources = {}        # Keeps resource objects to be bulk inserted/updated
         self.bulk_associations = {}     # Keeps association objects to be bulk inserted/updated
@@ -79,22 +91,94 @@ class Preloader(object):
         if not "preload_type" in master_cfg or master_cfg["preload_type"] != "steps":
             raise BadRequest("Invalid preload steps file")
 
+        start_time = time.time()
         if "actions" in master_cfg:
             # Shorthand notation for one step in master
             step_filename = filename
             self._execute_step("default", step_filename, skip_steps)
-            return
+        elif self.parallel_steps > 1:
+            self._execute_steps_parallel(master_cfg["steps"], os.path.dirname(filename), skip_steps)
+        else:
+            for step in master_cfg["steps"]:
+                if skip_steps and step in skip_steps:
+                    log.info("Skipping step %s" % step)
+                    continue
+                step_filename = "%s/%s.yml" % (os.path.dirname(filename), step)
+                self._execute_step(step, step_filename, skip_steps)
+
+        self._log_throughput("Preload", start_time, self.preload_stats["actions"],
+                             self.preload_stats["resources"], self.preload_stats["associations"])
 
-        for step in master_cfg["steps"]:
-            if skip_steps and step in skip_steps:
+    def _execute_steps_parallel(self, steps, dirname, skip_steps):
+        """
+        Executes preload steps concurrently, up to parallel_steps at a time. A step starts when all
+        steps it requires (as declared in the step file) have completed. Steps without declared
+        requirements do not wait for steps listed before them in the master file.
+        """
+        skip_steps = skip_steps if skip_steps is not None else []
+        step_cfgs, requires = {}, {}
+        for step in steps:
+            if step in skip_steps:
                 log.info("Skipping step %s" % step)
                 continue
-            step_filename = "%s/%s.yml" % (os.path.dirname(filename), step)
-            self._execute_step(step, step_filename, skip_steps)
+            step_cfgs[step] = self._read_preload_file("%s/%s.yml" % (dirname, step), safe_load=True)
+        for step, step_cfg in step_cfgs.iteritems():
+            req_steps = [rs.strip() for rs in (step_cfg.get("requires", "") or "").split(",")]
+            requires[step] = [rs for rs in req_steps if rs in step_cfgs]
+        pending = self._get_step_order(steps, requires)
+
+        completed, running, errors = set(), {}, []
+        done_queue = Queue()
 
-    def _execute_step(self, step, filename, skip_steps):
+        def run_step(step):
+            try:
+                self._execute_step(step, None, skip_steps, step_cfg=step_cfgs[step])
+            except Exception as ex:
+                log.exception("Preload step %s failed", step)
+                errors.append(ex)
+            finally:
+                done_queue.put(step)
+
+        while pending or running:
+            for step in list(pending):
+                if errors or len(running) >= self.parallel_steps:
+                    break
+                if all(rs in completed for rs in requires[step]):
+                    pending.remove(step)
+                    running[step] = gevent.spawn(run_step, step)
+            if not running:
+                break
+            step = done_queue.get()
+            running.pop(step, None)
+            completed.add(step)
+
+        if errors:
+            raise errors[0]
+
+    def _get_step_order(self, steps, requires):
+        """Returns steps in an order such that required steps come first (topological sort)"""
+        ordered, done, visiting = [], set(), set()
+
+        def visit(step):
+            if step in done:
+                return
+            if step in visiting:
+                raise BadRequest("Preload step dependency cycle at step %s" % step)
+            visiting.add(step)
+            for rs in requires[step]:
+                visit(rs)
+            visiting.discard(step)
+            done.add(step)
+            ordered.append(step)
+
+        for step in steps:
+            if step in requires:
+                visit(step)
+        return ordered
+
+    def _execute_step(self, step, filename, skip_steps, step_cfg=None):
         """Executes a preload step file"""
-        step_cfg = self._read_preload_file(filename, safe_load=True)
+        step_cfg = step_cfg or self._read_preload_file(filename, safe_load=True)
         if not "preload_type" in step_cfg or step_cfg["preload_type"] not in ("actions", "steps"):
             raise BadRequest("Invalid preload actions file")
         if skip_steps and step_cfg["preload_type"] == "actions" and step_cfg.get("requires", ""):
@@ -103,13 +187,29 @@ class Preloader(object):
                 skip_steps.append(step)
                 return
 
-        for action in step_cfg["actions"]:
+        start_time = time.time()
+        actions = step_cfg["actions"] or []
+        self._resolve_references(actions)
+
+        num_failed = 0
+        for action in actions:
             try:
                 self._execute_action(action)
             except Exception as ex:
+                num_failed += 1
                 log.warn("Action failed: " + str(ex), exc_info=True)
 
-        self.commit_bulk()
+        num_res, num_assoc = self.commit_bulk()
+
+        self.preload_stats["steps"] += 1
+        self.preload_stats["actions"] += len(actions)
+        self.preload_stats["failed"] += num_failed
+        self._log_throughput("Step %s" % step, start_time, len(actions), num_res, num_assoc, num_failed)
+
+    def _log_throughput(self, name, start_time, num_actions, num_res=0, num_assoc=0, num_failed=0):
+        duration = time.time() - start_time
+        log.info("%s: %s actions (%s failed), %s bulk resources, %s bulk associations in %.1f sec (%.1f actions/sec)",
+                 name, num_actions, num_failed, num_res, num_assoc, duration, num_actions / duration if duration else 0)
 
     def _execute_action(self, action):
         """Executes a preload action"""
@@ -157,10 +257,12 @@ class Preloader(object):
 
         log.debug("Found %s previously preloaded resources", len(res_objs))
 
-        res_assocs = self.rr.find_associations(predicate="*", id_only=False)
-        [self.resource_assocs.setdefault(assoc["p"], []).append(assoc) for assoc in res_assocs]
+        # Only associations of previously preloaded and system resources can be referenced.
+        # Associations of resources referenced by real id are indexed when these are resolved.
+        system_ids = [res_id for res_id in self.resource_ids.values() if re.match(UUID_RE, res_id)]
+        num_assocs = self._index_associations(res_ids + system_ids)
 
-        log.debug("Found %s existing associations", len(res_assocs))
+        log.debug("Found %s existing associations", num_assocs)
 
         existing_resources = dict(zip(res_preload_ids, res_objs))
 
@@ -169,9 +271,66 @@ class Preloader(object):
 
         res_id_mapping = dict(zip(res_preload_ids, res_ids))
         self.resource_ids.update(res_id_mapping)
+        self.resource_aliases.update(zip(res_ids, res_preload_ids))
         res_obj_mapping = dict(zip(res_preload_ids, res_objs))
         self.resource_objs.update(res_obj_mapping)
 
+    def _find_associations_mult(self, res_ids):
+        """Returns associations with any of the given resources as subject or object, in batches"""
+        assoc_by_id = {}
+        for i in xrange(0, len(res_ids), RESOLVE_BATCH_SIZE):
+            res_assocs = self.rr.find_associations(anyside=res_ids[i:i + RESOLVE_BATCH_SIZE], id_only=False)
+            assoc_by_id.update((assoc._id, assoc) for assoc in res_assocs)
+        return assoc_by_id.values()
+
+    def _index_associations(self, res_ids):
+        """
+        Indexes the existing associations of the given resources, unless already indexed.
+        Returns the number of newly indexed associations.
+        """
+        prev_indexed = set(self.assoc_indexed_ids)
+        new_ids = [res_id for res_id in set(res_ids) if res_id not in prev_indexed]
+        self.assoc_indexed_ids.update(new_ids)
+        num_assocs = 0
+        for assoc in self._find_associations_mult(new_ids):
+            # Associations with an already indexed resource were found before
+            if assoc.s not in prev_indexed and assoc.o not in prev_indexed:
+                self._add_existing_association(assoc)
+                num_assocs += 1
+        return num_assocs
+
+    def _add_existing_association(self, assoc):
+        self.resource_assocs.setdefault(assoc.p, []).append(assoc)
+        self.assoc_index.add((assoc.s, assoc.p, assoc.o))
+
+    def _resolve_references(self, actions):
+        """
+        Reads all resources referenced by real resource ID in the given actions with bulk reads,
+        so that they need not be read one at a time during action execution.
+        """
+        ref_ids = set()
+        for action in actions:
+            refs = [action.get(KEY_ID, None), action.get(KEY_OWNER, None)]
+            org_ids = action.get(KEY_ORGS, None)
+            if org_ids:
+                refs.extend(get_typed_value(org_ids, targettype="simplelist"))
+            for assoc in action.get("associations", None) or []:
+                refs.append(assoc.split(",")[1] if assoc.count(",") == 2 else None)
+            ref_ids.update(ref for ref in refs if isinstance(ref, basestring) and ref not in self.resource_ids
+                           and re.match(UUID_RE, ref))
+        ref_ids = list(ref_ids)
+        found_ids = []
+        for i in xrange(0, len(ref_ids), RESOLVE_BATCH_SIZE):
+            res_objs = self.rr.read_mult(ref_ids[i:i + RESOLVE_BATCH_SIZE], strict=False)
+            for res_id, res_obj in zip(ref_ids[i:i + RESOLVE_BATCH_SIZE], res_objs):
+                if res_obj is not None:
+                    self.resource_objs[res_id] = res_obj
+                    self.resource_ids[res_id] = res_id
+                    found_ids.append(res_id)
+        if ref_ids:
+            num_assocs = self._index_associations(found_ids)
+            log.debug("Resolved %s resources referenced by ID with %s existing associations", len(ref_ids), num_assocs)
+
     def create_object_from_cfg(self, cfg, objtype, key="resource", prefix="", existing_obj=None):
         """
         Construct an IonObject of a determined type from given config dict with attributes.
@@ -291,12 +450,14 @@ class Preloader(object):
             raise BadRequest("ID alias %s used twice" % alias)
         self.resource_ids[alias] = resid
         self.resource_objs[alias] = res_obj
+        self.resource_aliases[resid] = alias
         log.trace("Added resource alias=%s to id=%s", alias, resid)
 
     def _read_resource_id(self, res_id):
         existing_obj = self.rr.read(res_id)
         self.resource_objs[res_id] = existing_obj
         self.resource_ids[res_id] = res_id
+        self._index_associations([res_id])
         return existing_obj
 
     def _get_resource_id(self, alias_id):
@@ -317,11 +478,9 @@ class Preloader(object):
             return self.bulk_resources[res_id]
         elif res_id in self.resource_objs:
             return self.resource_objs[res_id]
-        else:
+        elif res_id in self.resource_aliases:
             # Real ID not alias - reverse lookup
-            alias_ids = [alias_id for alias_id,int_id in self.resource_ids.iteritems() if int_id==res_id]
-            if alias_ids:
-                return self.resource_objs[alias_ids[0]]
+            return self.resource_objs[self.resource_aliases[res_id]]
 
         if not silent:
             log.debug("_get_resource_obj(): No object found for '%s'", res_id)
@@ -335,10 +494,7 @@ class Preloader(object):
 
     def _has_association(self, sub, pred, obj):
         """Returns True if the described associated already exists."""
-        for assoc in self.resource_assocs.get(pred, []):
-            if assoc.s == sub and assoc.o == obj:
-                return True
-        return False
+        return (sub, pred, obj) in self.assoc_index
 
     def _update_resource_obj(self, res_id):
         """Updates an existing resource object"""
@@ -502,8 +658,12 @@ class Preloader(object):
             res_id = self.resource_ids[res_alias]
             other_res_id = self.resource_ids[other_id]
             if direction == "TO":
+                if self._has_association(res_id, predicate, other_res_id):
+                    continue
                 self._create_association(res_id, predicate, other_res_id, support_bulk=support_bulk)
             elif direction == "FROM":
+                if self._has_association(other_res_id, predicate, res_id):
+                    continue
                 self._create_association(other_res_id, predicate, res_id, support_bulk=support_bulk)
 
     def _create_association(self, subject=None, predicate=None, obj=None, support_bulk=False):
@@ -536,28 +696,45 @@ class Preloader(object):
                 ts=get_ion_ts())
             assoc_obj._id = assoc_id
             self.bulk_associations[assoc_id] = assoc_obj
+            self.assoc_index.add((subject_id, predicate, object_id))
             return assoc_id, '1-norev'
         else:
             return self.rr.create_association(subject, predicate, obj)
 
     def commit_bulk(self):
+        """
+        Stores all bulk resources and associations in batches. Returns the number of resources and
+        associations stored.
+        """
         if not self.bulk_resources and not self.bulk_associations:
-            return
+            return 0, 0
+
+        # Take over the current bulk objects, so that concurrent steps can continue to add objects
+        bulk_resources, bulk_associations, bulk_existing = self.bulk_resources, self.bulk_associations, self.bulk_existing
+        self.bulk_resources, self.bulk_associations, self.bulk_existing = {}, {}, set()
+        start_time = time.time()
+        batch_size = self.bulk_batch_size
 
         # Perform the create for resources
-        res_new = [obj for obj in self.bulk_resources.values() if obj["_id"] not in self.bulk_existing]
-        res = self.rr.rr_store.create_mult(res_new, allow_ids=True)
+        res_new = [obj for obj in bulk_resources.values() if obj["_id"] not in bulk_existing]
+        for i in xrange(0, len(res_new), batch_size):
+            self.rr.rr_store.create_mult(res_new[i:i + batch_size], allow_ids=True)
 
         # Perform the update for resources
-        res_upd = [obj for obj in self.bulk_resources.values() if obj["_id"] in self.bulk_existing]
-        res = self.rr.rr_store.update_mult(res_upd)
+        res_upd = [obj for obj in bulk_resources.values() if obj["_id"] in bulk_existing]
+        for i in xrange(0, len(res_upd), batch_size):
+            self.rr.rr_store.update_mult(res_upd[i:i + batch_size])
 
         # Perform the create for associations
-        assoc_new = [obj for obj in self.bulk_associations.values()]
-        res = self.rr.rr_store.create_mult(assoc_new, allow_ids=True)
-
-        log.info("Bulk stored {} resource objects ({} updates) and {} associations".format(len(res_new), len(res_upd), len(assoc_new)))
-
-        self.bulk_resources.clear()
-        self.bulk_associations.clear()
-        self.bulk_existing.clear()
+        assoc_new = bulk_associations.values()
+        for i in xrange(0, len(assoc_new), batch_size):
+            self.rr.rr_store.create_mult(assoc_new[i:i + batch_size], allow_ids=True)
+
+        duration = time.time() - start_time
+        num_objects = len(res_new) + len(res_upd) + len(assoc_new)
+        log.info("Bulk stored {} resource objects ({} updates) and {} associations in {:.1f} sec ({:.0f} objects/sec)".format(
+                 len(res_new), len(res_upd), len(assoc_new), duration, num_objects / duration if duration else 0))
+
+        self.preload_stats["resources"] += len(res_new) + len(res_upd)
+        self.preload_stats["associations"] += len(assoc_new)
+        return len(res_new) + len(res_upd), len(assoc_new)
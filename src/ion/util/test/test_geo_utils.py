@@ -170,4 +170,16 @@ class TestGeoUtils(PyonTestCase):
         geospatial_bounds.geospatial_longitude_limit_east = 0
         geospatial_bounds.geospatial_longitude_limit_west = -10
         with self.assertRaises(BadRequest):
-            GeoUtils.calc_geospatial_point_center(geospatial_bounds)
\ No newline at end of file
+            GeoUtils.calc_geospatial_point_center(geospatial_bounds)
+
+    def test_parse_aggregates(self):
+        self.assertEquals(GeoUtils.parse_extent("BOX(-10 -5.5,10 5)"),
+                          dict(lat_north=5.0, lat_south=-5.5, lon_east=10.0, lon_west=-10.0))
+        self.assertEquals(GeoUtils.parse_extent(None), {})
+
+        self.assertEquals(GeoUtils.parse_range("[0,100.5]"), (0.0, 100.5))
+        self.assertEquals(GeoUtils.parse_range("(,)"), (None, None))
+        self.assertEquals(GeoUtils.parse_range("empty"), (None, None))
+
+        self.assertEquals(GeoUtils.parse_point("POINT(-72 40.5)"), (40.5, -72.0))
+        self.assertEquals(GeoUtils.parse_point(None), (None, None))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import gevent
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.public import BadRequest
+from pyon.util.containers import DotDict
+from pyon.util.unit_test import UnitTestCase
+
+from ion.util.preload import Preloader
+
+
+@attr('UNIT')
+class TestPreloader(UnitTestCase):
+
+    def setUp(self):
+        self.preloader = Preloader()
+        self.preloader.preload_cfg = dict(bulk=True)
+        self.preloader._init_preload()
+        self.preloader.rr = Mock()
+        self.preloader.bulk = True
+        self.preloader.bulk_batch_size = 2
+        self.preloader.parallel_steps = 3
+
+    def test_parallel_steps(self):
+        step_cfgs = dict(orgs=dict(preload_type="actions", actions=[]),
+                         users=dict(preload_type="actions", actions=[], requires="orgs"),
+                         sites=dict(preload_type="actions", actions=[]),
+                         devices=dict(preload_type="actions", actions=[], requires="users,sites"))
+        self.preloader._read_preload_file = lambda filename, safe_load=False: step_cfgs[filename.split("/")[-1][:-4]]
+
+        events = []
+
+        def execute_step(step, filename, skip_steps, step_cfg=None):
+            events.append(("start", step))
+            gevent.sleep(0.01)
+            events.append(("end", step))
+        self.preloader._execute_step = execute_step
+
+        self.preloader._execute_steps_parallel(["devices", "users", "orgs", "sites"], "/preload", [])
+        started = [step for ev, step in events if ev == "start"]
+        self.assertEquals(set(started[:2]), {"orgs", "sites"})
+        self.assertLess(events.index(("end", "orgs")), events.index(("start", "users")))
+        self.assertEquals(events[-1], ("end", "devices"))
+
+        step_cfgs["orgs"]["requires"] = "devices"
+        with self.assertRaises(BadRequest):
+            self.preloader._execute_steps_parallel(["devices", "users", "orgs", "sites"], "/preload", [])
+
+    def test_commit_bulk(self):
+        res_objs = [dict(_id="res%s" % i) for i in xrange(5)]
+        for res_obj in res_objs:
+            self.preloader.bulk_resources[res_obj["_id"]] = res_obj
+        self.preloader.bulk_existing.add("res4")
+        self.preloader.bulk_associations.update(("assoc%s" % i, dict(_id="assoc%s" % i)) for i in xrange(3))
+
+        self.assertEquals(self.preloader.commit_bulk(), (5, 3))
+        rr_store = self.preloader.rr.rr_store
+        self.assertEquals(rr_store.create_mult.call_count, 4)
+        self.assertEquals(rr_store.update_mult.call_count, 1)
+        self.assertFalse(self.preloader.bulk_resources)
+        self.assertEquals(self.preloader.preload_stats["resources"], 5)
+        self.assertEquals(self.preloader.commit_bulk(), (0, 0))
+
+    def test_lookups(self):
+        self.preloader._register_id("ORG1", "org_id1", DotDict(_id="org_id1", type_="Org"))
+        self.assertIs(self.preloader._get_resource_obj("org_id1"), self.preloader.resource_objs["ORG1"])
+        self.assertTrue(self.preloader._resource_exists("ORG1"))
+        self.assertFalse(self.preloader._resource_exists("org_id2"))
+
+        self.preloader._create_association(DotDict(_id="s1", type_="Org"), "hasResource",
+                                           DotDict(_id="o1", type_="Site"), support_bulk=True)
+        self.assertTrue(self.preloader._has_association("s1", "hasResource", "o1"))
+        self.assertFalse(self.preloader._has_association("o1", "hasResource", "s1"))
+
+        res_id = "a" * 32
+        self.preloader.rr.read_mult.return_value = [DotDict(_id=res_id, type_="ActorIdentity")]
+        self.preloader.rr.find_associations.return_value = []
+        self.preloader._resolve_references([dict(action="resource:create", id="SITE1", owner=res_id,
+                                                 associations=["TO,%s,hasSite" % res_id])])
+        self.preloader.rr.read_mult.assert_called_once_with([res_id], strict=False)
+        self.assertEquals(self.preloader._get_resource_id(res_id), res_id)
+
+    def test_incremental_associations(self):
+        org_id, actor_id, site_id, ref_id = "a" * 32, "b" * 32, "c" * 32, "d" * 32
+        self.preloader._register_id("ORG_ION", org_id, DotDict(_id=org_id, type_="Org"))
+        existing_assocs = [DotDict(_id="as1", s=org_id, p="hasResource", o=site_id),
+                           DotDict(_id="as2", s=site_id, p="hasSite", o=ref_id),
+                           DotDict(_id="as3", s=ref_id, p="hasOwner", o=actor_id)]
+
+        def find_associations(anyside=None, id_only=False):
+            return [assoc for assoc in existing_assocs if assoc.s in anyside or assoc.o in anyside]
+        rr = self.preloader.rr
+        rr.find_resources_ext.return_value = ([DotDict(_id=site_id, type_="Site")], [dict(alt_id="SITE1")])
+        rr.find_associations.side_effect = find_associations
+        rr.read_mult.return_value = [DotDict(_id=ref_id, type_="Site")]
+
+        # Re-run of a sheet: associations with system and real id referenced resources exist already
+        cfg = dict(action="resource:create", id="SITE1", associations=["FROM,ORG_ION,hasResource",
+                                                                       "TO,%s,hasSite" % ref_id])
+        self.preloader._prepare_incremental()
+        self.preloader._resolve_references([cfg])
+        self.assertEquals(len(self.preloader.resource_assocs["hasResource"]), 1)
+        self.assertEquals(len(self.preloader.resource_assocs["hasSite"]), 1)
+        self.assertTrue(self.preloader._has_association(ref_id, "hasOwner", actor_id))
+
+        self.preloader.basic_associations_create(cfg, "SITE1", support_bulk=True)
+        self.assertEquals(self.preloader.commit_bulk(), (0, 0))
+
+        cfg["associations"].append("FROM,%s,hasSite" % ref_id)
+        self.preloader.basic_associations_create(cfg, "SITE1", support_bulk=True)
+        self.assertEquals(len(self.preloader.bulk_associations), 1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import gzip
+import resource
+import sys
+import time
+from StringIO import StringIO
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import UnitTestCase
+
+from ion.util.ui_utils import json_dumps, json_loads, json_iterencode, gzip_iterencode, get_json_item_count, np
+
+
+class _TestObject(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+@attr('UNIT')
+class TestJsonStreaming(UnitTestCase):
+
+    def test_iterencode(self):
+        value = dict(result=[dict(name="obj%s" % i, attrs=dict(idx=i, tags=["a", u"b\u20ac"]), valid=True)
+                             for i in xrange(500)] + [_TestObject(name="ion", value=1.5)],
+                     status=200, keys={1: None, None: "x"})
+        chunks = list(json_iterencode(value, chunk_size=1000))
+        self.assertGreater(len(chunks), 10)
+        self.assertEquals(json_loads("".join(chunks)), json_loads(json_dumps(value, default=lambda o: o.__dict__)))
+
+        gz_data = "".join(gzip_iterencode(chunks))
+        self.assertEquals(gzip.GzipFile(fileobj=StringIO(gz_data)).read(), "".join(chunks))
+
+        self.assertEquals(get_json_item_count(value), 2 + 3 + 501 + 500 * 3)
+
+    def test_iterencode_numpy(self):
+        if np is None:
+            raise self.SkipTest("numpy not available")
+        value = dict(time=np.arange(25000, dtype="i8"), var1=np.linspace(0, 1, 5), scalar=np.float64(2.5))
+        result = json_loads("".join(json_iterencode(value)))
+        self.assertEquals(result["time"], range(25000))
+        self.assertEquals(result["var1"], [0.0, 0.25, 0.5, 0.75, 1.0])
+        self.assertEquals(result["scalar"], 2.5)
+        self.assertEquals(get_json_item_count(value), 3 + 25005)
+
+
+@attr('PFM')
+class TestJsonStreamingSpeed(UnitTestCase):
+
+    def test_stream_response_memory(self):
+        # About 100 MB of compact encoded JSON
+        result = dict(result=[dict(_id="%032x" % i, name="Resource %s" % i, description="x" * 400,
+                                   attrs=dict(idx=i, values=range(20))) for i in xrange(200000)], status=200)
+        print >>sys.stderr, ""
+
+        def max_rss_mb():
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+        # Streaming first, because peak RSS can only increase
+        base_rss = max_rss_mb()
+        start_time = time.time()
+        first_byte, total_len = None, 0
+        for chunk in gzip_iterencode(json_iterencode(result)):
+            if first_byte is None and chunk:
+                first_byte = time.time() - start_time
+            total_len += len(chunk)
+        print >>sys.stderr, "Streamed gzip: TTFB %.4f s, total %.2f s, %s bytes, peak RSS +%.1f MB" % (
+            first_byte, time.time() - start_time, total_len, max_rss_mb() - base_rss)
+
+        start_time = time.time()
+        for chunk in json_iterencode(result):
+            if chunk:
+                break
+        print >>sys.stderr, "Streamed: TTFB %.4f s" % (time.time() - start_time)
+
+        base_rss = max_rss_mb()
+        start_time = time.time()
+        resp_str = json_dumps(result, indent=2)
+        print >>sys.stderr, "Full encode: TTFB %.2f s, %s bytes, peak RSS +%.1f MB" % (
+            time.time() - start_time, len(resp_str), max_rss_mb() - base_rss)
@@ -10,6 +10,12 @@ from flask import request, jsonify
 import sys
 import json
 import simplejson
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from pyon.public import BadRequest, OT, get_ion_ts_millis
 from pyon.util.containers import get_datetime
@@ -43,6 +49,114 @@ def encode_ion_object(obj):
     return obj.__dict__
 
 
+# Container nesting depth up to which streaming JSON encoding walks values incrementally
+STREAM_ENCODE_DEPTH = 3
+# Number of array elements encoded at once in streaming JSON encoding
+STREAM_ARRAY_SLICE = 10000
+
+
+def encode_stream_value(obj):
+    """ Default encoder function for streaming JSON encoding, passing through NumPy values """
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        elif isinstance(obj, np.generic):
+            return obj.item()
+    return encode_ion_object(obj)
+
+
+def json_iterencode(obj, chunk_size=65536, default=encode_stream_value):
+    """
+    Generator that encodes obj as JSON in chunks of about chunk_size bytes. Containers (dicts,
+    lists, ION objects) are walked incrementally up to a nesting depth, such that the full
+    encoded string is never held in memory. Deeper values are encoded with the standard encoder.
+    NumPy arrays are encoded as lists in slices.
+    """
+    buf, buf_len = [], 0
+    for frag in _iterencode_value(obj, default, 0):
+        buf.append(frag)
+        buf_len += len(frag)
+        if buf_len >= chunk_size:
+            yield "".join(buf)
+            buf, buf_len = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def _iterencode_value(value, default, depth):
+    if depth >= STREAM_ENCODE_DEPTH:
+        yield json_dumps(value, default=default)
+    elif isinstance(value, dict):
+        yield "{"
+        first = True
+        for key, item in value.iteritems():
+            if first:
+                first = False
+            else:
+                yield ", "
+            yield _encode_key(key)
+            yield ": "
+            for frag in _iterencode_value(item, default, depth + 1):
+                yield frag
+        yield "}"
+    elif isinstance(value, (list, tuple)):
+        yield "["
+        for i, item in enumerate(value):
+            if i:
+                yield ", "
+            for frag in _iterencode_value(item, default, depth + 1):
+                yield frag
+        yield "]"
+    elif np is not None and isinstance(value, np.ndarray) and value.ndim > 0:
+        yield "["
+        for i in xrange(0, len(value), STREAM_ARRAY_SLICE):
+            if i:
+                yield ", "
+            yield json_dumps(value[i:i + STREAM_ARRAY_SLICE].tolist())[1:-1]
+        yield "]"
+    elif isinstance(value, (basestring, int, long, float, bool)) or value is None:
+        yield json_dumps(value)
+    else:
+        for frag in _iterencode_value(default(value), default, depth):
+            yield frag
+
+
+def _encode_key(key):
+    if isinstance(key, basestring):
+        return json_dumps(key)
+    # Same coercion of non-string keys as the standard encoder
+    return json_dumps(json_dumps(key) if isinstance(key, (bool, type(None))) else unicode(key))
+
+
+def gzip_iterencode(chunks, level=6):
+    """ Generator that gzip compresses a sequence of str chunks """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode("utf8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def get_json_item_count(obj, max_depth=3):
+    """ Returns the number of list/dict items and array elements in the top levels of obj,
+    as an inexpensive estimate of its encoded size """
+    if np is not None and isinstance(obj, np.ndarray):
+        return obj.size
+    if isinstance(obj, dict):
+        values = obj.itervalues()
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    else:
+        return 0
+    count = len(obj)
+    if max_depth > 1:
+        count += sum(get_json_item_count(value, max_depth - 1) for value in values)
+    return count
+
+
 # -------------------------------------------------------------------------
 # UI helpers
 
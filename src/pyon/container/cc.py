@@ -548,4 +548,29 @@ class ContainerHeartbeater(object):
     def get_heartbeat_message(self):
         from interface.objects import ContainerHeartbeat
         hb_msg = ContainerHeartbeat(container_id=self.container.id, ts=get_ion_ts())
+        if self.heartbeat_cfg.get("include_load", True):
+            hb_msg.attributes["proc_load"] = self.get_process_load()
+        stats_mgr = getattr(self.container, "stats_mgr", None)
+        if self.heartbeat_cfg.get("include_metrics", True) and stats_mgr and stats_mgr.metrics_enabled:
+            try:
+                hb_msg.attributes["metrics"] = stats_mgr.get_metrics_summary()
+            except Exception:
+                log.warn("Could not get container metrics summary", exc_info=True)
         return hb_msg
+
+    def get_process_load(self):
+        """ Returns a dict of process id to load stats for all processes with an ION process thread """
+        queue_stats = self.heartbeat_cfg.get("queue_stats", False) is True
+        proc_load = {}
+        for proc_id, proc in self.container.proc_manager.procs.items():
+            ion_proc = getattr(proc, "_process", None)
+            if ion_proc is None or not hasattr(ion_proc, "get_load_stats"):
+                continue
+            try:
+                load_stats = ion_proc.get_load_stats(queue_stats=queue_stats)
+                load_stats["proc_name"] = proc._proc_name
+                load_stats["service_name"] = getattr(proc, "name", "") or ""
+                proc_load[proc_id] = load_stats
+            except Exception:
+                log.warn("Could not get load stats for process %s", proc_id, exc_info=True)
+        return proc_load
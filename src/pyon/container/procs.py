@@ -783,13 +783,12 @@ class ProcManager(object):
         """
         # Only applies if the process implements stateful interface
         if hasattr(process_instance, "_flush_state"):
-            def _flush_state():
-                with process_instance._state_lock:
-                    state_obj = process_instance.container.state_repository.put_state(process_instance.id, process_instance._proc_state,
-                                                                                      state_obj=process_instance._proc_state_obj)
-                    state_obj.state = None   # Make sure memory footprint is low for larger states
-                    process_instance._proc_state_obj = state_obj
-                    process_instance._proc_state_changed = False
+            def _flush_state(sync=True):
+                # Changes are coalesced by the state repository and written according to its durability mode
+                state_repository = process_instance.container.state_repository
+                state_repository.mark_dirty(process_instance)
+                if sync:
+                    state_repository.flush_dirty([process_instance.id])
 
             def _load_state():
                 if not hasattr(process_instance, "_proc_state"):
@@ -859,6 +858,13 @@ class ProcManager(object):
             process_instance._process.notify_stop()
             process_instance._process.stop()
 
+        # Write any pending process state not yet persisted due to the durability mode
+        if hasattr(process_instance, "_state_lock"):
+            try:
+                process_instance.container.state_repository.release_process(process_instance.id)
+            except Exception:
+                log.exception("Process %s persist state on quit failed", process_instance.id)
+
     def _set_publisher_endpoints(self, process_instance, publisher_streams=None):
         """ Creates and attaches named stream publishers
         """
@@ -4,7 +4,10 @@ __author__ = 'Michael Meisinger'
 
 from pyon.core.bootstrap import CFG
 from pyon.core.exception import ContainerConfigError
+from pyon.util.cache import get_cache_stats
 from pyon.util.log import log
+from pyon.util.metrics import MetricsRegistry, LATENCY_BUCKETS, SIZE_BUCKETS, COUNT_BUCKETS
+from pyon.util.span_tracer import SpanTracer
 from pyon.util.tracer import CallTracer
 
 
@@ -16,23 +19,35 @@ class ContainerStatsManager(object):
 
     def __init__(self, container):
         self.container = container
-        self.stats_groups = ["PROC", "SVCREQ", "MSG", "DB"]
+        self.stats_groups = ["PROC", "SVCREQ", "MSG", "DB", "POLICY"]
+        self.metrics_cfg = CFG.get_safe("container.metrics", {}) or {}
+        self.metrics_enabled = self.metrics_cfg.get("enabled", True) is True
+        self.metrics = MetricsRegistry(prefix=self.metrics_cfg.get("prefix", "scion_"),
+                                       max_series=self.metrics_cfg.get("max_series", 1000))
 
     def start(self):
         if self._started:
             return
 
         self._clear_stats_groups()
+        if self.metrics_enabled:
+            self._define_metrics()
         self._activate_collection()
 
         # Install the container tracer
         self.container.tracer = CallTracer
         self.container.tracer.configure(CFG.get_safe("container.tracer", {}))
 
+        # Distributed request tracing
+        SpanTracer.configure(CFG.get_safe("container.span_tracing", {}),
+                             resource={"service.name": "scioncc", "container_id": self.container.id})
+        SpanTracer.start()
+
         self._started = True
 
     def stop(self):
         if self._started:
+            SpanTracer.stop()
             self._deactivate_collection()
             self._clear_stats_groups()
             self._started = False
@@ -60,7 +75,22 @@ class ContainerStatsManager(object):
         if group not in self._stats_callbacks:
             raise ContainerConfigError("Unknown stats group: %s" % group)
         cbs = self._stats_callbacks[group]
-        cbs.pop(cb_func, None)
+        if cb_func in cbs:
+            cbs.remove(cb_func)
+
+    def register_gateway(self, service_gateway):
+        """ Activates request stats for a service gateway started after the stats manager """
+        if self._started and not service_gateway.request_callback:
+            service_gateway.register_request_callback(self._sg_callback)
+
+    def get_metrics_exposition(self):
+        """ Returns container metrics in the Prometheus text exposition format """
+        return self.metrics.get_exposition()
+
+    def get_metrics_summary(self):
+        """ Returns a compact summary of container metrics. Histograms cover the interval
+        since the prior call (e.g. the prior container heartbeat). """
+        return self.metrics.get_summary()
 
     # -------------------------------------------------------------------------
 
@@ -86,12 +116,82 @@ class ContainerStatsManager(object):
         from pyon.ion.process import set_process_stats_callback
         set_process_stats_callback(self._proc_callback)
 
+        from pyon.core.governance.governance_controller import set_policy_stats_callback
+        set_policy_stats_callback(self._policy_callback)
+
+        from pyon.ion.state import set_state_stats_callback
+        set_state_stats_callback(self._state_callback)
+
+    def _define_metrics(self):
+        m = self.metrics
+        self._m_proc_op = m.histogram("process_op_seconds", "Process operation execution time",
+                                      ("svc", "op"), unit_scale=1000000, buckets=LATENCY_BUCKETS)
+        self._m_proc_db = m.histogram("process_op_db_statements", "DB statements per process operation",
+                                      ("svc", "op"), buckets=COUNT_BUCKETS)
+        self._m_msg_size = m.histogram("message_size_bytes", "Size of messages sent and received",
+                                       ("direction",), buckets=SIZE_BUCKETS)
+        self._m_db_stmt = m.histogram("db_statement_seconds", "DB statement execution time",
+                                      ("scope",), unit_scale=1000000, buckets=LATENCY_BUCKETS)
+        self._m_svcreq = m.histogram("gateway_request_seconds", "Service gateway request time",
+                                     ("req_type", "status"), unit_scale=1000000, buckets=LATENCY_BUCKETS)
+        self._m_policy = m.histogram("policy_eval_seconds", "Governance policy evaluation time for incoming messages",
+                                     ("outcome",), unit_scale=1000000, buckets=LATENCY_BUCKETS)
+        self._m_state_lag = m.histogram("state_flush_lag_seconds", "Time from process state change to persistence",
+                                        unit_scale=1000000, buckets=LATENCY_BUCKETS)
+        self._m_state_batch = m.histogram("state_flush_batch_size", "Process states written per batched flush",
+                                          buckets=COUNT_BUCKETS)
+        m.gauge("state_dirty_processes", "Processes with changed state not yet persisted",
+                func=self._get_state_dirty_count)
+        m.counter("cache_requests_total", "Cache lookups by outcome",
+                  ("cache", "result"), func=lambda: self._get_cache_values(("hits", "misses")))
+        m.counter("cache_removals_total", "Cache entries removed by cause",
+                  ("cache", "cause"), func=lambda: self._get_cache_values(("evictions", "expirations", "invalidations")))
+        m.gauge("cache_entries", "Entries in cache",
+                ("cache",), func=lambda: self._get_cache_values(("entries",)))
+        m.gauge("cache_bytes", "Size of cached values in bytes (for size limited caches)",
+                ("cache",), func=lambda: self._get_cache_values(("bytes",)))
+        m.gauge("process_queue_depth", "Calls waiting in process control queue",
+                ("proc_name",), func=lambda: self._get_process_load_values("queue_depth"))
+        m.gauge("process_active_calls", "Calls currently executing in process",
+                ("proc_name",), func=lambda: self._get_process_load_values("active"))
+        m.gauge("process_saturation", "Percentage of process busy time in the current stats interval",
+                ("proc_name",), func=lambda: self._get_process_load_values("saturation"))
+
+    def _get_process_load_values(self, load_key):
+        values = {}
+        for proc in self.container.proc_manager.procs.values():
+            ion_proc = getattr(proc, "_process", None)
+            if ion_proc is None or not hasattr(ion_proc, "get_load_stats"):
+                continue
+            values[(proc._proc_name,)] = ion_proc.get_load_stats()[load_key]
+        return values
+
+    def _get_cache_values(self, stat_names):
+        values = {}
+        for cache_name, cache_stats in get_cache_stats().iteritems():
+            for stat_name in stat_names:
+                labels = (cache_name, stat_name) if len(stat_names) > 1 else (cache_name,)
+                values[labels] = cache_stats[stat_name]
+        return values
+
+    def _get_state_dirty_count(self):
+        state_repository = getattr(self.container, "state_repository", None)
+        if state_repository is None or not hasattr(state_repository, "get_flush_stats"):
+            return {}
+        return state_repository.get_flush_stats()["dirty"]
+
     def _deactivate_collection(self):
         from ion.service.service_gateway import sg_instance
         if sg_instance:
             # This container may not run the service gateway
             sg_instance.register_request_callback(None)
 
+        from pyon.ion.state import set_state_stats_callback
+        set_state_stats_callback(None)
+
+        from pyon.core.governance.governance_controller import set_policy_stats_callback
+        set_policy_stats_callback(None)
+
         from pyon.ion.process import set_process_stats_callback
         set_process_stats_callback(None)
 
@@ -113,25 +213,51 @@ class ContainerStatsManager(object):
                 log.exception("Error in stats callback")
 
     def _sg_callback(self, action, req_info):
+        if action == "end" and self.metrics_enabled:
+            self._m_svcreq.observe(req_info["end_time"] - req_info["start_time"],
+                                   (req_info["req_type"], req_info.get("resp_status", "")))
         self._call_callbacks("SVCREQ", action, req_info)
 
     def _proc_callback(self, **kwargs):
+        if self.metrics_enabled:
+            labels = (kwargs["svc"], kwargs["op"])
+            if kwargs.get("op_time", None) is not None:
+                self._m_proc_op.observe(kwargs["op_time"], labels)
+            self._m_proc_db.observe((kwargs["db_stats"] or {}).get("count.all", 0), labels)
         self._call_callbacks("PROC", "op_complete", kwargs)
 
+    def _policy_callback(self, invocation, policy_time, rejected):
+        if self.metrics_enabled:
+            self._m_policy.observe(policy_time, ("reject" if rejected else "permit",))
+        if self._stats_callbacks["POLICY"]:
+            self._call_callbacks("POLICY", "incoming", dict(invocation=invocation, policy_time=policy_time,
+                                                            rejected=rejected))
+
+    def _state_callback(self, num_dirty, num_written, flush_lag, flush_time):
+        if self.metrics_enabled:
+            self._m_state_lag.observe(flush_lag)
+            self._m_state_batch.observe(num_written)
+
     def _msg_in_callback(self, msg, headers, env):
         log_entry = dict(status="RECV %s bytes" % len(msg), headers=headers, env=env,
                          content_length=len(msg), content=str(msg)[:self.SAVE_MSG_MAX])
         CallTracer.log_scope_call("MSG.in", log_entry, include_stack=False)
+        if self.metrics_enabled:
+            self._m_msg_size.observe(len(msg), ("in",))
         self._call_callbacks("MSG", "in", log_entry)
 
     def _msg_out_callback(self, msg, headers, env):
         log_entry = dict(status="SENT %s bytes" % len(msg), headers=headers, env=env,
                          content_length=len(msg), content=str(msg)[:self.SAVE_MSG_MAX])
         CallTracer.log_scope_call("MSG.out", log_entry, include_stack=False)
+        if self.metrics_enabled:
+            self._m_msg_size.observe(len(msg), ("out",))
         self._call_callbacks("MSG", "out", log_entry)
 
     def _db_callback(self, scope, log_entry):
         CallTracer.log_scope_call(scope, log_entry, include_stack=True)
+        if self.metrics_enabled and "statement_time" in log_entry:
+            self._m_db_stmt.observe(log_entry["statement_time"], (scope,))
         self._call_callbacks("DB", scope, log_entry)
 
     @staticmethod
@@ -16,6 +16,10 @@ MSG_HEADER_TOKENS = "ion-actor-tokens"
 MSG_HEADER_RESOURCE_ID = "resource-id"
 MSG_HEADER_USER_CONTEXT_ID = "user-context-id"
 
+MSG_HEADER_TRACE = "trace-id"
+MSG_HEADER_SPAN = "span-id"
+MSG_HEADER_SAMPLED = "trace-sampled"
+
 
 # Process related constants
 
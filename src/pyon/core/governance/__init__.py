@@ -8,7 +8,8 @@ from pyon.core import (bootstrap, MSG_HEADER_ACTOR, MSG_HEADER_ROLES, MSG_HEADER
                        MSG_HEADER_VALID, MSG_HEADER_USER_CONTEXT_ID)
 from pyon.core.bootstrap import IonObject
 from pyon.core.exception import BadRequest, Inconsistent
-from pyon.ion.resource import RT, PRED, OT
+from pyon.datastore.datastore_query import DQ
+from pyon.ion.resource import RT, PRED, OT, LCS
 from pyon.util.containers import get_safe, get_ion_ts_millis
 from pyon.util.log import log
 
@@ -103,7 +104,7 @@ def find_roles_by_actor(actor_id=None):
     role_dict = dict()
 
     gov_controller = bootstrap.container_instance.governance_controller
-    role_list, _ = gov_controller.rr.find_objects(actor_id, PRED.hasRole, RT.UserRole)
+    role_list = gov_controller.get_actor_roles(actor_id)
 
     for role in role_list:
         if role.org_governance_name not in role_dict:
@@ -170,6 +171,53 @@ def get_system_actor_header(system_actor=None):
         return get_actor_header(None)
 
 
+def is_valid_commitment(commitment, cur_time=None):
+    """
+    Returns True if the given Commitment object has not expired
+    """
+    expiration = int(commitment.expiration or 0)
+    return expiration == 0 or (cur_time or get_ion_ts_millis()) < expiration
+
+
+def get_commitment_filter(rq, resource_id=None, principal_id=None, consumer_id=None, exclusive=None,
+                          include_expired=False):
+    """
+    Returns a filter expression for the given ResourceQuery matching Commitment resources, such that the
+    datastore can evaluate commitment checks with indexes. The principal is an Org or actor with
+    hasCommitment association. If exclusive is True or False, only exclusive resp. non-exclusive
+    commitments match. The filter can be used as association target filter.
+    """
+    filters = [rq.filter_type(RT.Commitment), rq.neq(DQ.RA_LCSTATE, LCS.DELETED)]
+    if resource_id:
+        filters.append(rq.filter_associated_from_object(resource_id, predicate=PRED.hasTarget))
+    if principal_id:
+        filters.append(rq.filter_associated_from_subject(principal_id, predicate=PRED.hasCommitment))
+    if consumer_id:
+        filters.append(rq.filter_attribute("consumer", consumer_id))
+    if exclusive is not None:
+        exclusive_filter = rq.and_(rq.filter_attribute("commitment.type_", OT.ResourceCommitment),
+                                   rq.filter_attribute("commitment.exclusive", True))
+        filters.append(exclusive_filter if exclusive else rq.not_(exclusive_filter))
+    if not include_expired:
+        # Expirations are millisecond timestamp strings of equal length and compare as strings
+        filters.append(rq.or_(rq.filter_attribute("expiration", "0"),
+                              rq.gt("expiration", str(get_ion_ts_millis()))))
+    return rq.and_(*filters)
+
+
+def get_commitment_query(resource_id=None, principal_id=None, consumer_id=None, exclusive=None,
+                         include_expired=False):
+    """
+    Returns a ResourceQuery for Commitment resources, see get_commitment_filter.
+    """
+    from pyon.ion.resregistry import ResourceQuery
+    rq = ResourceQuery()
+    rq.set_filter(get_commitment_filter(rq, resource_id=resource_id, principal_id=principal_id,
+                                        consumer_id=consumer_id, exclusive=exclusive,
+                                        include_expired=include_expired))
+    return rq
+
+
 def get_valid_principal_commitments(principal_id=None, consumer_id=None):
     """
     Returns the list of valid commitments for the specified principal (org or actor.
@@ -181,13 +229,8 @@ def get_valid_principal_commitments(principal_id=None, consumer_id=None):
 
     try:
         gov_controller = bootstrap.container_instance.governance_controller
-        commitments, _ = gov_controller.rr.find_objects(principal_id, PRED.hasCommitment, RT.Commitment, id_only=False)
-        if not commitments:
-            return None
-
-        cur_time = get_ion_ts_millis()
-        commitment_list = [com for com in commitments if (consumer_id == None or com.consumer == consumer_id) and \
-                    (int(com.expiration) == 0 or (int(com.expiration) > 0 and cur_time < int(com.expiration)))]
+        commitments = gov_controller.get_principal_commitments(principal_id)
+        commitment_list = [com for com in commitments if consumer_id is None or com.consumer == consumer_id]
         if commitment_list:
             return commitment_list
 
@@ -208,13 +251,8 @@ def get_valid_resource_commitments(resource_id=None, actor_id=None):
 
     try:
         gov_controller = bootstrap.container_instance.governance_controller
-        commitments, _ = gov_controller.rr.find_subjects(RT.Commitment, PRED.hasTarget, resource_id, id_only=False)
-        if not commitments:
-            return None
-
-        cur_time = get_ion_ts_millis()
-        commitment_list = [com for com in commitments if (actor_id == None or com.consumer == actor_id) and \
-                    (int(com.expiration) == 0 or (int(com.expiration) > 0 and cur_time < int(com.expiration)))]
+        commitments = gov_controller.get_resource_commitments(resource_id)
+        commitment_list = [com for com in commitments if actor_id is None or com.consumer == actor_id]
         if commitment_list:
             return commitment_list
 
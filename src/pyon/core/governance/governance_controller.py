@@ -4,24 +4,32 @@
 
 __author__ = 'Stephen P. Henrie, Michael Meisinger'
 
+import time
 import types
 
 from pyon.core import PROCTYPE_AGENT, PROCTYPE_SERVICE
 from pyon.core.bootstrap import CFG, get_service_registry, is_testing
 from pyon.core.exception import NotFound, Unauthorized
-from pyon.core.governance import get_system_actor_header, get_system_actor
+from pyon.core.governance import get_system_actor_header, get_system_actor, get_commitment_query, is_valid_commitment
 from pyon.core.governance.governance_dispatcher import GovernanceDispatcher
+from pyon.core.governance.policy.policy_bundle import PolicyBundleCache, POLICY_SCOPE_COMMON, POLICY_SCOPE_SERVICE, \
+    POLICY_SCOPE_RESOURCE, create_policy_bundle, get_bundle_policies, get_policy_scope, is_newer_bundle, \
+    parse_policy_scope
 from pyon.core.governance.policy.policy_decision import PolicyDecisionPointManager
 from pyon.core.interceptor.interceptor import Invocation
 from pyon.ion.event import EventSubscriber
-from pyon.ion.resource import RT, OT
-from pyon.util.containers import get_ion_ts, named_any
+from pyon.ion.resource import RT, PRED, OT
+from pyon.util.cache import BoundedCache
+from pyon.util.containers import get_ion_ts, get_ion_ts_millis, named_any
 from pyon.util.log import log
+from pyon.util.span_tracer import SpanTracer, SPAN_KIND_INTERNAL
 
 from interface.objects import PolicyTypeEnum
 from interface.services.core.ipolicy_management_service import PolicyManagementServiceProcessClient
 from interface.services.core.iresource_registry_service import ResourceRegistryServiceProcessClient
 
+stats_callback = None
+
 
 class GovernanceController(object):
     """
@@ -51,6 +59,16 @@ class GovernanceController(object):
         self._policy_update_log = []
         self._policy_snapshot = None
 
+        # Policy bundles applied to this container by scope, and bundles kept for later use (not applied)
+        self._policy_bundles = {}
+        self._cached_bundles = {}
+        self._bundle_cache = None
+        self.policy_stats = dict(policy_reads=0, bundles_applied=0, bundles_current=0, bundles_saved=0)
+
+        # Caches for actor roles and commitments used in governance checks, invalidated by Org events
+        self._role_cache = None
+        self._commitment_cache = None
+
     def start(self):
         log.debug("GovernanceController starting ...")
         self._CFG = CFG
@@ -78,9 +96,19 @@ class GovernanceController(object):
             config = CFG.get_safe('interceptor.interceptors.governance.config')
             self.initialize_from_config(config)
 
+            bundle_cache_dir = CFG.get_safe('container.policy.bundle_cache_dir', "")
+            if bundle_cache_dir:
+                self._bundle_cache = PolicyBundleCache(bundle_cache_dir,
+                                                       CFG.get_safe('container.policy.bundle_cache_max_age', 0))
+                self._load_cached_policy_bundles()
+
             self.policy_event_subscriber = EventSubscriber(event_type=OT.PolicyEvent, callback=self.policy_event_callback)
             self.policy_event_subscriber.start()
 
+            if CFG.get_safe('container.policy.governance_cache', True):
+                self._start_governance_caches(CFG.get_safe('container.policy.governance_cache_size', 10000),
+                                              CFG.get_safe('container.policy.governance_cache_ttl', 300))
+
             self._policy_snapshot = self._get_policy_snapshot()
             self._log_policy_update("start_governance_ctrl", message="Container start")
 
@@ -110,6 +138,11 @@ class GovernanceController(object):
         if self.policy_event_subscriber is not None:
             self.policy_event_subscriber.stop()
 
+        for cache in (self._role_cache, self._commitment_cache):
+            if cache is not None:
+                cache.close()
+        self._role_cache = self._commitment_cache = None
+
     @property
     def is_container_org_boundary(self):
         return self._is_container_org_boundary
@@ -140,6 +173,63 @@ class GovernanceController(object):
         return self.rr_client
 
 
+    # -------------------------------------------------------------------------
+    # Role and commitment lookups for governance checks
+
+    def _start_governance_caches(self, max_entries, ttl):
+        self._role_cache = BoundedCache("gov_actor_roles", max_entries=max_entries, ttl=ttl)
+        self._role_cache.add_invalidation_event(OT.UserRoleModifiedEvent, key_func=lambda evt: evt.actor_id or None)
+        self._role_cache.add_invalidation_event(OT.UserRoleCacheResetEvent)
+
+        self._commitment_cache = BoundedCache("gov_commitments", max_entries=max_entries, ttl=ttl)
+        for event_type in (OT.ResourceCommitmentCreatedEvent, OT.ResourceCommitmentReleasedEvent):
+            self._commitment_cache.add_invalidation_event(event_type, key_func=_get_commitment_event_keys)
+
+    def clear_governance_caches(self):
+        """Clears cached roles and commitments, e.g. after changes made without Org events
+        """
+        for cache in (self._role_cache, self._commitment_cache):
+            if cache is not None:
+                cache.clear()
+
+    def get_actor_roles(self, actor_id):
+        """Returns the list of UserRole objects assigned to an actor (in all Orgs)
+        """
+        if self._role_cache is None:
+            return self._load_actor_roles(actor_id)
+        return self._role_cache.get_or_load(actor_id, self._load_actor_roles)
+
+    def _load_actor_roles(self, actor_id):
+        role_list, _ = self.rr.find_objects(actor_id, PRED.hasRole, RT.UserRole, id_only=False)
+        return role_list
+
+    def get_resource_commitments(self, resource_id):
+        """Returns the list of unexpired Commitment objects for a resource
+        """
+        return self._get_commitments(("resource", resource_id))
+
+    def get_principal_commitments(self, principal_id):
+        """Returns the list of unexpired Commitment objects of a principal (Org or actor)
+        """
+        return self._get_commitments(("principal", principal_id))
+
+    def _get_commitments(self, key):
+        if self._commitment_cache is None:
+            com_objs = self._load_commitments(key)
+        else:
+            com_objs = self._commitment_cache.get_or_load(key, self._load_commitments)
+        # Cached commitments may have expired since
+        cur_time = get_ion_ts_millis()
+        return [com for com in com_objs if is_valid_commitment(com, cur_time)]
+
+    def _load_commitments(self, key):
+        scope, target_id = key
+        if scope == "resource":
+            rq = get_commitment_query(resource_id=target_id)
+        else:
+            rq = get_commitment_query(principal_id=target_id)
+        return self.rr.find_resources_ext(query=rq.get_query(), id_only=False)
+
     def get_container_org_boundary_id(self):
         """Returns the permanent org identifier configured for this container
         """
@@ -159,8 +249,26 @@ class GovernanceController(object):
     def process_incoming_message(self, invocation):
         """The GovernanceController hook into the incoming message interceptor stack
         """
-        self.process_message(invocation, self.interceptor_order, Invocation.PATH_IN)
-        return self.governance_dispatcher.handle_incoming_message(invocation)
+        if not stats_callback and not SpanTracer.enabled:
+            self.process_message(invocation, self.interceptor_order, Invocation.PATH_IN)
+            return self.governance_dispatcher.handle_incoming_message(invocation)
+
+        start_time = time.time()
+        rejected = True
+        try:
+            self.process_message(invocation, self.interceptor_order, Invocation.PATH_IN)
+            res = self.governance_dispatcher.handle_incoming_message(invocation)
+            rejected = False
+            return res
+        finally:
+            if stats_callback:
+                try:
+                    stats_callback(invocation, time.time() - start_time, rejected)
+                except Exception:
+                    log.exception("Error in policy stats callback")
+            if SpanTracer.enabled:
+                SpanTracer.record_child_span(invocation.headers, "policy", SPAN_KIND_INTERNAL, start_time,
+                                             attributes={"rejected": rejected})
 
     def process_outgoing_message(self, invocation):
         """The GovernanceController hook into the outgoing message interceptor stack
@@ -207,7 +315,8 @@ class GovernanceController(object):
                                 event=policy_event)
 
     def service_policy_event_callback(self, service_policy_event, *args, **kwargs):
-        """The ServicePolicyEvent handler
+        """The ServicePolicyEvent handler. If the event carries a policy bundle, it is applied
+        directly; otherwise the policy is read from the policy management service.
         """
         log.debug('Service policy event: %s', str(service_policy_event.__dict__))
 
@@ -215,13 +324,23 @@ class GovernanceController(object):
         service_name = service_policy_event.service_name
         service_op = service_policy_event.op
         delete_policy = True if service_policy_event.sub_type == 'DeletePolicy' else False
+        policy_bundle = getattr(service_policy_event, "policy_bundle", None)
 
         if service_name:
-            if self.container.proc_manager.is_local_service_process(service_name):
-                self.update_service_access_policy(service_name, service_op, delete_policy=delete_policy)
-            elif self.container.proc_manager.is_local_agent_process(service_name):
-                self.update_service_access_policy(service_name, service_op, delete_policy=delete_policy)
+            if self.container.proc_manager.is_local_service_process(service_name) or \
+                    self.container.proc_manager.is_local_agent_process(service_name):
+                if policy_bundle:
+                    self.apply_policy_bundle(policy_bundle)
+                else:
+                    self.update_service_access_policy(service_name, service_op, delete_policy=delete_policy)
+            elif policy_bundle:
+                # Keep for processes of this service started later (or after container restart)
+                self._cache_policy_bundle(policy_bundle)
+            else:
+                self._uncache_policy_bundle(get_policy_scope(POLICY_SCOPE_SERVICE, service_name))
 
+        elif policy_bundle:
+            self.apply_policy_bundle(policy_bundle)
         else:
             self.update_common_service_access_policy()
 
@@ -233,8 +352,12 @@ class GovernanceController(object):
         policy_id = resource_policy_event.origin
         resource_id = resource_policy_event.resource_id
         delete_policy = True if resource_policy_event.sub_type == 'DeletePolicy' else False
+        policy_bundle = getattr(resource_policy_event, "policy_bundle", None)
 
-        self.update_resource_access_policy(resource_id, delete_policy)
+        if policy_bundle:
+            self.apply_policy_bundle(policy_bundle)
+        else:
+            self.update_resource_access_policy(resource_id, delete_policy)
 
     def reset_policy_cache(self):
         """Empty and reload the container's policy caches.
@@ -258,6 +381,10 @@ class GovernanceController(object):
     def _clear_container_policy_caches(self):
         self.policy_decision_point_manager.clear_policy_cache()
         self.unregister_all_process_policy_preconditions()
+        self._policy_bundles.clear()
+        self._cached_bundles.clear()
+        if self._bundle_cache:
+            self._bundle_cache.clear()
 
     def update_process_policies(self, process_instance, safe_mode=False, force_update=True):
         """
@@ -307,51 +434,33 @@ class GovernanceController(object):
             rules = self.policy_client.get_active_service_access_policy_rules(
                     service_name='', org_name=self._container_org_name,
                     headers=self.system_actor_user_header)
-            self.policy_decision_point_manager.set_common_service_policy_rules(rules)
+            self.policy_stats["policy_reads"] += 1
+            self.apply_policy_bundle(create_policy_bundle(POLICY_SCOPE_COMMON, rules))
 
         except Exception as e:
             # If the resource does not exist, just ignore it - but log a warning.
             log.warn("There was an error applying access policy: %s" % e.message)
 
     def update_service_access_policy(self, service_name, service_op='', delete_policy=False, force_update=True):
-        """Update policy for a service"""
+        """Update policy for a service. Always reads all active policies of the service, so that
+        preconditions of changed or deleted policies are updated consistently"""
         if self.policy_decision_point_manager is None:
             return
-        if not force_update and not service_op and self.policy_decision_point_manager.has_service_policy(service_name):
-            log.info("Skipping update of service %s policy - already cached", service_name)
-            return
+        scope = get_policy_scope(POLICY_SCOPE_SERVICE, service_name)
+        if not force_update:
+            if self.policy_decision_point_manager.has_service_policy(service_name):
+                log.info("Skipping update of service %s policy - already cached", service_name)
+                return
+            if scope in self._cached_bundles:
+                self.apply_policy_bundle(self._cached_bundles[scope])
+                return
 
         try:
-            if service_op:
-                policies = self.policy_client.get_active_service_operation_preconditions(
-                        service_name=service_name, op=service_op, org_name=self._container_org_name,
-                        headers=self.system_actor_user_header)
-            else:
-                policies = self.policy_client.get_active_service_access_policy_rules(
-                        service_name=service_name, org_name=self._container_org_name,
-                        headers=self.system_actor_user_header)
-
-            # First update any access policy rules
-            svc_access_policy = [p for p in policies
-                                 if p.policy_type in (PolicyTypeEnum.COMMON_SERVICE_ACCESS, PolicyTypeEnum.SERVICE_ACCESS)]
-            self.policy_decision_point_manager.set_service_policy_rules(service_name, svc_access_policy)
-
-            # Next update any precondition policies
-            svc_preconditions = [p for p in policies
-                                 if p.policy_type == PolicyTypeEnum.SERVICE_OP_PRECOND]
-
-            # There can be several local processes for a service
-            procs = self.container.proc_manager.get_local_service_processes(service_name)
-            for proc in procs:
-                if svc_preconditions:
-                    for op_pre_policy in svc_preconditions:
-                        for pre_check in op_pre_policy.preconditions:
-                            self.unregister_process_operation_precondition(proc, op_pre_policy.op, pre_check)
-                            if not delete_policy:
-                                self.register_process_operation_precondition(proc, op_pre_policy.op, pre_check)
-                else:
-                    # Unregister all, just in case
-                    self.unregister_all_process_operation_precondition(proc, service_op)
+            policies = self.policy_client.get_active_service_access_policy_rules(
+                    service_name=service_name, org_name=self._container_org_name,
+                    headers=self.system_actor_user_header)
+            self.policy_stats["policy_reads"] += 1
+            self.apply_policy_bundle(create_policy_bundle(scope, policies))
 
         except Exception as ex:
             # If the resource does not exist, just ignore it - but log a warning.
@@ -361,18 +470,127 @@ class GovernanceController(object):
         """Update policy for a resource (such as a device fronted by an agent process)"""
         if self.policy_decision_point_manager is None:
             return
-        if self.policy_decision_point_manager.has_resource_policy(resource_id):
-            return
+        scope = get_policy_scope(POLICY_SCOPE_RESOURCE, resource_id)
+        if not force_update:
+            if self.policy_decision_point_manager.has_resource_policy(resource_id):
+                return
+            if scope in self._cached_bundles:
+                self.apply_policy_bundle(self._cached_bundles[scope])
+                return
 
         try:
             policy_list = self.policy_client.get_active_resource_access_policy_rules(
                     resource_id, headers=self.system_actor_user_header)
-            self.policy_decision_point_manager.set_resource_policy_rules(resource_id, policy_list)
+            self.policy_stats["policy_reads"] += 1
+            self.apply_policy_bundle(create_policy_bundle(scope, policy_list))
 
         except Exception as e:
             # If the resource does not exist, just ignore it - but log a warning.
             log.warn("There was an error applying access policy for resource %s: %s", resource_id, e.message)
 
+    # --- Policy bundles
+
+    def apply_policy_bundle(self, policy_bundle):
+        """
+        Applies a policy bundle (see policy_bundle module) to the policy decision points and
+        process operation preconditions of its scope, unless the same or a newer version was
+        applied before. Only the bundle's scope is updated. Returns True if policy was changed.
+        """
+        if self.policy_decision_point_manager is None:
+            return False
+        scope = policy_bundle["scope"]
+        prior_bundle = self._policy_bundles.get(scope, None)
+        if not is_newer_bundle(policy_bundle, prior_bundle):
+            self.policy_stats["bundles_current"] += 1
+            return False
+        if not policy_bundle["version"] and prior_bundle:
+            # A read back bundle keeps the version of the bundle it replaces, so that stale events are ignored
+            policy_bundle = dict(policy_bundle, version=prior_bundle["version"])
+
+        scope_type, scope_key = parse_policy_scope(scope)
+        policies = get_bundle_policies(policy_bundle)
+        try:
+            if scope_type == POLICY_SCOPE_COMMON:
+                self.policy_decision_point_manager.set_common_service_policy_rules(policies)
+            elif scope_type == POLICY_SCOPE_SERVICE:
+                prior_policies = get_bundle_policies(prior_bundle) if prior_bundle else []
+                self._set_service_policies(scope_key, policies, prior_policies)
+            elif scope_type == POLICY_SCOPE_RESOURCE:
+                self.policy_decision_point_manager.set_resource_policy_rules(scope_key, policies)
+            else:
+                log.warn("Ignoring policy bundle with unknown scope: %s", scope)
+                return False
+        except Exception as ex:
+            log.warn("Error applying policy bundle for %s: %s", scope, ex.message)
+            return False
+
+        self._policy_bundles[scope] = policy_bundle
+        self._cached_bundles.pop(scope, None)
+        self.policy_stats["bundles_applied"] += 1
+        self._save_policy_bundle(policy_bundle)
+        return True
+
+    def _set_service_policies(self, service_name, policies, prior_policies):
+        # First update any access policy rules
+        svc_access_policy = [p for p in policies
+                             if p.policy_type in (PolicyTypeEnum.COMMON_SERVICE_ACCESS, PolicyTypeEnum.SERVICE_ACCESS)]
+        self.policy_decision_point_manager.set_service_policy_rules(service_name, svc_access_policy)
+
+        # Next update any precondition policies, removing the ones of the prior policies
+        svc_preconditions = [p for p in policies if p.policy_type == PolicyTypeEnum.SERVICE_OP_PRECOND]
+        prior_preconditions = [p for p in prior_policies if p.policy_type == PolicyTypeEnum.SERVICE_OP_PRECOND]
+
+        # There can be several local processes for a service
+        procs = self.container.proc_manager.get_local_service_processes(service_name)
+        for proc in procs:
+            for op_pre_policy in prior_preconditions:
+                for pre_check in op_pre_policy.preconditions:
+                    self.unregister_process_operation_precondition(proc, op_pre_policy.op, pre_check)
+            for op_pre_policy in svc_preconditions:
+                for pre_check in op_pre_policy.preconditions:
+                    self.unregister_process_operation_precondition(proc, op_pre_policy.op, pre_check)
+                    self.register_process_operation_precondition(proc, op_pre_policy.op, pre_check)
+
+    def _cache_policy_bundle(self, policy_bundle):
+        """Keeps a bundle of a scope without local processes, to be applied when needed"""
+        scope = policy_bundle["scope"]
+        if not is_newer_bundle(policy_bundle, self._cached_bundles.get(scope, None)):
+            return
+        self._cached_bundles[scope] = policy_bundle
+        self._save_policy_bundle(policy_bundle)
+
+    def _uncache_policy_bundle(self, scope):
+        """Forgets a kept bundle that is out of date"""
+        if self._cached_bundles.pop(scope, None) and self._bundle_cache:
+            try:
+                self._bundle_cache.remove(scope)
+            except Exception:
+                log.warn("Error removing cached policy bundle %s", scope, exc_info=True)
+
+    def _save_policy_bundle(self, policy_bundle):
+        if not self._bundle_cache:
+            return
+        try:
+            self._bundle_cache.save(policy_bundle)
+            self.policy_stats["bundles_saved"] += 1
+        except Exception:
+            log.warn("Error saving policy bundle %s", policy_bundle["scope"], exc_info=True)
+
+    def _load_cached_policy_bundles(self):
+        """Warms the container's policy from bundles cached on local disk, e.g. before a restart.
+        Common policy is applied at once; other scopes are applied when their processes start."""
+        self._cached_bundles.update(self._bundle_cache.load_all())
+        common_bundle = self._cached_bundles.get(POLICY_SCOPE_COMMON, None)
+        if common_bundle:
+            self.apply_policy_bundle(common_bundle)
+        log.info("Loaded %s cached policy bundles", len(self._cached_bundles) + (1 if common_bundle else 0))
+
+    def get_policy_stats(self):
+        stats = dict(self.policy_stats)
+        stats["bundles_active"] = len(self._policy_bundles)
+        stats["bundles_cached"] = len(self._cached_bundles)
+        return stats
+
     def update_process_access_policy(self, process_key, service_op='', delete_policy=False, force_update=True):
         pass
         # procs, op_preconditions = [], None
@@ -644,3 +862,23 @@ class GovernanceController(object):
 
                     if not ret_val:
                         raise Unauthorized(ret_message)
+
+
+def _get_commitment_event_keys(event):
+    """Returns the commitment cache keys affected by a commitment event, or None for all keys"""
+    if not event.resource_id or not event.actor_id:
+        return None
+    keys = [("resource", event.resource_id), ("principal", event.actor_id)]
+    if event.origin:
+        keys.append(("principal", event.origin))
+    return keys
+
+
+def set_policy_stats_callback(stats_cb):
+    """ Sets a callback function (hook) to push stats after policy evaluation of an incoming message. """
+    global stats_callback
+    if stats_cb is None:
+        pass
+    elif stats_callback:
+        log.warn("Stats callback already defined")
+    stats_callback = stats_cb
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""Versioned, content-hashed policy bundles. A bundle holds the complete set of active policies of
+one policy scope (common service policy, a service, a resource), such that containers can apply
+policy changes from the event payload and warm their policy decision points from a local cache."""
+
+__author__ = 'Michael Meisinger'
+
+import hashlib
+import os
+import re
+import time
+import simplejson as json
+
+from pyon.util.containers import DotDict
+from pyon.util.log import log
+
+POLICY_SCOPE_COMMON = "common"
+POLICY_SCOPE_SERVICE = "service"
+POLICY_SCOPE_RESOURCE = "resource"
+
+
+def get_policy_scope(scope_type, scope_key=""):
+    """ Returns the scope string for a service name or resource id, e.g. "service:directory" """
+    if scope_type == POLICY_SCOPE_COMMON or not scope_key:
+        return POLICY_SCOPE_COMMON
+    return "%s:%s" % (scope_type, scope_key)
+
+
+def parse_policy_scope(scope):
+    """ Returns tuple (scope_type, scope_key) for a scope string """
+    scope_type, _, scope_key = scope.partition(":")
+    return scope_type, scope_key
+
+
+def get_policy_entry(policy):
+    """ Returns the parts of a Policy resource object relevant to enforcement as dict """
+    entry = dict(_id=policy._id, name=policy.name, policy_type=policy.policy_type,
+                 ordinal=policy.ordinal, definition=policy.definition)
+    details = policy.details
+    if details is not None and getattr(details, "preconditions", None):
+        entry["op"] = details.op
+        entry["preconditions"] = list(details.preconditions)
+    return entry
+
+
+def create_policy_bundle(scope, policy_list, version=0):
+    """
+    Returns a bundle dict for the given scope and list of active Policy objects (in order).
+    The version orders bundles of the same scope and is assigned by the policy management service
+    only; the hash identifies the content. Version 0 marks policy read back by a container, which
+    is authoritative, so containers never order bundles by their own clock.
+    """
+    policies = [get_policy_entry(p) for p in policy_list]
+    policy_hash = hashlib.sha1(json.dumps(policies, sort_keys=True)).hexdigest()
+    return dict(scope=scope, version=int(version or 0), hash=policy_hash, policies=policies)
+
+
+def get_bundle_policies(bundle):
+    """ Returns the policy entries of a bundle with attribute access, as used by the PDP manager """
+    return [DotDict(p) for p in bundle.get("policies", [])]
+
+
+def is_newer_bundle(bundle, current):
+    """ Returns True if bundle should replace the current bundle of the same scope """
+    if not current:
+        return True
+    if bundle["hash"] == current["hash"]:
+        return False
+    if not bundle["version"]:
+        # Policy read back from the policy management service is current
+        return True
+    return int(bundle["version"]) > int(current["version"])
+
+
+class PolicyBundleCache(object):
+    """
+    Keeps policy bundles as JSON files in a local directory, one file per scope.
+    Files are replaced atomically, so a container never reads a partially written bundle.
+    """
+
+    def __init__(self, cache_dir, max_age=0):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def _get_filename(self, scope):
+        return os.path.join(self.cache_dir, "policy_%s.json" % re.sub(r"[^\w.-]", "_", scope))
+
+    def save(self, bundle):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        filename = self._get_filename(bundle["scope"])
+        tmp_filename = "%s.%s.tmp" % (filename, os.getpid())
+        with open(tmp_filename, "w") as f:
+            json.dump(bundle, f)
+        os.rename(tmp_filename, filename)
+
+    def remove(self, scope):
+        filename = self._get_filename(scope)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def load_all(self):
+        """ Returns dict of scope to bundle for all cached bundles not older than max age """
+        bundles = {}
+        if not os.path.isdir(self.cache_dir):
+            return bundles
+        now = time.time()
+        for filename in os.listdir(self.cache_dir):
+            if not filename.startswith("policy_") or not filename.endswith(".json"):
+                continue
+            filename = os.path.join(self.cache_dir, filename)
+            try:
+                if self.max_age and now - os.path.getmtime(filename) > self.max_age:
+                    continue
+                with open(filename, "r") as f:
+                    bundle = json.load(f)
+                bundles[bundle["scope"]] = bundle
+            except Exception:
+                log.warn("Cannot read cached policy bundle %s", filename, exc_info=True)
+        return bundles
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith("policy_") and filename.endswith(".json"):
+                os.remove(os.path.join(self.cache_dir, filename))
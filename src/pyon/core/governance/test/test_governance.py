@@ -332,6 +332,8 @@ class GovernanceIntTest(IonIntegrationTestCase):
 
         #Add Org Manager Role
         self.rr.create_association(actor_id, PRED.hasRole, manager_role_id)
+        # Roles and commitments are changed directly in the resource registry, without Org events
+        self.container.governance_controller.clear_governance_caches()
 
         actor_roles = find_roles_by_actor(actor_id)
         role_header = get_role_message_headers({'ION': [manager_role, member_role]})
@@ -353,6 +355,7 @@ class GovernanceIntTest(IonIntegrationTestCase):
         self.rr.create_association(actor_id, PRED.hasRole, member2_role_id)
 
         self.rr.create_association(actor_id, PRED.hasRole, operator2_role_id)
+        self.container.governance_controller.clear_governance_caches()
 
         actor_roles = find_roles_by_actor(actor_id)
 
@@ -449,11 +452,13 @@ class GovernanceIntTest(IonIntegrationTestCase):
         com_obj = IonObject(RT.Commitment, provider=ion_org_id, consumer=actor_id, commitment=True, expiration=ts)
         com_id, _ = self.rr.create(com_obj)
         self.rr.create_association(ion_org_id, PRED.hasCommitment, com_id)
+        self.container.governance_controller.clear_governance_caches()
         c = get_valid_principal_commitments(ion_org_id, actor_id)
         # verify that the commitment is returned
         self.assertIsNotNone(c)
 
         self.rr.create_association(com_id, PRED.hasTarget, device_id)
+        self.container.governance_controller.clear_governance_caches()
         c = get_valid_resource_commitments(device_id, actor_id)
         # verify that the commitment is not returned
         self.assertIsNotNone(c)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import sys
+import time
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.core.bootstrap import IonObject
+from pyon.core.governance import OPERATOR_ROLE, MEMBER_ROLE, get_commitment_query, find_roles_by_actor, \
+    has_valid_shared_resource_commitment, has_valid_exclusive_resource_commitment
+from pyon.core.governance.governance_controller import GovernanceController, _get_commitment_event_keys
+from pyon.datastore.postgresql.pg_query import PostgresQueryBuilder
+from pyon.ion.resource import RT, PRED, OT
+from pyon.util.cache import BoundedCache
+from pyon.util.containers import DotDict, get_ion_ts_millis
+from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
+
+
+def get_sql(rq):
+    pqb = PostgresQueryBuilder(rq.get_query(), "ion_resources")
+    return pqb.get_query() % {k: repr(v) for k, v in pqb.get_values().iteritems()}
+
+
+@attr('UNIT')
+class TestGovernanceLookups(PyonTestCase):
+
+    def setUp(self):
+        self.rr = Mock()
+        container = Mock()
+        container.has_capability.return_value = True
+        container.resource_registry = self.rr
+        self.gc = GovernanceController(container)
+        self.gc._role_cache = BoundedCache(max_entries=10)
+        self.gc._commitment_cache = BoundedCache(max_entries=10)
+
+    def test_commitment_query(self):
+        sql = get_sql(get_commitment_query(resource_id="res1", consumer_id="actor1", exclusive=True))
+        self.assertIn("type_='Commitment' AND lcstate<>'DELETED'", sql)
+        self.assertIn("A0.o='res1' AND A0.p='hasTarget'", sql)
+        self.assertIn("json_string(doc,'consumer')='actor1'", sql)
+        self.assertIn("json_string(doc,'commitment.exclusive')='True'", sql)
+        self.assertIn("(json_string(doc,'expiration')='0' OR json_string(doc,'expiration')>", sql)
+
+        sql = get_sql(get_commitment_query(principal_id="org1", exclusive=False, include_expired=True))
+        self.assertIn("A0.s='org1' AND A0.p='hasCommitment'", sql)
+        self.assertIn("NOT ((json_string(doc,'commitment.type_')='ResourceCommitment'", sql)
+        self.assertNotIn("expiration", sql)
+
+    def test_cached_lookups(self):
+        role = DotDict(org_governance_name="ION", governance_name=OPERATOR_ROLE)
+        self.rr.find_objects.return_value = ([role], [])
+        self.assertEquals(self.gc.get_actor_roles("actor1"), [role])
+        self.assertEquals(self.gc.get_actor_roles("actor1"), [role])
+        self.assertEquals(self.rr.find_objects.call_count, 1)
+        self.rr.find_objects.assert_called_once_with("actor1", PRED.hasRole, RT.UserRole, id_only=False)
+
+        # Cached commitments expire without reload
+        com1 = DotDict(consumer="actor1", expiration="0")
+        com2 = DotDict(consumer="actor2", expiration=str(get_ion_ts_millis() + 50))
+        self.rr.find_resources_ext.return_value = [com1, com2]
+        self.assertEquals(self.gc.get_resource_commitments("res1"), [com1, com2])
+        time.sleep(0.06)
+        self.assertEquals(self.gc.get_resource_commitments("res1"), [com1])
+        self.assertEquals(self.rr.find_resources_ext.call_count, 1)
+        self.gc.get_principal_commitments("actor1")
+        self.assertEquals(self.rr.find_resources_ext.call_count, 2)
+
+        # Commitment events invalidate resource and principals only
+        event = DotDict(type_=OT.ResourceCommitmentReleasedEvent, origin="org1", resource_id="res1", actor_id="actor1")
+        self.assertEquals(_get_commitment_event_keys(event),
+                          [("resource", "res1"), ("principal", "actor1"), ("principal", "org1")])
+        self.assertIsNone(_get_commitment_event_keys(DotDict(event, actor_id="")))
+        for key in _get_commitment_event_keys(event):
+            self.gc._commitment_cache.evict(key)
+        self.assertEquals(len(self.gc._commitment_cache), 0)
+
+        self.gc.clear_governance_caches()
+        self.gc.get_actor_roles("actor1")
+        self.assertEquals(self.rr.find_objects.call_count, 2)
+
+        # Without caches, lookups go to the resource registry
+        self.gc._role_cache = self.gc._commitment_cache = None
+        self.gc.get_actor_roles("actor1")
+        self.gc.get_resource_commitments("res1")
+        self.assertEquals(self.rr.find_objects.call_count, 3)
+        self.assertEquals(self.rr.find_resources_ext.call_count, 3)
+
+
+@attr('PFM')
+class TestGovernanceLookupPerformance(IonIntegrationTestCase):
+
+    def setUp(self):
+        self._start_container()
+        self.rr = self.container.resource_registry
+        self.gc = self.container.governance_controller
+        if self.gc._role_cache is None:
+            self.gc._start_governance_caches(10000, 300)
+
+    def _add_other_actors(self, num_actors, role_id, org_id):
+        """Adds actors with a role and commitments for other resources, as well as expired commitments"""
+        actor_objs = [IonObject(RT.ActorIdentity, name="other_actor") for _ in xrange(num_actors)]
+        device_objs = [IonObject(RT.TestDevice, name="other_device") for _ in xrange(num_actors)]
+        actor_ids = [rid for rid, _ in self.rr.create_mult(actor_objs)]
+        device_ids = [rid for rid, _ in self.rr.create_mult(device_objs)]
+        expired = str(get_ion_ts_millis() - 10000)
+        com_objs = [IonObject(RT.Commitment, provider=org_id, consumer=actor_id, expiration=expired if i % 2 else "0",
+                              commitment=IonObject(OT.ResourceCommitment, resource_id=device_id))
+                    for i, (actor_id, device_id) in enumerate(zip(actor_ids, device_ids))]
+        com_ids = [rid for rid, _ in self.rr.create_mult(com_objs)]
+        assocs = []
+        for actor_id, device_id, com_id in zip(actor_ids, device_ids, com_ids):
+            assocs.extend([(actor_id, PRED.hasRole, role_id), (actor_id, PRED.hasCommitment, com_id),
+                           (org_id, PRED.hasCommitment, com_id), (com_id, PRED.hasTarget, device_id)])
+        self.rr.create_association_mult(assocs)
+
+    def test_check_latency(self):
+        """ Latency of role and commitment checks with a growing number of other roles and commitments """
+        org_id, _ = self.rr.create(IonObject(RT.Org, name="Org1", org_governance_name="Org1"))
+        operator_role_id, _ = self.rr.create(IonObject(RT.UserRole, governance_name=OPERATOR_ROLE,
+                                                       org_governance_name="Org1"))
+        member_role_id, _ = self.rr.create(IonObject(RT.UserRole, governance_name=MEMBER_ROLE,
+                                                     org_governance_name="Org1"))
+        actor_id, _ = self.rr.create(IonObject(RT.ActorIdentity, name="actor1"))
+        device_id, _ = self.rr.create(IonObject(RT.TestDevice, name="device1"))
+        com_id, _ = self.rr.create(IonObject(RT.Commitment, provider=org_id, consumer=actor_id, expiration="0",
+                                             commitment=IonObject(OT.ResourceCommitment, resource_id=device_id)))
+        self.rr.create_association_mult([(actor_id, PRED.hasRole, operator_role_id),
+                                         (actor_id, PRED.hasCommitment, com_id),
+                                         (org_id, PRED.hasCommitment, com_id),
+                                         (com_id, PRED.hasTarget, device_id)])
+
+        num_checks, num_actors = 200, 0
+        print >>sys.stderr, ""
+        for num_other in (100, 1000, 5000):
+            self._add_other_actors(num_other - num_actors, member_role_id, org_id)
+            num_actors = num_other
+            for cached in (False, True):
+                self.gc.clear_governance_caches()
+                start_time = time.time()
+                for i in xrange(num_checks):
+                    if not cached:
+                        self.gc.clear_governance_caches()
+                    self.assertTrue(has_valid_shared_resource_commitment(actor_id, device_id))
+                    self.assertFalse(has_valid_exclusive_resource_commitment(actor_id, device_id))
+                    self.assertIn(OPERATOR_ROLE, find_roles_by_actor(actor_id)["Org1"])
+                diff = time.time() - start_time
+                print >>sys.stderr, "Governance checks (cached=%s) with %s other actors: %.3f ms per check" % (
+                    cached, num_other, diff / num_checks * 1000)
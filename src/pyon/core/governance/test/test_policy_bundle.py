@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from gevent.event import Event
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.core.bootstrap import IonObject
+from pyon.core.governance.governance_controller import GovernanceController
+from pyon.core.governance.policy.policy_bundle import PolicyBundleCache, POLICY_SCOPE_COMMON, POLICY_SCOPE_SERVICE, \
+    POLICY_SCOPE_RESOURCE, create_policy_bundle, get_policy_scope, is_newer_bundle
+from pyon.core.governance.policy.policy_decision import PolicyDecisionPointManager
+from pyon.ion.resource import RT, OT
+from pyon.net.transport import LocalRouter
+from pyon.util.containers import DotDict
+from pyon.util.unit_test import PyonTestCase
+
+from interface.objects import PolicyTypeEnum
+
+PERMIT_RULE = '''<Rule RuleId="{rule_id}" Effect="Permit"><Description>{rule_id}</Description></Rule>'''
+
+
+def create_policy(policy_id, policy_type=PolicyTypeEnum.SERVICE_ACCESS, op="", preconditions=None):
+    policy = IonObject(RT.Policy, name=policy_id, policy_type=policy_type,
+                       definition=PERMIT_RULE.format(rule_id=policy_id))
+    policy._id = policy_id
+    if preconditions:
+        policy.details = IonObject(OT.ServiceOperationPreconditionPolicyDetails, service_name="svc1",
+                                   op=op, preconditions=preconditions)
+    return policy
+
+
+def create_controller(policy_client, pdp_manager=None, cache_dir=None):
+    container = Mock()
+    container.proc_manager.is_local_service_process.side_effect = lambda name: name == "svc1"
+    container.proc_manager.is_local_agent_process.return_value = False
+    container.proc_manager.get_local_service_processes.return_value = []
+    gc = GovernanceController(container)
+    gc.system_actor_id = "system_actor"
+    gc.system_actor_user_header = {}
+    gc._container_org_name = "ION"
+    gc.policy_client = policy_client
+    gc.policy_decision_point_manager = pdp_manager or PolicyDecisionPointManager(gc)
+    if cache_dir:
+        gc._bundle_cache = PolicyBundleCache(cache_dir)
+    return gc
+
+
+def create_event(event_type, policy_bundle=None, **kwargs):
+    return DotDict(type_=event_type, origin="policy1", sub_type="", op="", policy_bundle=policy_bundle or {}, **kwargs)
+
+
+@attr('UNIT')
+class TestPolicyBundle(PyonTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+
+    def test_bundle(self):
+        self.assertEquals(get_policy_scope(POLICY_SCOPE_SERVICE, "svc1"), "service:svc1")
+        self.assertEquals(get_policy_scope(POLICY_SCOPE_SERVICE, ""), POLICY_SCOPE_COMMON)
+
+        policies = [create_policy("p1"), create_policy("p2", PolicyTypeEnum.SERVICE_OP_PRECOND, "op1", ["func1"])]
+        bundle1 = create_policy_bundle("service:svc1", policies, version=100)
+        self.assertEquals(len(bundle1["policies"]), 2)
+        self.assertEquals(bundle1["policies"][1]["preconditions"], ["func1"])
+        self.assertEquals(create_policy_bundle("service:svc1", policies, version=200)["hash"], bundle1["hash"])
+
+        bundle2 = create_policy_bundle("service:svc1", policies[:1], version=200)
+        self.assertNotEquals(bundle2["hash"], bundle1["hash"])
+        self.assertTrue(is_newer_bundle(bundle1, None))
+        self.assertTrue(is_newer_bundle(bundle2, bundle1))
+        self.assertFalse(is_newer_bundle(bundle1, bundle2))
+        self.assertFalse(is_newer_bundle(bundle1, bundle1))
+
+        # Bundles read back by a container carry no version and replace any different bundle
+        readback = create_policy_bundle("service:svc1", policies)
+        self.assertEquals(readback["version"], 0)
+        self.assertTrue(is_newer_bundle(readback, bundle2))
+        self.assertFalse(is_newer_bundle(create_policy_bundle("service:svc1", policies[:1]), bundle2))
+        self.assertTrue(is_newer_bundle(bundle2, readback))
+
+        bundle_cache = PolicyBundleCache(os.path.join(self.cache_dir, "policy"), max_age=3600)
+        self.assertEquals(bundle_cache.load_all(), {})
+        bundle_cache.save(bundle1)
+        bundle_cache.save(bundle2)
+        bundle_cache.save(create_policy_bundle(get_policy_scope(POLICY_SCOPE_RESOURCE, "res/1"), []))
+        bundles = bundle_cache.load_all()
+        self.assertEquals(set(bundles), {"service:svc1", "resource:res/1"})
+        self.assertEquals(bundles["service:svc1"], bundle2)
+
+        bundle_cache.remove("resource:res/1")
+        self.assertEquals(set(bundle_cache.load_all()), {"service:svc1"})
+        bundle_cache.max_age = 0.01
+        time.sleep(0.02)
+        self.assertEquals(bundle_cache.load_all(), {})
+        bundle_cache.clear()
+        self.assertEquals(os.listdir(bundle_cache.cache_dir), [])
+
+    def test_apply_bundles(self):
+        policy_client = Mock()
+        policy_client.get_active_service_access_policy_rules.return_value = [create_policy("p1")]
+        pdp_manager = Mock()
+        pdp_manager.has_service_policy.return_value = False
+        pdp_manager.has_resource_policy.return_value = False
+        gc = create_controller(policy_client, pdp_manager, self.cache_dir)
+        proc = Mock()
+        proc.name = "svc1"
+        gc.container.proc_manager.get_local_service_processes.return_value = [proc]
+
+        # Event payload is applied without reading policy
+        bundle1 = create_policy_bundle("service:svc1", [create_policy("p1"), create_policy(
+            "p2", PolicyTypeEnum.SERVICE_OP_PRECOND, "op1", ["func1"])], version=100)
+        gc.service_policy_event_callback(create_event(OT.ServicePolicyEvent, bundle1, service_name="svc1"))
+        self.assertEquals(policy_client.get_active_service_access_policy_rules.call_count, 0)
+        self.assertEquals([p.name for p in pdp_manager.set_service_policy_rules.call_args[0][1]], ["p1"])
+        self.assertEquals(gc._service_op_preconditions["svc1"]["op1"], ["func1"])
+
+        # Duplicate and stale bundles are ignored; a newer bundle replaces only this scope
+        gc.service_policy_event_callback(create_event(OT.ServicePolicyEvent, bundle1, service_name="svc1"))
+        bundle0 = create_policy_bundle("service:svc1", [], version=50)
+        gc.service_policy_event_callback(create_event(OT.ServicePolicyEvent, bundle0, service_name="svc1"))
+        self.assertEquals(pdp_manager.set_service_policy_rules.call_count, 1)
+        self.assertEquals(gc.policy_stats["bundles_current"], 2)
+
+        bundle2 = create_policy_bundle("service:svc1", [create_policy("p1")], version=200)
+        gc.service_policy_event_callback(create_event(OT.ServicePolicyEvent, bundle2, service_name="svc1"))
+        self.assertNotIn("op1", gc._service_op_preconditions["svc1"])
+        self.assertEquals(pdp_manager.set_service_policy_rules.call_count, 2)
+        self.assertFalse(pdp_manager.clear_policy_cache.called)
+
+        # Bundles of other services are kept, resource bundles are applied
+        bundle3 = create_policy_bundle("service:svc2", [create_policy("p3")], version=200)
+        gc.service_policy_event_callback(create_event(OT.ServicePolicyEvent, bundle3, service_name="svc2"))
+        self.assertEquals(pdp_manager.set_service_policy_rules.call_count, 2)
+        bundle4 = create_policy_bundle("resource:res1", [create_policy("p4", PolicyTypeEnum.RESOURCE_ACCESS)])
+        gc.resource_policy_event_callback(create_event(OT.ResourcePolicyEvent, bundle4, resource_id="res1"))
+        pdp_manager.set_resource_policy_rules.assert_called_once_with("res1", [bundle4["policies"][0]])
+
+        # Events without payload read policy
+        gc.service_policy_event_callback(create_event(OT.ServicePolicyEvent, service_name="svc1"))
+        self.assertEquals(policy_client.get_active_service_access_policy_rules.call_count, 1)
+        self.assertEquals(gc.policy_stats["policy_reads"], 1)
+
+        # A restarted container warms its policy from disk without reading policy
+        gc2 = create_controller(policy_client, Mock(), self.cache_dir)
+        gc2.policy_decision_point_manager.has_service_policy.return_value = False
+        gc2._load_cached_policy_bundles()
+        self.assertEquals(set(gc2._cached_bundles), {"service:svc1", "service:svc2", "resource:res1"})
+        gc2.update_service_access_policy("svc2", force_update=False)
+        self.assertEquals(gc2.policy_decision_point_manager.set_service_policy_rules.call_args[0][0], "svc2")
+        self.assertEquals(policy_client.get_active_service_access_policy_rules.call_count, 1)
+        self.assertIn("service:svc2", gc2._policy_bundles)
+
+        # Read back policy applies regardless of clocks and keeps the version, so stale events are ignored
+        policy_client.get_active_service_access_policy_rules.return_value = [create_policy("p5")]
+        gc.update_service_access_policy("svc1")
+        self.assertEquals(gc._policy_bundles["service:svc1"]["version"], 200)
+        self.assertEquals([p.name for p in pdp_manager.set_service_policy_rules.call_args[0][1]], ["p5"])
+        bundle5 = create_policy_bundle("service:svc1", [create_policy("p1")], version=150)
+        gc.service_policy_event_callback(create_event(OT.ServicePolicyEvent, bundle5, service_name="svc1"))
+        self.assertEquals([p.name for p in pdp_manager.set_service_policy_rules.call_args[0][1]], ["p5"])
+
+
+@attr('PFM')
+class TestPolicyChurnPerformance(PyonTestCase):
+
+    def test_policy_churn(self):
+        """ Cost of distributing policy changes to many containers, with and without event payload """
+        num_containers, num_changes = 100, 20
+        policy_client = Mock()
+        policy_client.get_active_service_access_policy_rules.return_value = [create_policy("p1")]
+
+        router = LocalRouter("policytest")
+        router.start()
+        self.addCleanup(router.stop)
+        router.declare_exchange("events")
+        done = Event()
+        received = [0]
+        for i in xrange(num_containers):
+            gc = create_controller(policy_client)
+
+            def on_event(router, method_frame, header_frame, body, gc=gc):
+                gc.service_policy_event_callback(body)
+                received[0] += 1
+                if received[0] == num_containers * num_changes:
+                    done.set()
+            queue = "policy_q%s" % i
+            router.declare_queue(queue)
+            router.bind("events", queue, "ServicePolicyEvent.#")
+            ctag = router.start_consume(on_event, queue, no_ack=True)
+            self.addCleanup(router.stop_consume, ctag)
+
+        print >>sys.stderr, ""
+        for with_bundle in (False, True):
+            received[0] = 0
+            done.clear()
+            policy_client.reset_mock()
+            start_time = time.time()
+            for i in xrange(num_changes):
+                policies = [create_policy("p1"), create_policy("p%s" % (i + 2))]
+                policy_client.get_active_service_access_policy_rules.return_value = policies
+                bundle = create_policy_bundle("service:svc1", policies) if with_bundle else {}
+                event = create_event(OT.ServicePolicyEvent, bundle, service_name="svc1")
+                router.publish("events", "ServicePolicyEvent.svc1", event, {})
+            self.assertTrue(done.wait(timeout=60))
+            diff = time.time() - start_time
+            num_reads = policy_client.get_active_service_access_policy_rules.call_count
+            print >>sys.stderr, "Policy changes (payload=%s): %s containers x %s changes in %.3f s, %s policy reads" % (
+                with_bundle, num_containers, num_changes, diff, num_reads)
+            if with_bundle:
+                self.assertEquals(num_reads, 0)
+            else:
+                self.assertEquals(num_reads, num_containers * num_changes)
@@ -185,7 +185,7 @@ def get_obj_geospatial_bounds(doc, calculate=True, return_geo_bounds=False):
         # Set bounds from center point
         present, (lat, lon, elev) = get_obj_geospatial_point(doc, False)
         if present:
-            return True, ((lat, lon), (lat, lon), (lat, lon), (lat, lon))  # Polygon with 4 point (otherwise error)
+            return True, ((lon, lat), (lon, lat), (lon, lat), (lon, lat))  # Polygon with 4 point (otherwise error)
 
     return False, None
 
@@ -253,11 +253,13 @@ def get_obj_temporal_bounds(doc):
     temp_range = None
     if "temporal_range" in doc:
         temp_range = doc["temporal_range"]
+    elif "temporal_bounds" in doc:
+        temp_range = doc["temporal_bounds"]
     if temp_range and isinstance(temp_range, dict):
         if "start_datetime" in temp_range and "end_datetime" in temp_range:
             try:
-                t1 = float(temp_range["start_datetime"])
-                t2 = float(temp_range["end_datetime"])
+                t1 = float(temp_range["start_datetime"] or 0)
+                t2 = float(temp_range["end_datetime"] or 0)
                 if not any((t1, t2)):
                     return False, (0, 0)
                 return True, (t1, t2)
@@ -50,6 +50,7 @@ class DatastoreQueryConst(object):
     XOP_KEYWORD = XOP_PREFIX + "keyword"    # Find objects with 1..n keywords
     XOP_ALTID = XOP_PREFIX + "altid"        # Find objects with an altid in given values
     XOP_ISTYPE = XOP_PREFIX + "istype"      # Find objects with type or base type equal to given value (e.g. events)
+    XOP_FULLTEXT = XOP_PREFIX + "fulltext"  # Find resources matching a text search query (stemmed, weighted index)
 
     GOP_PREFIX = "gop:"                               # Geospatial operators prefix
     GOP_OVERLAPS_BBOX = GOP_PREFIX + "overlaps"       # Find objects with geometry overlapping given bbox
@@ -108,6 +109,17 @@ class DatastoreQueryConst(object):
     ORDER_ASC = "asc"
     ORDER_DESC = "desc"
 
+    # Aggregates and computed values
+    AGG_PREFIX = "agg:"
+    AGG_COUNT = AGG_PREFIX + "count"      # Number of objects per group of returned values
+    AGG_RANK = AGG_PREFIX + "rank"        # Relevance of object for the text search query (higher is better)
+    AGG_SNIPPET = AGG_PREFIX + "snippet"  # Name and description with text search matches highlighted
+    AGG_GEO_EXTENT = AGG_PREFIX + "geo_extent"    # Bounding box of object locations, as "BOX(x1 y1,x2 y2)"
+    AGG_VERT_EXTENT = AGG_PREFIX + "vert_extent"  # Range covering object vertical ranges, as "[z1,z2]"
+    AGG_TIME_EXTENT = AGG_PREFIX + "time_extent"  # Range covering object temporal ranges, as "[t1,t2]"
+    AGG_GEO_CENTER = AGG_PREFIX + "geo_center"    # Center of object location points, as WKT point
+    AGG_GEO_TILE = AGG_PREFIX + "geo_tile"        # Object location snapped to a grid of tile_size degrees
+
     # Text comparisons
     TXT_EQUALS = "txt:equals"
     TXT_IEQUALS = "txt:iequals"
@@ -118,6 +130,11 @@ class DatastoreQueryConst(object):
     TXT_REGEX = "txt:regex"
     TXT_IREGEX = "txt:iregex"
 
+    # Text search query modes
+    FTS_PLAIN = "fts:plain"     # Words, all must match (after stemming)
+    FTS_PHRASE = "fts:phrase"   # Words must match in sequence
+    FTS_QUERY = "fts:query"     # Boolean query expression, e.g. "sea & (water | ice) & !lake"
+
 DQ = DatastoreQueryConst
 QUERY_EXP_KEY = "QUERYEXP"
 QUERY_EXP_ID = "qexp_v1.0"
@@ -288,6 +305,16 @@ class DatastoreQueryBuilder(DatastoreQueryConst):
     def all_match(self, value):
         return self.op_expr(self.XOP_ALLMATCH, value)
 
+    def fulltext(self, value, mode=None):
+        """Text search over the weighted text index of resources (name, description, keywords and
+        other attributes). Order by AGG_RANK descending for most relevant first."""
+        if self.query["query_args"]["profile"] != DataStore.DS_PROFILE.RESOURCES:
+            raise BadRequest("Text search only supported for resources")
+        mode = mode or self.FTS_PLAIN
+        if mode not in (self.FTS_PLAIN, self.FTS_PHRASE, self.FTS_QUERY):
+            raise BadRequest("Unknown text search mode: %s" % mode)
+        return self.op_expr(self.XOP_FULLTEXT, value, mode)
+
     def attr_like(self, attr, value, case_sensitive=True):
         if case_sensitive:
             return self.op_expr(self.XOP_ATTLIKE, attr, value)
@@ -385,6 +412,42 @@ class DatastoreQueryBuilder(DatastoreQueryConst):
 
         return order_by_list
 
+    # --- Projection and aggregation
+
+    def set_returns(self, columns, distinct=False):
+        """Sets the query to return a list of rows with the values of given columns (attribute
+        names) instead of objects or ids. Attributes without a table column are returned as str.
+        With a text search filter, AGG_RANK and AGG_SNIPPET can be returned as well.
+        If distinct, each combination of values is returned only once."""
+        if not columns or type(columns) not in (list, tuple):
+            raise BadRequest("Illegal value for returned columns")
+        qargs = self.query["query_args"]
+        qargs["returns"] = [col if col.startswith(self.AGG_PREFIX) else self._get_attname(col) for col in columns]
+        qargs["distinct"] = bool(distinct)
+        qargs["group_count"] = False
+
+    def set_group_count(self, columns):
+        """Sets the query to return a list of rows with the distinct values of given columns and
+        the number of matching objects as last value. Order by AGG_COUNT for most frequent first."""
+        self.set_returns(columns)
+        self.query["query_args"]["group_count"] = True
+
+    def set_geo_extent(self):
+        """Sets the query to return one row with the number of matching objects and the extent of
+        their locations, vertical and temporal ranges. Computed by the datastore."""
+        self.set_returns([self.AGG_COUNT, self.AGG_GEO_EXTENT, self.AGG_VERT_EXTENT, self.AGG_TIME_EXTENT])
+        self.set_order_by(None)
+
+    def set_geo_tiles(self, tile_size):
+        """Sets the query to return one row per grid cell (tile) of given size in degrees with located
+        objects: tile, center and extent of the object locations and number of objects. Used to show
+        clusters on maps instead of many objects."""
+        if not tile_size or float(tile_size) <= 0:
+            raise BadRequest("Illegal value for tile size")
+        self.set_group_count([self.AGG_GEO_TILE, self.AGG_GEO_CENTER, self.AGG_GEO_EXTENT])
+        self.query["query_args"]["tile_size"] = float(tile_size)
+        self.set_order_by(None)
+
     # --- Other query parameters
 
     def set_skip(self, skip):
@@ -25,7 +25,8 @@ from pyon.core.exception import BadRequest, Conflict, NotFound, Inconsistent
 from pyon.datastore.datastore_common import DataStore, get_obj_geospatial_bounds, get_obj_geospatial_point, \
     get_obj_temporal_bounds, get_obj_vertical_bounds, get_obj_geometry
 from pyon.datastore.datastore_query import DQ
-from pyon.datastore.postgresql.pg_util import PostgresConnectionPool, StatementBuilder, psycopg2_connect, TracingCursor
+from pyon.datastore.postgresql.pg_util import PostgresConnectionPool, StatementBuilder, psycopg2_connect, TracingCursor, \
+    wait_notifies
 from pyon.util.containers import create_basic_identifier
 from pyon.util.tracer import CallTracer
 
@@ -47,6 +48,9 @@ OBJ_TYPE_PRECED = {"R": 1, "A": 2, "D": 3}
 # Shared connection pool for container
 pg_connection_pool = None
 
+# Database and datastore names upgraded by this process (see upgrade_datastore)
+upgraded_datastores = set()
+
 # Special callback for DB traces (note: during early phases of framework start, this is None)
 stats_callback = None
 
@@ -116,6 +120,11 @@ class PostgresDataStore(DataStore):
         if self.datastore_name:
             if not self.datastore_exists():
                 self.create_datastore()
+            elif (self.database, self._get_datastore_name()) not in upgraded_datastores:
+                try:
+                    self.upgrade_datastore()
+                except Exception:
+                    log.warn("Could not upgrade datastore '%s'", self.datastore_name, exc_info=True)
 
         log.debug("PostgresDataStore: created instance database=%s, datastore_name=%s, profile=%s, scope=%s",
                  self.database, self.datastore_name, self.profile, self.scope)
@@ -225,12 +234,7 @@ class PostgresDataStore(DataStore):
         qual_ds_name = self._get_datastore_name(datastore_name)
         profile = profile or self.profile or DEFAULT_PROFILE
         log.info("Creating datastore '%s' using profile %s", qual_ds_name, profile)
-        if profile == DataStore.DS_PROFILE.DIRECTORY:
-            profile = DataStore.DS_PROFILE.RESOURCES
-
-        profile = profile.lower()
-        if not os.path.exists("res/datastore/postgresql/profile_%s.sql" % profile):
-            profile = "basic"
+        profile = self._get_profile_script(profile)
         profile_sql = None
         with open("res/datastore/postgresql/profile_%s.sql" % profile, "r") as f:
             profile_sql = f.read()
@@ -250,6 +254,36 @@ class PostgresDataStore(DataStore):
                 except Exception as de:
                     raise BadRequest("Datastore %s create error: %s" % (datastore_name, de))
         log.debug("Datastore '%s' created" % (qual_ds_name))
+        upgraded_datastores.add((self.database, qual_ds_name))
+
+    def upgrade_datastore(self, datastore_name=None, profile=None):
+        """
+        Applies the upgrade script of the profile (if any) to an existing datastore, adding columns,
+        triggers, indexes etc. introduced after the datastore was created. The script is idempotent.
+        """
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        profile = self._get_profile_script(profile or self.profile or DEFAULT_PROFILE)
+        upgrade_filename = "res/datastore/postgresql/profile_%s_upgrade.sql" % profile
+        if os.path.exists(upgrade_filename):
+            with open(upgrade_filename, "r") as f:
+                upgrade_sql = f.read()
+            log.debug("Upgrading datastore '%s' using profile %s", qual_ds_name, profile)
+            with psycopg2_connect(c_host=self.host, c_port=self.port, c_dbname=self.database,
+                                  c_user=self.admin_username, c_password=self.admin_password,
+                                  tracer=self._call_tracer, trace_stmt="EXECUTE profile_%s_upgrade.sql" % profile) as conn:
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(upgrade_sql % dict(ds=qual_ds_name))
+        upgraded_datastores.add((self.database, qual_ds_name))
+
+    def _get_profile_script(self, profile):
+        """Returns the name of the SQL script profile for a datastore profile"""
+        if profile == DataStore.DS_PROFILE.DIRECTORY:
+            profile = DataStore.DS_PROFILE.RESOURCES
+        profile = profile.lower()
+        if not os.path.exists("res/datastore/postgresql/profile_%s.sql" % profile):
+            profile = "basic"
+        return profile
 
     def delete_datastore(self, datastore_name=None):
         """
@@ -362,11 +396,29 @@ class PostgresDataStore(DataStore):
     # -------------------------------------------------------------------------
     # Document operations
 
-    def list_objects(self, datastore_name=None):
+    def list_objects(self, datastore_name=None, id_filter=None, start_after=None, limit=0):
         """
         List all object types existing in the datastore instance.
+        With id_filter (substring of id), start_after (id) or limit, returns ids of the main table
+        in id order, such that large tables can be listed in pages.
         """
         qual_ds_name = self._get_datastore_name(datastore_name)
+        if id_filter or start_after or limit:
+            statement = "SELECT id FROM " + qual_ds_name
+            where_list = []
+            if id_filter:
+                where_list.append("id LIKE %(id_filter)s")
+            if start_after:
+                where_list.append("id>%(start_after)s")
+            if where_list:
+                statement += " WHERE " + " AND ".join(where_list)
+            statement += " ORDER BY id"
+            if limit > 0:
+                statement += " LIMIT %s" % int(limit)
+            with self.pool.cursor(**self.cursor_args) as cur:
+                cur.execute(statement, dict(id_filter="%" + str(id_filter or "") + "%", start_after=start_after))
+                return [row[0] for row in cur.fetchall()]
+
         if self.profile == DataStore.DS_PROFILE.RESOURCES:
             all_docs = self._find_all_docs("_all_docs", id_only=True, filter={})
             return [doc_id for doc_id, _, _ in all_docs]
@@ -439,15 +491,29 @@ class PostgresDataStore(DataStore):
             log.warn("Could not compute value for numrange column %s: %s", col, ex)
         return res
 
+    def _get_column_value(self, col, doc):
+        """Returns the value for an extra column given a document (text representation for special types)"""
+        if col in GEOSPATIAL_COLS:
+            return self._get_geom_value(col, doc)
+        elif col in NUMRANGE_COLS:
+            return self._get_range_value(col, doc)
+        return doc.get(col, None)
+
+    def _get_row_values(self, extra_cols, doc, allow_null_values=False):
+        """Returns a dict of values for the extra columns as input for json_populate_recordset"""
+        row_values = {}
+        for col in extra_cols:
+            value = self._get_column_value(col, doc)
+            if value and col in GEOSPATIAL_COLS:
+                value = "SRID=4326;" + value
+            if allow_null_values or value or type(value) is bool:
+                row_values[col] = value
+        return row_values
+
     def _create_value_expression(self, col, doc, valuename, value_dict, allow_null_values=False, assign=False):
         """Returns part of an SQL statement to insert or update a value for a column.
         Places the value into a dict for the DB client to convert properly"""
-        if col in GEOSPATIAL_COLS:
-            value = self._get_geom_value(col, doc)
-        elif col in NUMRANGE_COLS:
-            value = self._get_range_value(col, doc)
-        else:
-            value = doc.get(col, None)
+        value = self._get_column_value(col, doc)
 
         if allow_null_values or value or type(value) is bool:
             insert_expr = ", "
@@ -616,7 +682,13 @@ class PostgresDataStore(DataStore):
 
         return oid, version
 
-    def update_doc_mult(self, docs, datastore_name=None):
+    def update_doc_mult(self, docs, datastore_name=None, strict=True):
+        """
+        Updates a list of documents with one statement per table and returns 3-tuples of (Success, id, rev).
+        The revision of each document is checked. If strict, a revision conflict raises Conflict
+        and no document is updated. Otherwise conflicts are reported as (False, id, Conflict).
+        A document id must occur only once in the list.
+        """
         if type(docs) is not list:
             raise BadRequest("Invalid type for docs:%s" % type(docs))
         if not all(["_id" in doc for doc in docs]):
@@ -625,19 +697,109 @@ class PostgresDataStore(DataStore):
             raise BadRequest("Docs must have '_rev'")
         if not docs:
             return []
+        doc_ids = [doc["_id"] for doc in docs]
+        if len(set(doc_ids)) != len(doc_ids):
+            # Only one revision per document could be written
+            raise BadRequest("Docs must have unique '_id': %s" % sorted({did for did in doc_ids if doc_ids.count(did) > 1}))
         log.debug('update_doc_mult(): update %s documents', len(docs))
 
         qual_ds_name = self._get_datastore_name(datastore_name)
-        # Could use cur.executemany() here but does not allow for case-by-case reaction to failure
+        upd_docs = [doc for doc in docs if "_deleted" not in doc]
+        doc_obj_type = [self._get_obj_type(doc, self.profile) for doc in upd_docs]
+        updated_ids = set()
+
         with self.pool.cursor(**self.cursor_args) as cur:
-            result_list = []
             for doc in docs:
                 if "_deleted" in doc:
                     self._delete_doc(cur, qual_ds_name, doc["_id"])
-                    oid, version = doc["_id"], doc["_rev"]
-                else:
-                    oid, version = self._update_doc(cur, qual_ds_name, doc)
-                result_list.append((True, oid, version))
+
+            for obj_type in sorted(set(doc_obj_type), key=lambda x: OBJ_TYPE_PRECED.get(x, 10)):
+                docs_ot = [doc for (doc, doc_ot) in zip(upd_docs, doc_obj_type) if doc_ot == obj_type]
+
+                # Take the first document to determine the type of objects (resource, association, dir entry)
+                extra_cols, table = self._get_extra_cols(docs_ot[0], qual_ds_name, self.profile)
+                rows = []
+                for doc in docs_ot:
+                    doc["_rev"] = str(int(doc["_rev"]) + 1)
+                    row = self._get_row_values(extra_cols, doc)
+                    row.update(id=doc["_id"], rev=int(doc["_rev"]), doc=doc)
+                    rows.append(row)
+
+                # Null column values keep the current value, same as for a single document update
+                xval = "".join(", %s=COALESCE(v.%s, t.%s)" % (col, col, col) for col in extra_cols)
+                statement = "UPDATE " + table + " AS t SET doc=v.doc, rev=v.rev" + xval + \
+                            " FROM json_populate_recordset(NULL::" + table + ", %(rows)s) AS v" \
+                            " WHERE t.id=v.id AND t.rev=v.rev-1 RETURNING t.id"
+                cur.execute(statement, dict(rows=json.dumps(rows)))
+                updated_ids.update(row[0] for row in cur.fetchall())
+
+            conflict_ids = [doc["_id"] for doc in upd_docs if doc["_id"] not in updated_ids]
+            if conflict_ids and strict:
+                raise Conflict("Objects with ids %s revision conflict" % conflict_ids)
+
+        result_list = []
+        for doc in docs:
+            if "_deleted" in doc or doc["_id"] in updated_ids:
+                result_list.append((True, doc["_id"], doc["_rev"]))
+            else:
+                doc["_rev"] = str(int(doc["_rev"]) - 1)
+                result_list.append((False, doc["_id"], Conflict("Object with id %s revision conflict" % doc["_id"])))
+
+        return result_list
+
+    def upsert_doc(self, doc, object_id=None, datastore_name=None):
+        """Creates or replaces a document regardless of revision. Returns (id, rev)"""
+        res = self.upsert_doc_mult([doc], [object_id] if object_id else None, datastore_name=datastore_name)
+        return res[0][1], res[0][2]
+
+    def upsert_doc_mult(self, docs, object_ids=None, datastore_name=None):
+        """
+        Creates or replaces a list of documents regardless of their revision (last writer wins)
+        with one statement per table. Returns 3-tuples of (Success, id, rev).
+        """
+        if type(docs) is not list:
+            raise BadRequest("Invalid type for docs:%s" % type(docs))
+        if object_ids and len(object_ids) != len(docs):
+            raise BadRequest("Invalid object_ids")
+        if not docs:
+            return []
+        log.debug('upsert_doc_mult(): upsert %s documents', len(docs))
+
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        for i, doc in enumerate(docs):
+            if "_id" not in doc:
+                doc["_id"] = (object_ids[i] if object_ids else None) or self.get_unique_id()
+            doc["_rev"] = "1"
+        doc_obj_type = [self._get_obj_type(doc, self.profile) for doc in docs]
+        doc_revs = {}
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            # Need to make sure to first write resources then associations for referential integrity
+            for obj_type in sorted(set(doc_obj_type), key=lambda x: OBJ_TYPE_PRECED.get(x, 10)):
+                docs_ot = [doc for (doc, doc_ot) in zip(docs, doc_obj_type) if doc_ot == obj_type]
+
+                extra_cols, table = self._get_extra_cols(docs_ot[0], qual_ds_name, self.profile)
+                rows = []
+                for doc in docs_ot:
+                    row = self._get_row_values(extra_cols, doc, allow_null_values=True)
+                    row.update(id=doc["_id"], rev=1, doc=doc)
+                    rows.append(row)
+
+                xcol = "".join(", %s" % col for col in extra_cols)
+                xval = "".join(", %s=EXCLUDED.%s" % (col, col) for col in extra_cols)
+                statement = "INSERT INTO " + table + " AS t (id, rev, doc" + xcol + ") SELECT id, rev, doc" + xcol + \
+                            " FROM json_populate_recordset(NULL::" + table + ", %(rows)s)" \
+                            " ON CONFLICT (id) DO UPDATE SET rev=t.rev+1, doc=jsonb_set(EXCLUDED.doc::jsonb, " \
+                            "'{_rev}', to_jsonb((t.rev+1)::text))::json" + xval + " RETURNING t.id, t.rev"
+                try:
+                    cur.execute(statement, dict(rows=json.dumps(rows)))
+                except IntegrityError as ie:
+                    raise BadRequest("Some object cannot be written: %s" % ie)
+                doc_revs.update((row[0], str(row[1])) for row in cur.fetchall())
+
+        for doc in docs:
+            doc["_rev"] = doc_revs.get(doc["_id"], doc["_rev"])
+        result_list = [(True, doc["_id"], doc["_rev"]) for doc in docs]
 
         return result_list
 
@@ -876,6 +1038,83 @@ class PostgresDataStore(DataStore):
                 raise NotFound('Attachment %s does not exist in document %s.%s.',
                                attachment_name, datastore_name or qual_ds_name, doc_id)
 
+    # -------------------------------------------------------------------------
+    # Directory lock operations
+
+    def acquire_dir_lock_doc(self, doc, lock_id, lock_holder=None, cur_time=None, datastore_name=None):
+        """
+        Atomically acquires or renews a lock directory entry in one statement.
+        A newly acquired lock gets the next fencing token from a database sequence. The current
+        holder renewing an unexpired lock keeps its token. Expired locks are taken over.
+        @param cur_time  Current time in millis, for checking lock expiration
+        @retval  fencing token (int) if the lock was acquired or renewed, otherwise None
+        """
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        table = qual_ds_name + "_dir"
+        doc["_id"] = lock_id
+        doc["_rev"] = "1"
+        statement_args = dict(id=lock_id, doc=json.dumps(doc), org=doc["org"], parent=doc["parent"], key=doc["key"],
+                              holder=lock_holder or "", now=cur_time, seq=table + "_fence_seq")
+        expired_clause = "(d.doc->'attributes'->>'expires')::bigint BETWEEN 1 AND %(now)s"
+        holder_clause = "(%(holder)s<>'' AND d.doc->'attributes'->>'holder'=%(holder)s)"
+        statement = "INSERT INTO " + table + " AS d (id, rev, doc, org, parent, key) VALUES (%(id)s, 1, " \
+                    "jsonb_set(%(doc)s::jsonb, '{attributes,fence}', to_jsonb(nextval(%(seq)s)))::json, " \
+                    "%(org)s, %(parent)s, %(key)s) ON CONFLICT (org, parent, key) DO UPDATE " \
+                    "SET id=EXCLUDED.id, rev=1, doc=CASE WHEN " + holder_clause + " AND NOT " + expired_clause + \
+                    " THEN jsonb_set(EXCLUDED.doc::jsonb, '{attributes,fence}', COALESCE(" \
+                    "(d.doc->'attributes'->'fence')::jsonb, EXCLUDED.doc::jsonb->'attributes'->'fence'))::json " \
+                    "ELSE EXCLUDED.doc END WHERE " + expired_clause + " OR " + holder_clause + \
+                    " RETURNING (d.doc->'attributes'->>'fence')::bigint"
+        with self.pool.cursor(**self.cursor_args) as cur:
+            cur.execute(statement, statement_args)
+            row = cur.fetchone()
+
+        return int(row[0]) if row else None
+
+    def release_dir_locks(self, org, parent, key=None, lock_holder=None, expired_time=None, datastore_name=None):
+        """
+        Deletes lock directory entries below parent in one statement and notifies waiters.
+        @param key  Only release the lock with this key
+        @param lock_holder  Only release locks held by this holder
+        @param expired_time  Only release locks expired at this time in millis
+        @retval  list of keys of released locks
+        """
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        table = qual_ds_name + "_dir"
+        statement_args = dict(org=org, parent=parent, key=key, holder=lock_holder, now=expired_time,
+                              channel=qual_ds_name + "_dir_lock")
+        query_clause = "org=%(org)s AND parent=%(parent)s"
+        if key:
+            query_clause += " AND key=%(key)s"
+        if lock_holder:
+            query_clause += " AND doc->'attributes'->>'holder'=%(holder)s"
+        if expired_time:
+            query_clause += " AND (doc->'attributes'->>'expires')::bigint BETWEEN 1 AND %(now)s"
+        statement = "WITH del AS (DELETE FROM " + table + " WHERE " + query_clause + " RETURNING key) " \
+                    "SELECT key, pg_notify(%(channel)s, key) FROM del"
+        with self.pool.cursor(**self.cursor_args) as cur:
+            cur.execute(statement, statement_args)
+            rows = cur.fetchall()
+
+        return [row[0] for row in rows]
+
+    def listen_dir_locks(self, callback, quit_event, wait_interval=5.0, datastore_name=None):
+        """
+        Blocking loop that calls callback(key) for every released lock until quit_event is set.
+        Uses a dedicated connection outside of the pool, because it remains in LISTEN state.
+        """
+        channel = self._get_datastore_name(datastore_name) + "_dir_lock"
+        conn = self.pool.create_connection()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute('LISTEN "%s"' % channel)
+            while not quit_event.is_set():
+                for key in wait_notifies(conn, timeout=wait_interval):
+                    callback(key)
+        finally:
+            conn.close()
+
     # -------------------------------------------------------------------------
     # View operations
 
@@ -4,6 +4,11 @@
 
 __author__ = 'Michael Meisinger'
 
+try:
+    from psycopg2 import ProgrammingError
+except ImportError:
+    pass
+
 from pyon.core.bootstrap import get_obj_registry, CFG
 from pyon.core.exception import BadRequest, Conflict, NotFound, Inconsistent
 from pyon.core.object import IonObjectBase, IonObjectSerializer, IonObjectDeserializer
@@ -13,6 +18,8 @@ from pyon.datastore.datastore import DataStore
 from pyon.util.log import log
 from pyon.ion.resource import AvailabilityStates, OT, RT
 
+# Maximum number of associations followed in graph traversals (default if no max depth is given)
+MAX_TRAVERSE_DEPTH = 50
 
 class PostgresPyonDataStore(PostgresDataStore):
     """
@@ -70,6 +77,19 @@ class PostgresPyonDataStore(PostgresDataStore):
 
         return self.update_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects])
 
+    def upsert(self, obj, object_id=None):
+        """Creates or replaces an object regardless of its revision. Returns (id, rev)"""
+        if not isinstance(obj, IonObjectBase):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+
+        return self.upsert_doc(self._ion_object_to_persistence_dict(obj), object_id=object_id)
+
+    def upsert_mult(self, objects, object_ids=None):
+        if any([not isinstance(obj, IonObjectBase) for obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+
+        return self.upsert_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects], object_ids)
+
 
     def read(self, object_id, rev_id="", datastore_name="", object_type=None):
         if not isinstance(object_id, str):
@@ -105,6 +125,10 @@ class PostgresPyonDataStore(PostgresDataStore):
     def delete_mult(self, object_ids, datastore_name=None):
         return self.delete_doc_mult(object_ids, datastore_name)
 
+    def acquire_dir_lock(self, lock_entry, lock_id, lock_holder=None, cur_time=None):
+        return self.acquire_dir_lock_doc(self._ion_object_to_persistence_dict(lock_entry), lock_id,
+                                         lock_holder=lock_holder, cur_time=cur_time)
+
     # -------------------------------------------------------------------------
     # View operations
 
@@ -356,6 +380,117 @@ class PostgresPyonDataStore(PostgresDataStore):
 
         return assocs
 
+    def _get_assoc_edges(self, direction):
+        """
+        Returns a SQL fragment selecting non-retired associations as directed edges
+        (src, dst, p, dt) for the given traversal direction:
+        O (subject to object), S (object to subject) or A (both ways).
+        """
+        table = self._get_datastore_name() + "_assoc"
+        edges_o = "SELECT s AS src, o AS dst, p, ot AS dt FROM " + table + " WHERE retired<>true"
+        edges_s = "SELECT o AS src, s AS dst, p, st AS dt FROM " + table + " WHERE retired<>true"
+        if direction == "O":
+            return edges_o
+        elif direction == "S":
+            return edges_s
+        elif direction == "A":
+            return edges_o + " UNION ALL " + edges_s
+        raise BadRequest("Illegal association direction: %s" % direction)
+
+    def _get_edge_filter(self, predicate, target_type, query_args):
+        query_clause = ""
+        if predicate:
+            query_args["p"] = tuple(predicate) if type(predicate) in (list, tuple) else (predicate, )
+            query_clause += " AND e.p IN %(p)s"
+        if target_type:
+            query_args["dt"] = tuple(target_type) if type(target_type) in (list, tuple) else (target_type, )
+            query_clause += " AND e.dt IN %(dt)s"
+        return query_clause
+
+    def find_descendants(self, resource_id, direction="O", predicate=None, target_type=None, max_depth=0):
+        """
+        Returns a list of tuples (resource_id, depth) of all resources reachable from the given resource
+        (or list of resources) by following associations in the given direction. Depth is the length of the
+        shortest chain of associations. Can limit search depth, predicate and the type of traversed resources.
+        Executes as one recursive query. Each step keeps every resource only once per depth, such that
+        the number of rows is bounded by the number of reached resources times the depth, also for graphs
+        with many shared descendants or cycles.
+        """
+        if not resource_id:
+            raise BadRequest("Must provide resource_id")
+        if max_depth > MAX_TRAVERSE_DEPTH:
+            raise BadRequest("max_depth exceeds maximum of %s" % MAX_TRAVERSE_DEPTH)
+        start_ids = tuple(resource_id) if type(resource_id) in (list, tuple) else (resource_id, )
+        max_depth = max_depth if max_depth > 0 else MAX_TRAVERSE_DEPTH
+        query_args = dict(start_ids=start_ids, max_depth=max_depth)
+        edge_filter = self._get_edge_filter(predicate, target_type, query_args)
+        edges = self._get_assoc_edges(direction)
+
+        query = "WITH RECURSIVE ch_res(chid, depth) AS ("
+        query += "SELECT e.dst, 1 FROM (" + edges + ") AS e"
+        query += " WHERE e.src IN %(start_ids)s" + edge_filter
+        query += " UNION "
+        query += "SELECT e.dst, ch.depth + 1 FROM ch_res ch, (" + edges + ") AS e"
+        query += " WHERE e.src=ch.chid AND ch.depth<%(max_depth)s" + edge_filter
+        query += ") SELECT chid, min(depth) FROM ch_res WHERE NOT chid IN %(start_ids)s"
+        query += " GROUP BY chid ORDER BY 2, 1"
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            cur.execute(query, query_args)
+            rows = cur.fetchall()
+
+        return [(self._prep_id(row[0]), row[1]) for row in rows]
+
+    def find_shortest_path(self, source_id, target_id, direction="A", predicate=None, target_type=None, max_depth=10):
+        """
+        Returns the list of resource ids on a shortest chain of associations from source to target resource,
+        including source and target. Returns an empty list if target is not reachable within max_depth hops.
+        A first recursive query finds the distance to the target, stopping at the first match. A second
+        query returns the predecessors of resources reached within this distance to build the path.
+        Both keep every resource only once per depth and predecessor.
+        """
+        if not source_id or not target_id:
+            raise BadRequest("Must provide source_id and target_id")
+        if source_id == target_id:
+            return [source_id]
+        if not max_depth or max_depth <= 0:
+            raise BadRequest("Must provide max_depth")
+        if max_depth > MAX_TRAVERSE_DEPTH:
+            raise BadRequest("max_depth exceeds maximum of %s" % MAX_TRAVERSE_DEPTH)
+        query_args = dict(source_id=source_id, target_id=target_id, max_depth=max_depth)
+        pred_filter = self._get_edge_filter(predicate, None, query_args)
+        edges = self._get_assoc_edges(direction)
+
+        query = "WITH RECURSIVE sp_res(chid, depth, prev) AS ("
+        query += "SELECT %(source_id)s::text, 0, NULL::text"
+        query += " UNION "
+        query += "SELECT e.dst, sp.depth + 1, sp.chid FROM sp_res sp, (" + edges + ") AS e"
+        query += " WHERE e.src=sp.chid AND sp.chid<>%(target_id)s AND sp.depth<%(max_depth)s" + pred_filter
+        if target_type:
+            # Type filter applies to intermediate resources only
+            query_args["dt"] = tuple(target_type) if type(target_type) in (list, tuple) else (target_type, )
+            query += " AND (e.dst=%(target_id)s OR e.dt IN %(dt)s)"
+        query += ") "
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            # Relies on the breadth-first iteration of recursive queries: the first row found has minimal depth
+            cur.execute(query + "SELECT depth FROM sp_res WHERE chid=%(target_id)s LIMIT 1", query_args)
+            rows = cur.fetchall()
+            if not rows:
+                return []
+            query_args["max_depth"] = rows[0][0]
+            cur.execute(query + "SELECT chid, depth, prev FROM sp_res WHERE depth>0", query_args)
+            rows = cur.fetchall()
+
+        prev_by_node = {}
+        for chid, depth, prev in rows:
+            prev_by_node.setdefault((chid, depth), []).append(prev)
+        path, depth = [target_id], query_args["max_depth"]
+        while depth > 0:
+            path.append(min(prev_by_node[(path[-1], depth)]))
+            depth -= 1
+        return [self._prep_id(res_id) for res_id in reversed(path)]
+
     def _prepare_find_return(self, rows, res_assocs=None, id_only=True, **kwargs):
         if id_only:
             res_ids = [self._prep_id(row[0]) for row in rows]
@@ -724,7 +859,8 @@ class PostgresPyonDataStore(PostgresDataStore):
         """
         Find resources given a datastore query expression dict.
         @param query  a dict representation of a datastore query
-        @retval  list of resource ids or resource objects matching query (dependent on id_only value)
+        @retval  list of resource ids or resource objects matching query (dependent on id_only value),
+                 or list of lists of values if the query returns columns (see set_returns)
         """
         qual_ds_name = self._get_datastore_name()
         query_ds_sub = query["query_args"].get("ds_sub", None)
@@ -743,7 +879,13 @@ class PostgresPyonDataStore(PostgresDataStore):
 
         with self.pool.cursor(**self.cursor_args) as cur:
             exec_query = pqb.get_query()
-            cur.execute(exec_query, pqb.get_values())
+            try:
+                cur.execute(exec_query, pqb.get_values())
+            except ProgrammingError as pe:
+                if "syntax error in tsquery" in (pe.pgerror or ""):
+                    # Malformed text search query expression (FTS_QUERY mode)
+                    raise BadRequest("Invalid text search query: %s" % pe.pgerror.splitlines()[0])
+                raise
             rows = cur.fetchall()
             query_str = cur.query if len(cur.query) < 2000 else cur.query[:1000] + "...[" + str(len(cur.query) - 1200) + "]..." + cur.query[-200:]
             log.info("find_by_query() QUERY: %s (%s rows)", query_str, cur.rowcount)
@@ -761,7 +903,8 @@ class PostgresPyonDataStore(PostgresDataStore):
             else:
                 res_vals = [[self._persistence_dict_to_ion_object(row[1])] + list(rows[2:]) for row in rows]
 
-        elif query_format == "complex":
+        elif query_format == "complex" or not pqb.has_basic_cols:
+            # Return format is list of lists of returned values
             res_vals = [list(row) for row in rows]
 
         else:
@@ -39,6 +39,27 @@ class PostgresQueryBuilder(object):
               DQ.XOP_ATTILIKE: "ILIKE",
               }
 
+    # Table columns per profile (and ds_sub) that can be returned and ordered by directly
+    TABLE_COLS = {(DataStore.DS_PROFILE.RESOURCES, ""): {"id", "type_", "name", "lcstate", "availability",
+                                                         "visibility", "ts_created", "ts_updated"},
+                  (DataStore.DS_PROFILE.RESOURCES, "assoc"): {"id", "s", "st", "p", "o", "ot"},
+                  (DataStore.DS_PROFILE.EVENTS, ""): {"id", "type_", "origin", "origin_type", "sub_type",
+                                                      "ts_created"}}
+
+    # Text search query function per mode. Uses the configuration of the resource text index
+    TSQUERY_FUNC = {DQ.FTS_PLAIN: "plainto_tsquery",
+                    DQ.FTS_PHRASE: "phraseto_tsquery",
+                    DQ.FTS_QUERY: "to_tsquery"}
+    TS_CONFIG = "english"
+    TS_HEADLINE_OPTS = "MaxFragments=2,MinWords=5,MaxWords=20"
+
+    # Aggregate expressions for returned columns. Other returned columns are grouped by with group_count
+    AGG_COLS = {DQ.AGG_COUNT: "COUNT(*)",
+                DQ.AGG_GEO_EXTENT: "ST_Extent(COALESCE(geom_loc,geom))::text",
+                DQ.AGG_VERT_EXTENT: "numrange(min(lower(vertical_range)),max(upper(vertical_range)),'[]')::text",
+                DQ.AGG_TIME_EXTENT: "numrange(min(lower(temporal_range)),max(upper(temporal_range)),'[]')::text",
+                DQ.AGG_GEO_CENTER: "ST_AsText(ST_Centroid(ST_Collect(geom)))"}
+
     def __init__(self, query, basetable):
         DatastoreQueryBuilder.check_query(query)
         self.query = query
@@ -51,6 +72,8 @@ class PostgresQueryBuilder(object):
         self.query_format = self.query["query_args"].get("format", "")
         self.table_aliases = [self.basetable]
         self.has_basic_cols = True
+        self.distinct = False
+        self._tsqueries = {}
 
         if self.query_format == "sql":
             self.basic_cols = False
@@ -110,10 +133,20 @@ class PostgresQueryBuilder(object):
                 self.from_tables = self.basetable
                 self.table_aliases = [self.basetable]
 
-            self.where = self._build_where(self.query["where"])
-            self.order_by = self._build_order_by(self.query["order_by"])
             self.group_by = None
             self.having = None
+            returns = self.query["query_args"].get("returns", None)
+            if returns:
+                # Projection of column values, optionally distinct or grouped with count
+                self.has_basic_cols = False
+                self.cols = [self._build_col(col) for col in returns]
+                self.distinct = self.query["query_args"].get("distinct", False) is True
+                if self.query["query_args"].get("group_count", False) is True:
+                    self.group_by = ",".join(str(i + 1) for i, col in enumerate(returns) if col not in self.AGG_COLS)
+                    self.cols.append("COUNT(*)")
+
+            self.where = self._build_where(self.query["where"])
+            self.order_by = self._build_order_by(self.query["order_by"], attr_cols=True)
 
     def _value(self, value, flatten_list=True):
         """Saves a value for later type conformant insertion into the query"""
@@ -182,6 +215,9 @@ class PostgresQueryBuilder(object):
                 return "json_allattr(%sdoc) LIKE %s" % (table_prefix, self._value("%" + str(self._sub_param(value)) + "%"))
             else:   # default/others: ICONTAINS
                 return "json_allattr(%sdoc) ILIKE %s" % (table_prefix, self._value("%" + str(self._sub_param(value)) + "%"))
+        elif op == DQ.XOP_FULLTEXT:
+            value, mode = args
+            return "%stsv @@ %s" % (table_prefix, self._build_tsquery(self._sub_param(value), mode))
         elif op == DQ.XOP_KEYWORD:
             value = args[0]
             kw_values = value if type(value) in (list, tuple) else [value]
@@ -220,7 +256,7 @@ class PostgresQueryBuilder(object):
             elif op.endswith('_geom'):
                 colname, wkt, buf = args
                 # PostGIS geometry from WKT http://postgis.net/docs/ST_GeomFromEWKT.html
-                geom_from_wkt = 'ST_GeomFromEWKT(\'SRID=4326;%s\')' % (wkt)
+                geom_from_wkt = 'ST_GeomFromEWKT(%s)' % self._value("SRID=4326;%s" % self._sub_param(wkt))
                 # if buffer specified, wrap geometry in buffer http://postgis.net/docs/ST_Buffer.html
                 if buf:
                     postgis_cast = '' # we may need to cast PostGIS geography back to PostGIS geometry
@@ -234,7 +270,8 @@ class PostgresQueryBuilder(object):
             else:
                colname, x1, y1, x2, y2 = args
                return "%s %s ST_MakeEnvelope(%s,%s,%s,%s,4326)" % (table_prefix+colname, self.OP_STR[op],
-                    self._value(x1), self._value(y1), self._value(x2), self._value(y2))
+                    self._value(self._sub_param(x1)), self._value(self._sub_param(y1)),
+                    self._value(self._sub_param(x2)), self._value(self._sub_param(y2)))
         elif op == DQ.EXP_AND:
             return "(%s)" % " AND ".join(self._build_where(ex, table_prefix=table_prefix) for ex in args)
         elif op == DQ.EXP_OR:
@@ -344,19 +381,69 @@ class PostgresQueryBuilder(object):
         else:
             raise BadRequest("Unknown op: %s" % op)
 
-    def _build_order_by(self, expr):
+    def _build_order_by(self, expr, attr_cols=False):
         if not expr:
             return ""
         order_by_list = []
         for col, colsort in expr:
+            if attr_cols:
+                col = self._build_col(col)
             order_by_list.append("%s %s" % (col, "DESC" if colsort.lower() == "desc" else "ASC"))
         order_by = ",".join(order_by_list)
         return order_by
 
+    def _build_col(self, col):
+        """Returns the SQL expression for a returned or ordered column: a table column or object attribute"""
+        if col in self.AGG_COLS:
+            return self.AGG_COLS[col]
+        elif col == DQ.AGG_GEO_TILE:
+            tile_size = float(self.query["query_args"].get("tile_size", 1.0))
+            return "ST_AsText(ST_SnapToGrid(geom,%s))" % self._value(tile_size)
+        elif col == DQ.AGG_RANK:
+            return "ts_rank_cd(tsv,%s)" % self._get_fulltext_tsquery()
+        elif col == DQ.AGG_SNIPPET:
+            return "ts_headline('%s',coalesce(name,'')||' '||coalesce(json_string(doc,'description'),''),%s,'%s')" % (
+                self.TS_CONFIG, self._get_fulltext_tsquery(), self.TS_HEADLINE_OPTS)
+        table_cols = self.TABLE_COLS.get((self.query["query_args"].get("profile", ""), self.ds_sub), None)
+        if table_cols is None or col in table_cols:
+            return col
+        return "json_string(doc,%s)" % self._value(col)
+
+    def _build_tsquery(self, value, mode):
+        """Returns the tsquery expression for a text search value, the same expression for the same value"""
+        if (value, mode) not in self._tsqueries:
+            if mode not in self.TSQUERY_FUNC:
+                raise BadRequest("Unknown text search mode: %s" % mode)
+            self._tsqueries[(value, mode)] = "%s('%s',%s)" % (self.TSQUERY_FUNC[mode], self.TS_CONFIG,
+                                                              self._value(str(value)))
+        return self._tsqueries[(value, mode)]
+
+    def _get_fulltext_tsquery(self):
+        """Returns the tsquery expression of the first text search filter of the query (outside of associations)"""
+        def find_fulltext(expr):
+            if not expr:
+                return None
+            op, args = expr
+            if op == DQ.XOP_FULLTEXT:
+                return args
+            elif op in (DQ.EXP_AND, DQ.EXP_OR):
+                for ex in args:
+                    ft_args = find_fulltext(ex)
+                    if ft_args:
+                        return ft_args
+            return None
+        ft_args = find_fulltext(self.query["where"])
+        if not ft_args:
+            raise BadRequest("Rank and snippet require a text search filter")
+        value, mode = ft_args
+        return self._build_tsquery(self._sub_param(value), mode)
+
     def get_query(self):
         qargs = self.query["query_args"]
         frags = []
         frags.append("SELECT ")
+        if self.distinct:
+            frags.append("DISTINCT ")
         frags.append(",".join(self.cols))
         frags.append(" FROM ")
         frags.append(self.from_tables)
@@ -395,7 +482,7 @@ class PostgresQueryBuilder(object):
         elif profile == DataStore.DS_PROFILE.RESOURCES:
             return col in {"id", "type_", "name", "lcstate", "availability", "ts_created", "ts_updated"}
         elif profile == DataStore.DS_PROFILE.EVENTS:
-            return col in {"id", "type_", "origin", "origin_type", "sub_type", "actor_id"}
+            return col in {"id", "type_", "origin", "origin_type", "sub_type", "actor_id", "ts_created"}
         raise BadRequest("Unknown query profile")
 
     def get_base_alias(self):
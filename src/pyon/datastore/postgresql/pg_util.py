@@ -6,6 +6,7 @@ __author__ = 'Michael Meisinger'
 
 import contextlib
 import gevent
+from gevent import select as gselect
 from gevent.queue import Queue
 from gevent.socket import wait_read, wait_write
 import sys
@@ -13,6 +14,8 @@ import simplejson as json
 import time
 import threading
 
+from pyon.util.span_tracer import SpanTracer
+
 try:
     import psycopg2
     from psycopg2 import OperationalError, ProgrammingError, DatabaseError, IntegrityError, extensions
@@ -256,6 +259,19 @@ def psycopg2_connect(dsn=None, *args, **kwargs):
 db_connect = psycopg2_connect
 
 
+def wait_notifies(conn, timeout=None):
+    """
+    Waits on a connection that issued LISTEN until notifications arrive or timeout (secs).
+    Returns the list of received NOTIFY payloads, which is empty on timeout.
+    """
+    if not conn.notifies:
+        gselect.select([conn], [], [], timeout)
+    conn.poll()
+    payloads = [notify.payload for notify in conn.notifies]
+    del conn.notifies[:]
+    return payloads
+
+
 class TracingConnection(_connection):
     """A connection that logs all queries to a file or logger__ object."""
     def set_tracer(self, tracer, trace_stmt=None):
@@ -331,6 +347,9 @@ class TracingCursor(_cursor):
             if query_time:
                 stats_obj["time.all"] = stats_obj.get("time.all", 0.0) + query_time
 
+        if SpanTracer.enabled:
+            SpanTracer.record_db_span(statement, query_time)
+
         # Log to tracer
         if tracer:
             status = self.rowcount
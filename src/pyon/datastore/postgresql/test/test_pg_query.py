@@ -10,6 +10,7 @@ from mock import Mock, patch, ANY
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.unit_test import IonUnitTestCase
 
+from pyon.core.exception import BadRequest
 from pyon.datastore.datastore_query import DatastoreQueryBuilder
 from pyon.datastore.postgresql.pg_query import PostgresQueryBuilder
 
@@ -28,35 +29,112 @@ class PostgresDataStoreUnitTest(IonUnitTestCase):
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.overlaps_geom(qb.RA_GEOM_LOC,wkt,0.0))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Intersects(geom_loc,ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'))")
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Intersects(geom_loc,ST_GeomFromEWKT(%(v1)s))")
+        self.assertEquals(pqb.get_values(), {'v1': 'SRID=4326;POINT(-72.0 40.0)'})
 
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.contains_geom(qb.RA_GEOM_LOC,wkt,0.0))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Contains(geom_loc,ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'))")
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Contains(geom_loc,ST_GeomFromEWKT(%(v1)s))")
 
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.within_geom(qb.RA_GEOM_LOC,wkt,0.0))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Within(geom_loc,ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'))")
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Within(geom_loc,ST_GeomFromEWKT(%(v1)s))")
 
         # PostgresQueryBuilder - WKT (with buffer)
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.overlaps_geom(qb.RA_GEOM_LOC,wkt,buf))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Intersects(geom_loc,ST_Buffer(ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'), 0.100000))")
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Intersects(geom_loc,ST_Buffer(ST_GeomFromEWKT(%(v1)s), 0.100000))")
 
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.contains_geom(qb.RA_GEOM_LOC,wkt,buf))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Contains(geom_loc,ST_Buffer(ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'), 0.100000))")
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Contains(geom_loc,ST_Buffer(ST_GeomFromEWKT(%(v1)s), 0.100000))")
 
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.within_geom(qb.RA_GEOM_LOC,wkt,buf))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Within(geom_loc,ST_Buffer(ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'), 0.100000))")
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Within(geom_loc,ST_Buffer(ST_GeomFromEWKT(%(v1)s), 0.100000))")
 
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.equals_geom(qb.RA_GEOM_LOC,wkt,buf))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Equals(geom_loc,ST_Buffer(ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'), 0.100000))")
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Equals(geom_loc,ST_Buffer(ST_GeomFromEWKT(%(v1)s), 0.100000))")
+
+    def test_projection(self):
+        """ unit test to verify the SQL translation for returned columns, DISTINCT, GROUP BY and ORDER BY """
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.eq(qb.ATT_TYPE, "TestInstrument"), order_by=qb.order_by(["name", "firmware"]))
+        qb.set_returns(["name", "ra:firmware"], distinct=True)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT DISTINCT name,json_string(doc,%(v1)s) FROM test WHERE type_=%(v2)s ORDER BY name ASC,json_string(doc,%(v3)s) ASC")
+        self.assertEquals(pqb.get_values(), {'v1': 'firmware', 'v2': 'TestInstrument', 'v3': 'firmware'})
+        self.assertFalse(pqb.has_basic_cols)
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.eq(qb.ATT_TYPE, "TestInstrument"), order_by=qb.order_by(qb.AGG_COUNT, "desc"), limit=5)
+        qb.set_group_count(["lcstate", "firmware"])
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT lcstate,json_string(doc,%(v1)s),COUNT(*) FROM test WHERE type_=%(v2)s GROUP BY 1,2 ORDER BY COUNT(*) DESC LIMIT 5")
+
+        # Order by object attribute without table column
+        qb = DatastoreQueryBuilder(order_by=[("description", "desc"), ("ts_created", "asc")])
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test ORDER BY json_string(doc,%(v1)s) DESC,ts_created ASC")
+        self.assertTrue(pqb.has_basic_cols)
+
+    def test_fulltext(self):
+        """ unit test to verify the SQL translation for text search with rank, snippet and paging """
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.and_(qb.eq(qb.ATT_TYPE, "TestInstrument"), qb.fulltext("sea water")),
+                       order_by=qb.order_by([(qb.AGG_RANK, "desc"), ("id", "asc")]), limit=10, skip=20)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE (type_=%(v1)s AND tsv @@ plainto_tsquery('english',%(v2)s)) ORDER BY ts_rank_cd(tsv,plainto_tsquery('english',%(v2)s)) DESC,id ASC LIMIT 10 OFFSET 20")
+        self.assertEquals(pqb.get_values(), {'v1': 'TestInstrument', 'v2': 'sea water'})
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.fulltext("sea & !lake", qb.FTS_QUERY), order_by=qb.order_by(qb.AGG_RANK, "desc"))
+        qb.set_returns([qb.ATT_ID, qb.AGG_RANK, qb.AGG_SNIPPET])
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,ts_rank_cd(tsv,to_tsquery('english',%(v1)s)),ts_headline('english',coalesce(name,'')||' '||coalesce(json_string(doc,'description'),''),to_tsquery('english',%(v1)s),'MaxFragments=2,MinWords=5,MaxWords=20') FROM test WHERE tsv @@ to_tsquery('english',%(v1)s) ORDER BY ts_rank_cd(tsv,to_tsquery('english',%(v1)s)) DESC")
+        self.assertFalse(pqb.has_basic_cols)
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.fulltext("sea water", qb.FTS_PHRASE))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE tsv @@ phraseto_tsquery('english',%(v1)s)")
+
+        # Rank requires a text search filter; text search requires resources
+        qb = DatastoreQueryBuilder(order_by=[(qb.AGG_RANK, "desc")])
+        with self.assertRaises(BadRequest):
+            PostgresQueryBuilder(qb.get_query(), 'test')
+        qb = DatastoreQueryBuilder(profile="EVENTS")
+        with self.assertRaises(BadRequest):
+            qb.fulltext("sea")
+        with self.assertRaises(BadRequest):
+            DatastoreQueryBuilder().fulltext("sea", "fts:other")
+
+    def test_geo_aggregates(self):
+        """ unit test to verify the SQL translation for geospatial extent and map tile aggregates """
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.and_(qb.eq(qb.ATT_TYPE, "TestSite"), qb.overlaps_bbox(qb.RA_GEOM, -80, 30, -70, 40)),
+                       order_by=qb.order_by("name"))
+        qb.set_geo_extent()
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT COUNT(*),ST_Extent(COALESCE(geom_loc,geom))::text,numrange(min(lower(vertical_range)),max(upper(vertical_range)),'[]')::text,numrange(min(lower(temporal_range)),max(upper(temporal_range)),'[]')::text FROM test WHERE (type_=%(v1)s AND geom && ST_MakeEnvelope(%(v2)s,%(v3)s,%(v4)s,%(v5)s,4326))")
+        self.assertFalse(pqb.has_basic_cols)
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.eq(qb.ATT_TYPE, "TestSite"))
+        qb.set_geo_tiles(5)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT ST_AsText(ST_SnapToGrid(geom,%(v1)s)),ST_AsText(ST_Centroid(ST_Collect(geom))),ST_Extent(COALESCE(geom_loc,geom))::text,COUNT(*) FROM test WHERE type_=%(v2)s GROUP BY 1")
+        self.assertEquals(pqb.get_values(), {'v1': 5.0, 'v2': 'TestSite'})
+
+        with self.assertRaises(BadRequest):
+            DatastoreQueryBuilder().set_geo_tiles(0)
@@ -19,8 +19,8 @@ from pyon.ion.resource import RT, PRED, LCS, AS, lcstate, create_access_args
 from pyon.util.tracer import CallTracer
 
 from pyon.datastore.postgresql.datastore import PostgresPyonDataStore
-from pyon.datastore.postgresql.pg_util import init_db_stats, get_db_stats, clear_db_stats
-from pyon.datastore.datastore_query import DatastoreQueryBuilder
+from pyon.datastore.postgresql.pg_util import init_db_stats, get_db_stats, clear_db_stats, psycopg2_connect
+from pyon.datastore.datastore_query import DatastoreQueryBuilder, DQ
 
 import interface.objects
 
@@ -941,6 +941,51 @@ class TestDataStores(IonIntegrationTestCase):
         # Clean up
         self.data_store.delete_mult([plat1_obj_id, plat2_obj_id, plat3_obj_id, aid1_obj_id, dp1_obj_id])
 
+    def _execute_admin(self, data_store, statement):
+        with psycopg2_connect(c_host=data_store.host, c_port=data_store.port, c_dbname=data_store.database,
+                              c_user=data_store.admin_username, c_password=data_store.admin_password) as conn:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(statement)
+
+    def test_datastore_upgrade(self):
+        if self.server_type != "postgresql":
+            return
+        data_store = self.ds_class(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES, scope=get_sys_name())
+        try:
+            data_store.delete_datastore()
+        except NotFound:
+            pass
+        data_store.create_datastore()
+        self.data_store = data_store
+        self.resources = {}
+        plat1_obj_id = self._create_resource(RT.TestPlatform, 'Seawater buoy')
+
+        # Datastore created before text search and directory lock fencing were added
+        qual_ds_name = data_store._get_datastore_name()
+        self._execute_admin(data_store, 'DROP TRIGGER "%s_tsv_trigger" ON "%s"; ALTER TABLE "%s" DROP COLUMN tsv' % (
+            qual_ds_name, qual_ds_name, qual_ds_name))
+        self._execute_admin(data_store, 'DROP SEQUENCE "%s_dir_fence_seq"' % qual_ds_name)
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.fulltext("seawater"))
+        with self.assertRaises(Exception):
+            data_store.find_by_query(qb.get_query())
+
+        # Upgrade is idempotent and indexes existing resources
+        data_store.upgrade_datastore()
+        data_store.upgrade_datastore()
+        self.assertEquals(data_store.find_by_query(qb.get_query()), [plat1_obj_id])
+        lock_doc = dict(org="ION", parent="/System/Locks", key="lock1", attributes=dict(expires=0, holder="h1"))
+        self.assertIsInstance(data_store.acquire_dir_lock_doc(lock_doc, "lock1", lock_holder="h1", cur_time=1), (int, long))
+        data_store.release_dir_locks("ION", "/System/Locks")
+
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.fulltext("sea & & water", DQ.FTS_QUERY))
+        with self.assertRaises(BadRequest):
+            data_store.find_by_query(qb.get_query())
+
+        self.data_store.delete_mult([plat1_obj_id])
+
     def test_datastore_transactions(self):
         data_store = self.ds_class(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES, scope=get_sys_name())
         # Just in case previous run failed without cleaning up, delete data store
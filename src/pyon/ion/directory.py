@@ -4,6 +4,10 @@
 
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 
+import copy
+import time
+from gevent.event import Event
+
 from pyon.core import bootstrap
 from pyon.core.bootstrap import CFG
 from pyon.core.exception import Inconsistent, BadRequest, NotFound, Conflict
@@ -11,6 +15,7 @@ from pyon.container.cc import CCAP
 from pyon.datastore.datastore import DataStore
 from pyon.ion.event import EventPublisher, EventSubscriber
 from pyon.ion.identifier import create_unique_directory_id
+from pyon.util.async import spawn
 from pyon.util.log import log
 from pyon.util.containers import get_ion_ts, get_ion_ts_millis
 
@@ -21,6 +26,8 @@ LOCK_EXPIRES_ATTR = "expires"
 LOCK_EXPIRES_DEFAULT = 5000
 LOCK_EXPIRES_NEVER = 0
 LOCK_HOLDER_ATTR = "holder"
+LOCK_FENCE_ATTR = "fence"
+LOCK_WAIT_POLL = 5      # Secs between checks while waiting for a lock without expiration
 
 
 class Directory(object):
@@ -40,10 +47,22 @@ class Directory(object):
         self.orgname = orgname or CFG.system.root_org
         self.is_root = (self.orgname == CFG.system.root_org)
         self.events_enabled = CFG.get_safe("service.directory.publish_events") is True   # Publish change events?
+        # Keep a local replica of directory entries? Requires change events for coherence
+        self.cache_enabled = self.events_enabled and CFG.get_safe("service.directory.cache_enabled") is True
 
         self.event_pub = None
         self.event_sub = None
 
+        # Local replica: parent path -> dict of key -> DirEntry for all direct children of parent
+        self._cache = {}
+        self._cache_gen = {}      # parent path -> count of invalidations (detects changes during load)
+        self._watchers = {}       # parent path -> list of callbacks
+
+        self._lock_listener = None      # Greenlet receiving lock release notifications
+        self._lock_listener_quit = None
+        self._lock_waiters = {}         # lock key -> list of Events set on release
+        self._leases = set()            # Active DirectoryLease with background renewal
+
     def start(self):
         if self.events_enabled:
             # init change event publisher
@@ -65,7 +84,13 @@ class Directory(object):
         Close directory and all resources including datastore and event listener.
         """
         if self.event_sub:
-            self.event_sub.deactivate()
+            try:
+                self.event_sub.stop()
+            except Exception:
+                log.debug("Error stopping directory change event subscriber", exc_info=True)
+            self.event_sub = None
+        self._stop_lock_listener()
+        self._cache.clear()
         self.dir_store.close()
 
     # -------------------------------------------------------------------------
@@ -78,7 +103,7 @@ class Directory(object):
         @retval Either current DirEntry attributes dict or DirEntry object or None if not found.
         """
         path = self._get_path(parent, key) if key else parent
-        direntry = self._read_by_path(path)
+        direntry = self._read_by_path_cached(path)
         if return_entry:
             return direntry
         else:
@@ -90,7 +115,11 @@ class Directory(object):
         @param return_entry  If True, returns DirEntry object if found, otherwise DirEntry attributes dict
         @retval Either list of current DirEntry attributes dict or DirEntry object or None if not found.
         """
-        direntry_list = self._read_by_path(parent, mult_keys=keys)
+        if keys and self._is_cache_active(parent):
+            children = self._get_cached_children(parent)
+            direntry_list = [self._copy_entry(children.get(key, None)) for key in keys]
+        else:
+            direntry_list = self._read_by_path(parent, mult_keys=keys)
         if return_entry:
             return direntry_list
         else:
@@ -117,7 +146,7 @@ class Directory(object):
         entry_old = None
         cur_time = get_ion_ts()
         # Must read existing entry by path to make sure to not create path twice
-        direntry = self._read_by_path(dn)
+        direntry = self._read_by_path_cached(dn)
         if direntry and create_only:
             # We only wanted to make sure entry exists. Do not change
             # NOTE: It is ambiguous to the caller whether we ran into this situation. Seems OK.
@@ -127,17 +156,20 @@ class Directory(object):
             direntry.attributes = kwargs
             direntry.ts_updated = cur_time
             try:
-                self.dir_store.update(direntry)
+                _, direntry._rev = self.dir_store.update(direntry)
+                self._cache_put(direntry)
 
                 if self.events_enabled and self.container.has_capability(CCAP.EXCHANGE_MANAGER):
                     self.event_pub.publish_event(event_type="DirectoryModifiedEvent",
                                                  origin=self.orgname + ".DIR", origin_type="DIR",
                                                  key=key, parent=parent, org=self.orgname,
+                                                 container_id=self.container.id,
                                                  sub_type="REGISTER." + parent[1:].replace("/", "."),
                                                  mod_type=DirectoryModificationType.UPDATE)
             except Conflict:
                 # Concurrent update - we accept that we finished the race second and give up
                 log.warn("Concurrent update to %s detected. We lost: %s", dn, kwargs)
+                self._cache_invalidate(parent)
 
             if return_entry:
                 # Reset object back to prior state
@@ -152,11 +184,13 @@ class Directory(object):
             if ensure_parents:
                 self._ensure_parents_exist([direntry])
             try:
-                self.dir_store.create(direntry, create_unique_directory_id())
+                direntry._id, direntry._rev = self.dir_store.create(direntry, create_unique_directory_id())
+                self._cache_put(direntry)
                 if self.events_enabled and self.container.has_capability(CCAP.EXCHANGE_MANAGER):
                     self.event_pub.publish_event(event_type="DirectoryModifiedEvent",
                                                  origin=self.orgname + ".DIR", origin_type="DIR",
                                                  key=key, parent=parent, org=self.orgname,
+                                                 container_id=self.container.id,
                                                  sub_type="REGISTER." + parent[1:].replace("/", "."),
                                                  mod_type=DirectoryModificationType.CREATE)
             except BadRequest as ex:
@@ -164,6 +198,7 @@ class Directory(object):
                     raise
                 # Concurrent create - we accept that we finished the race second and give up
                 log.warn("Concurrent create of %s detected. We lost: %s", dn, kwargs)
+                self._cache_invalidate(parent)
 
         return entry_old
 
@@ -191,13 +226,17 @@ class Directory(object):
         pe_list = self._ensure_parents_exist(de_list, create=False)
         de_list.extend(pe_list)
         deid_list = [create_unique_directory_id() for i in xrange(len(de_list))]
-        self.dir_store.create_mult(de_list, deid_list)
+        res_list = self.dir_store.create_mult(de_list, deid_list)
+        for de, (_, de_id, de_rev) in zip(de_list, res_list):
+            de._id, de._rev = de_id, de_rev
+            self._cache_put(de)
 
         if self.events_enabled and self.container.has_capability(CCAP.EXCHANGE_MANAGER):
             for de in de_list:
                 self.event_pub.publish_event(event_type="DirectoryModifiedEvent",
                                              origin=self.orgname + ".DIR", origin_type="DIR",
                                              key=de.key, parent=de.parent, org=self.orgname,
+                                             container_id=self.container.id,
                                              sub_type="REGISTER." + de.parent[1:].replace("/", "."),
                                              mod_type=DirectoryModificationType.CREATE)
 
@@ -209,13 +248,15 @@ class Directory(object):
         path = self._get_path(parent, key) if key else parent
         log.debug("Removing content at path %s" % path)
 
-        direntry = self._read_by_path(path)
+        direntry = self._read_by_path_cached(path)
         if direntry:
             self.dir_store.delete(direntry)
+            self._cache_remove(direntry)
             if self.events_enabled and self.container.has_capability(CCAP.EXCHANGE_MANAGER):
                 self.event_pub.publish_event(event_type="DirectoryModifiedEvent",
                                              origin=self.orgname + ".DIR", origin_type="DIR",
                                              key=key, parent=parent, org=self.orgname,
+                                             container_id=self.container.id,
                                              sub_type="UNREGISTER." + parent[1:].replace("/", "."),
                                              mod_type=DirectoryModificationType.DELETE)
 
@@ -241,11 +282,11 @@ class Directory(object):
         """
         if not type(parent) is str or not parent.startswith("/"):
             raise BadRequest("Illegal argument parent: %s" % parent)
+        if direct_only and not kwargs and self._is_cache_active(parent):
+            children = self._get_cached_children(parent)
+            return [self._copy_entry(children[key]) for key in sorted(children)]
         if direct_only:
-            start_key = [self.orgname, parent, 0]
-            end_key = [self.orgname, parent]
-            res = self.dir_store.find_by_view('directory', 'by_parent',
-                start_key=start_key, end_key=end_key, id_only=True, convert_doc=True, **kwargs)
+            return self._find_direct_children(parent, **kwargs)
         else:
             path = parent[1:].split("/")
             start_key = [self.orgname, path, 0]
@@ -256,6 +297,13 @@ class Directory(object):
         match = [value for docid, indexkey, value in res]
         return match
 
+    def _find_direct_children(self, parent, **kwargs):
+        start_key = [self.orgname, parent, 0]
+        end_key = [self.orgname, parent]
+        res = self.dir_store.find_by_view('directory', 'by_parent',
+            start_key=start_key, end_key=end_key, id_only=True, convert_doc=True, **kwargs)
+        return [value for docid, indexkey, value in res]
+
     def find_by_key(self, key=None, parent='/', **kwargs):
         """
         Returns a list of DirEntry for each directory entry that matches the given key name.
@@ -296,7 +344,7 @@ class Directory(object):
     # -------------------------------------------------------------------------
     #  Concurrency Control
 
-    def acquire_lock(self, key, timeout=LOCK_EXPIRES_DEFAULT, lock_holder=None, lock_info=None):
+    def acquire_lock(self, key, timeout=LOCK_EXPIRES_DEFAULT, lock_holder=None, lock_info=None, wait_timeout=0):
         """
         Attempts to atomically acquire a lock with the given key and namespace.
         If holder is given and holder already has the lock, renew.
@@ -304,62 +352,49 @@ class Directory(object):
         @param timeout  Secs until lock expiration or 0 for no expiration
         @param lock_holder  Str value identifying lock holder for subsequent exclusive access
         @param lock_info  Dict value for additional attributes describing lock
+        @param wait_timeout  Secs to wait for the lock to be released if currently held
         @retval  bool - could lock be acquired?
         """
+        return self.acquire_lock_token(key, timeout, lock_holder, lock_info, wait_timeout) is not None
+
+    def acquire_lock_token(self, key, timeout=LOCK_EXPIRES_DEFAULT, lock_holder=None, lock_info=None, wait_timeout=0):
+        """
+        Same as acquire_lock, but returns the lock's fencing token or None if not acquired.
+        Fencing tokens increase monotonically with every new acquisition of any lock and are kept
+        when the holder renews, so that resources can reject requests from outdated lock holders.
+        While waiting, wakes up when the lock is released or when the current lock expires.
+        """
         if not key:
             raise BadRequest("Missing argument: key")
         if "/" in key:
             raise BadRequest("Invalid argument value: key")
 
-        lock_attrs = {LOCK_EXPIRES_ATTR: get_ion_ts_millis() + int(1000*timeout) if timeout else 0,
-                      LOCK_HOLDER_ATTR: lock_holder or ""}
-        if lock_info:
-            lock_attrs.update(lock_info)
-        expires = int(lock_attrs[LOCK_EXPIRES_ATTR])  # Check type just to be sure
-        if expires and get_ion_ts_millis() > expires:
-            raise BadRequest("Invalid lock expiration value: %s", expires)
-
-        direntry = self._create_dir_entry(LOCK_DIR_PATH, key, attributes=lock_attrs)
-        lock_result = False
-        try:
-            # This is an atomic operation. It relies on the unique key constraint of the directory service
-            self.dir_store.create(direntry, create_unique_directory_id())
-            lock_result = True
-        except BadRequest as ex:
-            if ex.message.startswith("DirEntry already exists"):
-                de_old = self.lookup(LOCK_DIR_PATH, key, return_entry=True)
-                if de_old:
-                    if self._is_lock_expired(de_old):
-                        # Lock is expired: remove, try to relock
-                        # Note: even as holder, it's safer to reacquire in this case than renew
-                        log.warn("Removing expired lock: %s/%s", de_old.parent, de_old.key)
-                        try:
-                            # This is safe, because of lock was deleted + recreated in the meantime, it has different id
-                            self._delete_lock(de_old)
-                            # Try recreate - may fail again due to concurrency
-                            self.dir_store.create(direntry, create_unique_directory_id())
-                            lock_result = True
-                        except BadRequest as ex:
-                            if not ex.message.startswith("DirEntry already exists"):
-                                log.exception("Error releasing/reacquiring expired lock %s", de_old.key)
-                        except Exception:
-                            log.exception("Error releasing/reacquiring expired lock %s", de_old.key)
-                    elif lock_holder and de_old.attributes[LOCK_HOLDER_ATTR] == lock_holder:
-                        # Holder currently holds the lock: renew
-                        log.debug("Renewing lock %s/%s for holder %s", de_old.parent, de_old.key, lock_holder)
-                        de_old.attributes = lock_attrs
-                        try:
-                            self.dir_store.update(de_old)
-                            lock_result = True
-                        except Exception:
-                            log.exception("Error renewing expired lock %s", de_old.key)
-                # We do nothing if we could not find the lock now...
-            else:
-                raise
-
-        log.debug("Directory.acquire_lock(%s): %s -> %s", key, lock_attrs, lock_result)
-
-        return lock_result
+        wait_until = time.time() + wait_timeout if wait_timeout else 0
+        while True:
+            release_event = self._add_lock_waiter(key) if wait_timeout else None
+            try:
+                fence = self._acquire_lock(key, timeout, lock_holder, lock_info)
+                wait_time = wait_until - time.time()
+                if fence is not None or wait_time <= 0:
+                    return fence
+                release_event.wait(timeout=min(wait_time, self._get_lock_wait_time(key)))
+            finally:
+                if release_event:
+                    self._remove_lock_waiter(key, release_event)
+
+    def acquire_lease(self, key, timeout=LOCK_EXPIRES_DEFAULT, lock_holder=None, lock_info=None, wait_timeout=0):
+        """
+        Acquires a lock and keeps renewing it in the background until released.
+        @param timeout  Secs of lease duration, renewed after a third of this time
+        @retval  DirectoryLease or None if lock could not be acquired
+        """
+        if not timeout:
+            raise BadRequest("Lease requires a lock timeout")
+        lock_holder = lock_holder or create_unique_directory_id()
+        fence = self.acquire_lock_token(key, timeout, lock_holder, lock_info, wait_timeout)
+        if fence is None:
+            return None
+        return DirectoryLease(self, key, timeout, lock_holder, fence, lock_info)
 
     def is_locked(self, key):
         if not key:
@@ -382,35 +417,92 @@ class Directory(object):
 
         log.debug("Directory.release_lock(%s)", key)
 
-        dir_entry = self.lookup(LOCK_DIR_PATH, key, return_entry=True)
-        if dir_entry:
-            if lock_holder and dir_entry.attributes[LOCK_HOLDER_ATTR] != lock_holder:
+        released = self.dir_store.release_dir_locks(self.orgname, LOCK_DIR_PATH, key=key, lock_holder=lock_holder)
+        if not released:
+            if self.lookup(LOCK_DIR_PATH, key, return_entry=True):
                 raise BadRequest("Cannot release lock - not currently lock holder")
-            self._delete_lock(dir_entry)
-        else:
             raise NotFound("Lock %s not found" % key)
 
     def release_expired_locks(self):
         """Removes all expired locks
         """
-        de_list = self.find_child_entries(LOCK_DIR_PATH, direct_only=True)
-        for de in de_list:
-            if self._is_lock_expired(de):
-                log.warn("Removing expired lock %s/%s", de.parent, de.key)
-                try:
-                    # This is safe, because if lock was deleted + recreated in the meantime, it has different id
-                    self._delete_lock(de)
-                except Exception:
-                    log.exception("Error releasing expired lock %s", de.key)
+        released = self.dir_store.release_dir_locks(self.orgname, LOCK_DIR_PATH, expired_time=get_ion_ts_millis())
+        if released:
+            log.warn("Removed %s expired locks: %s", len(released), released)
+        return released
+
+    def _acquire_lock(self, key, timeout, lock_holder, lock_info):
+        cur_time = get_ion_ts_millis()
+        lock_attrs = {LOCK_EXPIRES_ATTR: cur_time + int(1000*timeout) if timeout else 0,
+                      LOCK_HOLDER_ATTR: lock_holder or ""}
+        if lock_info:
+            lock_attrs.update(lock_info)
+        expires = int(lock_attrs[LOCK_EXPIRES_ATTR])  # Check type just to be sure
+        if expires and cur_time > expires:
+            raise BadRequest("Invalid lock expiration value: %s", expires)
+
+        direntry = self._create_dir_entry(LOCK_DIR_PATH, key, attributes=lock_attrs)
+        # This is an atomic operation. It relies on the unique key constraint of the directory service
+        fence = self.dir_store.acquire_dir_lock(direntry, create_unique_directory_id(),
+                                                lock_holder=lock_holder, cur_time=cur_time)
+
+        log.debug("Directory.acquire_lock(%s): %s -> %s", key, lock_attrs, fence)
+        return fence
 
     def _is_lock_expired(self, lock_entry):
         if not lock_entry:
             raise BadRequest("No lock entry provided")
         return 0 < lock_entry.attributes[LOCK_EXPIRES_ATTR] <= get_ion_ts_millis()
 
-    def _delete_lock(self, lock_entry):
-        lock_entry_id = lock_entry._id
-        self.dir_store.delete(lock_entry_id)
+    def _get_lock_wait_time(self, key):
+        """ Returns secs until the current lock expires and can be taken over """
+        lock_entry = self.lookup(LOCK_DIR_PATH, key, return_entry=True)
+        if not lock_entry:
+            return 0
+        expires = lock_entry.attributes.get(LOCK_EXPIRES_ATTR, 0)
+        if not expires:
+            return LOCK_WAIT_POLL
+        return max(expires - get_ion_ts_millis(), 0) / 1000.0 + 0.05
+
+    def _add_lock_waiter(self, key):
+        self._ensure_lock_listener()
+        release_event = Event()
+        self._lock_waiters.setdefault(key, []).append(release_event)
+        return release_event
+
+    def _remove_lock_waiter(self, key, release_event):
+        waiters = self._lock_waiters.get(key, None)
+        if waiters and release_event in waiters:
+            waiters.remove(release_event)
+            if not waiters:
+                del self._lock_waiters[key]
+
+    def _ensure_lock_listener(self):
+        """ Lazily starts one listener for lock release notifications, shared by all waiters """
+        if self._lock_listener is None:
+            self._lock_listener_quit = Event()
+            self._lock_listener = spawn(self._lock_listener_loop)
+
+    def _lock_listener_loop(self):
+        try:
+            self.dir_store.listen_dir_locks(self._receive_lock_release, self._lock_listener_quit)
+        except Exception:
+            # Waiters fall back to periodic checks until the next waiter restarts the listener
+            log.warn("Directory lock listener failed", exc_info=True)
+        finally:
+            self._lock_listener = None
+
+    def _receive_lock_release(self, key):
+        for release_event in self._lock_waiters.pop(key, []):
+            release_event.set()
+
+    def _stop_lock_listener(self):
+        for lease in list(self._leases):
+            lease.stop()
+        if self._lock_listener:
+            self._lock_listener_quit.set()
+            self._lock_listener.kill()
+            self._lock_listener = None
 
     # -------------------------------------------------------------------------
     # Internal functions
@@ -419,6 +511,115 @@ class Directory(object):
         # @TODO add support to fold updated config into container config
         pass
 
+    # -------------------------------------------------------------------------
+    # Local replica and change watch
+
+    def watch(self, parent, callback):
+        """
+        Registers a callback for changes to direct child entries of given parent, by any container.
+        The callback is called with arguments (parent, key, mod_type) after the local replica was updated.
+        Requires directory change events to be enabled.
+        """
+        if not type(parent) is str or not parent.startswith("/"):
+            raise BadRequest("Illegal argument parent: %s" % parent)
+        if not self.events_enabled:
+            raise BadRequest("Directory change events not enabled")
+        if not callable(callback):
+            raise BadRequest("Illegal argument callback")
+        self._ensure_change_subscriber()
+        self._watchers.setdefault(parent, []).append(callback)
+
+    def unwatch(self, parent, callback):
+        """
+        Removes a callback previously registered with watch.
+        """
+        callbacks = self._watchers.get(parent, None)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self._watchers[parent]
+
+    def _ensure_change_subscriber(self):
+        """
+        Starts listening to directory change events, as soon as the container can receive messages.
+        Returns True if changes are being received.
+        """
+        if self.event_sub:
+            return True
+        if not self.events_enabled or not self.container.has_capability(CCAP.EXCHANGE_MANAGER):
+            return False
+        self.event_sub = EventSubscriber(event_type="DirectoryModifiedEvent",
+                                         origin=self.orgname + ".DIR",
+                                         callback=self._receive_change_event)
+        self.event_sub.start()
+        return True
+
+    def _receive_change_event(self, event, headers):
+        parent, key = event.parent, event.key
+        if event.container_id and event.container_id == self.container.id:
+            # Change event for own write - the replica is already up to date
+            pass
+        elif key:
+            self._cache_invalidate(parent)
+        else:
+            # Entry was removed by path: parent is the path of the removed entry
+            self._cache_invalidate(parent)
+            self._cache_invalidate(parent.rsplit("/", 1)[0] or "/")
+
+        for callback in self._watchers.get(parent, ()):
+            try:
+                callback(parent, key, event.mod_type)
+            except Exception:
+                log.exception("Error in directory watch callback for %s", parent)
+
+    def _is_cache_active(self, parent):
+        # Locks are not cached - they are changed without change events and must be read consistently
+        return self.cache_enabled and parent != LOCK_DIR_PATH and self._ensure_change_subscriber()
+
+    def _get_cached_children(self, parent):
+        """
+        Returns dict key -> DirEntry for all direct children of parent, loading them on first access.
+        """
+        children = self._cache.get(parent, None)
+        if children is None:
+            cache_gen = self._cache_gen.get(parent, 0)
+            de_list = self._find_direct_children(parent)
+            children = {de.key: de for de in de_list}
+            # Only keep if no change was received while loading
+            if self._cache_gen.get(parent, 0) == cache_gen:
+                self._cache[parent] = children
+        return children
+
+    def _cache_put(self, direntry):
+        children = self._cache.get(direntry.parent, None)
+        if children is not None:
+            children[direntry.key] = self._copy_entry(direntry)
+
+    def _cache_remove(self, direntry):
+        children = self._cache.get(direntry.parent, None)
+        if children is not None:
+            children.pop(direntry.key, None)
+
+    def _cache_invalidate(self, parent):
+        self._cache.pop(parent, None)
+        self._cache_gen[parent] = self._cache_gen.get(parent, 0) + 1
+
+    def _copy_entry(self, direntry):
+        # Callers may modify returned entries - never hand out the replica's objects
+        return copy.deepcopy(direntry) if direntry is not None else None
+
+    def _read_by_path_cached(self, path):
+        """
+        Like _read_by_path, but served from the local replica if enabled.
+        """
+        if path is None:
+            raise BadRequest("Illegal arguments")
+        parent, key = path.rsplit("/", 1)
+        parent = parent or "/"
+        if self._is_cache_active(parent):
+            return self._copy_entry(self._get_cached_children(parent).get(key, None))
+        return self._read_by_path(path)
+
 
     def _get_path(self, parent, key):
         """
@@ -501,7 +702,8 @@ class Directory(object):
                     pe_list.append(direntry)
                     if create:
                         try:
-                            self.dir_store.create(direntry, create_unique_directory_id())
+                            direntry._id, direntry._rev = self.dir_store.create(direntry, create_unique_directory_id())
+                            self._cache_put(direntry)
                         except BadRequest as ex:
                             if not ex.message.startswith("DirEntry already exists"):
                                 raise
@@ -533,6 +735,7 @@ class Directory(object):
             for de in remove_list:
                 try:
                     self.dir_store.delete(de)
+                    self._cache_remove(de)
                 except Exception as ex:
                     log.warn("Removal of outdated %s directory entry failed: %s" % (common, de))
             log.info("Cleanup of %s old %s directory entries succeeded" % (len(remove_list), common))
@@ -542,3 +745,74 @@ class Directory(object):
                 common, str(ex)))
 
         return newest_entry
+
+
+class DirectoryLease(object):
+    """
+    A lock held by a holder and renewed in the background until released or lost.
+    The fencing token identifies this acquisition of the lock; pass it on to resources
+    that need to reject requests from a previous, outdated lock holder.
+    """
+
+    def __init__(self, directory, key, timeout, lock_holder, fence, lock_info=None):
+        self.directory = directory
+        self.key = key
+        self.timeout = timeout
+        self.lock_holder = lock_holder
+        self.fence = fence
+        self.lock_info = lock_info
+        self.expires = get_ion_ts_millis() + int(1000*timeout)
+        self.lost_callback = None       # Callable cb(lease) when renewal fails
+
+        self._renew_quit = Event()
+        self._renew_thread = spawn(self._renew_loop)
+        self.directory._leases.add(self)
+
+    def is_valid(self):
+        """ Returns True if the lease was not released, lost or expired """
+        return self.fence is not None and get_ion_ts_millis() < self.expires
+
+    def renew(self):
+        """ Renews the lease now. Returns True if still held with the same fencing token """
+        if self.fence is None:
+            return False
+        renew_time = get_ion_ts_millis()
+        fence = self.directory.acquire_lock_token(self.key, self.timeout, self.lock_holder, self.lock_info)
+        if fence is not None and fence == self.fence:
+            self.expires = renew_time + int(1000*self.timeout)
+            return True
+        log.warn("Lease %s lost by %s (fence %s -> %s)", self.key, self.lock_holder, self.fence, fence)
+        if fence is not None:
+            # Reacquired after expiration: another holder may have held the lock in between
+            try:
+                self.directory.release_lock(self.key, lock_holder=self.lock_holder)
+            except Exception:
+                pass
+        self.stop()
+        if self.lost_callback:
+            self.lost_callback(self)
+        return False
+
+    def release(self):
+        """ Stops renewal and releases the lock if still held """
+        was_held = self.fence is not None
+        self.stop()
+        if was_held:
+            try:
+                self.directory.release_lock(self.key, lock_holder=self.lock_holder)
+            except (BadRequest, NotFound):
+                # Lock expired and was taken over or removed
+                pass
+
+    def stop(self):
+        self.fence = None
+        self.directory._leases.discard(self)
+        self._renew_quit.set()
+
+    def _renew_loop(self):
+        while not self._renew_quit.wait(timeout=self.timeout / 3.0):
+            try:
+                if not self.renew():
+                    break
+            except Exception:
+                log.exception("Error renewing lease %s", self.key)
@@ -4,6 +4,7 @@
 
 __author__ = 'Michael Meisinger, David Stuebe, Dave Foster <dfoster@asascience.com>'
 
+import time
 from gevent.timeout import Timeout
 
 from pyon.core import MSG_HEADER_ACTOR, MSG_HEADER_VALID, MSG_HEADER_ROLES, MSG_HEADER_TOKENS
@@ -13,6 +14,7 @@ from pyon.net.endpoint import (Publisher, Subscriber, EndpointUnit, process_inte
         BaseEndpoint, RPCClient, RPCResponseEndpointUnit, RPCServer, PublisherEndpointUnit, SubscriberEndpointUnit)
 from pyon.ion.event import BaseEventSubscriberMixin
 from pyon.util.log import log
+from pyon.util.span_tracer import SpanTracer, SPAN_KIND_INTERNAL
 
 
 # -----------------------------------------------------------------------------
@@ -241,7 +243,10 @@ class ProcessRPCResponseEndpointUnit(ProcessEndpointUnitMixin, RPCResponseEndpoi
         """
         gc = self._routing_obj.container.governance_controller
         if gc:
+            start_time = time.time()
             gc.check_process_operation_preconditions(self._routing_obj, msg, headers)
+            if SpanTracer.enabled:
+                SpanTracer.record_child_span(headers, "preconditions", SPAN_KIND_INTERNAL, start_time)
 
         result, response_headers = RPCResponseEndpointUnit.message_received(self, msg, headers)
 
@@ -284,7 +289,7 @@ class ProcessRPCResponseEndpointUnit(ProcessEndpointUnitMixin, RPCResponseEndpoi
         if hasattr(self._process, "_proc_state"):
             if self._process._proc_state_changed:
                 log.debug("Process %s state changed. State=%s", self._process.id, self._process._proc_state)
-                self._process._flush_state()
+                self._process._flush_state(sync=False)
         return res
 
     def _get_process_saturation(self):
@@ -63,6 +63,19 @@ class ObjectStore(object):
         return self.obj_store.update_doc_mult(docs)
 
 
+    def upsert(self, obj, object_id=None):
+        return self.obj_store.upsert(obj, object_id=object_id)
+
+    def upsert_doc(self, doc, object_id=None):
+        return self.obj_store.upsert_doc(doc, object_id=object_id)
+
+    def upsert_mult(self, objects, object_ids=None):
+        return self.obj_store.upsert_mult(objects, object_ids=object_ids)
+
+    def upsert_doc_mult(self, docs, object_ids=None):
+        return self.obj_store.upsert_doc_mult(docs, object_ids=object_ids)
+
+
     def delete(self, obj):
         return self.obj_store.delete(obj)
 
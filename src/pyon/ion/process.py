@@ -2,14 +2,17 @@
 
 __author__ = 'Adam R. Smith, Michael Meisinger, Dave Foster <dfoster@asascience.com>'
 
+import math
 import threading
+import time
 import traceback
 import gevent
 from gevent import greenlet, Timeout
 from gevent.event import Event, AsyncResult
+from gevent.pool import Pool
 from gevent.queue import Queue
 
-from pyon.core import MSG_HEADER_ACTOR
+from pyon.core import MSG_HEADER_ACTOR, MSG_HEADER_TRACE, MSG_HEADER_SPAN, MSG_HEADER_SAMPLED
 from pyon.core.bootstrap import CFG
 from pyon.core.exception import IonException, ContainerError
 from pyon.core.exception import Timeout as IonTimeout
@@ -18,6 +21,7 @@ from pyon.datastore.postgresql.pg_util import init_db_stats, get_db_stats, clear
 from pyon.ion.service import BaseService
 from pyon.util.containers import get_ion_ts, get_ion_ts_millis
 from pyon.util.log import log
+from pyon.util.span_tracer import SpanTracer, SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, NOT_SAMPLED
 
 STAT_INTERVAL_LENGTH = 60000  # Interval time for process saturation stats collection
 
@@ -39,13 +43,23 @@ class IonProcessError(StandardError):
     pass
 
 
+def exclusive_operation(func):
+    """
+    Decorator for service operations (and subscriber callbacks) that must not run concurrently
+    with any other call of the same ION process. Only relevant for processes configured with
+    process.max_concurrency > 1; otherwise all calls are serialized anyways.
+    """
+    func._exclusive_op = True
+    return func
+
+
 class IonProcessThread(PyonThread):
     """
     The control part of an ION process.
     """
 
     def __init__(self, target=None, listeners=None, name=None, service=None, cleanup_method=None,
-                 heartbeat_secs=10, **kwargs):
+                 heartbeat_secs=10, max_concurrency=None, **kwargs):
         """
         Constructs the control part of an ION process.
         Used by the container's IonProcessThreadManager, as part of spawn_process.
@@ -59,6 +73,8 @@ class IonProcessThread(PyonThread):
         @param  cleanup_method  An optional callable to run when the process is stopping. Runs after all other
                                 notify_stop calls have run. Should take one param, this instance.
         @param  heartbeat_secs  Number of seconds to wait in between heartbeats.
+        @param  max_concurrency Number of calls to execute concurrently. If None, uses process.max_concurrency
+                                from the service config or container.process.max_concurrency (default 1=serial).
         """
         self._startup_listeners = listeners or []
         self.listeners          = []
@@ -74,6 +90,8 @@ class IonProcessThread(PyonThread):
         self._ready_control     = Event()
         self._errors            = []
         self._ctrl_current      = None      # set to the AR generated by _routing_call when in the context of a call
+        self._ctrl_active       = {}        # AR -> (greenlet, start time) for all calls currently executing
+        self._ctrl_workers      = None      # Pool of worker greenlets in concurrent mode
 
         # processing vs idle time (ms)
         self._start_time        = None
@@ -81,6 +99,9 @@ class IonProcessThread(PyonThread):
         self._proc_time_prior   = 0   # busy time at the beginning of the prior interval
         self._proc_time_prior2  = 0   # busy time at the beginning of 2 interval's ago
         self._proc_interval_num = 0   # interval num of last record
+        self._proc_time_mark    = 0   # time up to which busy time was accounted (for overlapping calls)
+        self._op_count          = 0   # number of calls executed
+        self._op_latency        = 0.0 # moving average of call execution time (ms)
 
         # for heartbeats, used to detect stuck processes
         self._heartbeat_secs    = heartbeat_secs    # amount of time to wait between heartbeats
@@ -93,6 +114,23 @@ class IonProcessThread(PyonThread):
         self._log_call_dbstats = CFG.get_safe("container.process.log_dbstats", False)
         self._warn_call_dbstmt_threshold = CFG.get_safe("container.process.warn_dbstmt_threshold", 0)
 
+        svc_cfg = getattr(service, "CFG", None)
+        if max_concurrency is None:
+            if svc_cfg is not None:
+                max_concurrency = svc_cfg.get_safe("process.max_concurrency", None)
+            if max_concurrency is None:
+                max_concurrency = CFG.get_safe("container.process.max_concurrency", 1)
+        self._max_concurrency = max(int(max_concurrency or 1), 1)
+        self._exclusive_ops = set(svc_cfg.get_safe("process.exclusive_ops", None) or []) if svc_cfg is not None else set()
+
+        prefetch_cfg = CFG.get_safe("container.messaging.endpoint.adaptive_prefetch") or {}
+        self._adaptive_prefetch = prefetch_cfg.get("enabled", False) is True
+        self._prefetch_max = int(prefetch_cfg.get("max_prefetch", 20))
+        self._prefetch_buffer_time = float(prefetch_cfg.get("buffer_time", 50))
+        self._prefetch_hysteresis = float(prefetch_cfg.get("hysteresis", 0.25))
+        self._prefetch_stable_beats = int(prefetch_cfg.get("stable_heartbeats", 3))
+        self._prefetch_change_beats = 0     # Number of consecutive heartbeats with target outside the band
+
         PyonThread.__init__(self, target=target, **kwargs)
 
     def heartbeat(self):
@@ -116,10 +154,11 @@ class IonProcessThread(PyonThread):
 
         # are we currently processing something?
         heartbeat_ok = True
-        if self._ctrl_current is not None:
-            st = traceback.extract_stack(self._ctrl_thread.proc.gr_frame)
+        cur_ar, cur_gl = self._get_current_call()
+        if cur_ar is not None:
+            st = traceback.extract_stack(cur_gl.gr_frame)
 
-            if self._ctrl_current == self._heartbeat_op:
+            if cur_ar == self._heartbeat_op:
 
                 if st == self._heartbeat_stack:
                     self._heartbeat_count += 1  # we've seen this before! increment count
@@ -134,7 +173,7 @@ class IonProcessThread(PyonThread):
                     self._heartbeat_stack = st
                     self._heartbeat_time  = get_ion_ts()
             else:
-                self._heartbeat_op      = self._ctrl_current
+                self._heartbeat_op      = cur_ar
                 self._heartbeat_count   = 1
                 self._heartbeat_time    = get_ion_ts()
                 self._heartbeat_stack   = st
@@ -146,6 +185,19 @@ class IonProcessThread(PyonThread):
         #log.debug("%s %s %s", listeners_ok, ctrl_thread_ok, heartbeat_ok)
         return (listeners_ok, ctrl_thread_ok, heartbeat_ok)
 
+    def _get_current_call(self):
+        """
+        Returns a tuple (AR, greenlet) of the call to watch for heartbeats: the call executing in the
+        control greenlet, or else the longest running call in a worker greenlet, or (None, None).
+        """
+        if self._ctrl_current is not None:
+            return self._ctrl_current, self._ctrl_thread.proc
+        active_calls = self._ctrl_active.items()
+        if active_calls:
+            ar, (call_gl, _) = min(active_calls, key=lambda item: item[1][1])
+            return ar, call_gl
+        return None, None
+
     @property
     def time_stats(self):
         """
@@ -168,6 +220,70 @@ class IonProcessThread(PyonThread):
 
         return (running_time, idle_time, self._proc_time, now_since_prior, proc_time_since_prior)
 
+    def get_load_stats(self, queue_stats=False):
+        """
+        Returns a dict with current load indicators of this process, as published in container heartbeats.
+        Saturation is the percentage of busy time in the current and prior stats interval, op_latency
+        the moving average call execution time in ms.
+        @param  queue_stats     If True, adds the number of messages waiting in the listener queues
+                                (requires a broker call per listener)
+        """
+        _, _, _, interval, interval_run = self.time_stats
+        load_stats = dict(queue_depth=self._ctrl_queue.qsize(),
+                          active=len(self._ctrl_active),
+                          concurrency=self._max_concurrency,
+                          saturation=int(interval_run / float(interval) * 100) if interval else 0,
+                          op_count=self._op_count,
+                          op_latency=round(self._op_latency, 1))
+        if queue_stats:
+            msg_backlog = 0
+            for listener in self.listeners:
+                try:
+                    msg_backlog += listener.get_stats()[0] or 0
+                except Exception:
+                    log.debug("Could not get queue stats for listener %s", listener)
+            load_stats["msg_backlog"] = msg_backlog
+        return load_stats
+
+    def _get_target_prefetch(self):
+        """
+        Returns the prefetch count per listener that buffers about buffer_time ms of work per worker,
+        given the current average call latency, bounded by concurrency and max_prefetch. Slow calls
+        thereby leave messages in the queue for other replicas of the same service.
+        """
+        min_prefetch = self._max_concurrency
+        latency = max(self._op_latency, 1.0)
+        target = min_prefetch * int(math.ceil(self._prefetch_buffer_time / latency))
+        return max(min_prefetch, min(target, self._prefetch_max))
+
+    def _adapt_prefetch(self):
+        """
+        Adjusts the prefetch count of all listeners to the measured call latency.
+        Changing the prefetch re-creates the consumer, so an already set prefetch count is only
+        changed when the target differs by more than the hysteresis fraction for stable_heartbeats
+        consecutive heartbeats. This avoids thrashing when the latency hovers around a threshold.
+        """
+        if not self._op_count:
+            return
+        target = self._get_target_prefetch()
+        prefetch_counts = [getattr(listener, "prefetch_count", None) for listener in self.listeners]
+        if any(self._is_prefetch_change(current, target) for current in prefetch_counts if current is not None):
+            self._prefetch_change_beats += 1
+        else:
+            self._prefetch_change_beats = 0
+        is_stable = self._prefetch_change_beats >= self._prefetch_stable_beats
+
+        for listener, current in zip(self.listeners, prefetch_counts):
+            if current is None or (is_stable and self._is_prefetch_change(current, target)):
+                log.debug("Process %s listener %s: set prefetch to %s (op latency %.1f ms)",
+                          self.name, listener, target, self._op_latency)
+                listener.set_prefetch(target)
+        if is_stable:
+            self._prefetch_change_beats = 0
+
+    def _is_prefetch_change(self, current, target):
+        return abs(target - current) > current * self._prefetch_hysteresis
+
     def _child_failed(self, child):
         """
         Callback from gevent as set in the TheadManager, when a child greenlet fails.
@@ -194,6 +310,8 @@ class IonProcessThread(PyonThread):
         """
         if self.proc:
             listener.routing_call = self._routing_call
+            if self._max_concurrency > 1:
+                listener.max_concurrency = self._max_concurrency
 
             if self.name:
                 svc_name = "unnamed-service"
@@ -248,6 +366,12 @@ class IonProcessThread(PyonThread):
 
         # wait on control flow loop, heartbeating as appropriate
         while not self._ctrl_thread.ev_exit.wait(timeout=self._heartbeat_secs):
+            if self._adaptive_prefetch:
+                try:
+                    self._adapt_prefetch()
+                except Exception:
+                    log.exception("Error adapting listener prefetch for process %s", self)
+
             hbst = self.heartbeat()
 
             if not all(hbst):
@@ -321,7 +445,12 @@ class IonProcessThread(PyonThread):
         The pending call is keyed by the AsyncResult returned by _routing_call.
         """
         if not self._cancel_pending_call(ar) and not ar.ready():
-            self._interrupt_control_thread()
+            active_call = self._ctrl_active.get(ar, None)
+            if active_call and active_call[0] is not self._ctrl_thread.proc:
+                # Call executes in a worker greenlet - only abort this one
+                active_call[0].kill(exception=OperationInterruptedException, block=False)
+            else:
+                self._interrupt_control_thread()
 
     def _control_flow(self):
         """
@@ -335,6 +464,10 @@ class IonProcessThread(PyonThread):
         then calls from within this greenlet.  Any exception raised is caught and re-raised
         in the greenlet that originally scheduled the call.  If successful, the AsyncResult
         created at scheduling time is set with the result of the call.
+
+        With max_concurrency > 1, calls are handed to a pool of worker greenlets instead, in queue
+        order. Calls marked exclusive (see exclusive_operation) wait for all running calls to
+        complete and then execute in this greenlet, blocking subsequent calls until done.
         """
         svc_name = getattr(self.service, "name", "unnamed-service") if self.service else "unnamed-service"
         proc_id = getattr(self.service, "id", "unknown-pid") if self.service else "unknown-pid"
@@ -342,112 +475,189 @@ class IonProcessThread(PyonThread):
             threading.current_thread().name = "%s-%s" % (svc_name, self.name)
         thread_base_name = threading.current_thread().name
 
+        if self._max_concurrency > 1:
+            self._ctrl_workers = Pool(size=self._max_concurrency)
+
         self._ready_control.set()
 
-        for calltuple in self._ctrl_queue:
-            calling_gl, ar, call, callargs, callkwargs, context = calltuple
-            request_id = (context or {}).get("request-id", None)
-            if request_id:
-                threading.current_thread().name = thread_base_name + "-" + str(request_id)
-            #log.debug("control_flow making call: %s %s %s (has context: %s)", call, callargs, callkwargs, context is not None)
+        workers = self._ctrl_workers
+        try:
+            while True:
+                exclusive = False
+                if workers is not None:
+                    # Only dequeue when a worker is available, so that waiting calls remain pending (cancelable)
+                    workers.wait_available()
+                    calltuple = self._ctrl_queue.peek()
+                    if calltuple is not StopIteration and self._is_exclusive_call(calltuple[2]):
+                        exclusive = True
+                        workers.join()
+
+                calltuple = self._ctrl_queue.get()
+                if calltuple is StopIteration:
+                    break
+
+                if workers is None or exclusive:
+                    self._execute_call(calltuple, svc_name, proc_id, thread_base_name)
+                else:
+                    workers.spawn(self._execute_call, calltuple, svc_name, proc_id, thread_base_name)
 
-            res = None
-            start_proc_time = get_ion_ts_millis()
-            self._record_proc_time(start_proc_time)
+            if workers is not None:
+                workers.join()
+        finally:
+            if workers is not None:
+                workers.kill(block=False)
 
-            # check context for expiration
-            if context is not None and 'reply-by' in context:
-                if start_proc_time >= int(context['reply-by']):
-                    log.info("control_flow: attempting to process message already exceeding reply-by, ignore")
+    def _is_exclusive_call(self, call):
+        """
+        Returns True if the given call must not execute concurrently with other calls.
+        """
+        if getattr(call, "_exclusive_op", False) is True:
+            return True
+        return getattr(call, "__name__", None) in self._exclusive_ops
+
+    def _execute_call(self, calltuple, svc_name, proc_id, thread_base_name):
+        """
+        Executes one call from the control queue in the current greenlet (control greenlet or worker).
+        """
+        calling_gl, ar, call, callargs, callkwargs, context = calltuple
+        request_id = (context or {}).get("request-id", None)
+        if request_id:
+            threading.current_thread().name = thread_base_name + "-" + str(request_id)
+        #log.debug("control_flow making call: %s %s %s (has context: %s)", call, callargs, callkwargs, context is not None)
+
+        res = None
+        start_proc_time = get_ion_ts_millis()
+        self._record_proc_time(start_proc_time)
+
+        # check context for expiration
+        if context is not None and 'reply-by' in context:
+            if start_proc_time >= int(context['reply-by']):
+                log.info("control_flow: attempting to process message already exceeding reply-by, ignore")
+
+                # raise a timeout in the calling thread to allow endpoints to continue processing
+                e = IonTimeout("Reply-by time has already occurred (reply-by: %s, op start time: %s)" % (context['reply-by'], start_proc_time))
+                calling_gl.kill(exception=e, block=False)
+
+                return
+
+        # If ar is set, means it is cancelled
+        if ar.ready():
+            log.info("control_flow: attempting to process message that has been cancelled, ignore")
+            return
+
+        cur_gl = greenlet.getcurrent()
+        is_ctrl_gl = self._ctrl_thread is None or cur_gl is self._ctrl_thread.proc
+        self._ctrl_active[ar] = (cur_gl, start_proc_time)
+        start_op_time = time.time()
+
+        op_span = None
+        if SpanTracer.enabled and context and MSG_HEADER_TRACE in context:
+            # Traced request: record queue wait since send and make the operation span the parent
+            # of nested calls by propagating it in the call context
+            trace_id, parent_id = context[MSG_HEADER_TRACE], context.get(MSG_HEADER_SPAN, None)
+            if "ts" in context:
+                SpanTracer.record_span(trace_id, None, parent_id, "queue", SPAN_KIND_INTERNAL,
+                                       min(int(context["ts"]) / 1000.0, start_op_time), start_op_time)
+            op_span_id = SpanTracer.new_span_id()
+            op_span = (trace_id, op_span_id, parent_id, SpanTracer.push_span(trace_id, op_span_id))
+            context = dict(context)
+            context[MSG_HEADER_SPAN] = op_span_id
+        elif SpanTracer.enabled and context and context.get(MSG_HEADER_SAMPLED, None) == "0":
+            # Unsampled request: calls without call context keep the sampling decision of the root
+            op_span = (None, None, None, SpanTracer.push_span(*NOT_SAMPLED))
+
+        init_db_stats()
+        try:
+            # ******************************************************************
+            # ****** THIS IS WHERE THE RPC OPERATION/SERVICE CALL IS MADE ******
 
-                    # raise a timeout in the calling thread to allow endpoints to continue processing
-                    e = IonTimeout("Reply-by time has already occurred (reply-by: %s, op start time: %s)" % (context['reply-by'], start_proc_time))
-                    calling_gl.kill(exception=e, block=False)
+            with self.service.push_context(context), \
+                 self.service.container.context.push_context(context):
+                if is_ctrl_gl:
+                    self._ctrl_current = ar
+                res = call(*callargs, **callkwargs)
 
-                    continue
+            # ****** END CALL, EXCEPTION HANDLING FOLLOWS                 ******
+            # ******************************************************************
 
-            # If ar is set, means it is cancelled
-            if ar.ready():
-                log.info("control_flow: attempting to process message that has been cancelled, ignore")
-                continue
+        except OperationInterruptedException:
+            # endpoint layer takes care of response as it's the one that caused this
+            log.debug("Operation interrupted")
+            pass
 
-            init_db_stats()
+        except Exception as e:
+            if self._log_call_exception:
+                log.exception("PROCESS exception: %s" % e.message)
+
+            # Raise the exception in the calling greenlet.
+            # Try decorating the args of the exception with the true traceback -
+            # this should be reported by ThreadManager._child_failed
+            exc = PyonThreadTraceback("IonProcessThread _control_flow caught an exception "
+                                      "(call: %s, *args %s, **kwargs %s, context %s)\n"
+                                      "True traceback captured by IonProcessThread' _control_flow:\n\n%s" % (
+                                      call, callargs, callkwargs, context, traceback.format_exc()))
+            e.args = e.args + (exc,)
+
+            if isinstance(e, (TypeError, IonException)):
+                # Pass through known process exceptions, in particular IonException
+                calling_gl.kill(exception=e, block=False)
+            else:
+                # Otherwise, wrap unknown, forward and hopefully we can continue on our way
+                self._errors.append((call, callargs, callkwargs, context, e, exc))
+
+                log.warn(exc)
+                log.warn("Attempting to continue...")
+
+                # Note: Too large exception string will crash the container (when passed on as msg header).
+                exception_str = str(exc)
+                if len(exception_str) > 10000:
+                    exception_str = (
+                        "Exception string representation too large. "
+                        "Begin and end of the exception:\n"
+                        + exception_str[:2000] + "\n...\n" + exception_str[-2000:]
+                    )
+                calling_gl.kill(exception=ContainerError(exception_str), block=False)
+        finally:
             try:
-                # ******************************************************************
-                # ****** THIS IS WHERE THE RPC OPERATION/SERVICE CALL IS MADE ******
-
-                with self.service.push_context(context), \
-                     self.service.container.context.push_context(context):
-                    self._ctrl_current = ar
-                    res = call(*callargs, **callkwargs)
-
-                # ****** END CALL, EXCEPTION HANDLING FOLLOWS                 ******
-                # ******************************************************************
-
-            except OperationInterruptedException:
-                # endpoint layer takes care of response as it's the one that caused this
-                log.debug("Operation interrupted")
-                pass
-
-            except Exception as e:
-                if self._log_call_exception:
-                    log.exception("PROCESS exception: %s" % e.message)
-
-                # Raise the exception in the calling greenlet.
-                # Try decorating the args of the exception with the true traceback -
-                # this should be reported by ThreadManager._child_failed
-                exc = PyonThreadTraceback("IonProcessThread _control_flow caught an exception "
-                                          "(call: %s, *args %s, **kwargs %s, context %s)\n"
-                                          "True traceback captured by IonProcessThread' _control_flow:\n\n%s" % (
-                                          call, callargs, callkwargs, context, traceback.format_exc()))
-                e.args = e.args + (exc,)
-
-                if isinstance(e, (TypeError, IonException)):
-                    # Pass through known process exceptions, in particular IonException
-                    calling_gl.kill(exception=e, block=False)
-                else:
-                    # Otherwise, wrap unknown, forward and hopefully we can continue on our way
-                    self._errors.append((call, callargs, callkwargs, context, e, exc))
-
-                    log.warn(exc)
-                    log.warn("Attempting to continue...")
-
-                    # Note: Too large exception string will crash the container (when passed on as msg header).
-                    exception_str = str(exc)
-                    if len(exception_str) > 10000:
-                        exception_str = (
-                            "Exception string representation too large. "
-                            "Begin and end of the exception:\n"
-                            + exception_str[:2000] + "\n...\n" + exception_str[-2000:]
-                        )
-                    calling_gl.kill(exception=ContainerError(exception_str), block=False)
-            finally:
-                try:
-                    # Compute statistics
-                    self._compute_proc_stats(start_proc_time)
-
-                    db_stats = get_db_stats()
+                # Compute statistics
+                self._compute_proc_stats(start_proc_time)
+
+                db_stats = get_db_stats()
+                if db_stats:
+                    if self._warn_call_dbstmt_threshold > 0 and db_stats.get("count.all", 0) >= self._warn_call_dbstmt_threshold:
+                        stats_str = ", ".join("{}={}".format(k, db_stats[k]) for k in sorted(db_stats.keys()))
+                        log.warn("PROC_OP '%s.%s' EXCEEDED DB THRESHOLD. stats=%s", svc_name, call.__name__, stats_str)
+                    elif self._log_call_dbstats:
+                        stats_str = ", ".join("{}={}".format(k, db_stats[k]) for k in sorted(db_stats.keys()))
+                        log.info("PROC_OP '%s.%s' DB STATS: %s", svc_name, call.__name__, stats_str)
+                clear_db_stats()
+
+                if stats_callback:
+                    stats_callback(proc_id=proc_id, proc_name=self.name, svc=svc_name, op=call.__name__,
+                                   request_id=request_id, context=context, op_time=time.time() - start_op_time,
+                                   db_stats=db_stats, proc_stats=self.time_stats, result=res, exc=None)
+
+                if op_span and op_span[0]:
+                    span_attrs = {"proc_id": proc_id, "db.count": 0}
                     if db_stats:
-                        if self._warn_call_dbstmt_threshold > 0 and db_stats.get("count.all", 0) >= self._warn_call_dbstmt_threshold:
-                            stats_str = ", ".join("{}={}".format(k, db_stats[k]) for k in sorted(db_stats.keys()))
-                            log.warn("PROC_OP '%s.%s' EXCEEDED DB THRESHOLD. stats=%s", svc_name, call.__name__, stats_str)
-                        elif self._log_call_dbstats:
-                            stats_str = ", ".join("{}={}".format(k, db_stats[k]) for k in sorted(db_stats.keys()))
-                            log.info("PROC_OP '%s.%s' DB STATS: %s", svc_name, call.__name__, stats_str)
-                    clear_db_stats()
-
-                    if stats_callback:
-                        stats_callback(proc_id=proc_id, proc_name=self.name, svc=svc_name, op=call.__name__,
-                                       request_id=request_id, context=context,
-                                       db_stats=db_stats, proc_stats=self.time_stats, result=res, exc=None)
-                except Exception:
-                    log.exception("Error computing process call stats")
-
+                        span_attrs["db.count"] = db_stats.get("count.all", 0)
+                        span_attrs["db.time"] = round(db_stats.get("time.all", 0.0), 6)
+                    if request_id:
+                        span_attrs["request_id"] = str(request_id)
+                    SpanTracer.record_span(op_span[0], op_span[1], op_span[2], "%s.%s" % (svc_name, call.__name__),
+                                           SPAN_KIND_SERVER, start_op_time, time.time(), span_attrs)
+            except Exception:
+                log.exception("Error computing process call stats")
+
+            if op_span:
+                SpanTracer.pop_span(op_span[3])
+            self._ctrl_active.pop(ar, None)
+            if is_ctrl_gl:
                 self._ctrl_current = None
-                threading.current_thread().name = thread_base_name
+            threading.current_thread().name = thread_base_name
 
-            # Set response in AsyncEvent of caller (endpoint greenlet)
-            ar.set(res)
+        # Set response in AsyncEvent of caller (endpoint greenlet)
+        ar.set(res)
 
     def _record_proc_time(self, cur_time):
         """ Keep the _proc_time of the prior and prior-prior intervals for stats computation
@@ -468,10 +678,20 @@ class IonProcessThread(PyonThread):
             self._proc_time_prior = self._proc_time
 
     def _compute_proc_stats(self, start_proc_time):
+        """ Adds busy time since the call start. With concurrent calls, overlapping time is only
+        counted once: busy time is accounted from the earliest still active call or the last mark.
+        """
         cur_time = get_ion_ts_millis()
         self._record_proc_time(cur_time)
-        proc_time = cur_time - start_proc_time
-        self._proc_time += proc_time
+        busy_start = min([start_proc_time] + [call_start for _, call_start in self._ctrl_active.itervalues()])
+        busy_start = max(busy_start, self._proc_time_mark)
+        self._proc_time += max(cur_time - busy_start, 0)
+        self._proc_time_mark = cur_time
+
+        # Exponential moving average of call latency
+        latency = cur_time - start_proc_time
+        self._op_latency = latency if not self._op_count else 0.8 * self._op_latency + 0.2 * latency
+        self._op_count += 1
 
     def start_listeners(self):
         """
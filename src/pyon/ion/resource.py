@@ -391,15 +391,31 @@ class ExtendedResourceContainer(object):
                                                 ext_associations=None, ext_exclude=None, **kwargs):
         """
         Returns a list of extended resource containers for given list of resource_ids.
+        All resources, associations and associated resources needed across the list are loaded
+        in bulk upfront, then fields are filled from the in-memory context.
         """
+        overall_start_time = time.time()
+        self.ctx = None  # Clear the context in case this instance gets reused
+
         if not isinstance(resource_id_list, types.ListType):
             raise Inconsistent("The parameter resource_id_list is not a list of resource_ids")
 
-        ret = list()
-        for res_id in resource_id_list:
-            ext_res = self.create_extended_resource_container(extended_resource_type, res_id, computed_resource_type,
-                ext_associations, ext_exclude )
-            ret.append(ext_res)
+        self._validate_container_types(extended_resource_type, computed_resource_type)
+        if not resource_id_list:
+            return []
+
+        resource_objs = self._rr.read_mult(resource_id_list)
+
+        # Initialize context object field and load associations for all resources at once
+        self._prepare_context(resource_id_list)
+        self._add_resources(resource_objs)
+
+        ret = [self._create_container_object(extended_resource_type, res_obj) for res_obj in resource_objs]
+        self._fill_containers(ret, computed_resource_type, ext_associations, ext_exclude, **kwargs)
+
+        overall_stop_time = time.time()
+        log.debug("Time to process %s extended resource containers %s %f secs", len(ret), extended_resource_type,
+                  overall_stop_time - overall_start_time)
 
         return ret
 
@@ -414,6 +430,30 @@ class ExtendedResourceContainer(object):
         if not isinstance(resource_id, types.StringType):
             raise Inconsistent("The parameter resource_id is not a single resource id string")
 
+        self._validate_container_types(extended_resource_type, computed_resource_type)
+
+        resource_object = self._rr.read(resource_id)
+
+        if not resource_object:
+            raise NotFound("The Resource %s does not exist" % resource_id)
+
+        res_container = self._create_container_object(extended_resource_type, resource_object)
+
+        # Initialize context object field and load resource associations
+        self._prepare_context(resource_object._id)
+        self._add_resources([resource_object])
+
+        self._fill_containers([res_container], computed_resource_type, ext_associations, ext_exclude, **kwargs)
+
+        overall_stop_time = time.time()
+
+        log.debug("Time to process extended resource container %s %f secs", extended_resource_type, overall_stop_time - overall_start_time )
+
+        #log.info("ResourceContainer: %s" % res_container)
+
+        return res_container
+
+    def _validate_container_types(self, extended_resource_type, computed_resource_type):
         if not self.service_provider or not self._rr:
             raise Inconsistent("This class is not initialized properly")
 
@@ -423,11 +463,10 @@ class ExtendedResourceContainer(object):
         if computed_resource_type and computed_resource_type not in getextends(OT.BaseComputedAttributes):
             raise BadRequest('The requested resource %s is not extended from %s' % (computed_resource_type, OT.BaseComputedAttributes))
 
-        resource_object = self._rr.read(resource_id)
-
-        if not resource_object:
-            raise NotFound("The Resource %s does not exist" % resource_id)
-
+    def _create_container_object(self, extended_resource_type, resource_object):
+        """
+        Creates the resource container object for a resource and checks the OriginResourceType.
+        """
         res_container = IonObject(extended_resource_type)
 
         # Check to make sure the extended resource decorator raise OriginResourceType matches the type of the resource type
@@ -441,31 +480,38 @@ class ExtendedResourceContainer(object):
 
         res_container._id = resource_object._id
         res_container.resource = resource_object
+        return res_container
 
-        # Initialize context object field and load resource associations
-        self._prepare_context(resource_object._id)
-
-        # Fill lcstate related resource container fields
-        self.set_container_lcstate_info(res_container)
+    def _fill_containers(self, res_containers, computed_resource_type, ext_associations, ext_exclude, **kwargs):
+        """
+        Fills the fields of all given resource containers. Determines the needs of all containers
+        first, then loads the needed associations and resources in bulk, then sets the field values.
+        The context must have been prepared with the associations of the container resources.
+        """
+        all_needs = []
+        for res_container in res_containers:
+            # Fill lcstate related resource container fields
+            self.set_container_lcstate_info(res_container)
 
-        # Fill resource container fields
-        self.set_container_field_values(res_container, ext_exclude, **kwargs)
+            # Determine needs for resource container fields
+            all_needs.append(self._get_object_field_needs(res_container, res_container.resource, ext_exclude, **kwargs))
 
-        # Fill computed attributes
-        self.set_computed_attributes(res_container, computed_resource_type, ext_exclude, **kwargs)
+            # Determine needs for computed attributes
+            if computed_resource_type:
+                res_container.computed = IonObject(computed_resource_type)
+                all_needs.append(self._get_object_field_needs(res_container.computed, res_container.resource, ext_exclude, **kwargs))
 
-        # Fill additional associations
-        self.set_extended_associations(res_container, ext_associations, ext_exclude)
+        # Load all associations and resources needed across all containers
+        self._load_field_needs(all_needs)
 
-        res_container.ts_created = get_ion_ts()
+        for obj_needs in all_needs:
+            self._set_object_field_needs(obj_needs)
 
-        overall_stop_time = time.time()
+        for res_container in res_containers:
+            # Fill additional associations
+            self.set_extended_associations(res_container, ext_associations, ext_exclude)
 
-        log.debug("Time to process extended resource container %s %f secs", extended_resource_type, overall_stop_time - overall_start_time )
-
-        #log.info("ResourceContainer: %s" % res_container)
-
-        return res_container
+            res_container.ts_created = get_ion_ts()
 
     def set_container_lcstate_info(self, res_container):
         """
@@ -503,12 +549,22 @@ class ExtendedResourceContainer(object):
         Iterate through all fields of the given object and set values according
         to the field type and decorator definition in the object type schema.
         """
+        obj_needs = self._get_object_field_needs(obj, resource, ext_exclude, **kwargs)
+        self._load_field_needs([obj_needs])
+        self._set_object_field_needs(obj_needs)
 
-        # Step 1: Determine needs to fill fields with resource objects.
+    def _get_object_field_needs(self, obj, resource, ext_exclude, **kwargs):
+        """
+        Step 1: Iterate through all fields of the given object and determine the associations and
+        resource objects needed to fill fields. Fields not depending on associated resources
+        are set directly. Returns a dict with the needs for this object.
+        """
         field_needs = []         # Fields that need to be set in a subsequent step
         resource_needs = set()   # Resources to read by id based on needs
         assoc_needs = set()      # Compound associations to follow
         final_target_types = {}  # Keeps track of what resource type filter is desired
+        obj_needs = dict(obj=obj, resource=resource, field_needs=field_needs, resource_needs=resource_needs,
+                         assoc_needs=assoc_needs, final_target_types=final_target_types)
 
         for field in obj._schema:
 
@@ -589,18 +645,29 @@ class ExtendedResourceContainer(object):
 
                 #log.debug("Time to process field %s(%s) %f secs", field, decorator, field_stop_time - field_start_time)
 
-        # field_needs contains a list of what's needed to load in next step (different cases)
-        if not field_needs:
-            return
+        return obj_needs
 
+    def _load_field_needs(self, all_needs):
+        """
+        Steps 2 and 3: Loads the associations and resource objects needed by the given list of
+        object needs into the context, with one association query and one resource read for all.
+        """
         # Step 2: Read second level of compound associations as needed
         # @TODO Can only do 2 level compounds for now. Make recursive someday
+        assoc_needs = set()
+        for obj_needs in all_needs:
+            assoc_needs.update(obj_needs["assoc_needs"])
+        assoc_needs.difference_update(self.ctx['assoc_loaded'])
         if assoc_needs:
             assocs = self._rr.find_associations(anyside=list(assoc_needs), id_only=False)
             self._add_associations(assocs)
+            self.ctx['assoc_loaded'].update(assoc_needs)
 
-            # Determine resource ids to read for compound associations
-            for field, need_type, needs in field_needs:
+        # Determine resource ids to read for compound associations
+        resource_needs = set()
+        for obj_needs in all_needs:
+            resource_needs.update(obj_needs["resource_needs"])
+            for field, need_type, needs in obj_needs["field_needs"]:
                 if need_type == 'A':
                     assoc_list, predicates = needs
                     for target_id, assoc in assoc_list:
@@ -609,12 +676,22 @@ class ExtendedResourceContainer(object):
                         for target_id1, assoc1 in assoc_list1:
                             resource_needs.add(target_id1)
 
-        # Step 3: Read resource objects based on needs
-        res_list = self._rr.read_mult(list(resource_needs))
-        res_objs = dict(zip(resource_needs, res_list))
+        # Step 3: Read resource objects based on needs (not already in the context)
+        resource_needs.difference_update(self.ctx['resources'])
+        if resource_needs:
+            resource_needs = list(resource_needs)
+            res_list = self._rr.read_mult(resource_needs)
+            self._add_resources(res_list)
 
-        # Step 4: Set fields to loaded resource objects based on type
-        for field, need_type, needs in field_needs:
+    def _set_object_field_needs(self, obj_needs):
+        """
+        Step 4: Sets the fields of an object from the associations and resources in the context.
+        """
+        obj, resource = obj_needs["obj"], obj_needs["resource"]
+        final_target_types = obj_needs["final_target_types"]
+        res_objs = self.ctx['resources']
+
+        for field, need_type, needs in obj_needs["field_needs"]:
             if need_type == 'L':    # case list
                 obj_list = [res_objs[target_id] for target_id, assoc in needs]
                 setattr(obj, field, obj_list)
@@ -671,21 +748,33 @@ class ExtendedResourceContainer(object):
 
     def _prepare_context(self, resource_id):
         """
-        Initializes the context object and loads associations for resource id.
+        Initializes the context object and loads associations for resource id or list of resource ids.
         """
-        self.ctx = dict(by_subject={}, by_object={})
+        self.ctx = dict(by_subject={}, by_object={}, assoc_ids=set(), assoc_loaded=set(), resources={})
         assocs = self._rr.find_associations(anyside=resource_id, id_only=False)
         self._add_associations(assocs)
         log.debug("Found %s associations for resource %s", len(assocs), resource_id)
 
+    def _add_resources(self, res_objs):
+        """
+        Adds a list of resource objects to the context memory structure, indexed by id.
+        """
+        resources = self.ctx['resources']
+        for res_obj in res_objs:
+            resources[res_obj._id] = res_obj
+
     def _add_associations(self, assocs):
         """
         Adds a list of Association objects to the context memory structure, indexed by
-        (resource_id, predicate).
+        (resource_id, predicate). Associations already in the context are skipped.
         """
         by_subject = self.ctx['by_subject']
         by_object = self.ctx['by_object']
+        assoc_ids = self.ctx['assoc_ids']
         for assoc in assocs:
+            if assoc._id in assoc_ids:
+                continue
+            assoc_ids.add(assoc._id)
             sub_key = (assoc.s, assoc.p)
             if sub_key not in by_subject:
                 by_subject[sub_key] = []
@@ -712,6 +712,34 @@ class ResourceRegistry(object):
     def find_subjects_mult(self, objects=[], id_only=False, predicate="", access_args=None):
         return self.rr_store.find_subjects_mult(objects=objects, id_only=id_only, predicate=predicate, access_args=access_args)
 
+    def find_descendants(self, resource_id="", predicate=None, target_type=None, max_depth=0):
+        """Returns a list of tuples (resource_id, depth) of resources reachable from the given resource id
+        (or list of ids) following associations from subject to object, recursively.
+        Depth is the minimum number of associations to the resource. Each resource is returned once.
+        - predicate  Predicate or list of predicates of associations to follow (default all)
+        - target_type  Resource type or list of types of resources to traverse (default all)
+        - max_depth  Maximum number of associations to follow (0 for the maximum of 50, more is BadRequest)
+        """
+        return self.rr_store.find_descendants(resource_id, direction="O", predicate=predicate,
+                                              target_type=target_type, max_depth=max_depth)
+
+    def find_ancestors(self, resource_id="", predicate=None, target_type=None, max_depth=0):
+        """Returns a list of tuples (resource_id, depth) of resources reachable from the given resource id
+        (or list of ids) following associations from object to subject, recursively.
+        Arguments as in find_descendants.
+        """
+        return self.rr_store.find_descendants(resource_id, direction="S", predicate=predicate,
+                                              target_type=target_type, max_depth=max_depth)
+
+    def find_shortest_path(self, source_id="", target_id="", predicate=None, target_type=None, max_depth=10, direction="A"):
+        """Returns a list of resource ids on a shortest chain of associations between source and target
+        resource, including both ends, or an empty list if there is no such chain within max_depth associations.
+        - direction  O to follow associations subject to object, S object to subject, A both ways (default)
+        - target_type  Resource type or list of types of intermediate resources (default all)
+        """
+        return self.rr_store.find_shortest_path(source_id, target_id, direction=direction, predicate=predicate,
+                                                target_type=target_type, max_depth=max_depth)
+
     def get_association(self, subject="", predicate="", object="", assoc_type=None, id_only=False):
         assoc = self.rr_store.find_associations(subject, predicate, object, id_only=id_only)
         if not assoc:
@@ -980,6 +1008,15 @@ class ResourceQuery(DatastoreQueryBuilder):
         Comparison op can be TXT_ICONTAINS or TXT_CONTAINS"""
         return self.op_expr(DQ.XOP_ALLMATCH, value, cmpop)
 
+    def filter_fulltext(self, text, mode=None):
+        """Text search with stemming over name, description, keywords and other attributes.
+        Mode is one of FTS_PLAIN (default), FTS_PHRASE or FTS_QUERY. See also order_by_rank"""
+        return self.fulltext(text, mode)
+
+    def order_by_rank(self):
+        """Orders by text search relevance, most relevant first, with stable order for paging"""
+        self.set_order_by(self.order_by([(DQ.AGG_RANK, DQ.ORDER_DESC), ("id", DQ.ORDER_ASC)]))
+
     def filter_keyword(self, kw_expr):
         """Include resources with one or multiple keywords"""
         return self.op_expr(DQ.XOP_KEYWORD, kw_expr)
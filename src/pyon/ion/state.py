@@ -4,18 +4,40 @@
 
 __author__ = 'Michael Meisinger'
 
+import base64
+from collections import OrderedDict
+import hashlib
+import time
+import zlib
+import gevent
+from gevent.lock import RLock
+import simplejson as json
+
 from pyon.core import bootstrap
-from pyon.core.exception import NotFound, BadRequest, Conflict
+from pyon.core.exception import BadRequest, ContainerConfigError
 from pyon.datastore.datastore import DataStore
 from pyon.util.containers import get_ion_ts
 from pyon.util.log import log
 
 from interface.objects import ProcessState
 
+# Durability modes for changed process states
+DURABILITY_SYNC = "sync"            # Written after each change (e.g. after each RPC call)
+DURABILITY_PERIODIC = "periodic"    # Coalesced and written in batches every flush interval
+DURABILITY_ON_QUIT = "on_quit"      # Written when the process terminates or the container stops
+DURABILITY_MODES = {DURABILITY_SYNC, DURABILITY_PERIODIC, DURABILITY_ON_QUIT}
+
+# Key in a persisted state dict indicating an encoded (compressed) state
+STATE_ENCODING_KEY = "_state_encoding"
+
+stats_callback = None
+
 
 class StateRepository(object):
     """
     Class that uses a data store to provide a persistent state repository for ION processes.
+    Changed process states are tracked as dirty and written in batched upserts according
+    to the configured durability mode.
     """
 
     def __init__(self, datastore_manager=None, container=None):
@@ -26,10 +48,32 @@ class StateRepository(object):
         datastore_manager = datastore_manager or self.container.datastore_manager
         self.state_store = datastore_manager.get_datastore("state", DataStore.DS_PROFILE.STATE)
 
+        self.state_cfg = bootstrap.CFG.get_safe("container.state", {}) or {}
+        self.durability = self.state_cfg.get("durability", DURABILITY_SYNC)
+        if self.durability not in DURABILITY_MODES:
+            raise ContainerConfigError("Invalid process state durability: %s" % self.durability)
+        self.flush_interval = float(self.state_cfg.get("flush_interval", 1.0))
+        self.compress_threshold = int(self.state_cfg.get("compress_threshold", 0) or 0)
+
+        self._dirty = OrderedDict()     # Process id -> (process, time of first unflushed change)
+        self._state_digests = {}        # Process id -> digest of last written state
+        self._flush_lock = RLock()      # Protects taking dirty entries, not the write
+        self._write_locks = {}          # Process id -> lock ordering the writes of this process' state
+        self._flush_gl = None
+        self.flush_stats = dict(flushes=0, written=0, unchanged=0, compressed=0, last_lag=0.0, max_lag=0.0)
+
     def start(self):
-        pass
+        if self.durability == DURABILITY_PERIODIC and not self._flush_gl:
+            self._flush_gl = gevent.spawn(self._flush_loop)
 
     def stop(self):
+        if self._flush_gl:
+            self._flush_gl.kill()
+            self._flush_gl = None
+        try:
+            self.flush_dirty()
+        except Exception:
+            log.exception("Error writing process states on stop")
         self.close()
 
     def close(self):
@@ -43,38 +87,41 @@ class StateRepository(object):
         Persist a private process state using the given key (typically a process id).
         The state vector is an object (e.g. a dict) that may contain any python type that
         is JSON-able. This means no custom objects are allowed in here.
+        The state is written in one round trip, replacing any persisted state (last writer wins).
         WARNING: If multiple threads/greenlets persist state concurrently, e.g. based
         on message processing and time, the calls to this method need to be protected
         by an exclusive lock (semaphore).
         @retval the ProcessState object as written
         """
-        log.debug("Store persistent state for key=%s", key)
-        if not isinstance(state, dict):
-            raise BadRequest("state must be type dict, not %s" % type(state))
-        if state_obj is not None:
-            if not isinstance(state_obj, ProcessState):
-                raise BadRequest("Argument state_obj is not ProcessState object")
-            state_obj.state = state
-            state_obj.ts = get_ion_ts()
-            try:
-                id, rev = self.state_store.update(state_obj)
-                state_obj._rev = rev
-                return state_obj
-            except Conflict as ce:
-                log.info("Process %s state update conflict - retry.")
+        return self.put_state_mult([(key, state, state_obj)])[0]
 
-        try:
-            state_obj = self.state_store.read(key)
-            state_obj.state = state
-            state_obj.ts = get_ion_ts()
-            id, rev = self.state_store.update(state_obj)
-            state_obj._rev = rev
-        except NotFound as nf:
-            state_obj = ProcessState(state=state, ts=get_ion_ts())
-            id, rev = self.state_store.create(state_obj, object_id=key)
+    def put_state_mult(self, state_list):
+        """
+        Persist multiple process states in one round trip.
+        @param state_list  list of tuples (key, state, state_obj) with state_obj optional (may be None)
+        @retval list of ProcessState objects as written
+        """
+        log.debug("Store persistent state for keys=%s", [state_entry[0] for state_entry in state_list])
+        keys, state_objs = [], []
+        for key, state, state_obj in state_list:
+            if not isinstance(state, dict):
+                raise BadRequest("state must be type dict, not %s" % type(state))
+            state = self._encode_state(state)
+            if state_obj is not None:
+                if not isinstance(state_obj, ProcessState):
+                    raise BadRequest("Argument state_obj is not ProcessState object")
+                state_obj.state = state
+                state_obj.ts = get_ion_ts()
+            else:
+                state_obj = ProcessState(state=state, ts=get_ion_ts())
+            keys.append(key)
+            state_objs.append(state_obj)
+
+        res_list = self.state_store.upsert_mult(state_objs, object_ids=keys)
+        for state_obj, (_, id, rev) in zip(state_objs, res_list):
             state_obj._id = id
             state_obj._rev = rev
-        return state_obj
+        return state_objs
 
     def get_state(self, key):
         """
@@ -85,8 +132,146 @@ class StateRepository(object):
         """
         log.debug("Retrieving persistent state for key=%s", key)
         state_obj = self.state_store.read(key)
+        state_obj.state = self._decode_state(state_obj.state)
         return state_obj.state, state_obj
 
+    def _encode_state(self, state, state_str=None):
+        """
+        Returns the state dict as persisted: compressed if its serialized size exceeds the
+        configured threshold, otherwise unchanged.
+        """
+        if not self.compress_threshold or STATE_ENCODING_KEY in state:
+            return state
+        state_str = state_str or json.dumps(state)
+        if len(state_str) <= self.compress_threshold:
+            return state
+        self.flush_stats["compressed"] += 1
+        return {STATE_ENCODING_KEY: "zlib", "data": base64.b64encode(zlib.compress(state_str))}
+
+    def _decode_state(self, state):
+        if not state or STATE_ENCODING_KEY not in state:
+            return state
+        if state[STATE_ENCODING_KEY] != "zlib":
+            raise BadRequest("Unknown state encoding: %s" % state[STATE_ENCODING_KEY])
+        return json.loads(zlib.decompress(base64.b64decode(state["data"])))
+
+    # -------------------------------------------------------------------------
+    # Write coalescing of changed process states
+
+    def mark_dirty(self, process):
+        """
+        Registers that the state of a stateful process has changed. The state is written
+        according to the durability mode: immediately (sync), with the next batched flush
+        (periodic) or when the process terminates (on_quit). Repeated changes before a
+        flush are coalesced into one write.
+        """
+        if process.id not in self._dirty:
+            self._dirty[process.id] = (process, time.time())
+        if self.durability == DURABILITY_SYNC:
+            self.flush_dirty([process.id])
+
+    def flush_dirty(self, keys=None):
+        """
+        Writes the states of all (or the given) dirty processes in one batched upsert.
+        States unchanged since the last write are skipped.
+        @retval number of states written
+        """
+        with self._flush_lock:
+            if keys is None:
+                keys = list(self._dirty)
+            entries = sorted((key, self._dirty.pop(key)) for key in keys if key in self._dirty)
+            if not entries:
+                return 0
+            write_locks = [self._write_locks.setdefault(key, RLock()) for key, _ in entries]
+
+        # Writes of different processes proceed concurrently. Writes of the same process are ordered,
+        # such that a later state snapshot is never overwritten by an earlier one
+        for write_lock in write_locks:
+            write_lock.acquire()
+        try:
+            return self._write_dirty(entries)
+        finally:
+            for write_lock in reversed(write_locks):
+                write_lock.release()
+
+    def _write_dirty(self, entries):
+        start_time = time.time()
+        state_list, written = [], []
+        for key, (process, dirty_since) in entries:
+            with process._state_lock:
+                # Snapshot, so that the process can continue to change state during the write
+                state = dict(process._proc_state)
+                process._proc_state_changed = False
+            state_str = json.dumps(state, sort_keys=True)
+            digest = hashlib.sha1(state_str).hexdigest()
+            if self._state_digests.get(key, None) == digest:
+                self.flush_stats["unchanged"] += 1
+                continue
+            state_list.append((key, self._encode_state(state, state_str), process._proc_state_obj))
+            written.append((key, process, digest))
+
+        try:
+            state_objs = self.put_state_mult(state_list) if state_list else []
+        except Exception:
+            # Keep the states dirty for the next flush
+            for key, (process, dirty_since) in entries:
+                self._dirty.setdefault(key, (process, dirty_since))
+                process._proc_state_changed = True
+            raise
+
+        for (key, process, digest), state_obj in zip(written, state_objs):
+            state_obj.state = None   # Make sure memory footprint is low for larger states
+            process._proc_state_obj = state_obj
+            self._state_digests[key] = digest
+
+        flush_lag = start_time - min(dirty_since for _, (_, dirty_since) in entries)
+        flush_stats = self.flush_stats
+        flush_stats["flushes"] += 1
+        flush_stats["written"] += len(state_list)
+        flush_stats["last_lag"] = flush_lag
+        flush_stats["max_lag"] = max(flush_stats["max_lag"], flush_lag)
+        if stats_callback:
+            stats_callback(num_dirty=len(entries), num_written=len(state_list), flush_lag=flush_lag,
+                           flush_time=time.time() - start_time)
+        return len(state_list)
+
+    def release_process(self, key):
+        """
+        Writes any pending state of a terminating process and stops tracking it.
+        """
+        try:
+            self.flush_dirty([key])
+        finally:
+            self._dirty.pop(key, None)
+            self._state_digests.pop(key, None)
+            self._write_locks.pop(key, None)
+
+    def get_flush_stats(self):
+        """ Returns counts of state writes and the current and past lag of dirty states """
+        flush_stats = dict(self.flush_stats)
+        flush_stats["durability"] = self.durability
+        flush_stats["dirty"] = len(self._dirty)
+        flush_stats["dirty_age"] = time.time() - min(since for _, since in self._dirty.itervalues()) if self._dirty else 0.0
+        return flush_stats
+
+    def _flush_loop(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            try:
+                self.flush_dirty()
+            except Exception:
+                log.exception("Error writing process states")
+
+
+def set_state_stats_callback(stats_cb):
+    """ Sets a callback function (hook) to push stats after a batched write of process states. """
+    global stats_callback
+    if stats_cb is None:
+        pass
+    elif stats_callback:
+        log.warn("Stats callback already defined")
+    stats_callback = stats_cb
+
 
 class StatefulProcessMixin(object):
     """
@@ -137,10 +322,10 @@ class StatefulProcessMixin(object):
             self._proc_state = {}
         self._proc_state_changed = True
 
-    def _flush_state(self):
+    def _flush_state(self, sync=True):
         """
-        Immediately pushes the state to the state repository. This call blocks
-        until the write has completed
+        Pushes the state to the state repository. If sync, this call blocks until the
+        write has completed, otherwise the write follows the container's durability mode.
         """
         pass
 
@@ -3,6 +3,7 @@
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+from mock import Mock, patch
 from nose.plugins.attrib import attr
 import gevent
 
@@ -12,7 +13,7 @@ from pyon.core.exception import BadRequest, NotFound
 from pyon.datastore.datastore import DatastoreManager
 from pyon.ion.directory import Directory
 
-from interface.objects import DirEntry
+from interface.objects import DirEntry, DirectoryModificationType
 
 
 @attr('UNIT', group='datastore')
@@ -204,4 +205,120 @@ class TestDirectory(IonUnitTestCase):
         lock5 = directory.acquire_lock("LOCK5", lock_holder="proc2", timeout=0.1)
         self.assertEquals(lock5, True)
 
-        directory.stop()
\ No newline at end of file
+        # TEST: Fencing tokens
+        fence6 = directory.acquire_lock_token("LOCK6", lock_holder="proc1", timeout=0.1)
+        self.assertGreater(fence6, 0)
+        self.assertEquals(directory.lookup("/System/Locks/LOCK6")["fence"], fence6)
+
+        res = directory.acquire_lock_token("LOCK6", lock_holder="proc1", timeout=0.1)
+        self.assertEquals(res, fence6)
+
+        res = directory.acquire_lock_token("LOCK6", lock_holder="proc2")
+        self.assertIsNone(res)
+
+        gevent.sleep(0.15)
+
+        res = directory.acquire_lock_token("LOCK6", lock_holder="proc2", timeout=0.1)
+        self.assertGreater(res, fence6)
+
+        # TEST: Blocking acquire
+        lock7 = directory.acquire_lock("LOCK7", lock_holder="proc1", timeout=10)
+        self.assertEquals(lock7, True)
+
+        gl = gevent.spawn(directory.acquire_lock, "LOCK7", lock_holder="proc2", timeout=10, wait_timeout=5)
+        gevent.sleep(0.2)
+        self.assertFalse(gl.ready())
+        directory.release_lock("LOCK7", lock_holder="proc1")
+        self.assertEquals(gl.get(timeout=2), True)
+
+        res = directory.acquire_lock("LOCK7", lock_holder="proc1", timeout=10, wait_timeout=0.2)
+        self.assertEquals(res, False)
+
+        # Waiters take over expired locks
+        lock8 = directory.acquire_lock("LOCK8", lock_holder="proc1", timeout=0.2)
+        self.assertEquals(lock8, True)
+        lock8 = directory.acquire_lock("LOCK8", lock_holder="proc2", timeout=0.2, wait_timeout=2)
+        self.assertEquals(lock8, True)
+
+        # TEST: Batch release of expired locks
+        directory.acquire_lock("LOCK9", lock_holder="proc1", timeout=0.1)
+        directory.acquire_lock("LOCK10", lock_holder="proc1", timeout=0.1)
+        gevent.sleep(0.15)
+        res = directory.release_expired_locks()
+        self.assertIn("LOCK9", res)
+        self.assertIn("LOCK10", res)
+        self.assertNotIn("LOCK7", res)
+        self.assertEquals(directory.is_locked("LOCK7"), True)
+
+        # TEST: Lease with background renewal
+        lease = directory.acquire_lease("LOCK11", timeout=0.3, lock_holder="proc1")
+        self.assertTrue(lease.is_valid())
+        gevent.sleep(0.5)
+        self.assertTrue(lease.is_valid())
+        self.assertEquals(directory.acquire_lock("LOCK11", lock_holder="proc2", timeout=0.3), False)
+        self.assertEquals(directory.lookup("/System/Locks/LOCK11")["fence"], lease.fence)
+
+        lease.release()
+        self.assertFalse(lease.is_valid())
+        self.assertEquals(directory.is_locked("LOCK11"), False)
+
+        directory.stop()
+
+    @patch('pyon.ion.directory.EventSubscriber')
+    @patch('pyon.ion.directory.EventPublisher')
+    def test_directory_cache(self, mock_pub, mock_sub):
+        dsm = DatastoreManager()
+        ds = dsm.get_datastore("resources", "DIRECTORY")
+        ds.delete_datastore()
+        ds.create_datastore()
+
+        self.patch_cfg('pyon.ion.directory.CFG', {'service': {'directory': {'publish_events': True, 'cache_enabled': True}}})
+
+        container = Mock()
+        container.has_capability.return_value = True
+        directory = Directory(datastore_manager=dsm, container=container)
+        directory.start()
+        self.assertTrue(mock_sub.return_value.start.called)
+
+        directory.register("/Cache", "A", value=1)
+        directory.register("/Cache", "B", value=2)
+
+        # Read your own writes
+        self.assertEquals(directory.lookup("/Cache/A"), {"value": 1})
+        self.assertEquals(directory.lookup_mult("/Cache", ["A", "B", "C"]), [{"value": 1}, {"value": 2}, None])
+        self.assertEquals(len(directory.find_child_entries("/Cache")), 2)
+
+        # Subsequent reads are served from the replica
+        with patch.object(directory.dir_store, "find_by_view") as mock_find:
+            self.assertEquals(directory.lookup("/Cache/B"), {"value": 2})
+            self.assertEquals(directory.lookup("/Cache/C"), None)
+            self.assertEquals(len(directory.find_child_entries("/Cache")), 2)
+            self.assertFalse(mock_find.called)
+
+        # Returned entries can be modified without affecting the replica
+        de = directory.lookup("/Cache/A", return_entry=True)
+        de.attributes["value"] = 11
+        self.assertEquals(directory.lookup("/Cache/A"), {"value": 1})
+
+        # Change events for own writes are ignored
+        self.assertEquals(mock_pub.return_value.publish_event.call_args[1]["container_id"], container.id)
+        evt = Mock(parent="/Cache", key="A", mod_type=DirectoryModificationType.CREATE, container_id=container.id)
+        directory._receive_change_event(evt, {})
+        self.assertIn("/Cache", directory._cache)
+
+        # Change by other container invalidates
+        directory.dir_store.update(directory.lookup("/Cache/A", return_entry=True))
+        watch_cb = Mock()
+        directory.watch("/Cache", watch_cb)
+        evt = Mock(parent="/Cache", key="A", mod_type=DirectoryModificationType.UPDATE, container_id="other_cc")
+        directory._receive_change_event(evt, {})
+        self.assertNotIn("/Cache", directory._cache)
+        watch_cb.assert_called_once_with("/Cache", "A", DirectoryModificationType.UPDATE)
+        self.assertEquals(directory.lookup("/Cache/A", return_entry=True)._rev, "2")
+
+        directory.unwatch("/Cache", watch_cb)
+        self.assertNotIn("/Cache", directory._watchers)
+
+        directory.unregister("/Cache", "A")
+        self.assertEquals(directory.lookup("/Cache/A"), None)
+        self.assertEquals(directory.lookup("/Cache/B"), {"value": 2})
@@ -82,6 +82,37 @@ class TestObjectStore(IonIntegrationTestCase):
         doc3r["a"] = u"BUZZ\u20ac"
         self.os.update_doc_mult([doc2r, doc3r])
 
+        # Revision conflicts are reported per document
+        doc2r = self.os.read_doc(did2)
+        doc2r["a"] = "ZAMM"
+        doc3s = dict(doc3r, a="ZAMM", _rev=str(int(doc3r["_rev"]) - 1))
+        with self.assertRaises(Conflict):
+            self.os.obj_store.update_doc_mult([doc2r, doc3s])
+        doc2r = self.os.read_doc(did2)
+        self.assertEquals(doc2r["a"], u"BUZZ\u20ac".encode("utf8"))
+
+        doc2r["a"] = "ZAMM"
+        res = self.os.obj_store.update_doc_mult([doc2r, doc3s], strict=False)
+        self.assertEquals(len(res), 2)
+        self.assertEquals(res[0][0], True)
+        self.assertEquals(res[1][0], False)
+        self.assertIsInstance(res[1][2], Conflict)
+        self.assertEquals(self.os.read_doc(did2)["a"], "ZAMM")
+
+        # The same document twice in one batch is rejected
+        doc2r = self.os.read_doc(did2)
+        with self.assertRaises(BadRequest):
+            self.os.obj_store.update_doc_mult([doc2r, dict(doc2r, a="BUZZ")])
+        self.assertEquals(self.os.read_doc(did2)["_rev"], doc2r["_rev"])
+
+        # Upsert creates or replaces regardless of revision
+        res = self.os.upsert_doc_mult([dict(a="UP1"), dict(a="UP2")], object_ids=["up1", did3])
+        self.assertEquals(res[0][1:], ("up1", "1"))
+        self.assertEquals(res[1][1], did3)
+        self.assertEquals(self.os.read_doc(did3)["a"], "UP2")
+        self.assertEquals(self.os.read_doc(did3)["_rev"], res[1][2])
+        self.os.delete_doc("up1")
+
         # Delete
         self.os.delete_doc(did1)
         self.os.delete_doc(did2)
@@ -2,7 +2,7 @@
 
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 
-from pyon.ion.process import IonProcessThread
+from pyon.ion.process import IonProcessThread, exclusive_operation
 from pyon.ion.endpoint import ProcessRPCServer
 from gevent.event import AsyncResult, Event
 from gevent.lock import Semaphore
@@ -532,6 +532,149 @@ class ProcessTest(PyonTestCase):
 
         self.assertEquals((True, True, False), hb)
 
+    def test_load_stats(self):
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=2)
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        self.addCleanup(p.stop)
+
+        load_stats = p.get_load_stats()
+        self.assertEquals(load_stats["concurrency"], 2)
+        self.assertEquals(load_stats["op_count"], 0)
+        self.assertEquals(load_stats["active"], 0)
+
+        def op():
+            time.sleep(0.02)
+        for i in xrange(3):
+            p._routing_call(op, MagicMock()).get(timeout=2)
+
+        load_stats = p.get_load_stats()
+        self.assertEquals(load_stats["op_count"], 3)
+        self.assertGreaterEqual(load_stats["op_latency"], 15)
+        self.assertNotIn("msg_backlog", load_stats)
+
+    def test_adapt_prefetch(self):
+        self.patch_cfg('pyon.ion.process.CFG', {'container': {'messaging': {'endpoint': {'adaptive_prefetch': {
+            'enabled': True, 'max_prefetch': 20, 'buffer_time': 50}}}}})
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=2)
+        listener = Mock(spec=ProcessRPCServer)
+        listener.prefetch_count = None
+        p.listeners.append(listener)
+
+        # no calls yet - nothing to adapt to
+        p._adapt_prefetch()
+        self.assertFalse(listener.set_prefetch.called)
+
+        # fast calls: prefetch up to the maximum
+        p._op_count, p._op_latency = 10, 2.0
+        p._adapt_prefetch()
+        listener.set_prefetch.assert_called_once_with(20)
+        listener.prefetch_count = 20
+        listener.set_prefetch.reset_mock()
+
+        # small changes and latency hovering around a threshold do not change prefetch
+        for latency in (6.0, 12.0, 2.0, 12.0, 12.0, 2.0, 12.0, 12.0):
+            p._op_latency = latency
+            p._adapt_prefetch()
+        self.assertFalse(listener.set_prefetch.called)
+
+        # a change persisting for stable_heartbeats heartbeats is applied
+        p._op_latency = 12.0
+        p._adapt_prefetch()
+        listener.set_prefetch.assert_called_once_with(10)
+
+        # slow calls: prefetch one message per concurrent call
+        p._op_latency = 500.0
+        self.assertEquals(p._get_target_prefetch(), 2)
+        p._op_latency = 20.0
+        self.assertEquals(p._get_target_prefetch(), 6)
+
+    def test_concurrent_calls(self):
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=3)
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        self.addCleanup(p.stop)
+
+        releaseev = Event()
+        self.addCleanup(releaseev.set)
+        running = []
+        def slow_op(idx):
+            running.append(idx)
+            releaseev.wait()
+            return idx
+
+        ars = [p._routing_call(slow_op, MagicMock(), i) for i in xrange(4)]
+
+        # three calls execute at the same time, the fourth stays pending
+        ars[0].wait(timeout=0.5)
+        self.assertEquals(running, [0, 1, 2])
+        self.assertEquals(len(p._ctrl_active), 3)
+        self.assertTrue(p.has_pending_call(ars[3]))
+
+        releaseev.set()
+        self.assertEquals([ar.get(timeout=2) for ar in ars], [0, 1, 2, 3])
+        self.assertEquals(p._ctrl_active, {})
+
+    def test_concurrent_calls_exclusive(self):
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=3)
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        self.addCleanup(p.stop)
+
+        releaseev = Event()
+        self.addCleanup(releaseev.set)
+        events = []
+        def slow_op(idx):
+            events.append(("start", idx))
+            releaseev.wait()
+            events.append(("end", idx))
+
+        @exclusive_operation
+        def excl_op(idx):
+            events.append(("excl", idx))
+
+        ar1 = p._routing_call(slow_op, MagicMock(), 1)
+        ar2 = p._routing_call(excl_op, MagicMock(), 2)
+        ar3 = p._routing_call(slow_op, MagicMock(), 3)
+
+        # exclusive call waits for running call and blocks the calls after it
+        ar1.wait(timeout=0.5)
+        self.assertEquals(events, [("start", 1)])
+        self.assertTrue(p.has_pending_call(ar2))
+
+        releaseev.set()
+        for ar in (ar1, ar2, ar3):
+            ar.get(timeout=2)
+        self.assertEquals(events, [("start", 1), ("end", 1), ("excl", 2), ("start", 3), ("end", 3)])
+
+    def test_concurrent_calls_abort(self):
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=2)
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        self.addCleanup(p.stop)
+
+        waitar = AsyncResult()
+        callar = AsyncResult()
+        def spin(inar, outar):
+            outar.set(True)
+            inar.wait()
+
+        ar = p._routing_call(spin, MagicMock(), callar, waitar)
+        waitar.get(timeout=2)
+
+        # aborting the call only interrupts its worker, the control greenlet keeps running
+        p.cancel_or_abort_call(ar)
+        ar2 = p._routing_call(callar.set, MagicMock(), sentinel.val)
+        ar2.get(timeout=2)
+        self.assertEquals(callar.get(), sentinel.val)
+        self.assertTrue(p._ctrl_thread.running)
+        self.assertEquals(p._ctrl_active, {})
+
 class FakeService(BaseService):
     """
     Class to use for testing below.
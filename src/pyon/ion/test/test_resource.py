@@ -11,6 +11,7 @@ from nose.plugins.attrib import attr
 from pyon.ion.resource import lcs_workflows, LCS, LCE, ExtendedResourceContainer, OT, RT, PRED, AS, lcstate, get_object_schema
 from pyon.core.bootstrap import IonObject
 from pyon.core.exception import BadRequest, Inconsistent
+from pyon.util.containers import DotDict
 from pyon.util.unit_test import IonUnitTestCase
 
 
@@ -86,6 +87,43 @@ class TestResources(IonUnitTestCase):
 
 
 
+    def test_extended_resource_list(self):
+        res_objs = {}
+        for res_id, res_type in [("ins1", RT.TestInstrument), ("ins2", RT.TestInstrument), ("ins3", RT.TestInstrument),
+                                 ("pol1", RT.Policy), ("pol2", RT.Policy), ("org1", RT.Org)]:
+            res_objs[res_id] = IonObject(res_type, name=res_id.upper())
+            res_objs[res_id]._id = res_id
+        assocs = [DotDict(_id="assoc%s" % i, s=s, st=res_objs[s].type_, p=p, o=o, ot=res_objs[o].type_)
+                  for i, (s, p, o) in enumerate([("ins1", PRED.hasPolicy, "pol1"), ("ins2", PRED.hasPolicy, "pol1"),
+                                                 ("ins3", PRED.hasPolicy, "pol2"), ("org1", PRED.hasResource, "ins1"),
+                                                 ("org1", PRED.hasResource, "ins3")])]
+
+        def find_associations(anyside=None, id_only=False):
+            res_ids = anyside if type(anyside) is list else [anyside]
+            return [assoc for assoc in assocs if assoc.s in res_ids or assoc.o in res_ids]
+        rr = Mock()
+        rr.read.side_effect = lambda res_id: res_objs[res_id]
+        rr.read_mult.side_effect = lambda res_ids: [res_objs[res_id] for res_id in res_ids]
+        rr.find_associations.side_effect = find_associations
+
+        # One association query and one read of associated resources for all containers
+        ext_list = ExtendedResourceContainer(Mock(), rr).create_extended_resource_container_list(
+            OT.ExtendedResource, ["ins1", "ins2", "ins3"])
+        self.assertEquals(rr.find_associations.call_count, 1)
+        self.assertEquals(rr.read_mult.call_count, 2)
+        self.assertEquals(set(rr.read_mult.call_args[0][0]), {"pol1", "pol2", "org1"})
+        self.assertEquals([[p._id for p in ext_res.policies] for ext_res in ext_list], [["pol1"], ["pol1"], ["pol2"]])
+        self.assertEquals([[o._id for o in ext_res.orgs] for ext_res in ext_list], [["org1"], [], ["org1"]])
+
+        # Fields match the containers of single resources
+        for ext_res in ext_list:
+            single_res = ExtendedResourceContainer(Mock(), rr).create_extended_resource_container(
+                OT.ExtendedResource, ext_res._id)
+            self.assertEquals(single_res.resource, ext_res.resource)
+            self.assertEquals(single_res.policies, ext_res.policies)
+            self.assertEquals(single_res.orgs, ext_res.orgs)
+            self.assertEquals(single_res.lcstate_transitions, ext_res.lcstate_transitions)
+
     def xtest_create_extended_resource_container(self):
 
         mock_clients = self._create_service_mock('resource_registry')
@@ -650,6 +650,30 @@ class TestResourceRegistry(IonIntegrationTestCase):
         res_obj = self.rr.find_resources_ext(query=rq.get_query(), id_only=False)
         self.assertEquals(len(res_obj), 1)
 
+        # TEST: Returned values, distinct and grouped
+
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_type(RT.TestSite))
+        rq.set_returns(["type_", "lcstate"], distinct=True)
+        rq.set_order_by(rq.order_by("lcstate"))
+        res_vals = self.rr.find_resources_ext(query=rq.get_query())
+        self.assertEquals(res_vals, [[RT.TestSite, LCS.DRAFT], [RT.TestSite, LCS.INTEGRATED]])
+
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_type([RT.TestSite, RT.TestInstrument]))
+        rq.set_group_count(["type_"])
+        rq.set_order_by(rq.order_by(rq.AGG_COUNT, "desc"))
+        res_vals = self.rr.find_resources_ext(query=rq.get_query())
+        self.assertEquals(res_vals, [[RT.TestSite, 4], [RT.TestInstrument, 2]])
+
+        rq = ResourceQuery()
+        rq.set_filter(rq.filter_type(RT.TestSite))
+        rq.set_returns(["name", "alt_ids"])
+        rq.set_order_by(rq.order_by("name", "desc"))
+        rq.set_limit(2)
+        res_vals = self.rr.find_resources_ext(query=rq.get_query())
+        self.assertEquals([v[0] for v in res_vals], ["PS1", "PS0"])
+
         # TEST: Full-text search
 
         rq = ResourceQuery()
@@ -855,6 +879,45 @@ class TestResourceRegistry(IonIntegrationTestCase):
         assoc_objs = self.rr.find_associations(query=aq.get_query(), id_only=False)
         self.assertEquals(len(assoc_objs), 3)
 
+        # --- Graph traversal
+
+        desc_list = self.rr.find_descendants(res_by_name["OS1"], predicate=PRED.hasTestSite)
+        self.assertEquals(desc_list, [(res_by_name["PS0"], 1), (res_by_name["PS1"], 2), (res_by_name["IS1"], 3)])
+
+        desc_list = self.rr.find_descendants(res_by_name["OS1"], predicate=[PRED.hasTestSite], max_depth=2)
+        self.assertEquals(len(desc_list), 2)
+
+        desc_list = self.rr.find_descendants(res_by_name["OS1"])
+        self.assertEquals(len(desc_list), 7)
+        self.assertIn((res_by_name["ID1"], 4), desc_list)
+
+        desc_list = self.rr.find_descendants(res_by_name["OS1"], target_type=RT.TestSite)
+        self.assertEquals(len(desc_list), 3)
+
+        anc_list = self.rr.find_ancestors(res_by_name["ID1"], predicate=PRED.hasTestDevice)
+        self.assertEquals(len(anc_list), 3)
+        self.assertIn((res_by_name["PS1"], 2), anc_list)
+
+        path = self.rr.find_shortest_path(res_by_name["OS1"], res_by_name["ID1"], direction="O")
+        self.assertEquals(len(path), 5)
+        self.assertEquals(path[0], res_by_name["OS1"])
+        self.assertEquals(path[-1], res_by_name["ID1"])
+
+        path = self.rr.find_shortest_path(res_by_name["DP1"], res_by_name["DP2"])
+        self.assertEquals(path, [res_by_name["DP1"], res_by_name["ID1"], res_by_name["DP2"]])
+
+        path = self.rr.find_shortest_path(res_by_name["OS1"], res_by_name["ID1"], direction="S")
+        self.assertEquals(path, [])
+
+        path = self.rr.find_shortest_path(res_by_name["OS1"], res_by_name["ID1"], max_depth=3)
+        self.assertEquals(path, [])
+
+        # Traversals deeper than the maximum are rejected instead of truncated
+        with self.assertRaises(BadRequest):
+            self.rr.find_descendants(res_by_name["OS1"], max_depth=51)
+        with self.assertRaises(BadRequest):
+            self.rr.find_shortest_path(res_by_name["OS1"], res_by_name["ID1"], max_depth=51)
+
         # --- Lifecycle state
 
         rq = ResourceQuery()
@@ -907,6 +970,39 @@ class TestResourceRegistry(IonIntegrationTestCase):
 
         self.rr.rr_store.delete_mult(res_by_name.values())
 
+    def test_graph_lattice(self):
+        # Diamond lattice: each site has two children that are shared with its sibling, i.e.
+        # 2 ** num_levels different association chains from the root to the sites of the last level
+        num_levels = 24
+        res_list = [IonObject(RT.TestSite, name="L%s_%s" % (level, i)) for level in xrange(num_levels + 1)
+                    for i in xrange(1 if level == 0 else 2)]
+        rid_list = [rid for rid, _ in self.rr.create_mult(res_list)]
+        root_id, level_ids = rid_list[0], [rid_list[1 + 2 * level:3 + 2 * level] for level in xrange(num_levels)]
+        assocs = [(root_id, PRED.hasTestSite, rid) for rid in level_ids[0]]
+        for parent_ids, child_ids in zip(level_ids[:-1], level_ids[1:]):
+            assocs.extend((parent_id, PRED.hasTestSite, child_id) for parent_id in parent_ids for child_id in child_ids)
+        self.rr.create_association_mult(assocs)
+
+        desc_list = self.rr.find_descendants(root_id, predicate=PRED.hasTestSite)
+        self.assertEquals(len(desc_list), 2 * num_levels)
+        self.assertEquals(sorted(desc_list), sorted((rid, level + 1) for level, rids in enumerate(level_ids)
+                                                    for rid in rids))
+
+        anc_list = self.rr.find_ancestors(level_ids[-1][0], predicate=PRED.hasTestSite)
+        self.assertEquals(len(anc_list), 2 * num_levels - 1)
+
+        path = self.rr.find_shortest_path(root_id, level_ids[-1][1], direction="O", max_depth=num_levels)
+        self.assertEquals(len(path), num_levels + 1)
+        self.assertEquals((path[0], path[-1]), (root_id, level_ids[-1][1]))
+        for level, rid in enumerate(path[1:]):
+            self.assertIn(rid, level_ids[level])
+
+        # Both ways, the lattice has many cycles
+        path = self.rr.find_shortest_path(level_ids[-1][0], level_ids[-1][1], max_depth=num_levels)
+        self.assertEquals(len(path), 3)
+
+        self.rr.rr_store.delete_mult(rid_list)
+
     def test_complex_query(self):
         def bnds(x1, y1, s=5):
             x2 = x1 + s
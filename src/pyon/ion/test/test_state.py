@@ -6,15 +6,20 @@ from unittest import SkipTest
 from nose.plugins.attrib import attr
 import uuid
 import gevent
+import gevent.event
+
+from gevent.lock import RLock
+from mock import Mock
 
 from pyon.datastore.datastore import DatastoreManager
-from pyon.ion.state import StateRepository, StatefulProcessMixin
+from pyon.ion.state import StateRepository, StatefulProcessMixin, DURABILITY_SYNC, DURABILITY_PERIODIC, \
+    DURABILITY_ON_QUIT, STATE_ENCODING_KEY
 from pyon.ion.process import StandaloneProcess
 from pyon.public import Inconsistent
 from pyon.util.containers import get_ion_ts
 from pyon.util.log import log
 from pyon.util.int_test import IonIntegrationTestCase
-from pyon.util.unit_test import IonUnitTestCase
+from pyon.util.unit_test import IonUnitTestCase, UnitTestCase
 
 from interface.services.examples.isample_service import SampleServiceClient
 
@@ -54,6 +59,134 @@ class TestState(IonUnitTestCase):
         state7 = {'key':'value7', 'key2': {}}
         state_repo.put_state("id1", state7, state_obj=state_obj4)
 
+        state8, state_obj8 = state_repo.get_state("id1")
+        self.assertEquals(state7, state8)
+        self.assertEquals(state_obj8._rev, "4")
+
+        # Test persisting multiple states at once
+        state_objs = state_repo.put_state_mult([("id1", {'key': 'value9'}, state_obj8),
+                                                ("id2", {'key': 'value10'}, None)])
+        self.assertEquals(len(state_objs), 2)
+        self.assertEquals(state_objs[0]._rev, "5")
+        self.assertEquals(state_objs[1]._id, "id2")
+        self.assertEquals(state_objs[1]._rev, "1")
+
+        state9, _ = state_repo.get_state("id1")
+        self.assertEquals(state9, {'key': 'value9'})
+        state10, _ = state_repo.get_state("id2")
+        self.assertEquals(state10, {'key': 'value10'})
+
+
+
+@attr('UNIT', group='state')
+class TestStateFlush(UnitTestCase):
+
+    def setUp(self):
+        self.state_repo = StateRepository(Mock(), container=Mock())
+        self.written = []
+
+        def upsert_mult(state_objs, object_ids=None):
+            self.written.append([(oid, state_obj.state) for oid, state_obj in zip(object_ids, state_objs)])
+            return [(True, oid, "1") for oid in object_ids]
+        self.state_repo.state_store.upsert_mult.side_effect = upsert_mult
+
+    def _create_process(self, pid, state):
+        process = Mock()
+        process.id = pid
+        process._proc_state = state
+        process._proc_state_obj = None
+        process._proc_state_changed = True
+        process._state_lock = RLock()
+        return process
+
+    def test_coalesce_flush(self):
+        self.state_repo.durability = DURABILITY_PERIODIC
+        proc1 = self._create_process("p1", {"key": "value1"})
+        proc2 = self._create_process("p2", {"key": "value2"})
+
+        self.state_repo.mark_dirty(proc1)
+        self.state_repo.mark_dirty(proc2)
+        proc1._proc_state["key"] = "value3"
+        self.state_repo.mark_dirty(proc1)
+        self.assertEquals(self.written, [])
+        self.assertEquals(self.state_repo.get_flush_stats()["dirty"], 2)
+
+        self.assertEquals(self.state_repo.flush_dirty(), 2)
+        self.assertEquals(self.written, [[("p1", {"key": "value3"}), ("p2", {"key": "value2"})]])
+        self.assertFalse(proc1._proc_state_changed)
+        self.assertEquals(proc1._proc_state_obj._rev, "1")
+        self.assertIsNone(proc1._proc_state_obj.state)
+
+        # Unchanged states are not written again
+        self.state_repo.mark_dirty(proc1)
+        self.assertEquals(self.state_repo.flush_dirty(), 0)
+        flush_stats = self.state_repo.get_flush_stats()
+        self.assertEquals((flush_stats["written"], flush_stats["unchanged"], flush_stats["dirty"]), (2, 1, 0))
+
+        # Failed writes keep the states dirty
+        proc2._proc_state["key"] = "value4"
+        self.state_repo.mark_dirty(proc2)
+        self.state_repo.state_store.upsert_mult.side_effect = Exception("DB down")
+        with self.assertRaises(Exception):
+            self.state_repo.flush_dirty()
+        self.assertTrue(proc2._proc_state_changed)
+        self.assertEquals(self.state_repo.get_flush_stats()["dirty"], 1)
+
+    def test_durability(self):
+        proc1 = self._create_process("p1", {"key": "value1"})
+        self.state_repo.durability = DURABILITY_SYNC
+        self.state_repo.mark_dirty(proc1)
+        self.assertEquals(len(self.written), 1)
+
+        self.state_repo.durability = DURABILITY_ON_QUIT
+        proc1._proc_state["key"] = "value2"
+        self.state_repo.mark_dirty(proc1)
+        self.assertEquals(len(self.written), 1)
+        self.state_repo.release_process("p1")
+        self.assertEquals(self.written[-1], [("p1", {"key": "value2"})])
+        self.assertEquals(self.state_repo.get_flush_stats()["dirty"], 0)
+
+    def test_concurrent_writes(self):
+        # Writes of a process do not wait for the write of another process, but for its own prior write
+        self.state_repo.durability = DURABILITY_SYNC
+        proc1 = self._create_process("p1", {"key": "value1"})
+        proc2 = self._create_process("p2", {"key": "value2"})
+        write_done = gevent.event.Event()
+        upsert_mult = self.state_repo.state_store.upsert_mult.side_effect
+
+        def slow_upsert_mult(state_objs, object_ids=None):
+            if object_ids == ["p1"] and not write_done.is_set():
+                write_done.wait(timeout=5)
+            return upsert_mult(state_objs, object_ids=object_ids)
+        self.state_repo.state_store.upsert_mult.side_effect = slow_upsert_mult
+
+        gl1 = gevent.spawn(self.state_repo.mark_dirty, proc1)
+        gevent.sleep(0)
+        self.state_repo.mark_dirty(proc2)
+        self.assertEquals(self.written, [[("p2", {"key": "value2"})]])
+
+        proc1._proc_state["key"] = "value3"
+        gl2 = gevent.spawn(self.state_repo.mark_dirty, proc1)
+        gevent.sleep(0)
+        self.assertEquals(len(self.written), 1)
+        write_done.set()
+        gevent.joinall([gl1, gl2], timeout=5, raise_error=True)
+        self.assertEquals(self.written[1:], [[("p1", {"key": "value1"})], [("p1", {"key": "value3"})]])
+
+    def test_compress(self):
+        self.state_repo.compress_threshold = 100
+        state = {"key": "value1", "data": ["x" * 20] * 50}
+        self.state_repo.put_state("p1", state)
+        self.state_repo.put_state("p2", {"key": "value2"})
+
+        stored_state = self.written[0][0][1]
+        self.assertEquals(stored_state[STATE_ENCODING_KEY], "zlib")
+        self.assertLess(len(stored_state["data"]), 100)
+        self.assertEquals(self.written[1][0][1], {"key": "value2"})
+
+        self.state_repo.state_store.read.return_value = Mock(state=stored_state)
+        self.assertEquals(self.state_repo.get_state("p1")[0], state)
+
 
 @attr('INT', group='state')
 class TestStatefulProcess(IonIntegrationTestCase):
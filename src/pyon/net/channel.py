@@ -615,6 +615,18 @@ class RecvChannel(BaseChannel):
                                                                     no_ack=self._consumer_no_ack,
                                                                     exclusive=self._consumer_exclusive)
 
+    def set_prefetch(self, prefetch_count):
+        """
+        Sets the number of unacknowledged messages the broker delivers to this channel (0 for no limit).
+        AMQP applies the prefetch when the consumer is created, so an active consumer is re-created
+        (unless the queue is auto-delete and would be removed).
+        """
+        with self._ensure_transport():
+            self._transport.qos_impl(prefetch_count=prefetch_count)
+            if self._consuming and isinstance(self._transport, AMQPTransport) and not self.queue_auto_delete:
+                self._on_stop_consume()
+                self._on_start_consume()
+
     def stop_consume(self):
         """
         Stops consuming messages.
@@ -904,6 +916,8 @@ class ListenChannel(RecvChannel):
         self._fsm.add_transition(self.I_CLOSE,          self.S_ACCEPTED,    None, self.S_CLOSING)
         self._fsm.add_transition(self.I_EXIT_ACCEPT,    self.S_CLOSING,     self._on_close_while_accepted,  self.S_CLOSED)
 
+        self._accept_count = 0      # Number of accepted channels with messages not yet acked/rejected
+
     def _create_accepted_channel(self, transport, msg):
         """
         Creates an AcceptedListenChannel.
@@ -941,15 +955,16 @@ class ListenChannel(RecvChannel):
 
         Sets the channel in the ACCEPTED state - caller is responsible for acking all messages
         received on the returned channel in order to put this channel back in the CONSUMING
-        state.
+        state. While consuming, further accepts are possible in the ACCEPTED state, so that
+        messages can be processed concurrently; the channel leaves ACCEPTED after all are acked.
         """
+        was_consuming = self._consuming
 
-        assert self._fsm.current_state in [self.S_ACTIVE, self.S_CLOSED], \
+        assert self._fsm.current_state in [self.S_ACTIVE, self.S_CLOSED] or \
+               (was_consuming and self._fsm.current_state == self.S_ACCEPTED), \
                 "Channel must be in active/closed state to accept, currently %s (forget to ack messages?)" % \
                 str(self._fsm.current_state)
 
-        was_consuming = self._consuming
-
         if not self._should_discard and not was_consuming:
             # tune QOS to get exactly n messages
             if not (self.queue_auto_delete and self._transport is not None and isinstance(self._transport, AMQPTransport)):
@@ -976,18 +991,23 @@ class ListenChannel(RecvChannel):
         map(ch._recv_queue.put, ms)
 
         # transition to ACCEPT
-        self._fsm.process(self.I_ENTER_ACCEPT)
+        if self._fsm.current_state != self.S_ACCEPTED:
+            self._fsm.process(self.I_ENTER_ACCEPT)
+        self._accept_count += 1
 
         # return the channel
         return ch
 
     def exit_accept(self):
         """
-        Public method for transitioning this channel out of ACCEPTED state.
+        Public method for transitioning this channel out of ACCEPTED state, once all accepted
+        channels have exited.
 
         Only should be used by a channel created by accept.
         """
-        self._fsm.process(self.I_EXIT_ACCEPT)
+        self._accept_count = max(self._accept_count - 1, 0)
+        if self._accept_count == 0:
+            self._fsm.process(self.I_EXIT_ACCEPT)
 
 
 class SubscriberChannel(ListenChannel):
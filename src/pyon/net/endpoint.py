@@ -4,20 +4,23 @@
 
 from gevent import event
 from gevent.lock import RLock
+from gevent.pool import Pool
 from gevent.timeout import Timeout
 from zope import interface
 import uuid
 import inspect
 from types import MethodType
 import threading
+import time
 
-from pyon.core import bootstrap, exception
+from pyon.core import bootstrap, exception, MSG_HEADER_TRACE, MSG_HEADER_SPAN
 from pyon.core.bootstrap import CFG, IonObject
 from pyon.core.exception import ExceptionFactory, IonException, BadRequest, Unauthorized
 from pyon.net.channel import ChannelClosedError, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel
 from pyon.core.interceptor.interceptor import Invocation, process_interceptors
 from pyon.util.containers import get_ion_ts, get_ion_ts_millis
 from pyon.util.log import log
+from pyon.util.span_tracer import SpanTracer, SPAN_KIND_PRODUCER, SPAN_KIND_CLIENT
 from pyon.net.transport import NameTrio, BaseTransport, XOTransport
 
 # create special logging category for RPC message tracking
@@ -81,6 +84,13 @@ class EndpointUnit(object):
     def attach_channel(self, channel):
         self.channel = channel
 
+    def get_context(self):
+        """
+        Gets the call context (headers of the message being processed) for outgoing messages.
+        Base endpoints have no context; process endpoints override.
+        """
+        return None
+
     def _build_invocation(self, **kwargs):
         """
         Builds an Invocation instance to be used by the interceptor stack.
@@ -155,6 +165,7 @@ class EndpointUnit(object):
         @returns    A 2-tuple of the message body sent and the message headers sent. These are
                     post-interceptor. Derivations will likely override the return value.
         """
+        send_start = time.time() if SpanTracer.enabled and headers and MSG_HEADER_SPAN in headers else None
         new_msg, new_headers = self.intercept_out(msg, headers)
 
         # Provide a hook for all outgoing messages before they hit transport
@@ -162,8 +173,20 @@ class EndpointUnit(object):
 
         self.channel.send(new_msg, new_headers)
 
+        if send_start:
+            self._record_send_span(new_headers, send_start)
+
         return new_msg, new_headers
 
+    def _record_send_span(self, headers, send_start):
+        """
+        Records the span of sending a traced message, with the span id given in the message headers.
+        """
+        trace_ctx = SpanTracer.get_trace_context(self.get_context())
+        SpanTracer.record_span(headers[MSG_HEADER_TRACE], headers[MSG_HEADER_SPAN], trace_ctx[1] if trace_ctx else None,
+                               "send %s" % (headers.get("receiver", "") or getattr(self.channel, "_send_name", "")),
+                               SPAN_KIND_PRODUCER, send_start, time.time())
+
     def intercept_out(self, msg, headers):
         """
         Builds an invocation and runs interceptors on it, direction: out.
@@ -205,7 +228,10 @@ class EndpointUnit(object):
         Any headers passed in here are strictly for reference. Headers set in there will take
         precedence and override any headers with the same key.
         """
-        return {'ts': get_ion_ts()}
+        header = {'ts': get_ion_ts()}
+        if SpanTracer.enabled:
+            header.update(SpanTracer.get_message_headers(self.get_context()))
+        return header
 
     def _build_payload(self, raw_msg, raw_headers):
         """
@@ -465,6 +491,10 @@ class ListeningBaseEndpoint(BaseEndpoint):
     """
     channel_type = ListenChannel
 
+    # Number of received messages routed concurrently (with equal prefetch). Set before listen
+    max_concurrency = 1
+    prefetch_count = None       # Prefetch count set explicitly for this endpoint
+
     def __init__(self, node=None, from_name=None, binding=None, transport=None, auto_delete=None):
         BaseEndpoint.__init__(self, node=node, transport=transport)
 
@@ -518,6 +548,8 @@ class ListeningBaseEndpoint(BaseEndpoint):
 
         Should be spawned in a greenlet. This method creates/sets up a channel to listen,
         starts listening, and consumes one-by-one messages in a loop until the Endpoint is closed.
+        With max_concurrency > 1, up to this number of messages are routed concurrently in
+        separate greenlets.
         """
 
         if thread_name:
@@ -530,12 +562,19 @@ class ListeningBaseEndpoint(BaseEndpoint):
 
         # Wait for actual consumer activation (note that get_one_msg calls ch.accept, which starts consuming)
 
+        route_pool = Pool(size=self.max_concurrency) if self.max_concurrency > 1 else None
         while True:
             self._active_event.wait()
+            if route_pool is not None:
+                route_pool.wait_available()
             m = None
             try:
                 m = self.get_one_msg()
-                m.route()       # call default handler
+                if route_pool is not None:
+                    route_pool.spawn(self._route_msg, m)
+                    m = None
+                else:
+                    m.route()       # call default handler
 
             except ChannelClosedError as ex:
                 break
@@ -544,6 +583,20 @@ class ListeningBaseEndpoint(BaseEndpoint):
                 if m is not None:
                     m.ack()
 
+        if route_pool is not None:
+            route_pool.join()
+
+    def _route_msg(self, m):
+        """
+        Routes and acks one message in a greenlet of the concurrent listen loop.
+        """
+        try:
+            m.route()
+        except Exception:
+            log.exception("Error routing message in listener %s", self._recv_name)
+        finally:
+            m.ack()
+
     def prepare_listener(self, binding=None, activate=True):
         """ Creates a channel, prepares it i.e. declares the queue and binding,
         and optionally creates a consumer on it. """
@@ -573,9 +626,22 @@ class ListeningBaseEndpoint(BaseEndpoint):
         Begins consuming. Can only be called after initialize.
         """
         assert self._chan
+        if self.prefetch_count:
+            self._chan.set_prefetch(self.prefetch_count)
+        elif self.max_concurrency > 1:
+            self._chan.set_prefetch(self.max_concurrency)
         self._chan.start_consume()
         self._active_event.set()
 
+    def set_prefetch(self, prefetch_count):
+        """
+        Sets the number of messages to prefetch from the broker for this endpoint. Applies to an
+        active consumer, or when activated.
+        """
+        self.prefetch_count = prefetch_count
+        if self._chan and self._active_event.is_set():
+            self._chan.set_prefetch(prefetch_count)
+
     def deactivate(self):
         """
         Stops consuming. Can only be called after initialize and activate.
@@ -866,15 +932,36 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
 
         # Call base _send, and get back the actual headers that were sent.
         # Extract the conv-id so we can tell the listener what is valid.
+        request_start = time.time()
         _, sent_headers = BidirectionalEndpointUnit._send(self, msg, headers=headers)
         try:
             result_data, result_headers = self._get_response(sent_headers['conv-id'], timeout)
         except Timeout:
             raise exception.Timeout('Request timed out (%d sec) waiting for response from %s, conv %s' % (
                     timeout, str(self.channel._send_name), sent_headers['conv-id']))
+        finally:
+            if SpanTracer.enabled and MSG_HEADER_SPAN in sent_headers:
+                self._record_request_span(sent_headers, request_start)
 
         return result_data, result_headers
 
+    def _record_send_span(self, headers, send_start):
+        # The sending span of a request is recorded when the response arrives
+        self._send_time = time.time() - send_start
+
+    def _record_request_span(self, headers, request_start):
+        """
+        Records the span of a request from send until response, with the span id given in the headers.
+        """
+        trace_ctx = SpanTracer.get_trace_context(self.get_context())
+        receiver = headers.get("receiver", "").split(",", 1)[-1]
+        attributes = {"conv_id": headers.get("conv-id", "")}
+        if getattr(self, "_send_time", None) is not None:
+            attributes["send_time"] = round(self._send_time, 6)
+        SpanTracer.record_span(headers[MSG_HEADER_TRACE], headers[MSG_HEADER_SPAN], trace_ctx[1] if trace_ctx else None,
+                               "request %s.%s" % (receiver, headers.get("op", "")),
+                               SPAN_KIND_CLIENT, request_start, time.time(), attributes)
+
     def _build_header(self, raw_msg, raw_headers):
         """
         Sets headers common to Request-Response patterns.
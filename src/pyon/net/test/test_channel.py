@@ -664,6 +664,34 @@ class TestListenChannel(PyonTestCase):
         self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACTIVE)
         self.assertTrue(self.ch._consuming)
 
+    def test_accept_concurrent(self):
+        rmock = Mock()
+        rmock.return_value = sentinel.msg
+
+        transport = Mock()
+
+        self.ch.recv = rmock
+        self.ch._recv_queue.await_n = MagicMock()
+        self.ch._create_accepted_channel = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._fsm.current_state = self.ch.S_ACTIVE
+        self.ch._consuming = True
+
+        # while consuming, a second message can be accepted before the first is acked
+        self.ch.accept()
+        self.ch.accept()
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACCEPTED)
+
+        self.ch.exit_accept()
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACCEPTED)
+        self.ch.exit_accept()
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACTIVE)
+
+        # not consuming, a second accept is an error
+        self.ch.accept()
+        self.ch._consuming = False
+        self.assertRaises(AssertionError, self.ch.accept)
+
     def test_close_while_accepted(self):
         rmock = Mock()
         rmock.return_value = sentinel.msg
@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 from pyon.net.endpoint import Publisher
+from pyon.net.transport import LocalRouter
 
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 
 
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from interface.services.examples.ihello_service import HelloServiceClient
 from nose.plugins.attrib import attr
 import time
@@ -75,4 +77,49 @@ class TestMessagingSpeed(IonIntegrationTestCase):
         diff = end_time - start_time
         mps = float(self.counter) / diff
 
-        print >>sys.stderr, "Published messages per second:", mps, "(", self.counter, "messages in", diff, "seconds)"
\ No newline at end of file
+        print >>sys.stderr, "Published messages per second:", mps, "(", self.counter, "messages in", diff, "seconds)"
+
+
+@attr('PFM')
+class TestLocalRouterSpeed(PyonTestCase):
+
+    def test_route_speed(self):
+        # 10k bindings, mostly wildcard event subscriptions, spread over 1000 queues
+        lr = LocalRouter("speedtest")
+        lr.declare_exchange('events')
+        num_queues = 1000
+        for i in xrange(num_queues):
+            lr.declare_queue('q%s' % i)
+        for i in xrange(10000):
+            queue = 'q%s' % (i % num_queues)
+            if i % 4 == 0:
+                binding = "*.ResourceModifiedEvent.*.%s.#" % ("type%s" % (i % 50))
+            elif i % 4 == 1:
+                binding = "#.res%s" % i
+            elif i % 4 == 2:
+                binding = "ResourceEvent.*.*.*.res%s" % i
+            else:
+                binding = "ResourceEvent.ResourceLifecycleEvent.#"
+            lr.bind('events', queue, binding)
+
+        print >>sys.stderr, ""
+
+        def route_all(keys):
+            start_time = time.time()
+            for rkey in keys:
+                lr._route('events', rkey, 'body', {})
+            diff = time.time() - start_time
+            for q in lr._queues.itervalues():
+                while not q.empty():
+                    q.get_nowait()
+            return diff
+
+        # Distinct routing keys (no cache hits)
+        keys = ["ResourceEvent.ResourceModifiedEvent.UPDATE.type%s.res%s" % (i % 50, i) for i in xrange(20000)]
+        diff = route_all(keys)
+        print >>sys.stderr, "Routed msgs per second (distinct keys):", len(keys) / diff, "(", len(keys), "messages in", diff, "seconds)"
+
+        # Repeated routing keys (cached matches)
+        keys = ["ResourceEvent.ResourceModifiedEvent.UPDATE.type%s.res%s" % (i % 50, i % 100) for i in xrange(20000)]
+        diff = route_all(keys)
+        print >>sys.stderr, "Routed msgs per second (repeated keys):", len(keys) / diff, "(", len(keys), "messages in", diff, "seconds)"
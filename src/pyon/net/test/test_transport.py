@@ -12,6 +12,7 @@ from pika import BasicProperties
 from nose.plugins.attrib import attr
 from mock import Mock, MagicMock, sentinel, patch, call, ANY
 from gevent.event import Event
+import gevent
 import time
 
 @attr('UNIT')
@@ -571,6 +572,46 @@ class TestTopicTrie(PyonTestCase):
         self.assertEquals({sentinel.wild},
                           set(self.tt.get_all_matches('a.b.b.b.b.b.b')))
 
+    def test_wildcard_matches(self):
+        self.tt.add_topic_tree('a.#', sentinel.p1)
+        self.tt.add_topic_tree('#.c', sentinel.p2)
+        self.tt.add_topic_tree('#', sentinel.p3)
+        self.tt.add_topic_tree('a.#.#.c', sentinel.p4)
+        self.tt.add_topic_tree('*.#.*', sentinel.p5)
+
+        self.assertEquals({sentinel.p1, sentinel.p3}, set(self.tt.get_all_matches('a')))
+        self.assertEquals({sentinel.p1, sentinel.p2, sentinel.p3, sentinel.p4, sentinel.p5},
+                          set(self.tt.get_all_matches('a.c')))
+        self.assertEquals({sentinel.p2, sentinel.p3, sentinel.p5}, set(self.tt.get_all_matches('x.y.c')))
+        self.assertEquals({sentinel.p3}, set(self.tt.get_all_matches('x')))
+
+    def test_match_cache(self):
+        self.tt.add_topic_tree('a.*', sentinel.p1)
+        self.assertEquals({sentinel.p1}, set(self.tt.get_all_matches('a.b')))
+
+        self.tt.add_topic_tree('a.b', sentinel.p2)
+        self.assertEquals({sentinel.p1, sentinel.p2}, set(self.tt.get_all_matches('a.b')))
+
+        self.tt.remove_topic_tree('a.*', sentinel.p1)
+        self.assertEquals({sentinel.p2}, set(self.tt.get_all_matches('a.b')))
+
+    def test_remove_prunes_nodes(self):
+        self.tt.add_topic_tree('a.b.c', sentinel.p1)
+        self.tt.add_topic_tree('a.b', sentinel.p2)
+        self.tt.add_topic_tree('a.b.c', sentinel.p3)
+
+        self.tt.remove_topic_tree('a.b.c', sentinel.p1)
+        self.assertIn('c', self.tt.root.children['a'].children['b'].children)
+
+        self.tt.remove_topic_tree('a.b.c', sentinel.p3)
+        self.assertNotIn('c', self.tt.root.children['a'].children['b'].children)
+
+        self.tt.remove_topic_tree('x.y', sentinel.p2)
+        self.assertNotIn('x', self.tt.root.children)
+
+        self.tt.remove_topic_tree('a.b', sentinel.p2)
+        self.assertEquals(self.tt.root.children, {})
+
 @attr('UNIT')
 class TestLocalRouter(PyonTestCase):
 
@@ -810,18 +851,19 @@ class TestLocalRouter(PyonTestCase):
         propsmock = Mock()
         propsmock.copy.return_value = sentinel.props
         gqueue = Mock()
-        m = (sentinel.exchange, sentinel.routing_key, sentinel.body, propsmock)
+        m = (sentinel.exchange, sentinel.routing_key, sentinel.body, propsmock, False)
         gqueue.get.side_effect = [m,
                                   LocalRouter.ConsumerClosedMessage()]
         cb = Mock()
-        self.lr._generate_dtag=Mock(return_value=sentinel.dtag)
 
         self.lr._run_consumer(sentinel.ctag, sentinel.queue, gqueue, cb)
 
         self.assertEquals(cb.call_count, 1)
         self.assertEquals(cb.call_args[0][0], self.lr)
+        dtag = cb.call_args[0][1]['delivery_tag']
+        self.assertIsInstance(dtag, int)
         self.assertEquals(dict(cb.call_args[0][1]), {'consumer_tag': sentinel.ctag,
-                                                     'delivery_tag': sentinel.dtag,
+                                                     'delivery_tag': dtag,
                                                      'redelivered': False,
                                                      'exchange': sentinel.exchange,
                                                      'routing_key': sentinel.routing_key})
@@ -852,14 +894,8 @@ class TestLocalRouter(PyonTestCase):
         self.assertIn(ctagnum, self.lr._ctag_pool._ids_free)
         self.assertNotIn(ctagnum, self.lr._ctag_pool._ids_in_use)
 
-    def test__generate_dtag(self):
-        dtag = self.lr._generate_dtag(sentinel.ctag, sentinel.cnt)
-
-        self.assertIn(str(sentinel.ctag), dtag)
-        self.assertIn(str(sentinel.cnt), dtag)
-
     def test_ack(self):
-        self.lr._unacked[sentinel.dtag] = True
+        self.lr._unacked[sentinel.dtag] = (None, None, None)
 
         self.lr.ack(sentinel.dtag)
         self.assertEquals(len(self.lr._unacked), 0)
@@ -873,11 +909,77 @@ class TestLocalRouter(PyonTestCase):
     def test_reject_requeue(self):
         q = Mock()
         self.lr._queues[sentinel.queue] = q
-        self.lr._unacked[sentinel.dtag] = (None, sentinel.queue, sentinel.m)
+        m = (sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.props, False)
+        self.lr._unacked[sentinel.dtag] = (None, sentinel.queue, m)
 
         self.lr.reject(sentinel.dtag, requeue=True)
         self.assertEquals(len(self.lr._unacked), 0)
-        q.put.assert_called_once_with(sentinel.m)
+        q.put.assert_called_once_with((sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.props, True))
+
+    def test_prefetch(self):
+        self.lr.declare_exchange('known')
+        self.lr.declare_queue('q1')
+        self.lr.bind('known', 'q1', 'a')
+
+        deliveries = []
+        def cb(router, method_frame, header_frame, body):
+            deliveries.append(method_frame.delivery_tag)
+        ctag = self.lr.start_consume(cb, 'q1', prefetch_count=2)
+
+        for i in xrange(5):
+            self.lr.publish('known', 'a', 'body%s' % i, {})
+        gevent.sleep(0.1)
+
+        # Only prefetch_count messages delivered until acked
+        self.assertEquals(len(deliveries), 2)
+        self.assertEquals(self.lr.get_stats('q1'), (3, 1))
+
+        self.lr.ack(deliveries[0])
+        gevent.sleep(0.05)
+        self.assertEquals(len(deliveries), 3)
+
+        # Rejected messages are redelivered
+        self.lr.reject(deliveries[1], requeue=True)
+        self.lr.set_prefetch(ctag, 0)
+        gevent.sleep(0.05)
+        self.assertEquals(len(deliveries), 6)
+        self.assertEquals(len(set(deliveries)), 6)
+
+        self.lr.stop_consume(ctag)
+
+    def test_stop_consume_shared_queue(self):
+        self.lr.declare_exchange('known')
+        self.lr.declare_queue('q1')
+        self.lr.bind('known', 'q1', 'a')
+
+        self.lr.CONSUMER_STOP_TIMEOUT = 0.1
+        busy_ev, deliveries1, deliveries2 = Event(), [], []
+        def cb1(router, method_frame, header_frame, body):
+            deliveries1.append(body)
+            busy_ev.wait()
+        def cb2(router, method_frame, header_frame, body):
+            deliveries2.append(body)
+        ctag1 = self.lr.start_consume(cb1, 'q1', no_ack=True)
+        self.lr.publish('known', 'a', 'body0', {})
+        gevent.sleep(0.05)
+        self.assertEquals(deliveries1, ['body0'])
+
+        # Stop consumer 1 while it is busy in a callback for longer than the stop timeout
+        ctag2 = self.lr.start_consume(cb2, 'q1', no_ack=True)
+        self.lr.stop_consume(ctag1)
+
+        # Stop consumer 2 while it waits for messages
+        for i in xrange(1, 4):
+            self.lr.publish('known', 'a', 'body%s' % i, {})
+        gevent.sleep(0.05)
+        self.lr.stop_consume(ctag2)
+        self.lr.publish('known', 'a', 'body4', {})
+        gevent.sleep(0.05)
+
+        self.assertEquals(deliveries1, ['body0'])
+        self.assertEquals(deliveries2, ['body1', 'body2', 'body3'])
+        self.assertEquals(self.lr.get_stats('q1'), (1, 0))
+        self.assertEquals(list(self.lr._queues['q1'].queue), [('known', 'a', 'body4', {}, False)])
 
     def test_transport_close(self):
         # no body in localrouter method
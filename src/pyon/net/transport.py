@@ -12,7 +12,8 @@ __author__ = 'Dave Foster <dfoster@asascience.com>'
 import os
 from contextlib import contextmanager
 from uuid import uuid4
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import count
 from pika import BasicProperties
 from gevent.event import AsyncResult, Event
 from gevent.queue import Queue
@@ -535,6 +536,7 @@ class TopicTrie(object):
 
     Used for events/pubsub in our system with the local transport. Efficiently stores all registered
     subscription topic trees in a trie structure, handling wildcards * and #.
+    Match results are cached per topic tree until the next change of the trie.
 
     See:
         http://www.zeromq.org/whitepapers:message-matching      (doesn't handle # so scrapped)
@@ -542,6 +544,8 @@ class TopicTrie(object):
         http://www.rabbitmq.com/blog/2011/03/28/very-fast-and-scalable-topic-routing-part-2/
     """
 
+    MATCH_CACHE_SIZE = 10000        # Max number of cached topic trees before the cache is reset
+
     class Node(object):
         """
         Internal node of a trie.
@@ -568,49 +572,12 @@ class TopicTrie(object):
 
             return new_node
 
-        def get_all_matches(self, topics):
-            """
-            Given a list of topic tokens, returns all patterns stored in child nodes/self that match the topic tokens.
-
-            This is a depth-first search pruned by token, with special handling for both wildcard types.
-            """
-            results = []
-
-            if len(topics) == 0:
-                # terminal point, return any pattern we have here
-                return self.patterns
-
-            cur_token = topics[0]
-            rem_tokens = topics[1:]     # will always be a list, even if empty or 1-len
-            #log.debug('get_all_matches(%s): cur_token %s, rem_tokens %s', self.token, cur_token, rem_tokens)
-
-            # child node direct matching
-            if cur_token in self.children:
-                results.extend(self.children[cur_token].get_all_matches(rem_tokens))
-
-            # now '*' wildcard
-            if '*' in self.children:
-                results.extend(self.children['*'].get_all_matches(rem_tokens))
-
-            # '#' means any number of tokens - naive method of descent, we'll feed it nothing to start. Then chop the full
-            # topics all the way down, put the results in a set to remove duplicates, and also any patterns on self.
-            if '#' in self.children:
-                # keep popping off and descend, make a set out of results
-                all_wild_childs = set()
-                for i in xrange(len(topics)):
-                    res = self.children['#'].get_all_matches(topics[i:])
-                    map(all_wild_childs.add, res)
-
-                results.extend(all_wild_childs)
-                results.extend(self.children['#'].patterns)     # any patterns defined in # are legal too
-
-            return results
-
     def __init__(self):
         """
         Creates a dummy root node that all topic trees hang off of.
         """
         self.root = self.Node(None)
+        self._match_cache = {}          # topic tree -> frozenset of patterns
 
     def add_topic_tree(self, topic_tree, pattern):
         """
@@ -626,30 +593,85 @@ class TopicTrie(object):
 
         if not pattern in curnode.patterns:
             curnode.patterns.append(pattern)
+            self._match_cache = {}
 
     def remove_topic_tree(self, topic_tree, pattern):
         """
         Splits a string topic_tree into tokens (by .) and removes the pattern from the terminal node.
-        @TODO should remove empty nodes
+        Removes nodes that are left without patterns and children.
         """
         topics = topic_tree.split(".")
 
-        curnode = self.root
-
+        path = [self.root]
         for topic in topics:
-            curnode = curnode.get_or_create_child(topic)
+            node = path[-1].children.get(topic, None)
+            if node is None:
+                return
+            path.append(node)
 
-        if pattern in curnode.patterns:
-            curnode.patterns.remove(pattern)
+        curnode = path[-1]
+        if pattern not in curnode.patterns:
+            return
+        curnode.patterns.remove(pattern)
+        self._match_cache = {}
+
+        # Prune empty nodes bottom up
+        for parent, node in reversed(zip(path[:-1], path[1:])):
+            if node.patterns or node.children:
+                break
+            del parent.children[node.token]
 
     def get_all_matches(self, topic_tree):
         """
-        Returns a list of all matches for a given topic tree string.
-        Creates a set out of the matching patterns, so multiple binds matching on the same pattern only
-        return once.
+        Returns a set of all matches for a given topic tree string.
+        Multiple binds matching on the same pattern only return once.
         """
-        topics = topic_tree.split(".")
-        return set(self.root.get_all_matches(topics))
+        matches = self._match_cache.get(topic_tree, None)
+        if matches is None:
+            matches = self._match(topic_tree.split("."))
+            if len(self._match_cache) >= self.MATCH_CACHE_SIZE:
+                self._match_cache = {}
+            self._match_cache[topic_tree] = matches
+        return matches
+
+    def _match(self, topics):
+        """
+        Matches topic tokens by advancing the set of active nodes token by token (NFA style),
+        instead of descending again for every suffix. A '#' node stays active for any token,
+        and nodes below a '#' are active before it consumed any token.
+        """
+        active = self._add_wildcard_nodes([self.root])
+        for token in topics:
+            next_nodes = []
+            for node in active:
+                if node.token == '#':
+                    next_nodes.append(node)
+                children = node.children
+                if token in children:
+                    next_nodes.append(children[token])
+                if '*' in children:
+                    next_nodes.append(children['*'])
+            if not next_nodes:
+                return frozenset()
+            active = self._add_wildcard_nodes(next_nodes)
+
+        matches = set()
+        for node in active:
+            matches.update(node.patterns)
+        return frozenset(matches)
+
+    def _add_wildcard_nodes(self, nodes):
+        """
+        Returns the set of given nodes plus all '#' nodes directly below them, which match zero tokens.
+        """
+        active = set()
+        while nodes:
+            node = nodes.pop()
+            if node not in active:
+                active.add(node)
+                if '#' in node.children:
+                    nodes.append(node.children['#'])
+        return active
 
 
 class LocalRouter(object):
@@ -659,31 +681,74 @@ class LocalRouter(object):
     of a single container.
     """
 
+    ROUTE_BATCH_SIZE = 500          # Max number of messages routed before yielding to other greenlets
+    PUBLISH_YIELD_INTERVAL = 100    # Publishers yield after this many messages to let routing catch up
+    CONSUMER_STOP_TIMEOUT = 5       # Max time in sec to wait for a consumer to finish its delivery when stopped
+
     class ConsumerClosedMessage(object):
         """
         Dummy object used to exit queue get looping greenlets.
         """
         pass
 
+    class ConsumerCredit(object):
+        """
+        Limits the number of unacked deliveries to a consumer (prefetch count, 0 for no limit).
+        Also signals the consumer greenlet to stop (closed).
+        """
+        def __init__(self, prefetch_count=0):
+            self.prefetch_count = prefetch_count
+            self.unacked = 0
+            self.closed = False
+            self.waiting = False        # True while the consumer is blocked waiting for a message
+            self._available = Event()
+            self._available.set()
+
+        def take(self):
+            """ Blocks until the consumer may receive another delivery """
+            while not self.closed and self.prefetch_count and self.unacked >= self.prefetch_count:
+                self._available.clear()
+                self._available.wait()
+            self.unacked += 1
+
+        def give(self):
+            self.unacked -= 1
+            self._available.set()
+
+        def set_prefetch(self, prefetch_count):
+            self.prefetch_count = prefetch_count
+            self._available.set()
+
+        def close(self):
+            self.closed = True
+            self._available.set()
+
     def __init__(self, sysname):
         self._sysname = sysname
         self.ready = Event()
 
         # exchange/queues/bindings
+        # Note: exchange and queue tables are copy-on-write, so that routing does not need the lock
         self._exchanges = {}                            # names -> { subscriber, topictrie(queue name) }
         self._queues = {}                               # names -> gevent queue
         self._bindings_by_queue = defaultdict(list)     # queue name -> [(ex, binding)]
-        self._lock_declarables = RLock()                # exchanges, queues, bindings, routing method
+        self._lock_declarables = RLock()                # exchanges, queues, bindings
 
         # consumers
         self._consumers = defaultdict(list)             # queue name -> [ctag, channel._on_deliver]
         self._consumers_by_ctag = {}                    # ctag -> queue_name ??
+        self._consumer_credit = {}                      # ctag -> ConsumerCredit
         self._ctag_pool = IDPool()                      # pool of consumer tags
         self._lock_consumers = RLock()                  # lock for interacting with any consumer related attrs
 
         # deliveries
-        self._unacked = {}                              # dtag -> (ctag, msg)
-        self._lock_unacked = RLock()                    # lock for interacting with unacked field
+        self._unacked = {}                              # dtag (int) -> (ctag, queue name, msg)
+        self._dtag_counter = count(1)                   # delivery tags, unique across consumers
+
+        # incoming messages, routed in batches
+        self._incoming = deque()
+        self._incoming_ready = Event()
+        self._publish_count = 0
 
         self._gl_msgs = None
         self._gl_pool = Pool()
@@ -699,7 +764,6 @@ class LocalRouter(object):
         """
         Starts all internal greenlets of this router device.
         """
-        self._queue_incoming = Queue()
         self._gl_msgs = self._gl_pool.spawn(self._run_gl_msgs)
         self._gl_msgs._glname = "pyon.net AMQP msgs"
         self._gl_msgs.link_exception(self._child_failed)
@@ -713,30 +777,41 @@ class LocalRouter(object):
 
     def _run_gl_msgs(self):
         self.ready.set()
+        incoming = self._incoming
         while True:
-            ex, rkey, body, props = self._queue_incoming.get()
-            try:
-                with self._lock_declarables:
-                    self._route(ex, rkey, body, props)
-            except Exception as e:
-                self.errors.append(e)
-                log.exception("Routing message")
+            self._incoming_ready.wait()
+            self._incoming_ready.clear()
+
+            # Route all queued messages in batches, yielding in between to let consumers run
+            while incoming:
+                for _ in xrange(min(len(incoming), self.ROUTE_BATCH_SIZE)):
+                    ex, rkey, body, props = incoming.popleft()
+                    try:
+                        self._route(ex, rkey, body, props)
+                    except Exception as e:
+                        self.errors.append(e)
+                        log.exception("Routing message")
+                sleep(0)
 
     def _route(self, exchange, routing_key, body, props):
         """
         Delivers incoming messages into queues based on known routes.
-        This entire method runs in a lock (likely pretty slow).
+        Runs outside of the declarables lock: the exchange and queue tables are replaced on change
+        (copy-on-write), and matching in the trie does not yield to other greenlets.
         """
-        assert exchange in self._exchanges, "Unknown exchange %s" % exchange
+        exchanges, queues = self._exchanges, self._queues
+        assert exchange in exchanges, "Unknown exchange %s" % exchange
 
-        queues = self._exchanges[exchange].get_all_matches(routing_key)
-        log.debug("route: ex %s, rkey %s,  matched %s routes", exchange, routing_key, len(queues))
+        matched = exchanges[exchange].get_all_matches(routing_key)
+        log.debug("route: ex %s, rkey %s,  matched %s routes", exchange, routing_key, len(matched))
 
         # deliver to each queue
-        for q in queues:
-            assert q in self._queues
-            log.debug("deliver -> %s", q)
-            self._queues[q].put((exchange, routing_key, body, props))
+        for q in matched:
+            gqueue = queues.get(q, None)
+            if gqueue is None:
+                # Queue deleted concurrently
+                continue
+            gqueue.put((exchange, routing_key, body, props, False))
 
     def _child_failed(self, gproc):
         """
@@ -756,18 +831,27 @@ class LocalRouter(object):
         self._gl_pool.join()
 
     def publish(self, exchange, routing_key, body, properties, immediate=False, mandatory=False):
-        self._queue_incoming.put((exchange, routing_key, body, properties))
-        sleep(0.0001)      # really wish switch would work instead of a sleep, seems wrong
+        self._incoming.append((exchange, routing_key, body, properties))
+        self._incoming_ready.set()
+
+        # Messages are routed when the publisher yields; avoid starving routing in long publish bursts
+        self._publish_count += 1
+        if self._publish_count % self.PUBLISH_YIELD_INTERVAL == 0:
+            sleep(0)
 
     def declare_exchange(self, exchange, **kwargs):
         with self._lock_declarables:
             if not exchange in self._exchanges:
-                self._exchanges[exchange] = TopicTrie()
+                exchanges = self._exchanges.copy()
+                exchanges[exchange] = TopicTrie()
+                self._exchanges = exchanges
 
     def delete_exchange(self, exchange, **kwargs):
         with self._lock_declarables:
             if exchange in self._exchanges:
-                del self._exchanges[exchange]
+                exchanges = self._exchanges.copy()
+                del exchanges[exchange]
+                self._exchanges = exchanges
 
     def declare_queue(self, queue, **kwargs):
         with self._lock_declarables:
@@ -780,14 +864,18 @@ class LocalRouter(object):
                         break
 
             if not queue in self._queues:
-                self._queues[queue] = Queue()
+                queues = self._queues.copy()
+                queues[queue] = Queue()
+                self._queues = queues
 
             return queue
 
     def delete_queue(self, queue, **kwargs):
         with self._lock_declarables:
             if queue in self._queues:
-                del self._queues[queue]
+                queues = self._queues.copy()
+                del queues[queue]
+                self._queues = queues
 
                 # kill bindings
                 for ex, binding in self._bindings_by_queue[queue]:
@@ -819,15 +907,16 @@ class LocalRouter(object):
                     self._bindings_by_queue[queue].pop(i)
                     break
 
-    def start_consume(self, callback, queue, no_ack=False, exclusive=False):
+    def start_consume(self, callback, queue, no_ack=False, exclusive=False, prefetch_count=0):
         assert queue in self._queues
 
         with self._lock_consumers:
             new_ctag = self._generate_ctag()
             assert new_ctag not in self._consumers_by_ctag
 
+            self._consumer_credit[new_ctag] = self.ConsumerCredit(prefetch_count)
             with self._lock_declarables:
-                gl = self._gl_pool.spawn(self._run_consumer, new_ctag, queue, self._queues[queue], callback)
+                gl = self._gl_pool.spawn(self._run_consumer, new_ctag, queue, self._queues[queue], callback, no_ack=no_ack)
                 gl.link_exception(self._child_failed)
             self._consumers[queue].append((new_ctag, callback, no_ack, exclusive, gl))
             self._consumers_by_ctag[new_ctag] = queue
@@ -840,50 +929,67 @@ class LocalRouter(object):
         with self._lock_consumers:
             queue = self._consumers_by_ctag[consumer_tag]
             self._consumers_by_ctag.pop(consumer_tag)
+            credit = self._consumer_credit.pop(consumer_tag, None)
+            if credit:
+                credit.close()
 
             for i, consumer in enumerate(self._consumers[queue]):
                 if consumer[0] == consumer_tag:
 
-                    # notify consumer greenlet that we want to stop
-                    if queue in self._queues:
-                        self._queues[queue].put(self.ConsumerClosedMessage())
-                    consumer[4].join(timeout=5)
-                    consumer[4].kill()
-
-                    # @TODO reject any unacked messages
+                    # The consumer greenlet exits before taking the next message. If it is blocked
+                    # waiting for a message, it can be killed without losing one.
+                    if credit is None or credit.waiting:
+                        consumer[4].kill()
+                    else:
+                        consumer[4].join(timeout=self.CONSUMER_STOP_TIMEOUT)
+                        consumer[4].kill()
 
                     self._consumers[queue].pop(i)
                     break
 
             self._return_ctag(consumer_tag)
 
-    def _run_consumer(self, ctag, queue_name, gqueue, callback):
-        cnt = 0
-        while True:
-            m = gqueue.get()
+    def set_prefetch(self, consumer_tag, prefetch_count):
+        """
+        Sets the max number of unacked deliveries for a consumer (0 for no limit).
+        """
+        credit = self._consumer_credit.get(consumer_tag, None)
+        if credit:
+            credit.set_prefetch(prefetch_count)
+
+    def _run_consumer(self, ctag, queue_name, gqueue, callback, no_ack=False):
+        credit = self._consumer_credit.get(ctag, None) or self.ConsumerCredit()
+        unacked = self._unacked
+        dtag_counter = self._dtag_counter
+
+        # Frames are allocated once per consumer; receivers copy what they need during the callback
+        method_frame = DotDict(consumer_tag=ctag)
+        header_frame = DotDict()
+
+        while not credit.closed:
+            if not no_ack:
+                credit.take()
+                if credit.closed:
+                    break
+            credit.waiting = True
+            try:
+                m = gqueue.get()
+            finally:
+                credit.waiting = False
             if isinstance(m, self.ConsumerClosedMessage):
                 break
-            exchange, routing_key, body, props = m
-
-            # create method frame
-            method_frame = DotDict()
-            method_frame['consumer_tag']    = ctag
-            method_frame['redelivered']     = False     # @TODO
-            method_frame['exchange']        = exchange
-            method_frame['routing_key']     = routing_key
-
-            # create header frame
-            header_frame = DotDict()
-            header_frame['headers'] = props.copy()
+            exchange, routing_key, body, props, redelivered = m
 
             # make delivery tag for ack/reject later
-            dtag = self._generate_dtag(ctag, cnt)
-            cnt += 1
-
-            with self._lock_unacked:
-                self._unacked[dtag] = (ctag, queue_name, m)
+            dtag = next(dtag_counter)
+            if not no_ack:
+                unacked[dtag] = (ctag, queue_name, m)
 
-            method_frame['delivery_tag'] = dtag
+            method_frame['redelivered']     = redelivered
+            method_frame['exchange']        = exchange
+            method_frame['routing_key']     = routing_key
+            method_frame['delivery_tag']    = dtag
+            header_frame['headers']         = props.copy()
 
             # deliver to callback
             try:
@@ -897,34 +1003,43 @@ class LocalRouter(object):
     def _return_ctag(self, ctag):
         self._ctag_pool.release_id(int(ctag.split("-")[-1]))
 
-    def _generate_dtag(self, ctag, cnt):
-        """
-        Generates a unique delivery tag for each consumer.
-
-        Greenlet-safe, no need to lock.
-        """
-        return "%s-%s" % (ctag, cnt)
-
     def ack(self, delivery_tag):
         assert delivery_tag in self._unacked
 
-        with self._lock_unacked:
-            del self._unacked[delivery_tag]
+        ctag, _, _ = self._unacked.pop(delivery_tag)
+        self._return_credit(ctag)
 
     def reject(self, delivery_tag, requeue=False):
         assert delivery_tag in self._unacked
 
-        with self._lock_unacked:
-            _, queue, m = self._unacked.pop(delivery_tag)
-            if requeue:
-                log.warn("REQUEUE: EXPERIMENTAL %s", delivery_tag)
-                self._queues[queue].put(m)
+        ctag, queue, m = self._unacked.pop(delivery_tag)
+        self._return_credit(ctag)
+        if requeue:
+            self._requeue(queue, m)
+
+    def _return_credit(self, ctag):
+        credit = self._consumer_credit.get(ctag, None)
+        if credit:
+            credit.give()
 
-    def transport_close(self, transport):
-        log.warn("LocalRouter.transport_close: %s TODO", transport)
-        # @TODO reject all messages in unacked spot
+    def _requeue(self, queue, m):
+        """ Puts a message back into its queue for redelivery, if the queue still exists """
+        gqueue = self._queues.get(queue, None)
+        if gqueue is not None:
+            exchange, routing_key, body, props, _ = m
+            gqueue.put((exchange, routing_key, body, props, True))
 
-        # turn off any consumers from this transport
+    def transport_close(self, transport, consumer_tags=None):
+        """
+        Stops the given consumers of a closed transport and requeues their unacked messages.
+        """
+        for ctag in consumer_tags or []:
+            if ctag in self._consumers_by_ctag:
+                self.stop_consume(ctag)
+            for dtag, (dctag, queue, m) in self._unacked.items():
+                if dctag == ctag:
+                    del self._unacked[dtag]
+                    self._requeue(queue, m)
 
     def get_stats(self, queue):
         """
@@ -960,6 +1075,8 @@ class LocalTransport(BaseTransport):
         self._active = True
 
         self._close_callbacks = []
+        self._consumer_tags = set()     # active consumers on this transport
+        self._prefetch_count = 0
 
     def declare_exchange_impl(self, exchange, **kwargs):
         self._broker.declare_exchange(exchange, **kwargs)
@@ -983,9 +1100,14 @@ class LocalTransport(BaseTransport):
         self._broker.publish(exchange, routing_key, body, properties, immediate=immediate, mandatory=mandatory)
 
     def start_consume_impl(self, callback, queue, no_ack=False, exclusive=False):
-        return self._broker.start_consume(callback, queue, no_ack=no_ack, exclusive=exclusive)
+        ctag = self._broker.start_consume(callback, queue, no_ack=no_ack, exclusive=exclusive)
+        self._consumer_tags.add(ctag)
+        if self._prefetch_count:
+            self._broker.set_prefetch(ctag, self._prefetch_count)
+        return ctag
 
     def stop_consume_impl(self, consumer_tag):
+        self._consumer_tags.discard(consumer_tag)
         self._broker.stop_consume(consumer_tag)
 
     def ack_impl(self, delivery_tag):
@@ -995,7 +1117,11 @@ class LocalTransport(BaseTransport):
         self._broker.reject(delivery_tag, requeue=requeue)
 
     def close(self):
-        self._broker.transport_close(self)
+        if self._consumer_tags:
+            self._broker.transport_close(self, consumer_tags=list(self._consumer_tags))
+            self._consumer_tags.clear()
+        else:
+            self._broker.transport_close(self)
         self._active = False
 
         for cb in self._close_callbacks:
@@ -1013,7 +1139,10 @@ class LocalTransport(BaseTransport):
         return self._ch_number
 
     def qos_impl(self, prefetch_size=0, prefetch_count=0, global_=False):
-        log.info("TODO: QOS")
+        # Applies to current and future consumers on this transport, like a channel basic.qos
+        self._prefetch_count = prefetch_count
+        for ctag in self._consumer_tags:
+            self._broker.set_prefetch(ctag, prefetch_count)
 
     def get_stats_impl(self, queue):
         return self._broker.get_stats(queue)
@@ -30,8 +30,8 @@ __all__ += ['DataStore']
 from pyon.datastore.datastore_query import DatastoreQueryBuilder, DQ
 __all__ += ['DatastoreQueryBuilder', 'DQ']
 
-from pyon.ion.process import IonProcessThreadManager, ImmediateProcess, SimpleProcess, StandaloneProcess, StreamProcess, get_ion_actor_id
-__all__ += ['IonProcessThreadManager', 'ImmediateProcess', 'SimpleProcess', 'StandaloneProcess', 'StreamProcess', 'get_ion_actor_id']
+from pyon.ion.process import IonProcessThreadManager, ImmediateProcess, SimpleProcess, StandaloneProcess, StreamProcess, get_ion_actor_id, exclusive_operation
+__all__ += ['IonProcessThreadManager', 'ImmediateProcess', 'SimpleProcess', 'StandaloneProcess', 'StreamProcess', 'get_ion_actor_id', 'exclusive_operation']
 
 from pyon.ion.endpoint import ProcessRPCClient, ProcessRPCServer, ProcessSubscriber, ProcessPublisher, ProcessEventSubscriber
 __all__ += ['ProcessRPCClient', 'ProcessRPCServer', 'ProcessSubscriber', 'ProcessPublisher', 'ProcessEventSubscriber']
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+""" Bounded caches with O(1) LRU eviction, TTL and byte size limits, hit/miss/eviction stats,
+coalescing of concurrent loads and invalidation by ION events. Named caches are registered
+process (container) wide, so that their stats can be collected. """
+
+__author__ = 'Michael Meisinger'
+
+from collections import OrderedDict
+import sys
+import time
+from gevent.event import AsyncResult
+
+from pyon.util.log import log
+
+# Named caches in this process
+cache_registry = {}
+
+# Result for load waiters if the loading greenlet was killed
+_LOAD_ABORTED = object()
+
+
+def get_cache(name, **kwargs):
+    """ Returns the registered cache with given name, creating it with the given arguments if needed """
+    cache = cache_registry.get(name, None)
+    if cache is None:
+        cache = BoundedCache(name, **kwargs)
+    return cache
+
+
+def get_cache_stats():
+    """ Returns a dict of cache name to stats for all registered caches """
+    return {name: cache.get_stats() for name, cache in cache_registry.iteritems()}
+
+
+def _get_size(value):
+    if isinstance(value, basestring):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class BoundedCache(object):
+    """
+    Key-value cache bounded by number of entries (least recently used entries are evicted) and
+    optionally by the total size of values in bytes. Entries may expire after a TTL (in seconds,
+    0 for no expiry). Caches are not synchronized, which is safe within one gevent process.
+    The default value size function is shallow for containers; pass size_func for accurate sizes.
+    """
+    def __init__(self, name=None, max_entries=1000, ttl=0, max_bytes=0, size_func=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size_func = size_func or _get_size
+        self.num_bytes = 0
+        self.stats = dict(hits=0, misses=0, evictions=0, expirations=0, invalidations=0, loads=0, load_waits=0)
+        self._entries = OrderedDict()   # key -> (value, expiry time or 0, size), least recently used first
+        self._loading = {}              # key -> AsyncResult of load in progress
+        self._stale_loads = set()       # Keys invalidated while loading
+        self._subscribers = []
+        if name:
+            if name in cache_registry:
+                log.warn("Cache %s already registered - replacing", name)
+            cache_registry[name] = self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._get_entry(key) is not None
+
+    def _get_entry(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry[1] and entry[1] < time.time():
+            self.num_bytes -= entry[2]
+            self.stats["expirations"] += 1
+            return None
+        self._entries[key] = entry      # Most recently used
+        return entry
+
+    def get(self, key, default=None):
+        entry = self._get_entry(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return default
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def put(self, key, value, ttl=None):
+        """ Caches a value. ttl overrides the cache's TTL for this entry """
+        ttl = self.ttl if ttl is None else ttl
+        size = self.size_func(value) if self.max_bytes else 0
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self.num_bytes -= old_entry[2]
+        self._entries[key] = (value, time.time() + ttl if ttl else 0, size)
+        self.num_bytes += size
+        self._prune()
+
+    def get_or_load(self, key, load_func, ttl=None):
+        """
+        Returns the cached value for key or calls load_func(key) and caches its result.
+        Concurrent misses for the same key in other greenlets wait for the first load instead
+        of loading again. Exceptions from load_func are raised to all waiting callers. If the
+        loading greenlet is killed, the waiting callers load again.
+        """
+        entry = self._get_entry(key)
+        if entry is not None:
+            self.stats["hits"] += 1
+            return entry[0]
+        self.stats["misses"] += 1
+
+        pending = self._loading.get(key, None)
+        if pending is not None:
+            self.stats["load_waits"] += 1
+            value = pending.get()
+            if value is _LOAD_ABORTED:
+                return self.get_or_load(key, load_func, ttl=ttl)
+            return value
+
+        pending = self._loading[key] = AsyncResult()
+        try:
+            value = load_func(key)
+        except Exception as ex:
+            pending.set_exception(ex)
+            raise
+        except BaseException:
+            # E.g. GreenletExit if the loading greenlet is killed
+            pending.set(_LOAD_ABORTED)
+            raise
+        finally:
+            self._loading.pop(key, None)
+            is_stale = key in self._stale_loads
+            self._stale_loads.discard(key)
+        self.stats["loads"] += 1
+        if not is_stale:
+            self.put(key, value, ttl=ttl)
+        pending.set(value)
+        return value
+
+    def evict(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.num_bytes -= entry[2]
+            self.stats["invalidations"] += 1
+        if key in self._loading:
+            self._stale_loads.add(key)
+
+    def clear(self):
+        self.stats["invalidations"] += len(self._entries)
+        self._entries.clear()
+        self.num_bytes = 0
+        self._stale_loads.update(self._loading)
+
+    def _prune(self):
+        entries = self._entries
+        while entries and ((self.max_entries and len(entries) > self.max_entries) or
+                           (self.max_bytes and self.num_bytes > self.max_bytes)):
+            _, entry = entries.popitem(last=False)
+            self.num_bytes -= entry[2]
+            self.stats["evictions"] += 1
+
+    def get_stats(self):
+        cache_stats = dict(self.stats)
+        cache_stats["entries"] = len(self._entries)
+        cache_stats["bytes"] = self.num_bytes
+        return cache_stats
+
+    # -------------------------------------------------------------------------
+
+    def add_invalidation_event(self, event_type, key_func=None, **kwargs):
+        """
+        Invalidates entries when an ION event of given type is received: the key or list of keys
+        returned by key_func(event), or all entries if key_func is None or returns None.
+        Additional kwargs (e.g. origin, origin_type) restrict the event subscription.
+        """
+        from pyon.ion.event import EventSubscriber
+
+        def invalidation_callback(event, *args, **kw):
+            keys = key_func(event) if key_func else None
+            if keys is None:
+                self.clear()
+            elif isinstance(keys, (list, tuple, set)):
+                for key in keys:
+                    self.evict(key)
+            else:
+                self.evict(keys)
+
+        event_sub = EventSubscriber(event_type=event_type, callback=invalidation_callback, **kwargs)
+        event_sub.start()
+        self._subscribers.append(event_sub)
+        return event_sub
+
+    def close(self):
+        """ Stops event invalidation and unregisters the cache """
+        for event_sub in self._subscribers:
+            try:
+                event_sub.stop()
+            except Exception:
+                log.exception("Error stopping cache invalidation subscriber")
+        self._subscribers = []
+        if self.name and cache_registry.get(self.name, None) is self:
+            del cache_registry[self.name]
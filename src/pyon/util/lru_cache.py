@@ -52,6 +52,7 @@ class LRUCache (object):
         self.cache = {}        # the actual cache Table
         self.keyTable = {} # time vs. key
         self.timeStampTable = {} #key vs. time
+        self.lastTs = 0    # timestamps must be unique as keys of keyTable
         # set key = value in cache
     def put(self, key, value):
         if value:
@@ -101,7 +102,8 @@ class LRUCache (object):
         if not oldTs == NOT_FOUND:
             del self.timeStampTable[key]
             del self.keyTable[oldTs]
-        newTs = LRUCache.currentTimeMicros()
+        newTs = max(LRUCache.currentTimeMicros(), self.lastTs + 1)
+        self.lastTs = newTs
         self.timeStampTable[key] = newTs
         self.keyTable[newTs] = key
 
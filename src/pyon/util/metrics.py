@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+""" In-process metrics registry with counters, gauges and log-linear (HDR style) histograms.
+Metrics can be rendered in the Prometheus text exposition format or summarized per interval. """
+
+__author__ = 'Michael Meisinger'
+
+from collections import OrderedDict
+
+from pyon.util.log import log
+
+
+# Histogram precision: each power of 2 range is split into 2**SUB_BITS buckets (max relative error ~3%)
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+
+# Default bucket boundaries for exposition (in the metric's base unit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+OTHER_LABEL = "_other"
+
+
+def _bucket_index(value):
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return ((shift + 1) << SUB_BITS) + (value >> shift) - SUB_COUNT
+
+
+def _bucket_lower(index):
+    if index < SUB_COUNT:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    return ((index & (SUB_COUNT - 1)) + SUB_COUNT) << shift
+
+
+class Histogram(object):
+    """
+    Records non-negative integer values into sparse log-linear buckets, such that quantiles
+    can be computed with bounded relative error at constant memory per order of magnitude.
+    """
+    __slots__ = ("counts", "count", "total", "max_value")
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max_value = 0
+
+    def record(self, value):
+        value = int(value)
+        if value < 0:
+            value = 0
+        idx = _bucket_index(value)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max_value:
+            self.max_value = value
+
+    def value_at_quantile(self, quantile):
+        """ Returns the (bucket midpoint) value below which the given fraction of values lies """
+        if not self.count:
+            return 0
+        target = max(1, int(round(quantile * self.count)))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= target:
+                lower, upper = _bucket_lower(idx), _bucket_lower(idx + 1)
+                return min(lower + (upper - lower - 1) / 2.0, self.max_value)
+        return self.max_value
+
+    def count_at_or_below(self, limit):
+        """ Returns the number of recorded values in buckets starting at or below limit """
+        limit_idx = _bucket_index(int(limit)) if limit >= 0 else -1
+        return sum(cnt for idx, cnt in self.counts.iteritems() if idx <= limit_idx)
+
+    def copy(self):
+        hist = Histogram()
+        hist.counts = dict(self.counts)
+        hist.count = self.count
+        hist.total = self.total
+        hist.max_value = self.max_value
+        return hist
+
+    def delta(self, prior):
+        """ Returns a new histogram with the values recorded since the prior copy was taken.
+        The max value is only known for the bucket, not the exact value. """
+        hist = Histogram()
+        for idx, cnt in self.counts.iteritems():
+            diff = cnt - prior.counts.get(idx, 0)
+            if diff > 0:
+                hist.counts[idx] = diff
+                hist.max_value = max(hist.max_value, _bucket_lower(idx + 1) - 1)
+        hist.count = self.count - prior.count
+        hist.total = self.total - prior.total
+        hist.max_value = min(hist.max_value, self.max_value)
+        return hist
+
+
+class Metric(object):
+    """ Base class for a named metric family with a fixed list of label names. Values are either
+    recorded explicitly or computed on collection by a function that returns either a single value
+    or a dict mapping label value tuples to values. """
+    metric_type = "untyped"
+
+    def __init__(self, name, doc, label_names=(), max_series=0, func=None):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(label_names)
+        self.max_series = max_series
+        self.func = func
+        self.series = {}
+
+    def _series_key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError("Metric %s requires labels %s" % (self.name, self.label_names))
+        if self.max_series and labels not in self.series and len(self.series) >= self.max_series:
+            # Bound cardinality: fold excess label combinations into one series
+            return (OTHER_LABEL,) * len(self.label_names)
+        return labels
+
+    def get_series(self):
+        if self.func is None:
+            return self.series
+        try:
+            values = self.func()
+        except Exception:
+            log.warn("Error computing metric %s", self.name, exc_info=True)
+            return {}
+        if not isinstance(values, dict):
+            return {(): values}
+        return values
+
+    def clear(self):
+        self.series.clear()
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, labels=(), value=1):
+        key = self._series_key(labels)
+        self.series[key] = self.series.get(key, 0) + value
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value, labels=()):
+        self.series[self._series_key(labels)] = value
+
+
+class HistogramMetric(Metric):
+    """ Histogram of values in a base unit (e.g. seconds, bytes), recorded with a resolution of
+    1/unit_scale and exposed with the given cumulative bucket boundaries. """
+    metric_type = "histogram"
+
+    def __init__(self, name, doc, label_names=(), max_series=0, unit_scale=1, buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, doc, label_names, max_series)
+        self.unit_scale = unit_scale
+        self.buckets = tuple(buckets)
+        self._marks = {}
+
+    def observe(self, value, labels=()):
+        key = self._series_key(labels)
+        hist = self.series.get(key, None)
+        if hist is None:
+            hist = self.series[key] = Histogram()
+        hist.record(value * self.unit_scale + 0.5)
+
+    def get_interval(self):
+        """ Returns dict of label values to histograms of the values recorded since the prior call """
+        interval = {}
+        for key, hist in self.series.items():
+            prior = self._marks.get(key, None)
+            interval[key] = hist.delta(prior) if prior else hist.copy()
+            self._marks[key] = hist.copy()
+        return interval
+
+    def clear(self):
+        Metric.clear(self)
+        self._marks.clear()
+
+
+class MetricsRegistry(object):
+    """
+    Registry of metric families. Metric recording is not synchronized, which is safe within one
+    gevent process. Metric names get the registry prefix in exports.
+    """
+
+    def __init__(self, prefix="", max_series=1000):
+        self.prefix = prefix
+        self.max_series = max_series
+        self._metrics = OrderedDict()
+
+    def _add_metric(self, metric):
+        if metric.name in self._metrics:
+            existing = self._metrics[metric.name]
+            if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                raise ValueError("Metric %s already registered with different definition" % metric.name)
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, doc, label_names=(), func=None):
+        return self._add_metric(Counter(name, doc, label_names, self.max_series, func=func))
+
+    def gauge(self, name, doc, label_names=(), func=None):
+        return self._add_metric(Gauge(name, doc, label_names, self.max_series, func=func))
+
+    def histogram(self, name, doc, label_names=(), unit_scale=1, buckets=LATENCY_BUCKETS):
+        return self._add_metric(HistogramMetric(name, doc, label_names, self.max_series,
+                                                unit_scale=unit_scale, buckets=buckets))
+
+    def get_metric(self, name):
+        return self._metrics.get(name, None)
+
+    def clear(self):
+        for metric in self._metrics.itervalues():
+            metric.clear()
+
+    # -------------------------------------------------------------------------
+
+    def get_exposition(self):
+        """ Returns all metrics as text in the Prometheus exposition format (version 0.0.4) """
+        lines = []
+        for metric in self._metrics.itervalues():
+            series = metric.get_series()
+            if not series:
+                continue
+            full_name = self.prefix + metric.name
+            lines.append("# HELP %s %s" % (full_name, _escape_doc(metric.doc)))
+            lines.append("# TYPE %s %s" % (full_name, metric.metric_type))
+            for key in sorted(series):
+                label_str = _format_labels(metric.label_names, key)
+                if metric.metric_type == "histogram":
+                    hist = series[key]
+                    for bound in metric.buckets:
+                        lines.append("%s_bucket%s %s" % (full_name, _format_labels(metric.label_names, key, le=bound),
+                                                         hist.count_at_or_below(bound * metric.unit_scale)))
+                    lines.append("%s_bucket%s %s" % (full_name, _format_labels(metric.label_names, key, le="+Inf"),
+                                                     hist.count))
+                    lines.append("%s_sum%s %s" % (full_name, label_str,
+                                                  _format_value(hist.total / float(metric.unit_scale))))
+                    lines.append("%s_count%s %s" % (full_name, label_str, hist.count))
+                else:
+                    lines.append("%s%s %s" % (full_name, label_str, _format_value(series[key])))
+        lines.append("")
+        return "\n".join(lines)
+
+    def get_summary(self):
+        """
+        Returns a compact dict of metric name to dict of label string to value. Histograms are
+        summarized for the interval since the prior call with count, mean, quantiles and max.
+        """
+        summary = {}
+        for metric in self._metrics.itervalues():
+            if metric.metric_type == "histogram":
+                scale = float(metric.unit_scale)
+                series = {}
+                for key, hist in metric.get_interval().iteritems():
+                    if not hist.count:
+                        continue
+                    entry = dict(count=hist.count,
+                                 mean=round(hist.total / scale / hist.count, 6),
+                                 max=round(hist.max_value / scale, 6))
+                    for quantile in SUMMARY_QUANTILES:
+                        entry["p%s" % int(quantile * 100)] = round(hist.value_at_quantile(quantile) / scale, 6)
+                    series[_summary_key(metric.label_names, key)] = entry
+            else:
+                series = {_summary_key(metric.label_names, key): value
+                          for key, value in metric.get_series().iteritems()}
+            if series:
+                summary[metric.name] = series
+        return summary
+
+
+def _escape_doc(doc):
+    return doc.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(label_names, label_values, le=None):
+    frags = ['%s="%s"' % (name, _escape_label(value)) for name, value in zip(label_names, label_values)]
+    if le is not None:
+        frags.append('le="%s"' % (le if isinstance(le, basestring) else _format_value(float(le))))
+    return "{%s}" % ",".join(frags) if frags else ""
+
+
+def _summary_key(label_names, label_values):
+    return ",".join("%s=%s" % (name, value) for name, value in zip(label_names, label_values)) or "_"
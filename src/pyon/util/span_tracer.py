@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""Distributed request tracing across message hops. Trace context (trace-id, span-id headers) is
+propagated with messages and the process call context; spans are buffered and exported as OTLP
+compatible JSON lines for offline analysis."""
+
+__author__ = 'Michael Meisinger'
+
+import os
+import random
+import threading
+import time
+from collections import deque
+import simplejson as json
+
+from pyon.core import MSG_HEADER_TRACE, MSG_HEADER_SPAN, MSG_HEADER_SAMPLED
+from pyon.util.log import log
+
+DEFAULT_CONFIG = {"enabled": False,
+                  "sample_rate": 1.0,       # Fraction of new (root) requests traced
+                  "db_spans": True,         # Record a span per DB statement in traced operations
+                  "max_spans": 50000,       # Span buffer size (oldest spans are dropped if not exported)
+                  "export_file": "",        # File name for OTLP JSON lines; {container_id} is substituted
+                  "flush_interval": 5.0,    # Seconds between exports
+                  }
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+
+# Trace context of a request that was not sampled at its root
+NOT_SAMPLED = ("", None)
+
+# Global span data. Spans are tuples: (trace_id, span_id, parent_id, name, kind, start, end, attributes)
+span_data = dict(spans=deque(maxlen=DEFAULT_CONFIG["max_spans"]),
+                 config=DEFAULT_CONFIG.copy(),
+                 resource={},
+                 export_file=None,
+                 flush_gl=None,
+                 dropped=0,
+                 )
+
+_span_local = threading.local()     # Greenlet local with gevent monkey patching
+
+
+class SpanTracer(object):
+    """
+    Records timed spans of traced requests. A span is identified by trace id and span id and links to
+    its parent span. Message headers carry the trace id and the id of the sending span.
+    """
+    enabled = False
+
+    @classmethod
+    def configure(cls, config, resource=None):
+        cfg = DEFAULT_CONFIG.copy()
+        cfg.update(config or {})
+        span_data["config"] = cfg
+        span_data["resource"] = resource or {}
+        if span_data["spans"].maxlen != cfg["max_spans"]:
+            span_data["spans"] = deque(span_data["spans"], maxlen=cfg["max_spans"])
+        export_file = cfg.get("export_file", "")
+        if export_file:
+            export_file = export_file.replace("{container_id}", str(span_data["resource"].get("container_id", "")))
+        span_data["export_file"] = export_file or None
+        cls.enabled = cfg.get("enabled", False) is True
+
+    @classmethod
+    def start(cls):
+        """ Starts periodic span export, if an export file is configured """
+        if not cls.enabled or not span_data["export_file"] or span_data["flush_gl"]:
+            return
+        import gevent
+        span_data["flush_gl"] = gevent.spawn(cls._flush_loop)
+
+    @classmethod
+    def stop(cls):
+        flush_gl = span_data["flush_gl"]
+        if flush_gl:
+            flush_gl.kill()
+            span_data["flush_gl"] = None
+            cls.flush()
+        cls.enabled = False
+
+    # -------------------------------------------------------------------------
+    # Trace context
+
+    @staticmethod
+    def new_trace_id():
+        return "%032x" % random.getrandbits(128)
+
+    @staticmethod
+    def new_span_id():
+        return "%016x" % random.getrandbits(64)
+
+    @classmethod
+    def get_trace_context(cls, context=None):
+        """
+        Returns (trace_id, span_id) of the current span, given a call context (message headers dict)
+        or the span of an executing operation in the current greenlet. Returns None if not traced
+        and NOT_SAMPLED if the request was not sampled at its root.
+        """
+        if context:
+            if MSG_HEADER_TRACE in context:
+                return context[MSG_HEADER_TRACE], context.get(MSG_HEADER_SPAN, None)
+            if context.get(MSG_HEADER_SAMPLED, None) == "0":
+                return NOT_SAMPLED
+        return getattr(_span_local, "span", None)
+
+    @classmethod
+    def get_message_headers(cls, context=None):
+        """
+        Returns the trace headers for an outgoing message: the trace id of the current context and a
+        new span id for the sending span. Starts a new trace for sampled root requests. The decision not
+        to sample a root request is propagated, so that downstream hops do not start partial traces.
+        """
+        trace_ctx = cls.get_trace_context(context)
+        if trace_ctx:
+            trace_id = trace_ctx[0]
+        elif random.random() < span_data["config"]["sample_rate"]:
+            trace_id = cls.new_trace_id()
+        else:
+            trace_id = None
+        if not trace_id:
+            return {MSG_HEADER_SAMPLED: "0"}
+        return {MSG_HEADER_TRACE: trace_id, MSG_HEADER_SPAN: cls.new_span_id()}
+
+    @classmethod
+    def push_span(cls, trace_id, span_id):
+        """ Sets the span of the operation executing in the current greenlet. Returns the prior span.
+        An empty trace id marks an operation of an unsampled request. """
+        prior = getattr(_span_local, "span", None)
+        _span_local.span = (trace_id, span_id) if trace_id is not None else None
+        return prior
+
+    @classmethod
+    def pop_span(cls, prior):
+        _span_local.span = prior
+
+    # -------------------------------------------------------------------------
+    # Span recording
+
+    @classmethod
+    def record_span(cls, trace_id, span_id, parent_id, name, kind, start_time, end_time, attributes=None):
+        """ Records a completed span. Times are in seconds since the epoch (float). """
+        spans = span_data["spans"]
+        if len(spans) == spans.maxlen:
+            span_data["dropped"] += 1
+        spans.append((trace_id, span_id or cls.new_span_id(), parent_id, name, kind, start_time, end_time, attributes))
+
+    @classmethod
+    def record_child_span(cls, headers, name, kind, start_time, end_time=None, attributes=None):
+        """ Records a span as child of the sending span of a traced message, given its headers """
+        if not headers or MSG_HEADER_TRACE not in headers:
+            return
+        cls.record_span(headers[MSG_HEADER_TRACE], None, headers.get(MSG_HEADER_SPAN, None), name, kind,
+                        start_time, end_time or time.time(), attributes)
+
+    @classmethod
+    def record_db_span(cls, statement, query_time):
+        """ Records a DB statement span within the operation executing in the current greenlet """
+        trace_ctx = getattr(_span_local, "span", None)
+        if not trace_ctx or not trace_ctx[0] or not span_data["config"]["db_spans"]:
+            return
+        end_time = time.time()
+        cls.record_span(trace_ctx[0], None, trace_ctx[1], "db", SPAN_KIND_CLIENT, end_time - (query_time or 0),
+                        end_time, {"db.statement": statement[:200]})
+
+    @classmethod
+    def get_spans(cls, trace_id=None):
+        spans = span_data["spans"]
+        if trace_id:
+            return [span for span in spans if span[0] == trace_id]
+        return list(spans)
+
+    @classmethod
+    def clear_spans(cls):
+        span_data["spans"].clear()
+        span_data["dropped"] = 0
+
+    # -------------------------------------------------------------------------
+    # Export
+
+    @classmethod
+    def _flush_loop(cls):
+        import gevent
+        while True:
+            gevent.sleep(span_data["config"]["flush_interval"])
+            try:
+                cls.flush()
+            except Exception:
+                log.exception("Error exporting spans")
+
+    @classmethod
+    def flush(cls):
+        """ Appends all buffered spans to the export file as one OTLP JSON request line """
+        export_file = span_data["export_file"]
+        spans = span_data["spans"]
+        if not export_file or not spans:
+            return 0
+        span_list = []
+        while spans:
+            span_list.append(spans.popleft())
+        export_str = json.dumps(cls.get_otlp_request(span_list), separators=(",", ":"))
+        export_dir = os.path.dirname(export_file)
+        if export_dir and not os.path.exists(export_dir):
+            os.makedirs(export_dir)
+        with open(export_file, "a") as f:
+            f.write(export_str)
+            f.write("\n")
+        if span_data["dropped"]:
+            log.warn("Span buffer overflow: %s spans dropped before export", span_data["dropped"])
+            span_data["dropped"] = 0
+        return len(span_list)
+
+    @classmethod
+    def get_otlp_request(cls, span_list):
+        """ Returns spans as dict in the OTLP/JSON ExportTraceServiceRequest format """
+        otlp_spans = []
+        for trace_id, span_id, parent_id, name, kind, start_time, end_time, attributes in span_list:
+            otlp_span = dict(traceId=trace_id, spanId=span_id, name=name, kind=kind,
+                             startTimeUnixNano=str(int(start_time * 1000000000)),
+                             endTimeUnixNano=str(int(end_time * 1000000000)))
+            if parent_id:
+                otlp_span["parentSpanId"] = parent_id
+            if attributes:
+                otlp_span["attributes"] = _otlp_attributes(attributes)
+            otlp_spans.append(otlp_span)
+        resource_attrs = dict(span_data["resource"])
+        resource_attrs.setdefault("service.name", "scioncc")
+        return dict(resourceSpans=[dict(resource=dict(attributes=_otlp_attributes(resource_attrs)),
+                                        scopeSpans=[dict(scope=dict(name="pyon"), spans=otlp_spans)])])
+
+
+def _otlp_attributes(attributes):
+    attr_list = []
+    for key in sorted(attributes):
+        value = attributes[key]
+        if isinstance(value, bool):
+            otlp_value = dict(boolValue=value)
+        elif isinstance(value, (int, long)):
+            otlp_value = dict(intValue=str(value))
+        elif isinstance(value, float):
+            otlp_value = dict(doubleValue=value)
+        else:
+            otlp_value = dict(stringValue=str(value))
+        attr_list.append(dict(key=key, value=otlp_value))
+    return attr_list
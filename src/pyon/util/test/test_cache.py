@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import sys
+import time
+import gevent
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.cache import BoundedCache, get_cache, get_cache_stats, cache_registry
+from pyon.util.lru_cache import LRUCache
+
+
+@attr('UNIT')
+class TestBoundedCache(PyonTestCase):
+
+    def test_cache(self):
+        cache = BoundedCache(max_entries=3)
+        for i in xrange(3):
+            cache.put(i, "value%s" % i)
+        self.assertEquals(cache.get(0), "value0")
+        cache.put(3, "value3")
+        self.assertEquals(len(cache), 3)
+        self.assertNotIn(1, cache)
+        self.assertIn(0, cache)
+
+        # Falsy values are cached
+        cache.put(4, None)
+        cache.put(5, "")
+        self.assertIn(4, cache)
+        self.assertEquals(cache.get(5, "default"), "")
+        self.assertEquals(cache.get(6, "default"), "default")
+
+        cache.evict(5)
+        self.assertNotIn(5, cache)
+        cache_stats = cache.get_stats()
+        self.assertEquals((cache_stats["hits"], cache_stats["misses"], cache_stats["evictions"],
+                           cache_stats["invalidations"], cache_stats["entries"]), (2, 1, 3, 1, 2))
+
+        # TTL expiry
+        cache.put("exp", "value", ttl=0.01)
+        self.assertIn("exp", cache)
+        gevent.sleep(0.02)
+        self.assertNotIn("exp", cache)
+        self.assertEquals(cache.get_stats()["expirations"], 1)
+
+    def test_size_limit(self):
+        cache = BoundedCache(max_entries=0, max_bytes=100)
+        for i in xrange(5):
+            cache.put(i, "x" * 30)
+        self.assertEquals(len(cache), 3)
+        self.assertEquals(cache.num_bytes, 90)
+        cache.put(4, "x" * 10)
+        self.assertEquals(cache.num_bytes, 70)
+        cache.clear()
+        self.assertEquals((len(cache), cache.num_bytes), (0, 0))
+
+    def test_load_coalescing(self):
+        cache = BoundedCache(max_entries=10)
+        loads = []
+
+        def load_value(key):
+            loads.append(key)
+            gevent.sleep(0.01)
+            if key == "fail":
+                raise KeyError(key)
+            return "value_%s" % key
+
+        results = [gevent.spawn(cache.get_or_load, "k1", load_value) for i in xrange(5)]
+        gevent.joinall(results)
+        self.assertEquals([gl.value for gl in results], ["value_k1"] * 5)
+        self.assertEquals(loads, ["k1"])
+        self.assertEquals(cache.get_stats()["load_waits"], 4)
+        self.assertEquals(cache.get_or_load("k1", load_value), "value_k1")
+        self.assertEquals(loads, ["k1"])
+
+        results = [gevent.spawn(cache.get_or_load, "fail", load_value) for i in xrange(2)]
+        gevent.joinall(results)
+        self.assertTrue(all(isinstance(gl.exception, KeyError) for gl in results))
+        self.assertNotIn("fail", cache)
+
+        # Values invalidated while loading are not cached
+        load_gl = gevent.spawn(cache.get_or_load, "k2", load_value)
+        gevent.sleep(0)
+        cache.evict("k2")
+        self.assertEquals(load_gl.get(), "value_k2")
+        self.assertNotIn("k2", cache)
+
+        # Waiters load again if the loading greenlet is killed
+        load_gl = gevent.spawn(cache.get_or_load, "k3", load_value)
+        gevent.sleep(0)
+        wait_gl = gevent.spawn(cache.get_or_load, "k3", load_value)
+        gevent.sleep(0)
+        load_gl.kill()
+        self.assertEquals(wait_gl.get(timeout=1), "value_k3")
+        self.assertEquals(loads.count("k3"), 2)
+        self.assertIn("k3", cache)
+        self.assertFalse(cache._loading)
+
+    def test_registry(self):
+        cache = get_cache("test_cache", max_entries=5)
+        self.addCleanup(cache.close)
+        self.assertIs(get_cache("test_cache"), cache)
+        cache.put("key", "value")
+        self.assertEquals(get_cache_stats()["test_cache"]["entries"], 1)
+        cache.close()
+        self.assertNotIn("test_cache", cache_registry)
+
+
+@attr('PFM')
+class TestBoundedCacheSpeed(PyonTestCase):
+
+    def test_cache_speed(self):
+        num_ops, max_size = 50000, 1000
+        keys = ["key%s" % (i % (max_size * 2)) for i in xrange(num_ops)]
+        print >>sys.stderr, ""
+
+        def time_ops(name, get_func, put_func):
+            start_time = time.time()
+            for key in keys:
+                if get_func(key) is None:
+                    put_func(key, key)
+            print >>sys.stderr, "%s: %.2f us per op" % (name, (time.time() - start_time) / num_ops * 1000000)
+
+        cache = BoundedCache(max_entries=max_size)
+        time_ops("BoundedCache", cache.get, cache.put)
+        cache = BoundedCache(max_entries=max_size, ttl=60)
+        time_ops("BoundedCache with TTL", cache.get, cache.put)
+        lru_cache = LRUCache(max_size, 0, 0)
+        time_ops("LRUCache", lru_cache.get, lru_cache.put)
+        lru_cache = LRUCache(max_size, 0, 10)
+        time_ops("LRUCache with elasticity 10", lru_cache.get, lru_cache.put)
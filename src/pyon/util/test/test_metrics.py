@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import random
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.metrics import Histogram, MetricsRegistry, OTHER_LABEL, COUNT_BUCKETS, _bucket_index, _bucket_lower
+
+
+@attr('UNIT')
+class TestMetrics(PyonTestCase):
+
+    def test_histogram(self):
+        for value in xrange(100000):
+            idx = _bucket_index(value)
+            self.assertTrue(_bucket_lower(idx) <= value < _bucket_lower(idx + 1))
+
+        hist = Histogram()
+        values = sorted(int(random.expovariate(1 / 5000.0)) for i in xrange(10000))
+        for value in values:
+            hist.record(value)
+        self.assertEquals(hist.count, 10000)
+        self.assertEquals(hist.max_value, values[-1])
+        for quantile in (0.5, 0.9, 0.99):
+            exact = values[int(quantile * len(values)) - 1]
+            self.assertLessEqual(abs(hist.value_at_quantile(quantile) - exact), exact * 0.04 + 1)
+
+        prior = hist.copy()
+        hist.record(1000000)
+        delta = hist.delta(prior)
+        self.assertEquals(delta.count, 1)
+        self.assertEquals(delta.total, 1000000)
+        self.assertLessEqual(abs(delta.value_at_quantile(0.5) - 1000000), 1000000 * 0.04)
+
+    def test_registry(self):
+        registry = MetricsRegistry(prefix="test_", max_series=3)
+        op_time = registry.histogram("op_seconds", "Operation time", ("svc", "op"), unit_scale=1000000)
+        msg_count = registry.counter("msgs_total", "Message count", ("direction",))
+        db_count = registry.histogram("db_statements", "DB statements", buckets=COUNT_BUCKETS)
+        registry.gauge("queue_depth", "Queue depth", ("proc",), func=lambda: {("p1",): 4})
+
+        for i in xrange(10):
+            op_time.observe(0.002 * i, ("svc1", "op1"))
+        msg_count.inc(("in",))
+        msg_count.inc(("in",), 2)
+        db_count.observe(3)
+        with self.assertRaises(ValueError):
+            msg_count.inc(("in", "out"))
+        self.assertIs(registry.histogram("op_seconds", "Operation time", ("svc", "op")), op_time)
+
+        expo = registry.get_exposition()
+        self.assertIn("# TYPE test_op_seconds histogram", expo)
+        self.assertIn('test_op_seconds_bucket{svc="svc1",op="op1",le="0.01"} 6', expo)
+        self.assertIn('test_op_seconds_bucket{svc="svc1",op="op1",le="+Inf"} 10', expo)
+        self.assertIn('test_op_seconds_count{svc="svc1",op="op1"} 10', expo)
+        self.assertIn('test_msgs_total{direction="in"} 3', expo)
+        self.assertIn('test_db_statements_bucket{le="2.0"} 0', expo)
+        self.assertIn('test_db_statements_bucket{le="5.0"} 1', expo)
+        self.assertIn('test_queue_depth{proc="p1"} 4', expo)
+
+        summary = registry.get_summary()
+        op_summary = summary["op_seconds"]["svc=svc1,op=op1"]
+        self.assertEquals(op_summary["count"], 10)
+        self.assertAlmostEqual(op_summary["mean"], 0.009, places=4)
+        self.assertAlmostEqual(op_summary["max"], 0.018, places=4)
+        self.assertEquals(summary["msgs_total"], {"direction=in": 3})
+
+        # Histogram summaries cover the interval since the prior summary
+        op_time.observe(1.5, ("svc1", "op1"))
+        summary = registry.get_summary()
+        self.assertEquals(summary["op_seconds"]["svc=svc1,op=op1"]["count"], 1)
+        self.assertNotIn("db_statements", summary)
+
+        # Cardinality is bounded
+        for i in xrange(5):
+            msg_count.inc(("dir%s" % i,))
+        self.assertEquals(len(msg_count.series), 4)
+        self.assertEquals(msg_count.series[(OTHER_LABEL,)], 3)
+
+        registry.clear()
+        self.assertNotIn("test_op_seconds", registry.get_exposition())
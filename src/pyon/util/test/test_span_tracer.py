@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import os
+import tempfile
+import time
+import simplejson as json
+from nose.plugins.attrib import attr
+
+from pyon.core import MSG_HEADER_TRACE, MSG_HEADER_SPAN, MSG_HEADER_SAMPLED
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.span_tracer import SpanTracer, span_data, SPAN_KIND_SERVER, SPAN_KIND_CLIENT, NOT_SAMPLED
+
+
+@attr('UNIT')
+class TestSpanTracer(PyonTestCase):
+
+    def setUp(self):
+        old_config, old_resource = span_data["config"], span_data["resource"]
+        self.addCleanup(SpanTracer.configure, old_config, old_resource)
+        self.addCleanup(SpanTracer.clear_spans)
+        SpanTracer.clear_spans()
+
+    def test_trace_context(self):
+        SpanTracer.configure(dict(enabled=True, sample_rate=0.0))
+        unsampled_headers = SpanTracer.get_message_headers(None)
+        self.assertEquals(unsampled_headers, {MSG_HEADER_SAMPLED: "0"})
+
+        # Downstream hops keep the sampling decision of the root
+        SpanTracer.configure(dict(enabled=True, sample_rate=1.0))
+        self.assertEquals(SpanTracer.get_trace_context(unsampled_headers), NOT_SAMPLED)
+        self.assertEquals(SpanTracer.get_message_headers(unsampled_headers), {MSG_HEADER_SAMPLED: "0"})
+        prior = SpanTracer.push_span(*NOT_SAMPLED)
+        self.assertEquals(SpanTracer.get_message_headers(None), {MSG_HEADER_SAMPLED: "0"})
+        SpanTracer.record_db_span("SELECT 0", 0.01)
+        SpanTracer.pop_span(prior)
+        self.assertEquals(SpanTracer.get_spans(), [])
+
+        root_headers = SpanTracer.get_message_headers(None)
+        self.assertEquals(len(root_headers[MSG_HEADER_TRACE]), 32)
+        self.assertEquals(len(root_headers[MSG_HEADER_SPAN]), 16)
+
+        # Messages sent within a traced request continue the trace
+        child_headers = SpanTracer.get_message_headers(root_headers)
+        self.assertEquals(child_headers[MSG_HEADER_TRACE], root_headers[MSG_HEADER_TRACE])
+        self.assertNotEquals(child_headers[MSG_HEADER_SPAN], root_headers[MSG_HEADER_SPAN])
+
+        # The span of an executing operation is the parent without call context
+        prior = SpanTracer.push_span("t1", "s1")
+        self.assertEquals(SpanTracer.get_trace_context(None), ("t1", "s1"))
+        self.assertEquals(SpanTracer.get_message_headers(None)[MSG_HEADER_TRACE], "t1")
+        SpanTracer.record_db_span("SELECT 1", 0.01)
+        SpanTracer.pop_span(prior)
+        self.assertEquals(SpanTracer.get_trace_context(None), None)
+        SpanTracer.record_db_span("SELECT 2", 0.01)
+
+        db_spans = SpanTracer.get_spans("t1")
+        self.assertEquals(len(db_spans), 1)
+        self.assertEquals(db_spans[0][2], "s1")
+        self.assertEquals(db_spans[0][7], {"db.statement": "SELECT 1"})
+
+    def test_export(self):
+        export_file = os.path.join(tempfile.mkdtemp(), "spans_{container_id}.jsonl")
+        SpanTracer.configure(dict(enabled=True, export_file=export_file, max_spans=5),
+                             resource={"container_id": "c1"})
+        export_file = span_data["export_file"]
+        self.assertTrue(export_file.endswith("spans_c1.jsonl"))
+
+        now = time.time()
+        SpanTracer.record_span("t1", "s1", None, "request svc.op", SPAN_KIND_CLIENT, now, now + 0.5)
+        headers = {MSG_HEADER_TRACE: "t1", MSG_HEADER_SPAN: "s1"}
+        SpanTracer.record_child_span(headers, "svc.op", SPAN_KIND_SERVER, now + 0.1, now + 0.4,
+                                     attributes={"db.count": 3, "db.time": 0.1, "request_id": "r1"})
+        SpanTracer.record_child_span({}, "untraced", SPAN_KIND_SERVER, now)
+        self.assertEquals(SpanTracer.flush(), 2)
+        self.assertEquals(SpanTracer.flush(), 0)
+
+        for i in xrange(7):
+            SpanTracer.record_span("t2", None, None, "op%s" % i, SPAN_KIND_SERVER, now, now)
+        self.assertEquals(SpanTracer.flush(), 5)
+
+        with open(export_file) as f:
+            lines = f.read().splitlines()
+        self.assertEquals(len(lines), 2)
+        otlp_req = json.loads(lines[0])
+        resource_spans = otlp_req["resourceSpans"][0]
+        self.assertIn({"key": "container_id", "value": {"stringValue": "c1"}}, resource_spans["resource"]["attributes"])
+        spans = resource_spans["scopeSpans"][0]["spans"]
+        self.assertEquals(len(spans), 2)
+        self.assertNotIn("parentSpanId", spans[0])
+        self.assertEquals(spans[1]["parentSpanId"], "s1")
+        self.assertEquals(spans[1]["traceId"], "t1")
+        self.assertAlmostEqual(int(spans[1]["endTimeUnixNano"]) - int(spans[1]["startTimeUnixNano"]), 300000000,
+                               delta=1000)
+        self.assertIn({"key": "db.count", "value": {"intValue": "3"}}, spans[1]["attributes"])
+        self.assertEquals(json.loads(lines[1])["resourceSpans"][0]["scopeSpans"][0]["spans"][-1]["name"], "op6")
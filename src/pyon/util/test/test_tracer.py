@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+import sys
+import time
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.tracer import CallTracer, trace_data
+
+
+class TracerTestMixin(object):
+
+    def _configure(self, **kwargs):
+        old_config = trace_data["config"]
+        self.addCleanup(CallTracer.configure, old_config)
+        config = dict(enabled=True, max_entries=100)
+        config.update(kwargs)
+        CallTracer.configure(config)
+        CallTracer.clear_all()
+
+
+@attr('UNIT')
+class TestCallTracer(PyonTestCase, TracerTestMixin):
+
+    def test_ring_buffer(self):
+        self._configure(max_entries=10)
+        for i in xrange(25):
+            CallTracer.log_scope_call("DB.test", dict(statement="stmt %s" % i), include_stack=False)
+        trace_log = trace_data["trace_log"]
+        self.assertEquals(len(trace_log), 10)
+        self.assertEquals(trace_log[0]["statement"], "stmt 15")
+        self.assertEquals(trace_log[-1]["statement"], "stmt 24")
+
+        CallTracer.log_scope_call("MSG.in", dict(statement="msg"), include_stack=False)
+        CallTracer.clear_scope("DB.test")
+        self.assertEquals([e["scope"] for e in trace_data["trace_log"]], ["MSG.in"])
+        self.assertEquals(trace_data["trace_log"].maxlen, 10)
+
+        CallTracer.configure(dict(enabled=False))
+        CallTracer.log_scope_call("MSG.in", dict(statement="msg"), include_stack=False)
+        self.assertEquals(len(trace_data["trace_log"]), 0)
+
+    def test_stack(self):
+        self._configure()
+
+        def traced_call():
+            CallTracer.log_scope_call("DB.test", dict(statement="stmt"), stack_first_frame=1)
+        traced_call()
+
+        stack = trace_data["trace_log"][-1]["stack"]
+        self.assertLessEqual(len(stack), 11)
+        self.assertEquals(stack[-1][2], "traced_call")
+        self.assertEquals(stack[-2][2], "test_stack")
+        self.assertTrue(stack[-1][0].endswith("test_tracer.py"))
+        self.assertIn("test_tracer.py:", CallTracer.format_stack(stack)[-1])
+        self.assertIn(":traced_call", CallTracer._default_formatter(trace_data["trace_log"][-1], stack=True))
+
+    def test_sampling(self):
+        self._configure(max_entries=5000, sample_rates={"DB": 0.1, "DB.resources": 0.0}, rate_limits={"MSG.in": 5})
+        for i in xrange(1000):
+            CallTracer.log_scope_call("DB.test", dict(statement="stmt"), include_stack=False)
+            CallTracer.log_scope_call("DB.resources", dict(statement="stmt"), include_stack=False)
+            CallTracer.log_scope_call("MSG.out", dict(statement="msg"), include_stack=False)
+        scope_counts = {}
+        for log_entry in trace_data["trace_log"]:
+            scope_counts[log_entry["scope"]] = scope_counts.get(log_entry["scope"], 0) + 1
+        self.assertTrue(40 < scope_counts["DB.test"] < 200)
+        self.assertNotIn("DB.resources", scope_counts)
+        self.assertEquals(scope_counts["MSG.out"], 1000)
+
+        # Sequence numbers count sampled out calls as well
+        self.assertEquals(trace_data["trace_log"][-1]["seq"], trace_data["scope_seq"]["MSG.out"])
+
+        start_sec = int(time.time())
+        for i in xrange(20):
+            CallTracer.log_scope_call("MSG.in", dict(statement="msg"), include_stack=False)
+        num_msg_in = len([e for e in trace_data["trace_log"] if e["scope"] == "MSG.in"])
+        if int(time.time()) == start_sec:
+            self.assertEquals(num_msg_in, 5)
+
+
+@attr('PFM')
+class TestCallTracerSpeed(PyonTestCase, TracerTestMixin):
+
+    def test_trace_overhead(self):
+        num_calls = 100000
+        print >>sys.stderr, ""
+
+        def time_calls(include_stack):
+            start_time = time.time()
+            for i in xrange(num_calls):
+                CallTracer.log_scope_call("DB.test", dict(statement="stmt"), include_stack=include_stack)
+            return (time.time() - start_time) / num_calls * 1000000
+
+        self._configure(enabled=False)
+        base_time = time_calls(False)
+        print >>sys.stderr, "Disabled tracer: %.2f us per call" % base_time
+
+        self._configure(max_entries=10000)
+        print >>sys.stderr, "Traced call, no stack: %.2f us per call" % (time_calls(False) - base_time)
+        print >>sys.stderr, "Traced call with stack: %.2f us per call" % (time_calls(True) - base_time)
+
+        self._configure(max_entries=10000, sample_rates={"DB": 0.01})
+        print >>sys.stderr, "Sampled call (1%%) with stack: %.2f us per call" % (time_calls(True) - base_time)
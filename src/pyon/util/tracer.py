@@ -5,8 +5,10 @@ https://confluence.oceanobservatories.org/display/CIDev/Collecting+and+managing+
 
 __author__ = 'Michael Meisinger'
 
-import inspect
-from collections import defaultdict
+import random
+import sys
+import time
+from collections import defaultdict, deque
 from contextlib import contextmanager
 # create special logging category for tracer logging
 import logging
@@ -23,14 +25,24 @@ DEFAULT_CONFIG = {"enabled": True,
                   "log_color": False,
                   "log_stack": False,
                   "log_truncate": 2000,
+                  "max_stack": 11,      # Maximum number of stack frames to record
+                  "sample_rates": {},   # Scope or scope category to fraction of calls to record (default 1.0)
+                  "rate_limits": {},    # Scope or scope category to max number of records per second
                   }
 
 # Global trace log data
-trace_data = dict(trace_log=[],                # Global log
+trace_data = dict(trace_log=deque(maxlen=DEFAULT_CONFIG["max_entries"]),  # Global log (ring buffer)
                   format_cb={},                # Scope specific formatter function
-                  scope_seq=defaultdict(int),  # Sequence number per scope
+                  scope_seq=defaultdict(int),  # Sequence number per scope (counts sampled out calls as well)
+                  scope_policy={},             # Scope to resolved (sample rate, rate limit)
+                  scope_window={},             # Scope to [rate limit window start second, count in window]
                   config=DEFAULT_CONFIG.copy(),  # Store config dict
                   )
+
+NO_SAMPLING = (1.0, 0)     # Scope policy (sample rate, rate limit) to record all calls
+
+# Functions where a recorded call stack ends (the entry into the process or container)
+STACK_STOP_FUNCS = {"_control_flow", "_execute_call", "load_ion", "spawn_process", "main", "dispatch_request"}
 SCOPE_COLOR = {
     "MSG": 31,
     "GW": 32,
@@ -59,36 +71,97 @@ class CallTracer(object):
     @staticmethod
     def log_scope_call(scope, log_entry, include_stack=True, stack_first_frame=4):
         try:
-            if not trace_data["config"].get("enabled", False):
+            config = trace_data["config"]
+            if not config.get("enabled", False):
+                return
+
+            trace_data["scope_seq"][scope] += 1
+            policy = trace_data["scope_policy"].get(scope, None) or CallTracer._get_scope_policy(scope, config)
+            if policy is not NO_SAMPLING and not CallTracer._check_sample(scope, policy):
                 return
 
             log_entry["scope"] = scope
             if not "ts" in log_entry:
                 log_entry["ts"] = get_ion_ts()
-            trace_data["scope_seq"][scope] += 1
             log_entry["seq"] = trace_data["scope_seq"][scope]
 
             if include_stack:
-                stack = inspect.stack()
-                frame_num = stack_first_frame
-                context = []
-                while len(stack) > frame_num and frame_num < 15:
-                    exec_line = "%s:%s:%s" % (stack[frame_num][1], stack[frame_num][2], stack[frame_num][3])
-                    context.insert(0, exec_line)
-                    if exec_line.endswith("_control_flow") or exec_line.endswith("load_ion") or exec_line.endswith("spawn_process")\
-                        or exec_line.endswith(":main") or exec_line.endswith(":dispatch_request"):
-                        break
-                    frame_num += 1
-                log_entry["stack"] = context
-
-            trace_data["trace_log"].append(log_entry)
-            if len(trace_data["trace_log"]) > trace_data["config"].get("max_entries", DEFAULT_CONFIG["max_entries"]) + 100:
-                trace_data["trace_log"] = trace_data["trace_log"][-trace_data["config"].get("max_entries", DEFAULT_CONFIG["max_entries"]):]
-
-            CallTracer.log_trace(log_entry)
+                log_entry["stack"] = CallTracer._get_stack(stack_first_frame, config.get("max_stack", 11))
+
+            trace_log = trace_data["trace_log"]
+            if getattr(trace_log, "maxlen", None) is None:
+                # Log was replaced by a list or unbounded deque - restore the ring buffer
+                trace_log = CallTracer._reset_log(trace_log)
+            trace_log.append(log_entry)
+
+            if config.get("log_trace", False):
+                CallTracer.log_trace(log_entry)
         except Exception as ex:
             log.warn("Count not log trace call: %s", log_entry)
 
+    @staticmethod
+    def _check_sample(scope, policy):
+        """ Returns True if a call in given scope should be recorded according to sample rate and rate limit """
+        sample_rate, rate_limit = policy
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return False
+        if rate_limit:
+            cur_sec = int(time.time())
+            window = trace_data["scope_window"].get(scope, None)
+            if window is None or window[0] != cur_sec:
+                window = trace_data["scope_window"][scope] = [cur_sec, 0]
+            if window[1] >= rate_limit:
+                return False
+            window[1] += 1
+        return True
+
+    @staticmethod
+    def _get_scope_policy(scope, config):
+        """ Resolves and caches sample rate and rate limit for a scope, from scope or scope category config """
+        scope_cat = scope.split(".", 1)[0]
+        sample_rates = config.get("sample_rates", None) or {}
+        rate_limits = config.get("rate_limits", None) or {}
+        sample_rate = sample_rates.get(scope, sample_rates.get(scope_cat, 1.0))
+        rate_limit = rate_limits.get(scope, rate_limits.get(scope_cat, 0))
+        policy = (float(sample_rate if sample_rate is not None else 1.0), int(rate_limit or 0))
+        if policy == NO_SAMPLING:
+            policy = NO_SAMPLING
+        trace_data["scope_policy"][scope] = policy
+        return policy
+
+    @staticmethod
+    def _get_stack(first_frame, max_frames):
+        """ Returns the call stack from the given frame number (0 is log_scope_call) outwards as list of
+        (file, line, function) tuples, outermost first. Walks frame objects directly, without reading
+        source files. """
+        try:
+            frame = sys._getframe(first_frame + 1)   # +1 for this function
+        except ValueError:
+            return []
+        context = []
+        append = context.append
+        for _ in xrange(max_frames):
+            if frame is None:
+                break
+            code = frame.f_code
+            func_name = code.co_name
+            append((code.co_filename, frame.f_lineno, func_name))
+            if func_name in STACK_STOP_FUNCS:
+                break
+            frame = frame.f_back
+        context.reverse()
+        return context
+
+    @staticmethod
+    def format_stack(stack):
+        return ["%s:%s:%s" % frame if type(frame) is tuple else frame for frame in stack]
+
+    @staticmethod
+    def _reset_log(entries=None):
+        max_entries = trace_data["config"].get("max_entries", DEFAULT_CONFIG["max_entries"])
+        trace_data["trace_log"] = deque(entries or [], maxlen=max_entries)
+        return trace_data["trace_log"]
+
     @staticmethod
     def log_trace(log_entry):
         if not trace_data["config"].get("log_trace", False):
@@ -109,11 +182,11 @@ class CallTracer(object):
 
     @staticmethod
     def clear_scope(scope):
-        trace_data["trace_log"] = [l for l in trace_data["trace_log"] if l["scope"] != scope]
+        CallTracer._reset_log([l for l in trace_data["trace_log"] if l["scope"] != scope])
 
     @staticmethod
     def clear_all():
-        trace_data["trace_log"] = []
+        CallTracer._reset_log()
 
     @staticmethod
     def save_log(**kwargs):
@@ -227,16 +300,20 @@ class CallTracer(object):
             frags.append("\033[0m")
         if "stack" in log_entry and kwargs.get("stack", False):
             frags.append("\n ")
-            frags.append("\n ".join(log_entry["stack"]))
+            frags.append("\n ".join(CallTracer.format_stack(log_entry["stack"])))
         return "".join(frags)
 
     @staticmethod
     def configure(config):
         trace_data["config"] = config or {}
-        enabled = bool(config.get("enabled", False))
+        enabled = bool(trace_data["config"].get("enabled", False))
         trace_data["enabled"] = enabled
+        trace_data["scope_policy"].clear()
+        trace_data["scope_window"].clear()
         if not enabled:
             CallTracer.clear_all()
+        else:
+            CallTracer._reset_log(trace_data["trace_log"])
 
     @staticmethod
     @contextmanager